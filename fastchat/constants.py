@@ -35,6 +35,27 @@ BLIND_MODE_INPUT_CHAR_LEN_LIMIT = int(
 CONVERSATION_TURN_LIMIT = 50
 # Session expiration time
 SESSION_EXPIRATION_TIME = 3600
+# Minimum interval in seconds between chatbot updates when streaming both sides of a battle
+BOT_RESPONSE_FRAME_INTERVAL = float(
+    os.getenv("FASTCHAT_BOT_RESPONSE_FRAME_INTERVAL", 0.05)
+)
+# Background writer of the local conversation logs: queue bound, and a group flush
+# every N records or M seconds. fsync policy is one of "never", "flush" or "always".
+LOG_WRITER_QUEUE_SIZE = int(os.getenv("FASTCHAT_LOG_WRITER_QUEUE_SIZE", 10000))
+LOG_WRITER_FLUSH_RECORDS = int(os.getenv("FASTCHAT_LOG_WRITER_FLUSH_RECORDS", 64))
+LOG_WRITER_FLUSH_INTERVAL = float(os.getenv("FASTCHAT_LOG_WRITER_FLUSH_INTERVAL", 0.2))
+LOG_WRITER_FSYNC = os.getenv("FASTCHAT_LOG_WRITER_FSYNC", "never")
+# Connection pool limits of each API provider endpoint
+API_PROVIDER_MAX_CONNECTIONS = int(
+    os.getenv("FASTCHAT_API_PROVIDER_MAX_CONNECTIONS", 64)
+)
+API_PROVIDER_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("FASTCHAT_API_PROVIDER_MAX_KEEPALIVE_CONNECTIONS", 16)
+)
+API_PROVIDER_KEEPALIVE_EXPIRY = float(
+    os.getenv("FASTCHAT_API_PROVIDER_KEEPALIVE_EXPIRY", 60)
+)
+API_PROVIDER_TIMEOUT = float(os.getenv("FASTCHAT_API_PROVIDER_TIMEOUT", 180))
 # CPU Instruction Set Architecture
 CPU_ISA = os.getenv("CPU_ISA")
 
@@ -44,10 +65,34 @@ CONTROLLER_HEART_BEAT_EXPIRATION = int(
     os.getenv("FASTCHAT_CONTROLLER_HEART_BEAT_EXPIRATION", 90)
 )
 WORKER_HEART_BEAT_INTERVAL = int(os.getenv("FASTCHAT_WORKER_HEART_BEAT_INTERVAL", 45))
+# Interval in seconds of the checks of a worker's queue length, which is sent to the
+# controller when it changes instead of waiting for the next heart beat
+WORKER_HEART_BEAT_CHECK_INTERVAL = float(
+    os.getenv("FASTCHAT_WORKER_HEART_BEAT_CHECK_INTERVAL", 2)
+)
+# Timeout in seconds of the controller polling the status of a worker
+CONTROLLER_WORKER_STATUS_TIMEOUT = float(
+    os.getenv("FASTCHAT_CONTROLLER_WORKER_STATUS_TIMEOUT", 5)
+)
+# Interval in seconds of the pings sent on an idle /watch stream of the controller
+CONTROLLER_WATCH_PING_INTERVAL = float(
+    os.getenv("FASTCHAT_CONTROLLER_WATCH_PING_INTERVAL", 15)
+)
+# Consecutive timeouts after which the power_of_two dispatch ejects a worker
+CONTROLLER_EJECTION_FAILURES = int(
+    os.getenv("FASTCHAT_CONTROLLER_EJECTION_FAILURES", 3)
+)
+# Seconds an ejected worker is left out of the power_of_two dispatch
+CONTROLLER_EJECTION_TIME = float(os.getenv("FASTCHAT_CONTROLLER_EJECTION_TIME", 30))
+# Connections of the controller to the workers for proxied streams, kept alive
+CONTROLLER_MAX_CONNECTIONS = int(os.getenv("FASTCHAT_CONTROLLER_MAX_CONNECTIONS", 4096))
 WORKER_API_TIMEOUT = int(os.getenv("FASTCHAT_WORKER_API_TIMEOUT", 100))
 WORKER_API_EMBEDDING_BATCH_SIZE = int(
     os.getenv("FASTCHAT_WORKER_API_EMBEDDING_BATCH_SIZE", 4)
 )
+# Expiry in seconds of the model list and model details cached by the OpenAI API server
+API_SERVER_CACHE_TTL = float(os.getenv("FASTCHAT_API_SERVER_CACHE_TTL", 10))
+API_SERVER_MAX_CONNECTIONS = int(os.getenv("FASTCHAT_API_SERVER_MAX_CONNECTIONS", 100))
 
 
 class ErrorCode(IntEnum):
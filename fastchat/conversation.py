@@ -449,8 +449,6 @@ class Conversation:
         return ret
 
     def to_gemini_api_messages(self):
-        from fastchat.utils import load_image
-
         if self.system_message == "":
             ret = []
         else:
@@ -462,8 +460,7 @@ class Conversation:
                     text, images = msg[0], msg[1]
                     content_list = [text]
                     for image in images:
-                        pil_image = load_image(image.base64_str)
-                        content_list.append(pil_image)
+                        content_list.append(image.to_pil_image())
                     ret.append({"role": "user", "content": content_list})
                 else:
                     ret.append({"role": "user", "content": msg})
@@ -620,10 +617,8 @@ class Conversation:
         return ret
 
     def save_new_images(self, has_csam_images=False, use_remote_storage=False):
-        import hashlib
         from fastchat.serve.chat_state import LOG_DIR
-        from fastchat.utils import load_image, upload_image_file_to_gcs
-        from PIL import Image
+        from fastchat.utils import upload_image_file_to_gcs
 
         _, last_user_message = self.messages[-2]
 
@@ -632,15 +627,14 @@ class Conversation:
 
             image_directory_name = "csam_images" if has_csam_images else "serve_images"
             for image in images:
-                loaded_image = load_image(image.base64_str)
-                hash_str = hashlib.md5(loaded_image.tobytes()).hexdigest()
+                hash_str = image.get_image_hash()
                 filename = os.path.join(
                     image_directory_name,
                     f"{hash_str}.{image.filetype}",
                 )
 
                 if use_remote_storage and not has_csam_images:
-                    image_url = upload_image_file_to_gcs(loaded_image, filename)
+                    image_url = upload_image_file_to_gcs(image.to_pil_image(), filename)
                     # NOTE(chris): If the URL were public, then we set it here so future model uses the link directly
                     # images[i] = image_url
                 else:
@@ -648,11 +642,9 @@ class Conversation:
                     # TODO: Update the image path
                     if not os.path.isfile(filename):
                         os.makedirs(os.path.dirname(filename), exist_ok=True)
-                        loaded_image.save(filename)
+                        image.to_pil_image().save(filename)
 
     def extract_text_and_image_hashes_from_messages(self):
-        import hashlib
-        from fastchat.utils import load_image
         from fastchat.serve.vision.image import ImageFormat
 
         messages = []
@@ -666,9 +658,7 @@ class Conversation:
                     if image.image_format == ImageFormat.URL:
                         image_hashes.append(image)
                     elif image.image_format == ImageFormat.BYTES:
-                        image = load_image(image.base64_str)
-                        image_hash = hashlib.md5(image.tobytes()).hexdigest()
-                        image_hashes.append(image_hash)
+                        image_hashes.append(image.get_image_hash())
 
                 messages.append((role, (text, image_hashes)))
             else:
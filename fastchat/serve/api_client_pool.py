@@ -0,0 +1,211 @@
+"""
+A process-wide pool of API provider clients.
+
+Provider SDK clients and `requests` sessions are created once per
+(api_type, api_base, api_key hash) and shared by all Gradio worker threads,
+so requests reuse kept-alive connections instead of paying a TLS handshake each.
+"""
+
+import hashlib
+import threading
+from typing import Any, Callable, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from fastchat.constants import (
+    API_PROVIDER_KEEPALIVE_EXPIRY,
+    API_PROVIDER_MAX_CONNECTIONS,
+    API_PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+    API_PROVIDER_TIMEOUT,
+)
+
+_global_pool = None
+_global_pool_lock = threading.Lock()
+
+
+def get_api_client_pool():
+    global _global_pool
+    with _global_pool_lock:
+        if _global_pool is None:
+            _global_pool = APIClientPool()
+        return _global_pool
+
+
+def hash_api_key(api_key: Optional[str]) -> str:
+    """Hash an API key so it is not kept in plain text in the pool keys."""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+class _CountingStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """An HTTP transport counting the requests sent and the responses still open."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.active_requests = 0
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            self.active_requests += 1
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            self._release()
+            raise
+        response.stream = _CountingStream(response.stream, self._release)
+        return response
+
+    def _release(self):
+        with self._lock:
+            self.active_requests -= 1
+
+
+class APIClientPool:
+    """Cache of provider clients with bounded, kept-alive HTTP connection pools."""
+
+    def __init__(
+        self,
+        max_connections: int = API_PROVIDER_MAX_CONNECTIONS,
+        max_keepalive_connections: int = API_PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = API_PROVIDER_KEEPALIVE_EXPIRY,
+        timeout: float = API_PROVIDER_TIMEOUT,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+
+        self._clients: dict[tuple[str, str, str], Any] = {}
+        self._http_clients: dict[tuple[str, str, str], httpx.Client] = {}
+        self._transports: dict[tuple[str, str, str], _CountingTransport] = {}
+        self._sessions: dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_client(
+        self,
+        api_type: str,
+        api_base: Optional[str],
+        api_key: Optional[str],
+        create_client: Callable[[httpx.Client], Any],
+    ) -> Any:
+        """Get the SDK client for an endpoint.
+
+        `create_client` builds the SDK client on top of the given pooled httpx client.
+        """
+        key = (api_type, api_base or "", hash_api_key(api_key))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._hits += 1
+                return client
+            self._misses += 1
+            transport = _CountingTransport(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+            http_client = httpx.Client(
+                transport=transport,
+                timeout=httpx.Timeout(self.timeout, connect=10),
+            )
+            client = create_client(http_client)
+            self._clients[key] = client
+            self._http_clients[key] = http_client
+            self._transports[key] = transport
+            return client
+
+    def get_session(self, api_base: str) -> requests.Session:
+        """Get a `requests` session with kept-alive connections for an endpoint."""
+        with self._lock:
+            session = self._sessions.get(api_base)
+            if session is not None:
+                self._hits += 1
+                return session
+            self._misses += 1
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.max_connections,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[api_base] = session
+            return session
+
+    def stats(self) -> dict[str, Any]:
+        """Number of pooled clients, and the requests and open connections of each pool."""
+        with self._lock:
+            transports = dict(self._transports)
+            sessions = dict(self._sessions)
+            stats = {"hits": self._hits, "misses": self._misses, "pools": []}
+
+        for (api_type, api_base, api_key_hash), transport in transports.items():
+            # httpx does not expose its connections, report the requests it has sent
+            # and the responses still open, each of which holds a connection
+            stats["pools"].append(
+                {
+                    "api_type": api_type,
+                    "api_base": api_base,
+                    "api_key_hash": api_key_hash,
+                    "requests": transport.requests,
+                    "active_requests": transport.active_requests,
+                    "max_connections": self.max_connections,
+                }
+            )
+
+        for api_base, session in sessions.items():
+            adapter = session.get_adapter("https://")
+            connections = idle = requests_sent = 0
+            for pool_key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[pool_key]
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            stats["pools"].append(
+                {
+                    "api_type": "requests",
+                    "api_base": api_base,
+                    "connections": connections,
+                    "idle_connections": idle,
+                    "requests": requests_sent,
+                    "max_connections": self.max_connections,
+                }
+            )
+        return stats
+
+    def close(self):
+        with self._lock:
+            for http_client in self._http_clients.values():
+                http_client.close()
+            for session in self._sessions.values():
+                session.close()
+            self._clients.clear()
+            self._http_clients.clear()
+            self._transports.clear()
+            self._sessions.clear()
@@ -7,8 +7,7 @@ import re
 from typing import Optional, Any
 import time
 
-import requests
-
+from fastchat.serve.api_client_pool import get_api_client_pool
 from fastchat.utils import build_logger
 
 
@@ -22,6 +21,94 @@ def preprocess_model_api_dict(model_api_dict: dict[str, Any]) -> dict[str, Any]:
     return model_api_dict
 
 
+class StreamedText:
+    """Accumulate the text of a provider stream.
+
+    Provider stream iterators yield dicts with an "error_code" and either
+    - "delta": the text appended to the response since the previous item, or
+    - "text": the full response so far, replacing what was received before.
+
+    Deltas are buffered and only joined when the text is read, so consuming a
+    stream costs O(delta) per item instead of O(response length).
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._chunks = []
+
+    def update(self, data):
+        if "delta" in data:
+            self._chunks.append(data["delta"])
+        else:
+            self._text = data["text"]
+            self._chunks.clear()
+
+    @property
+    def text(self):
+        if self._chunks:
+            self._text += "".join(self._chunks)
+            self._chunks.clear()
+        return self._text
+
+
+class ReasoningTagFilter:
+    """Remove reasoning sections, such as DeepSeek's `<think>...</think>`, from a text stream.
+
+    Costs O(delta) per chunk and handles tags split across chunks. The concatenated
+    output equals `re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)` on the
+    full response: an unclosed section is emitted as is when the stream finishes.
+    """
+
+    def __init__(self, open_tag="<think>", close_tag="</think>"):
+        self.open_tag = open_tag
+        self.close_tag = close_tag
+        self._inside = False
+        # text which may be the beginning of a tag
+        self._pending = ""
+        # content of the open reasoning section, emitted if it is never closed
+        self._hidden = []
+
+    def feed(self, delta):
+        """Consume a chunk and return the visible text it completes."""
+        text = self._pending + delta
+        self._pending = ""
+        visible = []
+        while text:
+            tag = self.close_tag if self._inside else self.open_tag
+            pos = text.find(tag)
+            if pos == -1:
+                keep = self._partial_tag_length(text, tag)
+                end = len(text) - keep
+                (self._hidden if self._inside else visible).append(text[:end])
+                self._pending = text[end:]
+                break
+            if self._inside:
+                self._hidden.clear()
+            else:
+                visible.append(text[:pos])
+            self._inside = not self._inside
+            text = text[pos + len(tag) :]
+        return "".join(visible)
+
+    def finish(self):
+        """Return the remaining visible text at the end of the stream."""
+        if self._inside:
+            rest = self.open_tag + "".join(self._hidden) + self._pending
+        else:
+            rest = self._pending
+        self._inside = False
+        self._pending = ""
+        self._hidden = []
+        return rest
+
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        for length in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
+
+
 def get_api_provider_stream_iter(
     conv,
     model_name,
@@ -276,17 +363,30 @@ def openai_api_stream_iter(
 
     api_key = api_key or os.environ["OPENAI_API_KEY"]
 
+    api_base = api_base or "https://api.openai.com/v1"
     if "azure" in model_name:
-        client = openai.AzureOpenAI(
-            api_version="2023-07-01-preview",
-            azure_endpoint=api_base or "https://api.openai.com/v1",
-            api_key=api_key,
+        client = get_api_client_pool().get_client(
+            "azure_openai",
+            api_base,
+            api_key,
+            lambda http_client: openai.AzureOpenAI(
+                api_version="2023-07-01-preview",
+                azure_endpoint=api_base,
+                api_key=api_key,
+                http_client=http_client,
+            ),
         )
     else:
-        client = openai.OpenAI(
-            base_url=api_base or "https://api.openai.com/v1",
-            api_key=api_key,
-            timeout=180,
+        client = get_api_client_pool().get_client(
+            "openai",
+            api_base,
+            api_key,
+            lambda http_client: openai.OpenAI(
+                base_url=api_base,
+                api_key=api_key,
+                timeout=180,
+                http_client=http_client,
+            ),
         )
 
     # Make requests for logging
@@ -322,20 +422,20 @@ def openai_api_stream_iter(
             max_tokens=max_new_tokens,
             stream=True,
         )
-        text = ""
+        # Support for deepseek <think> tag: delete the reasoning section
+        reasoning_filter = ReasoningTagFilter() if "deepseek" in model_name else None
         for chunk in res:
             if len(chunk.choices) > 0:
-                text += chunk.choices[0].delta.content or ""
-                if "deepseek" in model_name:
-                    # Support for deepseek <think> tag
-                    # text = text.replace('<think>', '<details open><summary style="color: lightgray;">Thinking...</summary>').replace('</think>', '</details>\n\n')
-                    # delete <think> tag
-                    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+                delta = chunk.choices[0].delta.content or ""
+                if reasoning_filter is not None:
+                    delta = reasoning_filter.feed(delta)
                 data = {
-                    "text": text,
+                    "delta": delta,
                     "error_code": 0,
                 }
                 yield data
+        if reasoning_filter is not None:
+            yield {"delta": reasoning_filter.finish(), "error_code": 0}
     else:
         if is_o1:
             is_o1_mini = "o1-mini" in model_name
@@ -365,12 +465,12 @@ def openai_api_stream_iter(
         pos = 0
         while pos < len(text):
             # simulate token streaming
-            pos += 2
             time.sleep(0.001)
             data = {
-                "text": text[:pos],
+                "delta": text[pos : pos + 2],
                 "error_code": 0,
             }
+            pos += 2
             yield data
 
 
@@ -408,7 +508,7 @@ def column_api_stream_iter(
         # try 3 times
         for i in range(3):
             try:
-                response = requests.post(
+                response = get_api_client_pool().get_session(api_base).post(
                     api_base, json=gen_params, stream=True, timeout=30
                 )
                 break
@@ -421,14 +521,12 @@ def column_api_stream_iter(
                     }
                     return
 
-        text = ""
         for line in response.iter_lines():
             if line:
                 data = line.decode("utf-8")
                 if data.startswith("data:"):
                     data = json.loads(data[6:])["message"]
-                    text += data
-                    yield {"text": text, "error_code": 0}
+                    yield {"delta": data, "error_code": 0}
 
     except Exception as e:
         logger.error(f"==== error ====\n{e}")
@@ -463,7 +561,15 @@ def openai_assistant_api_stream_iter(
     import base64
 
     api_key = api_key or os.environ["OPENAI_API_KEY"]
-    client = openai.OpenAI(base_url="https://api.openai.com/v1", api_key=api_key)
+    api_base = "https://api.openai.com/v1"
+    client = get_api_client_pool().get_client(
+        "openai_assistant",
+        api_base,
+        api_key,
+        lambda http_client: openai.OpenAI(
+            base_url=api_base, api_key=api_key, http_client=http_client
+        ),
+    )
 
     if state.oai_thread_id is None:
         logger.info("==== create thread ====")
@@ -486,7 +592,7 @@ def openai_assistant_api_stream_iter(
     }
     logger.info(f"==== request ====\n{gen_params}")
 
-    res = requests.post(
+    res = get_api_client_pool().get_session(api_base).post(
         f"https://api.openai.com/v1/threads/{state.oai_thread_id}/runs",
         headers={
             "Authorization": f"Bearer {api_key}",
@@ -596,7 +702,15 @@ def openai_assistant_api_stream_iter(
 def anthropic_api_stream_iter(model_name, prompt, temperature, top_p, max_new_tokens):
     import anthropic
 
-    c = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+    api_key = os.environ["ANTHROPIC_API_KEY"]
+    c = get_api_client_pool().get_client(
+        "anthropic",
+        None,
+        api_key,
+        lambda http_client: anthropic.Anthropic(
+            api_key=api_key, http_client=http_client
+        ),
+    )
 
     # Make requests
     gen_params = {
@@ -617,11 +731,9 @@ def anthropic_api_stream_iter(model_name, prompt, temperature, top_p, max_new_to
         model=model_name,
         stream=True,
     )
-    text = ""
     for chunk in res:
-        text += chunk.completion
         data = {
-            "text": text,
+            "delta": chunk.completion,
             "error_code": 0,
         }
         yield data
@@ -638,15 +750,30 @@ def anthropic_message_api_stream_iter(
     import anthropic
 
     if vertex_ai:
-        client = anthropic.AnthropicVertex(
-            region=os.environ["GCP_LOCATION"],
-            project_id=os.environ["GCP_PROJECT_ID"],
-            max_retries=5,
+        region = os.environ["GCP_LOCATION"]
+        project_id = os.environ["GCP_PROJECT_ID"]
+        client = get_api_client_pool().get_client(
+            "anthropic_vertex",
+            f"{region}/{project_id}",
+            None,
+            lambda http_client: anthropic.AnthropicVertex(
+                region=region,
+                project_id=project_id,
+                max_retries=5,
+                http_client=http_client,
+            ),
         )
     else:
-        client = anthropic.Anthropic(
-            api_key=os.environ["ANTHROPIC_API_KEY"],
-            max_retries=5,
+        api_key = os.environ["ANTHROPIC_API_KEY"]
+        client = get_api_client_pool().get_client(
+            "anthropic",
+            None,
+            api_key,
+            lambda http_client: anthropic.Anthropic(
+                api_key=api_key,
+                max_retries=5,
+                http_client=http_client,
+            ),
         )
 
     text_messages = []
@@ -680,7 +807,6 @@ def anthropic_message_api_stream_iter(
         # remove system prompt
         messages = messages[1:]
 
-    text = ""
     with client.messages.stream(
         temperature=temperature,
         top_p=top_p,
@@ -690,9 +816,8 @@ def anthropic_message_api_stream_iter(
         system=system_prompt,
     ) as stream:
         for chunk in stream.text_stream:
-            text += chunk
             data = {
-                "text": text,
+                "delta": chunk,
                 "error_code": 0,
             }
             yield data
@@ -751,11 +876,9 @@ def gemini_api_stream_iter(
     if use_stream:
         response = convo.send_message(messages[-1]["content"], stream=True)
         try:
-            text = ""
             for chunk in response:
-                text += chunk.candidates[0].content.parts[0].text
                 data = {
-                    "text": text,
+                    "delta": chunk.candidates[0].content.parts[0].text,
                     "error_code": 0,
                 }
                 yield data
@@ -773,12 +896,12 @@ def gemini_api_stream_iter(
             pos = 0
             while pos < len(text):
                 # simulate token streaming
-                pos += 5
                 time.sleep(0.001)
                 data = {
-                    "text": text[:pos],
+                    "delta": text[pos : pos + 5],
                     "error_code": 0,
                 }
+                pos += 5
                 yield data
         except Exception as e:
             logger.error(f"==== error ====\n{e}")
@@ -817,7 +940,7 @@ def ai2_api_stream_iter(
     if temperature == 0.0 and top_p < 1.0:
         raise ValueError("top_p must be 1 when temperature is 0.0")
 
-    res = requests.post(
+    res = get_api_client_pool().get_session(api_base).post(
         api_base,
         stream=True,
         headers={"Authorization": f"Bearer {ai2_key}"},
@@ -843,19 +966,17 @@ def ai2_api_stream_iter(
         logger.error(f"unexpected response ({res.status_code}): {res.text}")
         raise ValueError("unexpected response from InferD", res)
 
-    text = ""
     for line in res.iter_lines():
         if line:
             part = json.loads(line)
             if "result" in part and "output" in part["result"]:
-                for t in part["result"]["output"]["text"]:
-                    text += t
+                delta = "".join(part["result"]["output"]["text"])
             else:
                 logger.error(f"unexpected part: {part}")
                 raise ValueError("empty result in InferD response")
 
             data = {
-                "text": text,
+                "delta": delta,
                 "error_code": 0,
             }
             yield data
@@ -871,7 +992,12 @@ def mistral_api_stream_iter(
     if api_key is None:
         api_key = os.environ["MISTRAL_API_KEY"]
 
-    client = Mistral(api_key=api_key)
+    client = get_api_client_pool().get_client(
+        "mistral",
+        None,
+        api_key,
+        lambda http_client: Mistral(api_key=api_key, client=http_client),
+    )
 
     # Make requests for logging
     text_messages = []
@@ -909,12 +1035,10 @@ def mistral_api_stream_iter(
         top_p=top_p,
     )
 
-    text = ""
     for chunk in res:
         if chunk.data.choices[0].delta.content is not None:
-            text += chunk.data.choices[0].delta.content
             data = {
-                "text": text,
+                "delta": chunk.data.choices[0].delta.content,
                 "error_code": 0,
             }
             yield data
@@ -954,7 +1078,7 @@ def nvidia_api_stream_iter(
     # try 3 times
     for i in range(3):
         try:
-            response = requests.post(
+            response = get_api_client_pool().get_session(api_base).post(
                 api_base, headers=headers, json=payload, stream=True, timeout=3
             )
             break
@@ -967,15 +1091,13 @@ def nvidia_api_stream_iter(
                 }
                 return
 
-    text = ""
     for line in response.iter_lines():
         if line:
             data = line.decode("utf-8")
             if data.endswith("[DONE]"):
                 break
             data = json.loads(data[6:])["choices"][0]["delta"]["content"]
-            text += data
-            yield {"text": text, "error_code": 0}
+            yield {"delta": data, "error_code": 0}
 
 
 def yandexgpt_api_stream_iter(
@@ -999,7 +1121,7 @@ def yandexgpt_api_stream_iter(
     logger.info(f"==== request ====\n{payload}")
 
     # https://llm.api.cloud.yandex.net/foundationModels/v1/completion
-    response = requests.post(
+    response = get_api_client_pool().get_session(api_base).post(
         api_base, headers=headers, json=payload, stream=True, timeout=60
     )
     text = ""
@@ -1039,10 +1161,16 @@ def cohere_api_stream_iter(
         "system": "System",
     }
 
-    client = cohere.Client(
-        api_key=api_key,
-        base_url=api_base,
-        client_name=client_name,
+    client = get_api_client_pool().get_client(
+        f"cohere:{client_name}",
+        api_base,
+        api_key,
+        lambda http_client: cohere.Client(
+            api_key=api_key,
+            base_url=api_base,
+            client_name=client_name,
+            httpx_client=http_client,
+        ),
     )
 
     # prepare and log requests
@@ -1075,11 +1203,9 @@ def cohere_api_stream_iter(
         p=top_p,
     )
     try:
-        text = ""
         for streaming_item in res:
             if streaming_item.event_type == "text-generation":
-                text += streaming_item.text
-                yield {"text": text, "error_code": 0}
+                yield {"delta": streaming_item.text, "error_code": 0}
     except cohere.core.ApiError as e:
         logger.error(f"==== error from cohere api: {e} ====")
         yield {
@@ -1142,13 +1268,10 @@ def vertex_api_stream_iter(model_name, messages, temperature, top_p, max_new_tok
         safety_settings=safety_settings,
     )
 
-    ret = ""
     for chunk in generator:
         # NOTE(chris): This may be a vertex api error, below is HOTFIX: https://github.com/googleapis/python-aiplatform/issues/3129
-        ret += chunk.candidates[0].content.parts[0]._raw_part.text
-        # ret += chunk.text
         data = {
-            "text": ret,
+            "delta": chunk.candidates[0].content.parts[0]._raw_part.text,
             "error_code": 0,
         }
         yield data
@@ -1170,7 +1293,12 @@ def reka_api_stream_iter(
 
     api_key = api_key or os.environ["REKA_API_KEY"]
 
-    client = Reka(api_key=api_key)
+    client = get_api_client_pool().get_client(
+        "reka",
+        api_base,
+        api_key,
+        lambda http_client: Reka(api_key=api_key, httpx_client=http_client),
+    )
 
     use_search_engine = False
     if "-online" in model_name:
@@ -1247,7 +1375,7 @@ def metagen_api_stream_iter(
         }
         logger.info(f"==== request ====\n{gen_params}")
 
-        res = requests.post(
+        res = get_api_client_pool().get_session(api_base).post(
             f"{api_base}/chat_stream_completions?access_token={api_key}",
             stream=True,
             headers={"Content-Type": "application/json"},
@@ -1273,14 +1401,11 @@ def metagen_api_stream_iter(
                 "error_code": 1,
             }
 
-        text = ""
         for line in res.iter_lines():
             if line:
                 part = json.loads(line.decode("utf-8"))
-                if "text" in part:
-                    text += part["text"]
                 data = {
-                    "text": text,
+                    "delta": part.get("text", ""),
                     "error_code": 0,
                 }
                 yield data
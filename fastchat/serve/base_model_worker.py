@@ -1,15 +1,20 @@
 import asyncio
+import json
 import threading
 import time
-from typing import List
+from typing import Callable, List
 
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import JSONResponse
 import requests
 
-from fastchat.constants import WORKER_HEART_BEAT_INTERVAL
+from fastchat.constants import (
+    WORKER_HEART_BEAT_CHECK_INTERVAL,
+    WORKER_HEART_BEAT_INTERVAL,
+)
 from fastchat.conversation import Conversation
-from fastchat.utils import pretty_print_semaphore, build_logger
+from fastchat.serve.stream_framing import create_stream_response
+from fastchat.utils import build_logger
 
 
 worker = None
@@ -18,10 +23,211 @@ logger = None
 app = FastAPI()
 
 
-def heart_beat_worker(obj):
-    while True:
-        time.sleep(WORKER_HEART_BEAT_INTERVAL)
-        obj.send_heart_beat()
+class LatencyStats:
+    """
+    Rolling (EWMA) time to first token and decoding speed of the streamed requests.
+    Reported to the controller in the heart beat, the load is in the queue length.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.ttft = 0.0
+        self.tokens_per_second = 0.0
+        self._lock = threading.Lock()
+
+    def start_request(self) -> float:
+        return time.perf_counter()
+
+    def finish_request(
+        self, start: float, first_chunk: float = None, num_tokens: int = None
+    ):
+        end = time.perf_counter()
+        with self._lock:
+            if first_chunk is None:
+                return
+            self.ttft = self._update(self.ttft, first_chunk - start)
+            if num_tokens and end > first_chunk:
+                self.tokens_per_second = self._update(
+                    self.tokens_per_second, num_tokens / (end - first_chunk)
+                )
+
+    def _update(self, average: float, value: float) -> float:
+        if average == 0:
+            return value
+        return (1 - self.alpha) * average + self.alpha * value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "ttft": self.ttft,
+                "tokens_per_second": self.tokens_per_second,
+            }
+
+
+def get_completion_tokens(chunk):
+    """The number of generated tokens reported by the last output of a stream, if any."""
+    try:
+        if isinstance(chunk, dict):
+            return chunk["usage"]["completion_tokens"]
+        usage = json.loads(chunk.rstrip(b"\0").split(b"\0")[-1])["usage"]
+        return usage["completion_tokens"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def track_latency(latency_stats: LatencyStats, generator):
+    """Wrap a sync or async stream generator to record its latency."""
+
+    if hasattr(generator, "__aiter__"):
+
+        async def wrapped():
+            start = latency_stats.start_request()
+            first_chunk = chunk = None
+            try:
+                async for chunk in generator:
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter()
+                    yield chunk
+            finally:
+                latency_stats.finish_request(
+                    start, first_chunk, chunk and get_completion_tokens(chunk)
+                )
+
+    else:
+
+        def wrapped():
+            start = latency_stats.start_request()
+            first_chunk = chunk = None
+            try:
+                for chunk in generator:
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter()
+                    yield chunk
+            finally:
+                latency_stats.finish_request(
+                    start, first_chunk, chunk and get_completion_tokens(chunk)
+                )
+
+    return wrapped()
+
+
+class HeartBeatSender:
+    """
+    Send the heart beats of the models served at one address over a persistent
+    connection. The status is checked every WORKER_HEART_BEAT_CHECK_INTERVAL seconds and
+    sent as soon as its queue length changes. Otherwise a keep-alive is sent every
+    WORKER_HEART_BEAT_INTERVAL seconds. The queue length is in every heart beat, keep-alives
+    included, since the controller counts each request it dispatches until the next heart
+    beat corrects it. The latency stats are only sent when they changed.
+    The lag of a heart beat is how late its thread woke up to send it, and its rtt how
+    long the controller took to answer.
+    """
+
+    def __init__(
+        self,
+        controller_addr: str,
+        worker_addr: str,
+        get_status: Callable[[], dict],
+        register: Callable[[], None],
+        alpha: float = 0.2,
+    ):
+        self.controller_addr = controller_addr
+        self.worker_addr = worker_addr
+        self.get_status = get_status
+        self.register = register
+        self.alpha = alpha
+        self.session = requests.Session()
+        # the status last received by the controller
+        self.sent = {}
+        self.num_sent = 0
+        self.num_failed = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.rtt = 0.0
+        self._lock = threading.Lock()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        now = time.monotonic()
+        keep_alive_at = now + WORKER_HEART_BEAT_INTERVAL
+        retry_interval = WORKER_HEART_BEAT_CHECK_INTERVAL
+        while True:
+            wake_at = min(now + WORKER_HEART_BEAT_CHECK_INTERVAL, keep_alive_at)
+            time.sleep(max(wake_at - time.monotonic(), 0))
+            now = time.monotonic()
+            status = self.get_status()
+            sent = self.sent
+            changed = not sent or status["queue_length"] != sent["queue_length"]
+            if now < keep_alive_at and not changed:
+                continue
+            if self.send(status, lag=max(now - wake_at, 0)):
+                keep_alive_at = now + WORKER_HEART_BEAT_INTERVAL
+                retry_interval = WORKER_HEART_BEAT_CHECK_INTERVAL
+            else:
+                # back off while the controller is unreachable
+                keep_alive_at = now + retry_interval
+                retry_interval = min(retry_interval * 2, WORKER_HEART_BEAT_INTERVAL)
+
+    def get_payload(self, status: dict) -> dict:
+        payload = {
+            "worker_name": self.worker_addr,
+            "queue_length": status["queue_length"],
+        }
+        latency_stats = status.get("latency_stats")
+        if latency_stats and latency_stats != self.sent.get("latency_stats"):
+            payload["latency_stats"] = latency_stats
+        return payload
+
+    def send(self, status: dict = None, lag: float = 0.0) -> bool:
+        """Send a heart beat, and register again if the controller has forgotten us."""
+        if status is None:
+            status = self.get_status()
+        payload = self.get_payload(status)
+        logger.debug(f"Send heart beat. {payload}")
+
+        start = time.monotonic()
+        try:
+            ret = self.session.post(
+                self.controller_addr + "/receive_heart_beat", json=payload, timeout=5
+            )
+            exist = ret.json()["exist"]
+        except (requests.exceptions.RequestException, KeyError) as e:
+            logger.error(f"heart beat error: {e}")
+            with self._lock:
+                self.num_failed += 1
+            # the controller may have missed a change, send everything next time
+            self.sent = {}
+            return False
+
+        with self._lock:
+            self.num_sent += 1
+            self.lag = self._update(self.lag, lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.rtt = self._update(self.rtt, time.monotonic() - start)
+        self.sent = status
+        if not exist:
+            self.sent = {}
+            self.register()
+        return True
+
+    def _update(self, average: float, value: float) -> float:
+        if self.num_sent <= 1:
+            return value
+        return (1 - self.alpha) * average + self.alpha * value
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "sent": self.num_sent,
+                "failed": self.num_failed,
+                "lag": self.lag,
+                "max_lag": self.max_lag,
+                "rtt": self.rtt,
+            }
 
 
 class BaseModelWorker:
@@ -52,7 +258,9 @@ class BaseModelWorker:
         self.context_len = None
         self.call_ct = 0
         self.semaphore = None
+        self.latency_stats = LatencyStats()
 
+        self.heart_beat_sender = None
         self.heart_beat_thread = None
 
         if logger is None:
@@ -79,12 +287,13 @@ class BaseModelWorker:
 
     def init_heart_beat(self):
         self.register_to_controller()
-        self.heart_beat_thread = threading.Thread(
-            target=heart_beat_worker,
-            args=(self,),
-            daemon=True,
+        self.heart_beat_sender = HeartBeatSender(
+            self.controller_addr,
+            self.worker_addr,
+            self.get_status,
+            self.register_to_controller,
         )
-        self.heart_beat_thread.start()
+        self.heart_beat_thread = self.heart_beat_sender.start()
 
     def register_to_controller(self):
         logger.info("Register to controller")
@@ -100,33 +309,10 @@ class BaseModelWorker:
         assert r.status_code == 200
 
     def send_heart_beat(self):
-        logger.info(
-            f"Send heart beat. Models: {self.model_names}. "
-            f"Semaphore: {pretty_print_semaphore(self.semaphore)}. "
-            f"call_ct: {self.call_ct}. "
-            f"worker_id: {self.worker_id}. "
-        )
-
-        url = self.controller_addr + "/receive_heart_beat"
-
-        while True:
-            try:
-                ret = requests.post(
-                    url,
-                    json={
-                        "worker_name": self.worker_addr,
-                        "queue_length": self.get_queue_length(),
-                    },
-                    timeout=5,
-                )
-                exist = ret.json()["exist"]
-                break
-            except (requests.exceptions.RequestException, KeyError) as e:
-                logger.error(f"heart beat error: {e}")
-            time.sleep(5)
-
-        if not exist:
-            self.register_to_controller()
+        if self.heart_beat_sender is None:
+            # not registered to the controller
+            return
+        self.heart_beat_sender.send()
 
     def get_queue_length(self):
         if self.semaphore is None:
@@ -143,11 +329,15 @@ class BaseModelWorker:
             return self.limit_worker_concurrency - sempahore_value + waiter_count
 
     def get_status(self):
-        return {
+        status = {
             "model_names": self.model_names,
             "speed": 1,
             "queue_length": self.get_queue_length(),
+            "latency_stats": self.latency_stats.to_dict(),
         }
+        if self.heart_beat_sender is not None:
+            status["heart_beat_stats"] = self.heart_beat_sender.get_stats()
+        return status
 
     def count_token(self, params):
         prompt = params["prompt"]
@@ -197,9 +387,9 @@ def create_background_tasks():
 async def api_generate_stream(request: Request):
     params = await request.json()
     await acquire_worker_semaphore()
-    generator = worker.generate_stream_gate(params)
+    generator = track_latency(worker.latency_stats, worker.generate_stream_gate(params))
     background_tasks = create_background_tasks()
-    return StreamingResponse(generator, background=background_tasks)
+    return create_stream_response(generator, request.headers, background_tasks)
 
 
 @app.post("/worker_generate")
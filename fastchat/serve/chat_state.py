@@ -2,7 +2,6 @@
 Chat State and Logging
 '''
 
-import json
 import os
 from typing import Any, Literal, Optional
 from fastchat.conversation import Conversation
@@ -252,8 +251,8 @@ def save_log_to_local(
 ):
     '''
     Save the log locally.
+    The record is serialized right away and written by the background log writer.
     '''
-    log_json = json.dumps(log_data, default=str)
-    os.makedirs(os.path.dirname(log_path), exist_ok=True)
-    with open(log_path, "w" if write_mode == 'overwrite' else 'a') as fout:
-        fout.write(log_json + "\n")
+    from fastchat.serve.log_writer import get_log_writer
+
+    get_log_writer().write(log_path, log_data, write_mode)
@@ -0,0 +1,349 @@
+"""
+A continuous batching engine for HuggingFace causal language models.
+
+Concurrent requests share one batched forward pass per decoding step. New requests are
+prefilled together in one forward pass and join the batch between two steps, and
+finished requests leave it, so a long generation does not hold up the others. The KV caches of the batch are left
+padded to a common length and the padding is masked out with the attention mask.
+
+Usage:
+engine = ContinuousBatchingEngine(model, tokenizer, "cpu", context_len=2048)
+for output in engine.generate_stream({"prompt": "Hello", "max_new_tokens": 32}):
+    print(output["text"])
+"""
+import gc
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+from fastchat.serve.inference import (
+    IncrementalDetokenizer,
+    apply_stop_str,
+    generate_stream,
+    prepare_logits_processor,
+    sample_top_p_top_k,
+)
+from fastchat.serve.kv_cache import get_kv_tensors, make_cache
+from fastchat.utils import build_logger
+
+logger = build_logger("continuous_batching", "continuous_batching.log")
+
+
+def is_continuous_batching_supported(model, generate_stream_func) -> bool:
+    """Only decoder-only models served by the default `generate_stream` are supported."""
+    return (
+        generate_stream_func is generate_stream and not model.config.is_encoder_decoder
+    )
+
+
+def left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    pad = length - tensor.shape[dim]
+    if pad <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class _Request:
+    """The decoding state of one request, following `generate_stream`."""
+
+    def __init__(self, params: Dict, tokenizer, context_len: int):
+        self.prompt = params["prompt"]
+        self.temperature = float(params.get("temperature", 1.0))
+        self.repetition_penalty = float(params.get("repetition_penalty", 1.0))
+        self.top_p = float(params.get("top_p", 1.0))
+        self.top_k = int(params.get("top_k", -1))  # -1 means disable
+        self.max_new_tokens = int(params.get("max_new_tokens", 256))
+        self.echo = bool(params.get("echo", True))
+        self.stop_str = params.get("stop", None)
+        self.stop_token_ids = params.get("stop_token_ids", None) or []
+        if tokenizer.eos_token_id not in self.stop_token_ids:
+            self.stop_token_ids.append(tokenizer.eos_token_id)
+        self.logits_processor = prepare_logits_processor(
+            self.temperature, self.repetition_penalty, 1.0, -1
+        )
+
+        max_src_len = context_len - self.max_new_tokens - 1
+        self.input_ids = tokenizer(self.prompt).input_ids[-max_src_len:]
+        self.output_ids = list(self.input_ids)
+        self.input_echo_len = len(self.input_ids)
+        self.num_generated = 0
+        self.output = ""
+        self.detokenizer = IncrementalDetokenizer(
+            tokenizer, 0 if self.echo else self.input_echo_len
+        )
+
+        self.outputs = queue.Queue()
+        self.cancelled = False
+
+    def sample(self, logits: torch.Tensor, device: str) -> int:
+        """Sample the next token from the logits of the last position."""
+        if self.logits_processor:
+            if self.repetition_penalty > 1.0:
+                output_ids = torch.as_tensor([self.output_ids], device=logits.device)
+            else:
+                output_ids = None
+            logits = self.logits_processor(output_ids, logits.unsqueeze(0))[0]
+
+        if device == "mps":
+            # Switch to CPU by avoiding some bugs in mps backend.
+            logits = logits.float().to("cpu")
+
+        if self.temperature < 1e-5 or self.top_p < 1e-8:  # greedy
+            return int(torch.argmax(logits))
+        return int(sample_top_p_top_k(logits, self.top_p, self.top_k))
+
+    def append(self, token: int, tokenizer, stream_interval: int) -> bool:
+        """Add a generated token and stream the output. Return whether the request is done."""
+        i = self.num_generated
+        self.num_generated += 1
+        self.output_ids.append(token)
+        stopped = token in self.stop_token_ids
+
+        if i % stream_interval == 0 or i == self.max_new_tokens - 1 or stopped:
+            output = self.detokenizer.decode(
+                self.output_ids, final=stopped or i == self.max_new_tokens - 1
+            )
+            self.output, found_stop_str, partially_stopped = apply_stop_str(
+                output, self.stop_str, len(self.prompt) if self.echo else 0
+            )
+            stopped = stopped or found_stop_str
+            # Prevent yielding partial stop sequence
+            if not partially_stopped:
+                self.put_output(None)
+
+        if stopped:
+            self.put_output("stop")
+        elif self.num_generated == self.max_new_tokens:
+            self.put_output("length")
+        else:
+            return False
+        return True
+
+    def put_output(self, finish_reason: Optional[str]):
+        # the usage is reported as `generate_stream` does
+        completion_tokens = self.num_generated - 1
+        self.outputs.put(
+            {
+                "text": self.output,
+                "logprobs": None,
+                "usage": {
+                    "prompt_tokens": self.input_echo_len,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": self.input_echo_len + completion_tokens,
+                },
+                "finish_reason": finish_reason,
+            }
+        )
+
+
+class ContinuousBatchingEngine:
+    """
+    Run the requests of `generate_stream` calls from any thread in shared batches.
+
+    A background thread owns the model and the batch. At most `max_batch_size`
+    requests decode together; the others wait for a slot.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        device: str,
+        context_len: int,
+        stream_interval: int = 2,
+        max_batch_size: int = 8,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = model.device if hasattr(model, "device") else device
+        self.context_len = context_len
+        self.stream_interval = stream_interval
+        self.max_batch_size = max_batch_size
+
+        self._waiting = queue.Queue()
+        self._running: List[_Request] = []
+        # the KV cache of the running requests and its attention mask, left padded
+        self._kv_tensors: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None
+        self._attention_mask: Optional[torch.Tensor] = None
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def supports(self, params: Dict) -> bool:
+        # The batched sampler does not compute logprobs, the worker serves those
+        # requests with `generate_stream` instead.
+        return params.get("logprobs", None) is None
+
+    def generate_stream(self, params: Dict) -> Iterator[Dict]:
+        """Yield the same outputs as `generate_stream` of fastchat.serve.inference."""
+        request = _Request(params, self.tokenizer, self.context_len)
+        self._waiting.put(request)
+        try:
+            while True:
+                output = request.outputs.get()
+                if isinstance(output, Exception):
+                    raise output
+                yield output
+                if output["finish_reason"] is not None:
+                    return
+        finally:
+            # the client may have gone away, stop decoding for it
+            request.cancelled = True
+
+    def _loop(self):
+        while True:
+            self._admit()
+            if not self._running:
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                logger.error(f"Batched decoding failed: {e}")
+                for request in self._running:
+                    request.outputs.put(e)
+                self._select([])
+
+    @torch.inference_mode()
+    def _admit(self):
+        # block only when there is nothing to decode
+        block = not self._running
+        requests = []
+        while len(self._running) + len(requests) < self.max_batch_size:
+            try:
+                request = self._waiting.get(block=block)
+            except queue.Empty:
+                break
+            block = False
+            if not request.cancelled:
+                requests.append(request)
+        if not requests:
+            return
+        try:
+            self._prefill(requests)
+        except Exception as e:
+            logger.error(f"Prefill failed: {e}")
+            for request in requests:
+                request.outputs.put(e)
+
+    def _prefill(self, requests: List[_Request]):
+        """Prefill the new requests in one forward pass, left padded to a common length."""
+        length = max(len(request.input_ids) for request in requests)
+        input_ids = torch.as_tensor(
+            [[0] * (length - len(r.input_ids)) + r.input_ids for r in requests],
+            device=self.device,
+        )
+        attention_mask = torch.as_tensor(
+            [
+                [0] * (length - len(r.input_ids)) + [1] * len(r.input_ids)
+                for r in requests
+            ],
+            device=self.device,
+        )
+        position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+
+        logits = out.logits[:, -1, :]
+        keep = []
+        for i, request in enumerate(requests):
+            token = request.sample(logits[i], self.device)
+            if not request.append(token, self.tokenizer, self.stream_interval):
+                keep.append(i)
+        if not keep:
+            return
+
+        index = torch.as_tensor(keep, device=self.device)
+        attention_mask = attention_mask.index_select(0, index)
+        start = int(attention_mask.any(dim=0).nonzero()[0])
+        attention_mask = attention_mask[:, start:]
+        kv_tensors = [
+            (
+                keys.index_select(0, index.to(keys.device))[:, :, start:],
+                values.index_select(0, index.to(values.device))[:, :, start:],
+            )
+            for keys, values in get_kv_tensors(out.past_key_values)
+        ]
+        if self._kv_tensors is None:
+            self._kv_tensors = kv_tensors
+            self._attention_mask = attention_mask
+        else:
+            length = max(self._attention_mask.shape[1], attention_mask.shape[1])
+            self._kv_tensors = [
+                (
+                    torch.cat([left_pad(keys, length, 2), left_pad(k, length, 2)]),
+                    torch.cat([left_pad(values, length, 2), left_pad(v, length, 2)]),
+                )
+                for (keys, values), (k, v) in zip(self._kv_tensors, kv_tensors)
+            ]
+            self._attention_mask = torch.cat(
+                [
+                    left_pad(self._attention_mask, length, 1),
+                    left_pad(attention_mask, length, 1),
+                ]
+            )
+        self._running.extend(requests[i] for i in keep)
+
+    @torch.inference_mode()
+    def _step(self):
+        input_ids = torch.as_tensor(
+            [[request.output_ids[-1]] for request in self._running], device=self.device
+        )
+        # the position of the new token is the number of real tokens before it
+        position_ids = self._attention_mask.sum(dim=1, keepdim=True)
+        attention_mask = torch.cat(
+            [self._attention_mask, torch.ones_like(input_ids)], dim=1
+        )
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=make_cache(self._kv_tensors),
+            use_cache=True,
+        )
+        self._kv_tensors = get_kv_tensors(out.past_key_values)
+        self._attention_mask = attention_mask
+
+        logits = out.logits[:, -1, :]
+        keep = []
+        for i, request in enumerate(self._running):
+            if request.cancelled:
+                continue
+            token = request.sample(logits[i], self.device)
+            if not request.append(token, self.tokenizer, self.stream_interval):
+                keep.append(i)
+        if len(keep) < len(self._running):
+            self._select(keep)
+
+    def _select(self, keep: List[int]):
+        """Keep the given rows of the batch and drop the padding no row needs anymore."""
+        if not keep:
+            self._running = []
+            self._kv_tensors = self._attention_mask = None
+            gc.collect()
+            torch.cuda.empty_cache()
+            if self.device == "xpu":
+                torch.xpu.empty_cache()
+            if self.device == "npu":
+                torch.npu.empty_cache()
+            return
+
+        self._running = [self._running[i] for i in keep]
+        index = torch.as_tensor(keep, device=self._attention_mask.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        start = int(attention_mask.any(dim=0).nonzero()[0])
+        self._attention_mask = attention_mask[:, start:]
+        self._kv_tensors = [
+            (
+                keys.index_select(0, index.to(keys.device))[:, :, start:],
+                values.index_select(0, index.to(values.device))[:, :, start:],
+            )
+            for keys, values in self._kv_tensors
+        ]
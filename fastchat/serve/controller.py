@@ -4,57 +4,48 @@ It sends worker addresses to clients.
 """
 import argparse
 import asyncio
-import dataclasses
-from enum import Enum, auto
 import json
 import logging
 import os
 import time
-from typing import List, Union
+from typing import AsyncIterator, Dict, List, Optional, Union
 import threading
 
 from fastapi import FastAPI, Request
 from fastapi.responses import StreamingResponse
-import numpy as np
-import requests
+import httpx
 import uvicorn
 
 from fastchat.constants import (
+    CONTROLLER_EJECTION_FAILURES,
+    CONTROLLER_EJECTION_TIME,
     CONTROLLER_HEART_BEAT_EXPIRATION,
+    CONTROLLER_MAX_CONNECTIONS,
+    CONTROLLER_WATCH_PING_INTERVAL,
+    CONTROLLER_WORKER_STATUS_TIMEOUT,
     WORKER_API_TIMEOUT,
     ErrorCode,
     SERVER_ERROR_MSG,
 )
+from fastchat.serve.stream_framing import (
+    FRAMED_MEDIA_TYPE,
+    FrameEncoder,
+    accepts_frames,
+    complete_length,
+    is_framed,
+)
+from fastchat.serve.worker_registry import (
+    DispatchMethod,
+    WorkerInfo,
+    WorkerRegistry,
+    update_latency_stats,
+)
 from fastchat.utils import build_logger
 
 
 logger = build_logger("controller", "controller.log")
 
 
-class DispatchMethod(Enum):
-    LOTTERY = auto()
-    SHORTEST_QUEUE = auto()
-
-    @classmethod
-    def from_str(cls, name):
-        if name == "lottery":
-            return cls.LOTTERY
-        elif name == "shortest_queue":
-            return cls.SHORTEST_QUEUE
-        else:
-            raise ValueError(f"Invalid dispatch method")
-
-
-@dataclasses.dataclass
-class WorkerInfo:
-    model_names: List[str]
-    speed: int
-    queue_length: int
-    check_heart_beat: bool
-    last_heart_beat: str
-    multimodal: bool
-
-
 def heart_beat_controller(controller):
     while True:
         time.sleep(CONTROLLER_HEART_BEAT_EXPIRATION)
@@ -63,33 +54,64 @@ def heart_beat_controller(controller):
 
 class Controller:
     def __init__(self, dispatch_method: str):
-        # Dict[str -> WorkerInfo]
-        self.worker_info = {}
         self.dispatch_method = DispatchMethod.from_str(dispatch_method)
+        self.registry = WorkerRegistry(
+            self.dispatch_method,
+            ejection_failures=CONTROLLER_EJECTION_FAILURES,
+            ejection_time=CONTROLLER_EJECTION_TIME,
+        )
+        self._http_client = None
+        self._stream_client = None
 
         self.heart_beat_thread = threading.Thread(
             target=heart_beat_controller, args=(self,)
         )
         self.heart_beat_thread.start()
 
-    def register_worker(
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                timeout=CONTROLLER_WORKER_STATUS_TIMEOUT
+            )
+        return self._http_client
+
+    @property
+    def stream_client(self) -> httpx.AsyncClient:
+        """The client of the proxied streams, keeping the connections to workers alive."""
+        if self._stream_client is None:
+            self._stream_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=CONTROLLER_MAX_CONNECTIONS,
+                    max_keepalive_connections=CONTROLLER_MAX_CONNECTIONS,
+                ),
+                timeout=WORKER_API_TIMEOUT,
+            )
+        return self._stream_client
+
+    async def aclose(self):
+        for client in [self._http_client, self._stream_client]:
+            if client is not None:
+                await client.aclose()
+
+    async def register_worker(
         self,
         worker_name: str,
         check_heart_beat: bool,
         worker_status: dict,
         multimodal: bool,
     ):
-        if worker_name not in self.worker_info:
+        if worker_name not in self.registry:
             logger.info(f"Register a new worker: {worker_name}")
         else:
             logger.info(f"Register an existing worker: {worker_name}")
 
         if not worker_status:
-            worker_status = self.get_worker_status(worker_name)
+            worker_status = await self.get_worker_status(worker_name)
         if not worker_status:
             return False
 
-        self.worker_info[worker_name] = WorkerInfo(
+        worker_info = WorkerInfo(
             worker_status["model_names"],
             worker_status["speed"],
             worker_status["queue_length"],
@@ -97,14 +119,24 @@ class Controller:
             time.time(),
             multimodal,
         )
+        old_info = self.registry.get(worker_name)
+        if old_info is not None:
+            # keep the outlier ejection state across re-registrations
+            worker_info.recent_failures = old_info.recent_failures
+            worker_info.last_failure = old_info.last_failure
+            worker_info.ejections = old_info.ejections
+            worker_info.ejected_until = old_info.ejected_until
+        if worker_status.get("latency_stats"):
+            update_latency_stats(worker_info, worker_status["latency_stats"])
+        self.registry.upsert(worker_name, worker_info)
 
         logger.info(f"Register done: {worker_name}, {worker_status}")
         return True
 
-    def get_worker_status(self, worker_name: str):
+    async def get_worker_status(self, worker_name: str) -> Optional[dict]:
         try:
-            r = requests.post(worker_name + "/worker_get_status", timeout=5)
-        except requests.exceptions.RequestException as e:
+            r = await self.http_client.post(worker_name + "/worker_get_status")
+        except httpx.HTTPError as e:
             logger.error(f"Get status fails: {worker_name}, {e}")
             return None
 
@@ -114,117 +146,86 @@ class Controller:
 
         return r.json()
 
+    async def get_all_worker_statuses(
+        self, worker_names: List[str]
+    ) -> Dict[str, Optional[dict]]:
+        """Poll the status of the workers concurrently."""
+        statuses = await asyncio.gather(
+            *(self.get_worker_status(worker_name) for worker_name in worker_names)
+        )
+        return dict(zip(worker_names, statuses))
+
     def remove_worker(self, worker_name: str):
-        del self.worker_info[worker_name]
+        self.registry.remove(worker_name)
 
-    def refresh_all_workers(self):
-        old_info = dict(self.worker_info)
-        self.worker_info = {}
+    async def refresh_all_workers(self):
+        statuses = await self.get_all_worker_statuses(self.registry.worker_names())
 
-        for w_name, w_info in old_info.items():
-            if not self.register_worker(
-                w_name, w_info.check_heart_beat, None, w_info.multimodal
-            ):
+        for w_name, worker_status in statuses.items():
+            w_info = self.registry.get(w_name)
+            if w_info is None:
+                # removed while polling
+                continue
+            if worker_status is None:
                 logger.info(f"Remove stale worker: {w_name}")
+                self.remove_worker(w_name)
+                continue
+            await self.register_worker(
+                w_name, w_info.check_heart_beat, worker_status, w_info.multimodal
+            )
 
     def list_models(self):
-        model_names = set()
-
-        for w_name, w_info in self.worker_info.items():
-            model_names.update(w_info.model_names)
-
-        return list(model_names)
+        return self.registry.list_models()
 
     def list_multimodal_models(self):
-        model_names = set()
-
-        for w_name, w_info in self.worker_info.items():
-            if w_info.multimodal:
-                model_names.update(w_info.model_names)
-
-        return list(model_names)
+        return self.registry.list_models(multimodal=True)
 
     def list_language_models(self):
-        model_names = set()
-
-        for w_name, w_info in self.worker_info.items():
-            if not w_info.multimodal:
-                model_names.update(w_info.model_names)
-
-        return list(model_names)
+        return self.registry.list_models(multimodal=False)
 
     def get_worker_address(self, model_name: str):
-        if self.dispatch_method == DispatchMethod.LOTTERY:
-            worker_names = []
-            worker_speeds = []
-            for w_name, w_info in self.worker_info.items():
-                if model_name in w_info.model_names:
-                    worker_names.append(w_name)
-                    worker_speeds.append(w_info.speed)
-            worker_speeds = np.array(worker_speeds, dtype=np.float32)
-            norm = np.sum(worker_speeds)
-            if norm < 1e-4:
-                return ""
-            worker_speeds = worker_speeds / norm
-            if True:  # Directly return address
-                pt = np.random.choice(np.arange(len(worker_names)), p=worker_speeds)
-                worker_name = worker_names[pt]
-                return worker_name
-
-            # Check status before returning
-            while True:
-                pt = np.random.choice(np.arange(len(worker_names)), p=worker_speeds)
-                worker_name = worker_names[pt]
-
-                if self.get_worker_status(worker_name):
-                    break
-                else:
-                    self.remove_worker(worker_name)
-                    worker_speeds[pt] = 0
-                    norm = np.sum(worker_speeds)
-                    if norm < 1e-4:
-                        return ""
-                    worker_speeds = worker_speeds / norm
-                    continue
-            return worker_name
-        elif self.dispatch_method == DispatchMethod.SHORTEST_QUEUE:
-            worker_names = []
-            worker_qlen = []
-            for w_name, w_info in self.worker_info.items():
-                if model_name in w_info.model_names:
-                    worker_names.append(w_name)
-                    worker_qlen.append(w_info.queue_length / w_info.speed)
-            if len(worker_names) == 0:
-                return ""
-            min_index = np.argmin(worker_qlen)
-            w_name = worker_names[min_index]
-            self.worker_info[w_name].queue_length += 1
-            logger.info(
-                f"names: {worker_names}, queue_lens: {worker_qlen}, ret: {w_name}"
-            )
-            return w_name
-        else:
-            raise ValueError(f"Invalid dispatch method: {self.dispatch_method}")
+        return self.registry.get_worker_address(model_name)
 
-    def receive_heart_beat(self, worker_name: str, queue_length: int):
-        if worker_name not in self.worker_info:
+    def receive_heart_beat(
+        self,
+        worker_name: str,
+        queue_length: Optional[int] = None,
+        latency_stats: Optional[dict] = None,
+    ):
+        if not self.registry.receive_heart_beat(
+            worker_name, queue_length, latency_stats
+        ):
             logger.info(f"Receive unknown heart beat. {worker_name}")
             return False
 
-        self.worker_info[worker_name].queue_length = queue_length
-        self.worker_info[worker_name].last_heart_beat = time.time()
-        logger.info(f"Receive heart beat. {worker_name}")
+        logger.debug(f"Receive heart beat. {worker_name}")
         return True
 
     def remove_stale_workers_by_expiration(self):
         expire = time.time() - CONTROLLER_HEART_BEAT_EXPIRATION
-        to_delete = []
-        for worker_name, w_info in self.worker_info.items():
-            if w_info.check_heart_beat and w_info.last_heart_beat < expire:
-                to_delete.append(worker_name)
-
-        for worker_name in to_delete:
-            self.remove_worker(worker_name)
+        self.registry.remove_stale_workers(expire)
+
+    async def watch(self):
+        """
+        Stream the registry as NDJSON: a snapshot, then every change.
+        A ping is sent when there is no change for a while, so clients can detect a dead stream.
+        """
+        snapshot, subscriber = self.registry.subscribe()
+        try:
+            yield json.dumps(snapshot).encode() + b"\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.get(), CONTROLLER_WATCH_PING_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    event = {"type": "ping", "version": self.registry.version}
+                if event is None:
+                    # the client is too slow, it will resubscribe
+                    return
+                yield json.dumps(event).encode() + b"\n"
+        finally:
+            self.registry.unsubscribe(subscriber)
 
     def handle_no_worker(self, params):
         logger.info(f"no worker: {params['model']}")
@@ -234,8 +235,13 @@ class Controller:
         }
         return json.dumps(ret).encode() + b"\0"
 
+    def report_worker_failure(self, worker_name: str) -> bool:
+        """A request to the worker failed, here or in a client streaming from it directly."""
+        logger.info(f"worker timeout: {worker_name}")
+        return self.registry.report_failure(worker_name)
+
     def handle_worker_timeout(self, worker_address):
-        logger.info(f"worker timeout: {worker_address}")
+        self.report_worker_failure(worker_address)
         ret = {
             "text": SERVER_ERROR_MSG,
             "error_code": ErrorCode.CONTROLLER_WORKER_TIMEOUT,
@@ -244,13 +250,13 @@ class Controller:
 
     # Let the controller act as a worker to achieve hierarchical
     # management. This can be used to connect isolated sub networks.
-    def worker_api_get_status(self):
+    async def worker_api_get_status(self):
         model_names = set()
         speed = 0
         queue_length = 0
 
-        for w_name in self.worker_info:
-            worker_status = self.get_worker_status(w_name)
+        statuses = await self.get_all_worker_statuses(self.registry.worker_names())
+        for worker_status in statuses.values():
             if worker_status is not None:
                 model_names.update(worker_status["model_names"])
                 speed += worker_status["speed"]
@@ -263,32 +269,93 @@ class Controller:
             "queue_length": queue_length,
         }
 
-    def worker_api_generate_stream(self, params):
+    async def worker_api_generate_stream(
+        self, params, framed: bool = False
+    ) -> AsyncIterator[bytes]:
+        # frames from the worker are forwarded as they are, the default stream of
+        # an older worker is framed here
+        encoder = FrameEncoder() if framed else None
+
+        def encode_error(chunk):
+            # the error replaces what the client has received so far
+            return encoder.encode_chunk(chunk, reset=True) if framed else chunk
+
         worker_addr = self.get_worker_address(params["model"])
         if not worker_addr:
-            yield self.handle_no_worker(params)
+            yield encode_error(self.handle_no_worker(params))
+            return
 
         try:
-            response = requests.post(
+            async with self.stream_client.stream(
+                "POST",
                 worker_addr + "/worker_generate_stream",
+                headers={"Accept": FRAMED_MEDIA_TYPE} if framed else None,
                 json=params,
-                stream=True,
-                timeout=WORKER_API_TIMEOUT,
+            ) as response:
+                worker_framed = is_framed(response.headers)
+                # only complete outputs are forwarded, so that an error can follow
+                pending = b""
+                async for data in response.aiter_raw():
+                    data = pending + data
+                    end = complete_length(data, worker_framed)
+                    chunk, pending = data[:end], data[end:]
+                    if not chunk:
+                        continue
+                    if framed and not worker_framed:
+                        chunk = encoder.encode_chunk(chunk)
+                    yield chunk
+        except httpx.HTTPError:
+            yield encode_error(self.handle_worker_timeout(worker_addr))
+
+
+async def wait_for_disconnect(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_until_disconnect(
+    generator: AsyncIterator[bytes], request: Request
+) -> AsyncIterator[bytes]:
+    """
+    Forward a proxied stream until the client disconnects.
+    The stream is closed on a disconnect, which closes its connection to the worker,
+    even while it waits for the worker.
+    """
+    disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+    next_chunk = None
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(generator.__anext__())
+            await asyncio.wait(
+                [next_chunk, disconnect], return_when=asyncio.FIRST_COMPLETED
             )
-            for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
-                if chunk:
-                    yield chunk + b"\0"
-        except requests.exceptions.RequestException as e:
-            yield self.handle_worker_timeout(worker_addr)
+            if not next_chunk.done():
+                return
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        disconnect.cancel()
+        if next_chunk is not None and not next_chunk.done():
+            next_chunk.cancel()
+            await asyncio.wait([next_chunk])
+        await generator.aclose()
 
 
 app = FastAPI()
 
 
+@app.on_event("shutdown")
+async def app_shutdown():
+    await controller.aclose()
+
+
 @app.post("/register_worker")
 async def register_worker(request: Request):
     data = await request.json()
-    controller.register_worker(
+    await controller.register_worker(
         data["worker_name"],
         data["check_heart_beat"],
         data.get("worker_status", None),
@@ -298,7 +365,12 @@ async def register_worker(request: Request):
 
 @app.post("/refresh_all_workers")
 async def refresh_all_workers():
-    models = controller.refresh_all_workers()
+    await controller.refresh_all_workers()
+
+
+@app.post("/watch")
+async def watch():
+    return StreamingResponse(controller.watch(), media_type="application/x-ndjson")
 
 
 @app.post("/list_models")
@@ -329,20 +401,33 @@ async def get_worker_address(request: Request):
 @app.post("/receive_heart_beat")
 async def receive_heart_beat(request: Request):
     data = await request.json()
-    exist = controller.receive_heart_beat(data["worker_name"], data["queue_length"])
+    exist = controller.receive_heart_beat(
+        data["worker_name"], data.get("queue_length"), data.get("latency_stats")
+    )
     return {"exist": exist}
 
 
+@app.post("/report_worker_failure")
+async def report_worker_failure(request: Request):
+    data = await request.json()
+    ejected = controller.report_worker_failure(data["worker_name"])
+    return {"ejected": ejected}
+
+
 @app.post("/worker_generate_stream")
 async def worker_api_generate_stream(request: Request):
     params = await request.json()
-    generator = controller.worker_api_generate_stream(params)
-    return StreamingResponse(generator)
+    framed = accepts_frames(request.headers)
+    generator = controller.worker_api_generate_stream(params, framed)
+    return StreamingResponse(
+        stream_until_disconnect(generator, request),
+        media_type=FRAMED_MEDIA_TYPE if framed else None,
+    )
 
 
 @app.post("/worker_get_status")
 async def worker_api_get_status(request: Request):
-    return controller.worker_api_get_status()
+    return await controller.worker_api_get_status()
 
 
 @app.get("/test_connection")
@@ -357,7 +442,7 @@ def create_controller():
     parser.add_argument(
         "--dispatch-method",
         type=str,
-        choices=["lottery", "shortest_queue"],
+        choices=["lottery", "shortest_queue", "power_of_two"],
         default="shortest_queue",
     )
     parser.add_argument(
@@ -32,6 +32,7 @@ from fastchat.serve.gradio_web_server import (
     disable_text,
     acknowledgment_md,
     get_ip,
+    merge_bot_response_streams,
     get_model_description_md,
     set_chat_system_messages
 )
@@ -522,52 +523,13 @@ def bot_response_multi(
             )
         )
 
-    model_tpy = []
-    for i in range(num_sides):
-        token_per_yield = 1
-        if states[i] is not None and states[i].model_name in [
-            "gemini-pro",
-            "gemma-1.1-2b-it",
-            "gemma-1.1-7b-it",
-            "phi-3-mini-4k-instruct",
-            "phi-3-mini-128k-instruct",
-            "snowflake-arctic-instruct",
-        ]:
-            token_per_yield = 30
-        elif states[i] is not None and  states[i].model_name in [
-            "qwen-max-0428",
-            "qwen-vl-max-0809",
-            "qwen1.5-110b-chat",
-            "llava-v1.6-34b",
-        ]:
-            token_per_yield = 7
-        elif states[i] is not None and states[i].model_name in [
-            "qwen2.5-72b-instruct",
-            "qwen2-72b-instruct",
-            "qwen-plus-0828",
-            "qwen-max-0919",
-            "llama-3.1-405b-instruct-bf16",
-        ]:
-            token_per_yield = 4
-        model_tpy.append(token_per_yield)
-
+    # stream both sides concurrently, so a slow model does not hold back the other
     chatbots = [None] * num_sides
-    iters = 0
-    while True:
-        stop = True
-        iters += 1
-        for i in range(num_sides):
-            try:
-                # yield fewer times if chunk size is larger
-                if model_tpy[i] == 1 or (iters % model_tpy[i] == 1 or iters < 3):
-                    ret = next(gen[i])
-                    states[i], chatbots[i] = ret[0], ret[1]
-                stop = False
-            except StopIteration:
-                pass
+    for rets in merge_bot_response_streams(gen):
+        for i, ret in enumerate(rets):
+            if ret is not None:
+                states[i], chatbots[i] = ret[0], ret[1]
         yield states + chatbots + [disable_btn] * sandbox_state0['btn_list_length']
-        if stop:
-            break
 
 
 def build_side_by_side_ui_anony(models):
@@ -5,9 +5,11 @@ The gradio demo server for chatting with a single model.
 import argparse
 from collections import defaultdict
 import hashlib
+import json
 import json5
 import os
 import random
+import threading
 import time
 from typing import List
 from gradio_sandboxcomponent import SandboxComponent
@@ -16,6 +18,7 @@ import gradio as gr
 import requests
 
 from fastchat.constants import (
+    BOT_RESPONSE_FRAME_INTERVAL,
     WORKER_API_TIMEOUT,
     ErrorCode,
     MODERATION_MSG,
@@ -30,9 +33,11 @@ from fastchat.constants import (
 from fastchat.conversation import Conversation
 from fastchat.model.model_registry import get_model_info, model_info
 from fastchat.serve.chat_state import LOG_DIR, ModelChatState, save_log_to_local
-from fastchat.serve.api_provider import get_api_provider_stream_iter
+from fastchat.serve.api_provider import StreamedText, get_api_provider_stream_iter
 from fastchat.serve.gradio_global_state import Context
 from fastchat.serve.remote_logger import get_remote_logger
+from fastchat.serve.stream_framing import FRAMED_MEDIA_TYPE, FrameDecoder, is_framed
+from fastchat.serve.worker_registry import WorkerRegistryClient
 from fastchat.serve.sandbox.sandbox_state import ChatbotSandboxState
 from fastchat.serve.sandbox.code_runner import SandboxGradioSandboxComponents, SandboxEnvironment, DEFAULT_SANDBOX_INSTRUCTIONS, RUN_CODE_BUTTON_HTML, SUPPORTED_SANDBOX_ENVIRONMENTS, create_chatbot_sandbox_state, on_click_code_message_run, on_edit_code, reset_sandbox_state, set_sandbox_state_ids, update_sandbox_config, update_sandbox_state_system_prompt, update_visibility_for_single_model, on_edit_dependency
 from fastchat.serve.sandbox.sandbox_telemetry import log_sandbox_telemetry_gradio_fn, save_conv_log_to_azure_storage
@@ -66,6 +71,8 @@ disable_text = gr.Textbox(
 controller_url = None
 enable_moderation = False
 use_remote_storage = False
+# Local mirror of the controller's workers, enabled by --watch-controller
+worker_registry_client = None
 
 acknowledgment_md = """
 
@@ -116,18 +123,26 @@ def set_global_vars(
     controller_url_,
     enable_moderation_,
     use_remote_storage_,
+    watch_controller_=False,
 ):
-    global controller_url, enable_moderation, use_remote_storage
+    global controller_url, enable_moderation, use_remote_storage, worker_registry_client
     controller_url = controller_url_
     enable_moderation = enable_moderation_
     use_remote_storage = use_remote_storage_
+    if watch_controller_ and controller_url:
+        worker_registry_client = WorkerRegistryClient(controller_url).start()
 
 
 def get_model_list(controller_url, register_api_endpoint_file, vision_arena: bool):
     global api_endpoint_info
 
     # Add models from the controller
-    if controller_url:
+    registry_models = None
+    if worker_registry_client is not None:
+        registry_models = worker_registry_client.list_models(multimodal=vision_arena)
+    if registry_models is not None:
+        models = registry_models
+    elif controller_url:
         ret = requests.post(controller_url + "/refresh_all_workers")
         assert ret.status_code == 200
 
@@ -406,17 +421,49 @@ def model_worker_stream_iter(
         gen_params["images"] = images
 
     # Stream output
-    response = requests.post(
-        worker_addr + "/worker_generate_stream",
-        headers=headers,
-        json=gen_params,
-        stream=True,
-        timeout=WORKER_API_TIMEOUT,
-    )
-    for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
-        if chunk:
-            data = json5.loads(chunk.decode())
-            yield data
+    try:
+        response = requests.post(
+            worker_addr + "/worker_generate_stream",
+            headers={**headers, "Accept": FRAMED_MEDIA_TYPE},
+            json=gen_params,
+            stream=True,
+            timeout=WORKER_API_TIMEOUT,
+        )
+        if is_framed(response.headers):
+            decoder = FrameDecoder()
+            for chunk in response.iter_content(chunk_size=None):
+                yield from decoder.feed(chunk)
+            return
+
+        for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
+            if chunk:
+                data = json.loads(chunk)
+                yield data
+    except requests.exceptions.RequestException:
+        report_worker_failure(worker_addr)
+        raise
+
+
+def report_worker_failure(worker_addr):
+    """Report a failed request to the controller, which ejects a worker failing repeatedly."""
+    if not controller_url:
+        return
+    try:
+        requests.post(
+            controller_url + "/report_worker_failure",
+            json={"worker_name": worker_addr},
+            timeout=5,
+        )
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Failed to report a failure of {worker_addr}: {e}")
+
+
+def update_gradio_chatbot_last_message(chatbot, message):
+    """Return a copy of a rendered gradio chatbot with the last response replaced.
+
+    Unlike `to_gradio_chatbot`, this does not re-render the conversation history.
+    """
+    return chatbot[:-1] + [[chatbot[-1][0], message]]
 
 
 def is_limit_reached(model_name, ip):
@@ -486,10 +533,14 @@ def bot_response(
     if model_api_dict is None:
         # if not API-based model, use worker
         # Query worker address
-        ret = requests.post(
-            controller_url + "/get_worker_address", json={"model": model_name}
-        )
-        worker_addr = ret.json()["address"]
+        worker_addr = None
+        if worker_registry_client is not None:
+            worker_addr = worker_registry_client.get_worker_address(model_name)
+        if worker_addr is None:
+            ret = requests.post(
+                controller_url + "/get_worker_address", json={"model": model_name}
+            )
+            worker_addr = ret.json()["address"]
         logger.info(f"model_name: {model_name}, worker_addr: {worker_addr}")
 
         # No available worker
@@ -555,22 +606,31 @@ def bot_response(
         yield (state, None) + (no_change_btn,) * sandbox_state["btn_list_length"]
         return
     conv.update_last_message(html_code)
-    yield (state, state.to_gradio_chatbot()) + (disable_btn,) * (sandbox_state["btn_list_length"])
+    # render the history once, only the last response changes while streaming
+    chatbot = state.to_gradio_chatbot()
+    yield (state, chatbot) + (disable_btn,) * (sandbox_state["btn_list_length"])
 
     try:
-        log_data = {"text": ""}
-        for i, log_data in enumerate(stream_iter):
-            if log_data["error_code"] == 0:
-                output = log_data["text"].strip()
+        streamed_text = StreamedText()
+        last_render_time = 0.0
+        for i, data in enumerate(stream_iter):
+            if data["error_code"] == 0:
+                streamed_text.update(data)
+                # append-only deltas are cheap, the full text is rendered at most once per frame
+                if time.time() - last_render_time < BOT_RESPONSE_FRAME_INTERVAL:
+                    continue
+                last_render_time = time.time()
+                output = streamed_text.text.strip()
                 conv.update_last_message(output + "▌")
                 # conv.update_last_message(output + html_code)
-                yield (state, state.to_gradio_chatbot()) + (disable_btn,) * sandbox_state["btn_list_length"]
+                chatbot = update_gradio_chatbot_last_message(chatbot, output + "▌")
+                yield (state, chatbot) + (disable_btn,) * sandbox_state["btn_list_length"]
             else:
-                output = log_data["text"] + f"\n\n(error_code: {log_data['error_code']})"
+                output = data["text"] + f"\n\n(error_code: {data['error_code']})"
                 conv.update_last_message(output)
                 yield (state, state.to_gradio_chatbot()) + (disable_btn,) * (sandbox_state["btn_list_length"]-2) + (enable_btn, enable_btn)
                 return
-        output = log_data["text"].strip()
+        output = streamed_text.text.strip()
         conv.update_last_message(output)
 
         # [CODE SANDBOX] Add a "Run in Sandbox" button to the last message if code is detected
@@ -621,6 +681,62 @@ def bot_response(
     # save_conv_log_to_azure_storage(local_filepath.lstrip(LOCAL_LOG_DIR), log_data)
 
 
+def merge_bot_response_streams(gens, frame_interval=BOT_RESPONSE_FRAME_INTERVAL):
+    """
+    Drive several `bot_response` generators concurrently, each in its own thread.
+
+    Yields the latest output of every generator (None until its first output),
+    at most once per `frame_interval` seconds, so a slow or stalled model does not
+    delay the updates of the other. Finishes after all generators are exhausted.
+    """
+    num_gens = len(gens)
+    latest = [None] * num_gens
+    done = [False] * num_gens
+    errors = []
+    changed = False
+    stopped = False
+    cond = threading.Condition()
+
+    def drive(i):
+        nonlocal changed
+        try:
+            for ret in gens[i]:
+                with cond:
+                    latest[i] = ret
+                    changed = True
+                    cond.notify()
+                if stopped:
+                    break
+        except Exception as e:
+            with cond:
+                errors.append(e)
+        finally:
+            gens[i].close()
+            with cond:
+                done[i] = True
+                changed = True
+                cond.notify()
+
+    for i in range(num_gens):
+        threading.Thread(target=drive, args=(i,), daemon=True).start()
+
+    try:
+        while True:
+            with cond:
+                cond.wait_for(lambda: changed)
+                if errors:
+                    raise errors[0]
+                changed = False
+                rets = list(latest)
+                finished = all(done)
+            yield rets
+            if finished:
+                return
+            time.sleep(frame_interval)
+    finally:
+        stopped = True
+
+
 block_css = """
 .prose {
     font-size: 105% !important;
@@ -1335,11 +1451,21 @@ if __name__ == "__main__":
         default=False,
         help="Uploads image files to google cloud storage if set to true",
     )
+    parser.add_argument(
+        "--watch-controller",
+        action="store_true",
+        help="Mirror the controller's workers through its /watch stream, and pick workers locally",
+    )
     args = parser.parse_args()
     logger.info(f"args: {args}")
 
     # Set global variables
-    set_global_vars(args.controller_url, args.moderate, args.use_remote_storage)
+    set_global_vars(
+        args.controller_url,
+        args.moderate,
+        args.use_remote_storage,
+        args.watch_controller,
+    )
     models, all_models = get_model_list(
         args.controller_url, args.register_api_endpoint_file, vision_arena=False
     )
@@ -32,6 +32,7 @@ from fastchat.serve.gradio_block_arena_vision_named import (
     load_demo_side_by_side_vision_named,
 )
 from fastchat.serve.gradio_global_state import Context
+from fastchat.serve.sandbox.sandbox_manager import start_sandbox_pools
 
 from fastchat.serve.gradio_web_server import (
     set_global_vars,
@@ -320,11 +321,21 @@ if __name__ == "__main__":
         type=str,
         help="Set the password for the gradio web server",
     )
+    parser.add_argument(
+        "--watch-controller",
+        action="store_true",
+        help="Mirror the controller's workers through its /watch stream, and pick workers locally",
+    )
     args = parser.parse_args()
     logger.info(f"args: {args}")
 
     # Set global variables
-    set_global_vars(args.controller_url, args.moderate, args.use_remote_storage)
+    set_global_vars(
+        args.controller_url,
+        args.moderate,
+        args.use_remote_storage,
+        args.watch_controller,
+    )
     set_global_vars_named(args.moderate)
     set_global_vars_anony(args.moderate)
     text_models, all_text_models = get_model_list(
@@ -359,6 +370,9 @@ if __name__ == "__main__":
     if args.gradio_auth_path is not None:
         auth = parse_gradio_auth_creds(args.gradio_auth_path)
 
+    # Start pre-warming sandboxes so the first runs do not pay the cold start
+    start_sandbox_pools()
+
     # Launch the demo
     demo = build_demo(
         context,
@@ -6,7 +6,7 @@ import math
 import os
 import sys
 import time
-from typing import Iterable, Optional, Dict
+from typing import Dict, Iterable, List, Optional
 import warnings
 
 import psutil
@@ -39,6 +39,7 @@ from fastchat.modules.awq import AWQConfig
 from fastchat.modules.gptq import GptqConfig
 from fastchat.modules.exllama import ExllamaConfig
 from fastchat.modules.xfastertransformer import XftConfig
+from fastchat.serve.kv_cache import PrefixCache, get_kv_tensors, make_cache
 from fastchat.utils import is_partial_stop, is_sentence_complete, get_context_length
 
 
@@ -58,6 +59,105 @@ def prepare_logits_processor(
     return processor_list
 
 
+def sample_top_p_top_k(
+    logits: torch.Tensor, top_p: float, top_k: int, num_samples: int = 1
+) -> torch.Tensor:
+    """
+    Sample token ids from 1-D logits filtered like TopPLogitsWarper followed by
+    TopKLogitsWarper. With top_k set, only the top k logits are sorted and sampled from,
+    instead of the whole vocabulary.
+    """
+    if top_k <= 0 and not 1e-8 <= top_p < 1.0:
+        return torch.multinomial(torch.softmax(logits, dim=-1), num_samples)
+
+    if top_k > 0:
+        top_logits, top_indices = torch.topk(logits, min(top_k, logits.shape[-1]))
+    else:
+        top_logits, top_indices = torch.sort(logits, descending=True)
+    if 1e-8 <= top_p < 1.0:
+        # Keep a token if the more likely tokens have less than top_p probability.
+        probs = torch.exp(top_logits - torch.logsumexp(logits, dim=-1))
+        probs_above = torch.cumsum(probs, dim=-1) - probs
+        top_logits = top_logits.masked_fill(probs_above >= top_p, -float("inf"))
+    probs = torch.softmax(top_logits, dim=-1)
+    return top_indices[torch.multinomial(probs, num_samples)]
+
+
+class IncrementalDetokenizer:
+    """
+    Decode the growing token ids of a stream, so that streaming n tokens costs O(n)
+    instead of decoding all the ids again on every chunk.
+
+    Each call decodes a window from the tokens of the previous chunk to the end, and
+    appends the text after the previous chunk's text. Starting one chunk back gives
+    tokenizers whose output depends on the neighbors (SentencePiece leading spaces,
+    byte-level BPE, multibyte characters split across tokens) the same context as a
+    full decode. An incomplete character at the end is held back until it is
+    complete or the stream ends.
+    """
+
+    decode_kwargs = dict(
+        skip_special_tokens=True,
+        spaces_between_special_tokens=False,
+        clean_up_tokenization_spaces=True,
+    )
+
+    def __init__(self, tokenizer, start: int = 0):
+        self.tokenizer = tokenizer
+        # the window is token_ids[prefix_offset:], the new tokens start at read_offset
+        self.prefix_offset = self.read_offset = start
+        self.text = ""
+
+    def decode(self, token_ids: List[int], final: bool = False) -> str:
+        """Return the text of `token_ids[start:]`. `token_ids` must extend those of the previous call."""
+        prefix_text = self.tokenizer.decode(
+            token_ids[self.prefix_offset : self.read_offset], **self.decode_kwargs
+        )
+        new_text = self.tokenizer.decode(
+            token_ids[self.prefix_offset :], **self.decode_kwargs
+        )
+        if len(new_text) <= len(prefix_text):
+            return self.text
+        if new_text.endswith("\ufffd") and not final:
+            # show the complete characters, but decode the window again next time
+            return self.text + new_text[len(prefix_text) :].rstrip("\ufffd")
+        self.text += new_text[len(prefix_text) :]
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(token_ids)
+        return self.text
+
+
+def apply_stop_str(output: str, stop_str, rfind_start: int):
+    """
+    Truncate the output at the last occurrence of a stop string after `rfind_start`.
+    Return the output, whether a stop string was found and whether the output ends
+    with the beginning of one, in which case it should not be streamed yet.
+    """
+    stopped = partially_stopped = False
+    if stop_str:
+        if isinstance(stop_str, str):
+            pos = output.rfind(stop_str, rfind_start)
+            if pos != -1:
+                output = output[:pos]
+                stopped = True
+            else:
+                partially_stopped = is_partial_stop(output, stop_str)
+        elif isinstance(stop_str, Iterable):
+            for each_stop in stop_str:
+                pos = output.rfind(each_stop, rfind_start)
+                if pos != -1:
+                    output = output[:pos]
+                    stopped = True
+                    break
+                else:
+                    partially_stopped = is_partial_stop(output, each_stop)
+                    if partially_stopped:
+                        break
+        else:
+            raise ValueError("Invalid stop field type.")
+    return output, stopped, partially_stopped
+
+
 @torch.inference_mode()
 def generate_stream(
     model,
@@ -67,6 +167,7 @@ def generate_stream(
     context_len: int,
     stream_interval: int = 2,
     judge_sent_end: bool = False,
+    prefix_cache: Optional[PrefixCache] = None,
 ):
     if hasattr(model, "device"):
         device = model.device
@@ -86,8 +187,9 @@ def generate_stream(
     if tokenizer.eos_token_id not in stop_token_ids:
         stop_token_ids.append(tokenizer.eos_token_id)
 
+    # top_p and top_k are applied when sampling
     logits_processor = prepare_logits_processor(
-        temperature, repetition_penalty, top_p, top_k
+        temperature, repetition_penalty, 1.0, -1
     )
     input_ids = tokenizer(prompt).input_ids
 
@@ -114,8 +216,39 @@ def generate_stream(
     else:
         start_ids = torch.as_tensor([input_ids], device=device)
 
+    if model.config.is_encoder_decoder:
+        prefix_cache = None
+    # Only prefill the tokens after the longest cached prefix.
+    # The prompt logprobs need the logits of all tokens.
+    cached_len, cached_kv_tensors = 0, None
+    if prefix_cache is not None and logprobs is None:
+        cached_len, cached_kv_tensors = prefix_cache.get(input_ids)
+
     past_key_values = out = None
     token_logprobs = [None]  # The first token has no logprobs.
+    if echo:
+        first_output_index = 0
+        rfind_start = len_prompt
+    else:
+        first_output_index = input_echo_len
+        rfind_start = 0
+    detokenizer = IncrementalDetokenizer(tokenizer, first_output_index)
+    # the decoded text of each output token, for logprobs
+    token_texts = []
+    text_offsets = []
+    # The output ids, with room for the new tokens, stay on the device with the
+    # logprobs and the second choices of the sampled tokens. They are copied to the
+    # host only when the output is streamed, so decoding does not wait for each token.
+    output_ids_tensor = torch.empty(
+        (1, input_echo_len + max_new_tokens), dtype=torch.int64, device=device
+    )
+    output_ids_tensor[0, :input_echo_len] = torch.as_tensor(input_ids, device=device)
+    length = input_echo_len
+    if logprobs is not None:
+        sampled_logprobs = torch.empty(input_echo_len + max_new_tokens, device=device)
+    if judge_sent_end:
+        second_choices = torch.empty_like(output_ids_tensor[0])
+    num_choices = 2 if judge_sent_end else 1
     sent_interrupt = False
     finish_reason = None
     stopped = False
@@ -128,6 +261,13 @@ def generate_stream(
                     use_cache=True,
                 )
                 logits = model.lm_head(out[0])
+            elif cached_len:
+                out = model(
+                    input_ids=start_ids[:, cached_len:],
+                    use_cache=True,
+                    past_key_values=make_cache(cached_kv_tensors),
+                )
+                logits = out.logits
             else:
                 out = model(input_ids=start_ids, use_cache=True)
                 logits = out.logits
@@ -135,20 +275,19 @@ def generate_stream(
 
             if logprobs is not None:
                 # Prefull logprobs for the prompt.
-                shift_input_ids = start_ids[..., 1:].contiguous()
-                shift_logits = logits[..., :-1, :].contiguous()
-                shift_logits = torch.log_softmax(shift_logits, dim=-1).tolist()
-                for label_id, logit in zip(
-                    shift_input_ids[0].tolist(), shift_logits[0]
-                ):
-                    token_logprobs.append(logit[label_id])
+                shift_logprobs = torch.log_softmax(logits[0, :-1, :], dim=-1)
+                token_logprobs.extend(
+                    shift_logprobs.gather(-1, start_ids[0, 1:, None])[:, 0].tolist()
+                )
         else:  # decoding
+            if sent_interrupt:
+                # The last token was replaced, run the whole sequence again.
+                decoder_input_ids = output_ids_tensor[:, :length]
+            else:
+                decoder_input_ids = output_ids_tensor[:, length - 1 : length]
             if model.config.is_encoder_decoder:
                 out = model.decoder(
-                    input_ids=torch.as_tensor(
-                        [[token] if not sent_interrupt else output_ids],
-                        device=device,
-                    ),
+                    input_ids=decoder_input_ids,
                     encoder_hidden_states=encoder_output,
                     use_cache=True,
                     past_key_values=past_key_values if not sent_interrupt else None,
@@ -158,10 +297,7 @@ def generate_stream(
                 logits = model.lm_head(out[0])
             else:
                 out = model(
-                    input_ids=torch.as_tensor(
-                        [[token] if not sent_interrupt else output_ids],
-                        device=device,
-                    ),
+                    input_ids=decoder_input_ids,
                     use_cache=True,
                     past_key_values=past_key_values if not sent_interrupt else None,
                 )
@@ -171,7 +307,7 @@ def generate_stream(
 
         if logits_processor:
             if repetition_penalty > 1.0:
-                tmp_output_ids = torch.as_tensor([output_ids], device=logits.device)
+                tmp_output_ids = output_ids_tensor[:, :length].to(logits.device)
             else:
                 tmp_output_ids = None
             last_token_logits = logits_processor(tmp_output_ids, logits[:, -1, :])[0]
@@ -183,94 +319,70 @@ def generate_stream(
             last_token_logits = last_token_logits.float().to("cpu")
 
         if temperature < 1e-5 or top_p < 1e-8:  # greedy
-            _, indices = torch.topk(last_token_logits, 2)
-            tokens = [int(index) for index in indices.tolist()]
+            _, tokens = torch.topk(last_token_logits, num_choices)
         else:
-            probs = torch.softmax(last_token_logits, dim=-1)
-            indices = torch.multinomial(probs, num_samples=2)
-            tokens = [int(token) for token in indices.tolist()]
-        token = tokens[0]
-        output_ids.append(token)
+            tokens = sample_top_p_top_k(last_token_logits, top_p, top_k, num_choices)
+        output_ids_tensor[0, length] = tokens[0]
+        if judge_sent_end:
+            second_choices[length] = tokens[1]
         if logprobs is not None:
             # Cannot use last_token_logits because logprobs is based on raw logits.
-            token_logprobs.append(
-                torch.log_softmax(logits[0, -1, :], dim=-1)[token].tolist()
-            )
-
-        if token in stop_token_ids:
-            stopped = True
-        else:
-            stopped = False
+            raw_logits = logits[0, -1, :]
+            sampled_logprobs[length] = raw_logits[
+                tokens[0].to(raw_logits.device)
+            ] - torch.logsumexp(raw_logits, dim=-1)
+        length += 1
+
+        # Check the stop tokens only when the output is streamed, a stop token sampled
+        # since the last check ends the output at its step. judge_sent_end replaces
+        # a stop token at once.
+        if i % stream_interval == 0 or i == max_new_tokens - 1 or judge_sent_end:
+            start = len(output_ids)
+            new_ids = output_ids_tensor[0, start:length].tolist()
+            for j, token in enumerate(new_ids):
+                if token in stop_token_ids:
+                    stopped = True
+                    i -= len(new_ids) - j - 1
+                    length = start + j + 1
+                    break
+            output_ids.extend(new_ids[: length - start])
+            if logprobs is not None:
+                token_logprobs.extend(sampled_logprobs[start:length].tolist())
 
         # Yield the output tokens
         if i % stream_interval == 0 or i == max_new_tokens - 1 or stopped:
-            if echo:
-                tmp_output_ids = output_ids
-                rfind_start = len_prompt
-            else:
-                tmp_output_ids = output_ids[input_echo_len:]
-                rfind_start = 0
-
-            output = tokenizer.decode(
-                tmp_output_ids,
-                skip_special_tokens=True,
-                spaces_between_special_tokens=False,
-                clean_up_tokenization_spaces=True,
+            output = detokenizer.decode(
+                output_ids, final=stopped or i == max_new_tokens - 1
             )
             ret_logprobs = None
             if logprobs is not None:
+                for token_id in output_ids[first_output_index + len(token_texts) :]:
+                    text_offsets.append(
+                        text_offsets[-1] + len(token_texts[-1]) if token_texts else 0
+                    )
+                    token_texts.append(tokenizer.decode(token_id))
                 ret_logprobs = {
-                    "text_offset": [],
-                    "tokens": [
-                        tokenizer.decode(token)
-                        for token in (
-                            output_ids if echo else output_ids[input_echo_len:]
-                        )
-                    ],
-                    "token_logprobs": token_logprobs
-                    if echo
-                    else token_logprobs[input_echo_len:],
-                    "top_logprobs": [{}]
-                    * len(token_logprobs if echo else token_logprobs[input_echo_len:]),
+                    "text_offset": list(text_offsets),
+                    "tokens": list(token_texts),
+                    "token_logprobs": token_logprobs[first_output_index:],
+                    "top_logprobs": [{}] * len(token_logprobs[first_output_index:]),
                 }
-                # Compute text_offset
-                curr_pos = 0
-                for text in ret_logprobs["tokens"]:
-                    ret_logprobs["text_offset"].append(curr_pos)
-                    curr_pos += len(text)
 
             # TODO: For the issue of incomplete sentences interrupting output, apply a patch and others can also modify it to a more elegant way
             if judge_sent_end and stopped and not is_sentence_complete(output):
-                if len(tokens) > 1:
-                    token = tokens[1]
-                    output_ids[-1] = token
-                else:
-                    output_ids.pop()
+                output_ids[-1] = int(second_choices[length - 1])
+                output_ids_tensor[0, length - 1] = output_ids[-1]
                 stopped = False
                 sent_interrupt = True
+                # the last token changed, decode again from the start
+                detokenizer = IncrementalDetokenizer(tokenizer, first_output_index)
+                del token_texts[length - first_output_index - 1 :]
+                del text_offsets[len(token_texts) :]
 
-            partially_stopped = False
-            if stop_str:
-                if isinstance(stop_str, str):
-                    pos = output.rfind(stop_str, rfind_start)
-                    if pos != -1:
-                        output = output[:pos]
-                        stopped = True
-                    else:
-                        partially_stopped = is_partial_stop(output, stop_str)
-                elif isinstance(stop_str, Iterable):
-                    for each_stop in stop_str:
-                        pos = output.rfind(each_stop, rfind_start)
-                        if pos != -1:
-                            output = output[:pos]
-                            stopped = True
-                            break
-                        else:
-                            partially_stopped = is_partial_stop(output, each_stop)
-                            if partially_stopped:
-                                break
-                else:
-                    raise ValueError("Invalid stop field type.")
+            output, found_stop_str, partially_stopped = apply_stop_str(
+                output, stop_str, rfind_start
+            )
+            stopped = stopped or found_stop_str
 
             # Prevent yielding partial stop sequence
             if not partially_stopped:
@@ -306,6 +418,16 @@ def generate_stream(
         "finish_reason": finish_reason,
     }
 
+    if prefix_cache is not None:
+        # The KV cache covers the output ids except the last one, and the tokens
+        # sampled after a stop token.
+        num_cached = len(output_ids) - 1
+        kv_tensors = [
+            (keys[:, :, :num_cached], values[:, :, :num_cached])
+            for keys, values in get_kv_tensors(past_key_values)
+        ]
+        prefix_cache.put(output_ids[:-1], kv_tensors)
+
     # Clean
     del past_key_values, out
     gc.collect()
@@ -0,0 +1,176 @@
+"""
+KV cache utilities for HuggingFace causal language models.
+
+`PrefixCache` keeps the KV caches of finished requests, so that a request starting
+with the same tokens, such as the next turn of a conversation, only prefills the rest.
+"""
+from collections import OrderedDict
+import dataclasses
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import torch
+
+
+def get_kv_tensors(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """The (key, value) tensors of each layer, shaped [batch, heads, seq_len, head_dim]."""
+    if hasattr(past_key_values, "layers"):  # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, "to_legacy_cache"):
+        past_key_values = past_key_values.to_legacy_cache()
+    return [(keys, values) for keys, values in past_key_values]
+
+
+def make_cache(kv_tensors: List[Tuple[torch.Tensor, torch.Tensor]]):
+    try:
+        from transformers import DynamicCache
+    except ImportError:  # transformers < 4.36 takes the legacy tuples
+        return tuple(kv_tensors)
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(kv_tensors))
+    return DynamicCache(kv_tensors)
+
+
+@dataclasses.dataclass
+class _Entry:
+    token_ids: List[int]
+    kv_tensors: List[Tuple[torch.Tensor, torch.Tensor]]
+    prefix_hashes: List[int]
+    num_bytes: int
+
+
+class PrefixCache:
+    """
+    An LRU cache of KV caches under a memory budget, looked up by token id prefix.
+
+    An entry is indexed by the hashes of its token id prefixes at every `block_size`
+    tokens, so a lookup finds the entry sharing the most blocks with the request and
+    reuses its KV cache up to the first differing token. The caches of a sequence
+    and of its extension are not both kept, the shorter one is replaced.
+    """
+
+    def __init__(self, max_bytes: int, block_size: int = 16):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # prefix hash -> keys of the entries starting with that prefix
+        self._index: Dict[int, Set[int]] = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        self.num_bytes = 0
+        self.num_lookups = 0
+        self.num_hits = 0
+        self.prefill_tokens = 0
+        self.saved_prefill_tokens = 0
+
+    def get(
+        self, token_ids: List[int]
+    ) -> Tuple[int, Optional[List[Tuple[torch.Tensor, torch.Tensor]]]]:
+        """
+        Return the number of leading tokens whose KV cache is cached, and that cache.
+        The last token is never included, its logits are needed to sample the next one.
+        """
+        with self._lock:
+            self.num_lookups += 1
+            self.prefill_tokens += len(token_ids)
+            key, length = self._find(token_ids)
+            length = min(length, len(token_ids) - 1)
+            if length <= 0:
+                return 0, None
+
+            self.num_hits += 1
+            self.saved_prefill_tokens += length
+            self._entries.move_to_end(key)
+            kv_tensors = [
+                (keys[:, :, :length], values[:, :, :length])
+                for keys, values in self._entries[key].kv_tensors
+            ]
+        return length, kv_tensors
+
+    def put(
+        self, token_ids: List[int], kv_tensors: List[Tuple[torch.Tensor, torch.Tensor]]
+    ):
+        """Cache the KV cache of `token_ids`, evicting the least recently used ones."""
+        num_bytes = sum(
+            keys.numel() * keys.element_size() + values.numel() * values.element_size()
+            for keys, values in kv_tensors
+        )
+        if (
+            len(token_ids) < self.block_size
+            or num_bytes > self.max_bytes
+            # e.g. sliding window caches keep only the last tokens
+            or kv_tensors[0][0].shape[2] != len(token_ids)
+        ):
+            return
+
+        with self._lock:
+            key, length = self._find(token_ids)
+            if key is not None:
+                if length == len(token_ids):  # already cached
+                    self._entries.move_to_end(key)
+                    return
+                if length == len(self._entries[key].token_ids):
+                    self._remove(key)
+
+            while self._entries and self.num_bytes + num_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+            key = self._next_key
+            self._next_key += 1
+            prefix_hashes = list(self._prefix_hashes(token_ids))
+            self._entries[key] = _Entry(
+                list(token_ids), kv_tensors, prefix_hashes, num_bytes
+            )
+            for prefix_hash in prefix_hashes:
+                self._index.setdefault(prefix_hash, set()).add(key)
+            self.num_bytes += num_bytes
+
+    def get_stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.num_bytes,
+            "lookups": self.num_lookups,
+            "hits": self.num_hits,
+            "hit_rate": self.num_hits / self.num_lookups if self.num_lookups else 0.0,
+            "prefill_tokens": self.prefill_tokens,
+            "saved_prefill_tokens": self.saved_prefill_tokens,
+        }
+
+    def _prefix_hashes(self, token_ids: List[int]) -> Iterator[int]:
+        prefix_hash = None
+        for end in range(self.block_size, len(token_ids) + 1, self.block_size):
+            prefix_hash = hash(
+                (prefix_hash, tuple(token_ids[end - self.block_size : end]))
+            )
+            yield prefix_hash
+
+    def _find(self, token_ids: List[int]) -> Tuple[Optional[int], int]:
+        """The key of the entry sharing the longest prefix with `token_ids`, and its length."""
+        keys = None
+        for prefix_hash in self._prefix_hashes(token_ids):
+            if prefix_hash not in self._index:
+                break
+            keys = self._index[prefix_hash]
+        if keys is None:
+            return None, 0
+
+        key = max(keys)  # the most recently added
+        cached_ids = self._entries[key].token_ids
+        length = 0
+        # compare the tokens, a hash may collide
+        for cached_id, token_id in zip(cached_ids, token_ids):
+            if cached_id != token_id:
+                break
+            length += 1
+        return key, length
+
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        for prefix_hash in entry.prefix_hashes:
+            keys = self._index[prefix_hash]
+            keys.discard(key)
+            if not keys:
+                del self._index[prefix_hash]
+        self.num_bytes -= entry.num_bytes
@@ -0,0 +1,294 @@
+"""
+A background writer for the local conversation logs.
+
+Request threads serialize their log records and enqueue them, so the records can be
+mutated right after. A single writer thread appends them to cached file handles and
+flushes in groups, either every `flush_records` records or every `flush_interval`
+seconds, whichever comes first.
+"""
+
+import atexit
+from collections import OrderedDict
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Literal, Optional
+
+from fastchat.constants import (
+    LOG_WRITER_FLUSH_INTERVAL,
+    LOG_WRITER_FLUSH_RECORDS,
+    LOG_WRITER_FSYNC,
+    LOG_WRITER_QUEUE_SIZE,
+)
+from fastchat.utils import build_logger
+
+logger = build_logger("gradio_web_server", "gradio_web_server.log")
+
+FsyncPolicy = Literal["never", "flush", "always"]
+
+_global_writer = None
+_global_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    global _global_writer
+    with _global_writer_lock:
+        if _global_writer is None:
+            _global_writer = LogWriter()
+            atexit.register(_global_writer.close)
+        return _global_writer
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class LogWriter:
+    """
+    Append JSON log records to local files from a background thread.
+
+    Records of the same file are written in the order they are enqueued.
+    When the queue is full, `write` blocks until the writer catches up, and the
+    time spent waiting is reported in `stats`.
+
+    fsync policy:
+        never: leave it to the OS.
+        flush: fsync the written files at every group flush.
+        always: fsync after every record.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = LOG_WRITER_QUEUE_SIZE,
+        flush_records: int = LOG_WRITER_FLUSH_RECORDS,
+        flush_interval: float = LOG_WRITER_FLUSH_INTERVAL,
+        fsync: FsyncPolicy = LOG_WRITER_FSYNC,
+        max_open_files: int = 256,
+    ):
+        if fsync not in ("never", "flush", "always"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_open_files = max_open_files
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._files: OrderedDict[str, Any] = OrderedDict()
+        self._dirty_files: set[str] = set()
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._written = 0
+        self._errors = 0
+        self._flushes = 0
+        self._fsyncs = 0
+        self._blocked_writes = 0
+        self._blocked_seconds = 0.0
+        self._max_queue_depth = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(
+        self,
+        log_path: str,
+        log_data: dict[str, Any],
+        write_mode: Literal["overwrite", "append"] = "append",
+    ):
+        """
+        Serialize a log record and enqueue it.
+
+        After `close`, the record is written synchronously instead.
+        """
+        try:
+            log_json = json.dumps(log_data, default=str)
+        except Exception as e:
+            logger.error(f"Failed to serialize log for {log_path}: {e}")
+            with self._stats_lock:
+                self._errors += 1
+            return
+        item = (log_path, log_json, write_mode)
+        # enqueue under the lock, so no record can be put behind the stop sentinel
+        with self._close_lock:
+            closed = self._closed
+            if not closed:
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    start = time.perf_counter()
+                    self._queue.put(item)
+                    with self._stats_lock:
+                        self._blocked_writes += 1
+                        self._blocked_seconds += time.perf_counter() - start
+        if closed:
+            # write after the records the writer thread is still draining
+            self._thread.join()
+            with self._close_lock:
+                self._write_record(*item)
+                self._flush_files()
+                self._close_files()
+            return
+        with self._stats_lock:
+            self._enqueued += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all records enqueued so far are written and flushed.
+        """
+        request = _FlushRequest()
+        with self._close_lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put(request)
+        if closed:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return request.done.wait(timeout)
+
+    def close(self):
+        """
+        Write the remaining records and close the files.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> dict[str, int | float]:
+        with self._stats_lock:
+            return {
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "errors": self._errors,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "flushes": self._flushes,
+                "fsyncs": self._fsyncs,
+                "blocked_writes": self._blocked_writes,
+                "blocked_seconds": self._blocked_seconds,
+                "open_files": len(self._files),
+            }
+
+    def _run(self):
+        pending = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush_files()
+                self._close_files()
+                return
+            if isinstance(item, _FlushRequest):
+                self._flush_files()
+                pending, deadline = 0, None
+                item.done.set()
+                continue
+            if item is not None:
+                self._write_record(*item)
+                pending += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if pending and (
+                pending >= self.flush_records or time.monotonic() >= deadline
+            ):
+                self._flush_files()
+                pending, deadline = 0, None
+
+    def _write_record(self, log_path, log_json, write_mode):
+        try:
+            if write_mode == "overwrite":
+                self._close_file(log_path)
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                with open(log_path, "w") as fout:
+                    fout.write(log_json + "\n")
+                    if self.fsync != "never":
+                        fout.flush()
+                        os.fsync(fout.fileno())
+                        self._count_fsync()
+            else:
+                fout = self._get_file(log_path)
+                fout.write(log_json + "\n")
+                if self.fsync == "always":
+                    fout.flush()
+                    os.fsync(fout.fileno())
+                    self._count_fsync()
+                else:
+                    self._dirty_files.add(log_path)
+            with self._stats_lock:
+                self._written += 1
+        except Exception as e:
+            logger.error(f"Failed to write log to {log_path}: {e}")
+            self._close_file(log_path)
+            with self._stats_lock:
+                self._errors += 1
+
+    def _get_file(self, log_path):
+        fout = self._files.get(log_path)
+        if fout is not None:
+            self._files.move_to_end(log_path)
+            return fout
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        fout = open(log_path, "a")
+        self._files[log_path] = fout
+        while len(self._files) > self.max_open_files:
+            self._close_file(next(iter(self._files)))
+        return fout
+
+    def _flush_files(self):
+        for log_path in list(self._dirty_files):
+            fout = self._files.get(log_path)
+            if fout is None:
+                continue
+            try:
+                fout.flush()
+                if self.fsync == "flush":
+                    os.fsync(fout.fileno())
+                    self._count_fsync()
+            except Exception as e:
+                logger.error(f"Failed to flush log {log_path}: {e}")
+                with self._stats_lock:
+                    self._errors += 1
+        self._dirty_files.clear()
+        with self._stats_lock:
+            self._flushes += 1
+
+    def _close_file(self, log_path):
+        fout = self._files.pop(log_path, None)
+        if fout is None:
+            return
+        try:
+            if log_path in self._dirty_files and self.fsync == "flush":
+                fout.flush()
+                os.fsync(fout.fileno())
+                self._count_fsync()
+            fout.close()
+        except Exception as e:
+            logger.error(f"Failed to close log {log_path}: {e}")
+        self._dirty_files.discard(log_path)
+
+    def _close_files(self):
+        for log_path in list(self._files):
+            self._close_file(log_path)
+
+    def _count_fsync(self):
+        with self._stats_lock:
+            self._fsyncs += 1
@@ -4,7 +4,6 @@ A model worker that executes the model.
 import argparse
 import base64
 import gc
-import json
 import os
 from typing import List, Optional
 import uuid
@@ -25,6 +24,12 @@ from fastchat.modules.exllama import ExllamaConfig
 from fastchat.modules.xfastertransformer import XftConfig
 from fastchat.modules.gptq import GptqConfig
 from fastchat.serve.base_model_worker import BaseModelWorker, app
+from fastchat.serve.continuous_batching import (
+    ContinuousBatchingEngine,
+    is_continuous_batching_supported,
+)
+from fastchat.serve.inference import generate_stream
+from fastchat.serve.kv_cache import PrefixCache
 from fastchat.utils import (
     build_logger,
     get_context_length,
@@ -61,6 +66,8 @@ class ModelWorker(BaseModelWorker):
         embed_in_truncate: bool = False,
         seed: Optional[int] = None,
         debug: bool = False,
+        continuous_batching: bool = False,
+        prefix_cache_size: float = 0,
         **kwargs,
     ):
         super().__init__(
@@ -98,9 +105,49 @@ class ModelWorker(BaseModelWorker):
         self.embed_in_truncate = embed_in_truncate
         self.seed = seed
 
+        self.batching_engine = None
+        if continuous_batching:
+            if seed is not None:
+                # the batched requests share one random state, a seed cannot be replayed
+                logger.warning("Continuous batching does not support --seed, disabled.")
+            elif is_continuous_batching_supported(
+                self.model, self.generate_stream_func
+            ):
+                self.batching_engine = ContinuousBatchingEngine(
+                    self.model,
+                    self.tokenizer,
+                    device,
+                    self.context_len,
+                    stream_interval,
+                    max_batch_size=limit_worker_concurrency,
+                )
+            else:
+                logger.warning(
+                    f"Continuous batching is not supported for {model_path}, disabled."
+                )
+
+        self.prefix_cache = None
+        if prefix_cache_size > 0:
+            if self.batching_engine is not None:
+                logger.warning(
+                    "Prefix caching is not supported with continuous batching, disabled."
+                )
+            elif self.generate_stream_func is generate_stream:
+                self.prefix_cache = PrefixCache(int(prefix_cache_size * 2**30))
+            else:
+                logger.warning(
+                    f"Prefix caching is not supported for {model_path}, disabled."
+                )
+
         if not no_register:
             self.init_heart_beat()
 
+    def get_status(self):
+        status = super().get_status()
+        if self.prefix_cache is not None:
+            status["prefix_cache"] = self.prefix_cache.get_stats()
+        return status
+
     def generate_stream_gate(self, params):
         if self.device == "npu":
             import torch_npu
@@ -109,16 +156,24 @@ class ModelWorker(BaseModelWorker):
         self.call_ct += 1
 
         try:
-            if self.seed is not None:
-                set_seed(self.seed)
-            for output in self.generate_stream_func(
-                self.model,
-                self.tokenizer,
-                params,
-                self.device,
-                self.context_len,
-                self.stream_interval,
-            ):
+            if self.batching_engine and self.batching_engine.supports(params):
+                outputs = self.batching_engine.generate_stream(params)
+            else:
+                if self.seed is not None:
+                    set_seed(self.seed)
+                kwargs = {}
+                if self.prefix_cache is not None:
+                    kwargs["prefix_cache"] = self.prefix_cache
+                outputs = self.generate_stream_func(
+                    self.model,
+                    self.tokenizer,
+                    params,
+                    self.device,
+                    self.context_len,
+                    self.stream_interval,
+                    **kwargs,
+                )
+            for output in outputs:
                 ret = {
                     "text": output["text"],
                     "error_code": 0,
@@ -129,24 +184,24 @@ class ModelWorker(BaseModelWorker):
                     ret["finish_reason"] = output["finish_reason"]
                 if "logprobs" in output:
                     ret["logprobs"] = output["logprobs"]
-                yield json.dumps(ret).encode() + b"\0"
+                yield ret
         except torch.cuda.OutOfMemoryError as e:
             ret = {
                 "text": f"{SERVER_ERROR_MSG}\n\n({e})",
                 "error_code": ErrorCode.CUDA_OUT_OF_MEMORY,
             }
-            yield json.dumps(ret).encode() + b"\0"
+            yield ret
         except (ValueError, RuntimeError) as e:
             ret = {
                 "text": f"{SERVER_ERROR_MSG}\n\n({e})",
                 "error_code": ErrorCode.INTERNAL_ERROR,
             }
-            yield json.dumps(ret).encode() + b"\0"
+            yield ret
 
     def generate_gate(self, params):
         for x in self.generate_stream_gate(params):
             pass
-        return json.loads(x[:-1].decode())
+        return x
 
     def __process_embed_chunk(self, input_ids, attention_mask, **model_type_dict):
         if model_type_dict.get("is_bert"):
@@ -325,6 +380,20 @@ def create_model_worker():
         help="Limit the model concurrency to prevent OOM.",
     )
     parser.add_argument("--stream-interval", type=int, default=2)
+    parser.add_argument(
+        "--continuous-batching",
+        action="store_true",
+        help="Decode concurrent requests in shared batches, up to --limit-worker-concurrency. "
+        "Disabled by --seed; disables --prefix-cache-size.",
+    )
+    parser.add_argument(
+        "--prefix-cache-size",
+        type=float,
+        default=0,
+        help="Keep the KV caches of finished requests, up to this many GiB, so that "
+        "requests sharing their prefix (e.g. the next turn of a chat) skip its prefill. "
+        "0 disables it.",
+    )
     parser.add_argument("--no-register", action="store_true")
     parser.add_argument(
         "--seed",
@@ -406,6 +475,8 @@ def create_model_worker():
         embed_in_truncate=args.embed_in_truncate,
         seed=args.seed,
         debug=args.debug,
+        continuous_batching=args.continuous_batching,
+        prefix_cache_size=args.prefix_cache_size,
     )
     return args, worker
 
@@ -0,0 +1,188 @@
+"""
+A columnar store of the cleaned battles.
+
+The battles are written as a parquet dataset partitioned by date, with the conversations
+in their own dataset next to the other columns:
+    {path}/battles/date=2024-06-01/part-0.parquet
+    {path}/conversations/date=2024-06-01/part-0.parquet
+A rating job only reads the columns it needs from the battles, the dates and the filters
+prune the files and the row groups before they are read, and the files are memory-mapped.
+The conversations are joined back on (date, battle_id) only when they are asked for.
+
+load_battles reads a store or a clean battle json file into the same DataFrame, so the
+monitor scripts take either.
+
+Usage:
+python3 -m fastchat.serve.monitor.battle_store --clean-battle-file clean_battle_conv_20240601.json --output clean_battle_conv_20240601
+"""
+import argparse
+import datetime
+import json
+import os
+from typing import List, Optional
+
+import pandas as pd
+from pytz import timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# what the rating jobs read
+RATING_COLUMNS = [
+    "model_a",
+    "model_b",
+    "winner",
+    "tstamp",
+    "judge",
+    "language",
+    "anony",
+]
+CONVERSATION_COLUMNS = ["conversation_a", "conversation_b"]
+JOIN_COLUMNS = ["date", "battle_id"]
+
+
+def is_battle_store(path: str) -> bool:
+    return os.path.isdir(os.path.join(path, "battles"))
+
+
+def get_battle_dates(tstamps) -> pd.Series:
+    return (
+        pd.to_datetime(tstamps, unit="s", utc=True)
+        .dt.tz_convert(timezone("US/Pacific"))
+        .dt.strftime("%Y-%m-%d")
+    )
+
+
+def write_battles(battles, path: str):
+    """
+    Write the battles, as returned by clean_battle_data, to a store.
+    The dates already in the store and in the battles are replaced, the other dates are kept.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    battles = pd.DataFrame(battles)
+    battles = battles.sort_values(by=["tstamp"], kind="stable", ignore_index=True)
+    battles["date"] = get_battle_dates(battles["tstamp"])
+    battles["battle_id"] = battles.groupby("date").cumcount()
+
+    conversation_columns = [c for c in CONVERSATION_COLUMNS if c in battles.columns]
+    groups = {"battles": [c for c in battles.columns if c not in conversation_columns]}
+    if conversation_columns:
+        groups["conversations"] = JOIN_COLUMNS + conversation_columns
+
+    for name, columns in groups.items():
+        table = pa.Table.from_pandas(battles[columns], preserve_index=False)
+        ds.write_dataset(
+            table,
+            os.path.join(path, name),
+            format="parquet",
+            partitioning=["date"],
+            partitioning_flavor="hive",
+            basename_template="part-{i}.parquet",
+            existing_data_behavior="delete_matching",
+            max_rows_per_group=1 << 17,
+        )
+
+
+def get_dataset(path: str, name: str):
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    return ds.dataset(
+        os.path.join(path, name),
+        format="parquet",
+        partitioning="hive",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def to_expression(filters):
+    """Filters as a pyarrow expression, or as the [(column, op, value), ...] of pyarrow.parquet."""
+    import pyarrow.parquet as pq
+
+    if filters is None or not isinstance(filters, list):
+        return filters
+    return pq.filters_to_expression(filters)
+
+
+def to_dataframe(table) -> pd.DataFrame:
+    """Like the json: the lists and the dicts of the nested columns are python objects."""
+    import pyarrow.types as pat
+
+    nested = [field.name for field in table.schema if pat.is_nested(field.type)]
+    df = table.drop_columns(nested).to_pandas()
+    for name in nested:
+        df[name] = table.column(name).to_pylist()
+    return df[table.column_names]
+
+
+def read_battles(
+    path: str, columns: Optional[List[str]] = None, filters=None
+) -> pd.DataFrame:
+    """
+    Read the battles of a store in the order of their tstamp.
+    columns: None for all the columns but the conversations
+    filters: a pyarrow expression or [(column, op, value), ...], e.g. [("date", ">=", "2024-06-01")]
+    """
+    battles = get_dataset(path, "battles")
+    if columns is None:
+        columns = [c for c in battles.schema.names if c not in JOIN_COLUMNS]
+    conversation_columns = [c for c in columns if c in CONVERSATION_COLUMNS]
+    battle_columns = [c for c in columns if c not in CONVERSATION_COLUMNS]
+
+    table = battles.to_table(
+        columns=list(dict.fromkeys(battle_columns + JOIN_COLUMNS)),
+        filter=to_expression(filters),
+    )
+    df = to_dataframe(table)
+    df["date"] = df["date"].astype(str)
+    df = df.sort_values(by=JOIN_COLUMNS, ignore_index=True)
+
+    if conversation_columns:
+        import pyarrow.dataset as ds
+
+        dates = df["date"].unique().tolist()
+        conversations = to_dataframe(
+            get_dataset(path, "conversations").to_table(
+                columns=JOIN_COLUMNS + conversation_columns,
+                filter=ds.field("date").isin(dates),
+            )
+        )
+        conversations["date"] = conversations["date"].astype(str)
+        df = df.merge(conversations, on=JOIN_COLUMNS, how="left")
+    return df[columns]
+
+
+def load_battles(
+    path: str, columns: Optional[List[str]] = None, filters=None
+) -> pd.DataFrame:
+    """
+    Load the battles of a store or of a clean battle json file.
+    filters only apply to a store, filter the DataFrame of a json file instead.
+    """
+    if is_battle_store(path):
+        return read_battles(path, columns=columns, filters=filters)
+    if filters is not None:
+        raise ValueError("filters need a battle store, not a json file")
+
+    with open(path, "rb") as fin:
+        data = orjson.loads(fin.read()) if orjson is not None else json.load(fin)
+    battles = pd.DataFrame(data)
+    return battles if columns is None else battles[columns]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clean-battle-file", type=str, required=True)
+    parser.add_argument("--output", type=str, required=True)
+    args = parser.parse_args()
+
+    battles = load_battles(args.clean_battle_file)
+    write_battles(battles, args.output)
+    last_updated = datetime.datetime.fromtimestamp(
+        battles["tstamp"].max(), tz=timezone("US/Pacific")
+    ).strftime("%Y-%m-%d %H:%M:%S %Z")
+    print(f"Write {len(battles)} battles until {last_updated} to {args.output}")
@@ -10,6 +10,8 @@ import random
 import threading
 import orjson
 
+from fastchat.serve.monitor.battle_store import load_battles
+
 from category import Category
 
 
@@ -190,9 +192,7 @@ if __name__ == "__main__":
     )
 
     print("loading input data (might take min)")
-    with open(config["input_file"], "rb") as f:
-        data = orjson.loads(f.read())
-    input_data = pd.DataFrame(data)
+    input_data = load_battles(config["input_file"])
 
     # much faster than pd.apply
     input_data["uid"] = input_data.question_id.map(str) + input_data.tstamp.map(str)
@@ -18,6 +18,7 @@ from collections import Counter
 import shortuuid
 
 from fastchat.serve.monitor.basic_stats import get_log_files, NUM_SERVERS
+from fastchat.serve.monitor.battle_store import write_battles
 from fastchat.utils import detect_language
 
 
@@ -382,6 +383,9 @@ if __name__ == "__main__":
     parser.add_argument("--exclude-model-names", type=str, nargs="+")
     parser.add_argument("--ban-ip-file", type=str)
     parser.add_argument("--sanitize-ip", action="store_true", default=False)
+    parser.add_argument(
+        "--output-format", type=str, choices=["json", "parquet"], default="json"
+    )
     args = parser.parse_args()
 
     log_files = get_log_files(args.max_num_files)
@@ -418,6 +422,11 @@ if __name__ == "__main__":
         battles = new_battles
         output = f"clean_battle_conv_{cutoff_date}.json"
 
-    with open(output, "w", encoding="utf-8", errors="replace") as fout:
-        json.dump(battles, fout, indent=2, ensure_ascii=False)
+    if args.output_format == "parquet":
+        # a battle store, see battle_store
+        output = output[: -len(".json")]
+        write_battles(battles, output)
+    else:
+        with open(output, "w", encoding="utf-8", errors="replace") as fout:
+            json.dump(battles, fout, indent=2, ensure_ascii=False)
     print(f"Write cleaned data to {output}")
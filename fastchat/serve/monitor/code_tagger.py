@@ -7,6 +7,8 @@ import nltk
 from tqdm import tqdm
 from nltk.tokenize import word_tokenize
 
+from fastchat.serve.monitor.battle_store import load_battles
+
 
 def is_code_conversation(text: str) -> tuple[bool, list[str]]:
     """Check if the text is a code conversation"""
@@ -139,8 +141,7 @@ def check_conv_row(conv_row):
 
 
 def process_battle_file(battle_file_path: str, n_cpus: int):
-    with open(battle_file_path, "r") as f:
-        data = json.load(f)
+    data = load_battles(battle_file_path).to_dict("records")
 
     with mp.Pool(n_cpus) as pool:
         tagged_data = list(tqdm(pool.imap(check_conv_row, data), total=len(data)))
@@ -13,6 +13,8 @@ import matplotlib.pyplot as plt
 
 import numpy as np
 
+from fastchat.serve.monitor.battle_store import load_battles
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--output_dir", type=str, default="output")
@@ -23,8 +25,7 @@ if __name__ == "__main__":
     output_dir = args.output_dir
     input_file = args.input_file
 
-    with open(input_file) as f:
-        data = json.load(f)
+    data = load_battles(input_file).to_dict("records")
 
     os.makedirs(output_dir, exist_ok=True)
 
@@ -15,6 +15,11 @@ from tqdm import tqdm
 
 from fastchat.model.model_registry import get_model_info
 from fastchat.serve.monitor.basic_stats import get_log_files
+from fastchat.serve.monitor.battle_store import (
+    CONVERSATION_COLUMNS,
+    RATING_COLUMNS,
+    load_battles,
+)
 from fastchat.serve.monitor.clean_battle_data import clean_battle_data
 from fastchat.serve.monitor.rating_systems import (
     compute_elo,
@@ -34,29 +39,49 @@ def get_median_elo_from_bootstrap(bootstrap_df):
     return median
 
 
+def pivot_battle_counts(battles):
+    """
+    Count the battles of each model_a and model_b.
+    `battles` can also hold counts of battles, in a "count" column.
+    """
+    if "count" in battles.columns:
+        return pd.pivot_table(
+            battles,
+            index="model_a",
+            columns="model_b",
+            values="count",
+            aggfunc="sum",
+            fill_value=0,
+        )
+    return pd.pivot_table(
+        battles, index="model_a", columns="model_b", aggfunc="size", fill_value=0
+    )
+
+
+def count_model_battles(battles):
+    """Count the battles of each model, see pivot_battle_counts."""
+    if "count" in battles.columns:
+        return (
+            battles.groupby("model_a")["count"]
+            .sum()
+            .add(battles.groupby("model_b")["count"].sum(), fill_value=0)
+        )
+    return (
+        battles["model_a"]
+        .value_counts()
+        .add(battles["model_b"].value_counts(), fill_value=0)
+    )
+
+
 def compute_pairwise_win_fraction(battles, model_order, limit_show_number=None):
     # Times each model wins as Model A
-    a_win_ptbl = pd.pivot_table(
-        battles[battles["winner"] == "model_a"],
-        index="model_a",
-        columns="model_b",
-        aggfunc="size",
-        fill_value=0,
-    )
+    a_win_ptbl = pivot_battle_counts(battles[battles["winner"] == "model_a"])
 
     # Table counting times each model wins as Model B
-    b_win_ptbl = pd.pivot_table(
-        battles[battles["winner"] == "model_b"],
-        index="model_a",
-        columns="model_b",
-        aggfunc="size",
-        fill_value=0,
-    )
+    b_win_ptbl = pivot_battle_counts(battles[battles["winner"] == "model_b"])
 
     # Table counting number of A-B pairs
-    num_battles_ptbl = pd.pivot_table(
-        battles, index="model_a", columns="model_b", aggfunc="size", fill_value=0
-    )
+    num_battles_ptbl = pivot_battle_counts(battles)
 
     # Computing the proportion of wins for each model as A and as B
     # against all other models
@@ -122,9 +147,7 @@ def visualize_pairwise_win_fraction(battles, model_order, scale=1):
 
 
 def visualize_battle_count(battles, model_order, scale=1):
-    ptbl = pd.pivot_table(
-        battles, index="model_a", columns="model_b", aggfunc="size", fill_value=0
-    )
+    ptbl = pivot_battle_counts(battles)
     battle_counts = ptbl + ptbl.T
     fig = px.imshow(
         battle_counts.loc[model_order, model_order],
@@ -212,28 +235,45 @@ def limit_user_votes(battles, daily_vote_per_user):
     return battles_new
 
 
-def get_model_pair_stats(battles):
-    battles["ordered_pair"] = battles.apply(
-        lambda x: tuple(sorted([x["model_a"], x["model_b"]])), axis=1
+def get_pair_votes(battles):
+    """
+    the sorted (model, model) pair of each battle, as an index into the list of pairs, and
+    the vote for the first model of the pair: 1 for a win, 0.5 for a tie and 0 for a loss
+    """
+    n = len(battles)
+    # sorted ids compare like the model names
+    model_ids, models = pd.factorize(
+        pd.concat([battles["model_a"], battles["model_b"]]), sort=True
     )
+    model_a, model_b = model_ids[:n], model_ids[n:]
+    first = np.minimum(model_a, model_b)
+    pair_ids, pair_keys = pd.factorize(
+        first * len(models) + np.maximum(model_a, model_b)
+    )
+    pairs = [
+        (models[key // len(models)], models[key % len(models)]) for key in pair_keys
+    ]
 
-    model_pair_stats = {}
+    winner = battles["winner"].to_numpy()
+    votes = np.zeros(n)
+    votes[
+        ((winner == "model_a") & (model_a == first))
+        | ((winner == "model_b") & (model_b == first))
+    ] = 1.0
+    votes[np.isin(winner, ["tie", "tie (bothbad)"])] = 0.5
+    return pair_ids, pairs, votes
 
-    for index, row in battles.iterrows():
-        pair = row["ordered_pair"]
-        if pair not in model_pair_stats:
-            model_pair_stats[pair] = {"win": 0, "loss": 0, "tie": 0}
 
-        if row["winner"] in ["tie", "tie (bothbad)"]:
-            model_pair_stats[pair]["tie"] += 1
-        elif row["winner"] == "model_a" and row["model_a"] == min(pair):
-            model_pair_stats[pair]["win"] += 1
-        elif row["winner"] == "model_b" and row["model_b"] == min(pair):
-            model_pair_stats[pair]["win"] += 1
-        else:
-            model_pair_stats[pair]["loss"] += 1
-
-    return model_pair_stats
+def get_model_pair_stats(battles):
+    pair_ids, pairs, votes = get_pair_votes(battles)
+    counts = {
+        key: np.bincount(pair_ids, weights=votes == vote, minlength=len(pairs))
+        for key, vote in [("win", 1.0), ("loss", 0.0), ("tie", 0.5)]
+    }
+    return {
+        pair: {key: int(counts[key][i]) for key in counts}
+        for i, pair in enumerate(pairs)
+    }
 
 
 def outlier_detect(
@@ -251,54 +291,57 @@ def outlier_detect(
         user_list = user_vote_cnt[user_vote_cnt >= 5].index.tolist()
     print("#User to be checked: ", len(user_list))
 
+    # the first max_vote votes of each user, in the order of the battles
+    user_battles = battles[battles["judge"].isin(user_list)]
+    vote_idx = user_battles.groupby("judge", sort=False).cumcount().to_numpy()
+    user_battles = user_battles[vote_idx < max_vote]
+    vote_idx = vote_idx[vote_idx < max_vote]
+    users = user_battles["judge"].to_numpy()
+
+    pair_ids, pairs, votes = get_pair_votes(user_battles)
+    stats = [model_pair_stats[pair] for pair in pairs]
+    # only count win and loss
+    wins = np.array([x["win"] for x in stats], dtype=np.int64)[pair_ids]
+    losses = np.array([x["loss"] for x in stats], dtype=np.int64)[pair_ids]
+
+    # the ratings of the pair below, equal to and above the vote
+    below = np.where(votes > 0, losses, 0)
+    equal = np.where(votes == 1, wins, np.where(votes == 0, losses, 0))
+    above = np.where(votes < 1, wins, 0)
+    if randomized:
+        # with a small noise on every rating, each equal rating is below the vote with
+        # the same uniform probability
+        equal_below = np.random.binomial(equal, np.random.uniform(size=len(votes)))
+        equal_above = equal - equal_below
+    else:
+        equal_below = equal_above = equal
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_upper = (below + equal_below) / (wins + losses)
+        p_lower = (above + equal_above) / (wins + losses)
+        # the logs of the e-values 1 / (2 * p), the product of the votes is a running sum
+        log_upper = -np.log(2 * p_upper)
+        log_lower = -np.log(2 * p_lower)
+
+    # a pair without wins and losses gives a nan p-value, the products stay nan after it
+    invalid = np.isnan(log_upper) | np.isnan(log_lower)
+
+    def by_user(values):
+        return pd.Series(values).groupby(users, sort=False)
+
+    invalid = by_user(invalid).cummax().to_numpy()
+    threshold = np.log(1 / alpha)
+    flagged = ~invalid & (
+        (by_user(np.where(invalid, 0, log_upper)).cumsum().to_numpy() > threshold)
+        | (by_user(np.where(invalid, 0, log_lower)).cumsum().to_numpy() > threshold)
+    )
+    # the number of votes when each bad user is identified
+    num_votes = by_user(np.where(flagged, vote_idx + 1, max_vote + 1)).min()
+
     bad_user_list = []
     for user in user_list:
-        flag = False
-        p_upper = []
-        p_lower = []
-        df_2 = battles[battles["judge"] == user]
-        for row in df_2.iterrows():
-            if len(p_upper) >= max_vote:
-                break
-
-            model_pair = tuple(sorted([row[1]["model_a"], row[1]["model_b"]]))
-
-            if row[1]["winner"] in ["tie", "tie (bothbad)"]:
-                vote = 0.5
-            elif row[1]["winner"] == "model_a" and row[1]["model_a"] == model_pair[0]:
-                vote = 1
-            elif row[1]["winner"] == "model_b" and row[1]["model_b"] == model_pair[0]:
-                vote = 1
-            else:
-                vote = 0
-
-            stats = model_pair_stats[model_pair]
-            # count all votes
-            # ratings = np.array(
-            #     [1] * stats["win"] + [0.5] * stats["tie"] + [0] * stats["loss"]
-            # )
-
-            # only count win and loss
-            ratings = np.array([1] * stats["win"] + [0] * stats["loss"])
-            if randomized:
-                noise = np.random.uniform(-1e-5, 1e-5, len(ratings))
-                ratings += noise
-                vote += np.random.uniform(-1e-5, 1e-5)
-
-            p_upper += [(ratings <= vote).mean()]
-            p_lower += [(ratings >= vote).mean()]
-
-            M_upper = np.prod(1 / (2 * np.array(p_upper)))
-            M_lower = np.prod(1 / (2 * np.array(p_lower)))
-
-            # M_upper = np.prod((1 - c_param) / (c_param * np.array(p_upper) ** c_param))
-            # M_lower = np.prod((1 - c_param) / (c_param * np.array(p_lower) ** c_param))
-            if (M_upper > 1 / alpha) or (M_lower > 1 / alpha):
-                print(f"Identify bad user with {len(p_upper)} votes")
-                flag = True
-                break
-        if flag:
-            bad_user_list.append({"user_id": user, "votes": len(p_upper)})
+        if num_votes.get(user, max_vote + 1) <= max_vote:
+            print(f"Identify bad user with {num_votes[user]} votes")
+            bad_user_list.append({"user_id": user, "votes": int(num_votes[user])})
     print("Bad user length: ", len(bad_user_list))
     print(bad_user_list)
 
@@ -389,6 +432,42 @@ def report_elo_analysis_results(
         elo_rating_median = get_median_elo_from_bootstrap(bootstrap_df)
         elo_rating_final = elo_rating_median
 
+    results = summarize_elo_analysis_results(
+        rating_system,
+        elo_rating_online,
+        elo_rating_final,
+        bootstrap_df,
+        battles,
+        battles_no_ties,
+        battles["tstamp"].max(),
+        scale=scale,
+    )
+    results["style_coefficients"] = (
+        {
+            "bootstrap": np.vstack(boostrap_coef),
+            "final": coef_final,
+        }
+        if rating_system == "bt" and style_control
+        else {}
+    )
+    return results
+
+
+def summarize_elo_analysis_results(
+    rating_system,
+    elo_rating_online,
+    elo_rating_final,
+    bootstrap_df,
+    battles,
+    battles_no_ties,
+    last_updated_tstamp,
+    scale=1,
+):
+    """
+    Build the leaderboard table and plots of the ratings.
+    `battles` and `battles_no_ties` can also hold counts of battles, see
+    pivot_battle_counts.
+    """
     model_order = list(elo_rating_final.keys())
 
     model_rating_q025 = bootstrap_df.quantile(0.025)
@@ -411,9 +490,7 @@ def report_elo_analysis_results(
             "variance": bootstrap_df.var(),
             "rating_q975": bootstrap_df.quantile(0.975),
             "rating_q025": bootstrap_df.quantile(0.025),
-            "num_battles": battles["model_a"]
-            .value_counts()
-            .add(battles["model_b"].value_counts(), fill_value=0),
+            "num_battles": count_model_battles(battles),
             "final_ranking": pd.Series(ranking),
         }
     )
@@ -437,7 +514,6 @@ def report_elo_analysis_results(
         bootstrap_df, elo_rating_final, limit_show_number, scale=scale
     )
 
-    last_updated_tstamp = battles["tstamp"].max()
     last_updated_datetime = datetime.datetime.fromtimestamp(
         last_updated_tstamp, tz=timezone("US/Pacific")
     ).strftime("%Y-%m-%d %H:%M:%S %Z")
@@ -455,12 +531,6 @@ def report_elo_analysis_results(
         "last_updated_tstamp": last_updated_tstamp,
         "bootstrap_df": bootstrap_df,
         "leaderboard_table_df": leaderboard_table_df,
-        "style_coefficients": {
-            "bootstrap": np.vstack(boostrap_coef),
-            "final": coef_final,
-        }
-        if rating_system == "bt" and style_control
-        else {},
     }
 
 
@@ -495,8 +565,13 @@ if __name__ == "__main__":
     np.random.seed(42)
 
     if args.clean_battle_file:
-        # Read data from a cleaned battle files
-        battles = pd.read_json(args.clean_battle_file)
+        # Read data from a cleaned battle file or battle store, only the columns used
+        columns = RATING_COLUMNS
+        if args.style_control:
+            columns = columns + ["conv_metadata"]
+        if "long" in args.category:
+            columns = columns + CONVERSATION_COLUMNS
+        battles = load_battles(args.clean_battle_file, columns=columns)
     else:
         # Read data from all log files
         log_files = get_log_files(args.max_num_files)
@@ -0,0 +1,312 @@
+"""
+Keep the leaderboard up to date from the append-only battle logs.
+
+Instead of cleaning all the logs and refitting from scratch on every refresh, the state
+keeps the byte offset read in each log file, the count of each (model_a, model_b,
+outcome) of the battles so far, which is all BT needs (see preprocess_for_bt), and the
+last ratings. A refresh reads and cleans only the new votes, adds them to the counts and
+refits BT starting from the last ratings.
+
+The filters of report_elo_analysis_results that look at one battle at a time are
+supported. daily_vote_per_user and run_outlier_detect need all the battles, they are not.
+
+Usage:
+python3 -m fastchat.serve.monitor.incremental_leaderboard --state-file elo_state.pkl
+"""
+import argparse
+from collections import Counter
+import datetime
+import json
+import math
+import os
+import pickle
+from pytz import timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from fastchat.serve.monitor.basic_stats import get_log_files
+from fastchat.serve.monitor.clean_battle_data import VOTES, process_data
+from fastchat.serve.monitor.elo_analysis import (
+    pretty_print_elo_rating,
+    summarize_elo_analysis_results,
+)
+from fastchat.serve.monitor.rating_systems import (
+    compute_bootstrap_bt_from_counts,
+    compute_elo,
+    fit_bt,
+    scale_and_offset,
+)
+
+# the outcome ids of preprocess_for_bt, a tie is 1
+OUTCOME_IDS = {"model_a": 2, "model_b": 0}
+OUTCOME_WINNERS = {2: "model_a", 1: "tie", 0: "model_b"}
+
+
+def read_new_votes(filename: str, offset: int = 0) -> Tuple[List[dict], int]:
+    """
+    Read the votes appended to a log file after `offset`.
+    Return them with the offset after the last complete line, where the next read starts.
+    """
+    with open(filename, "rb") as fin:
+        fin.seek(offset)
+        data = fin.read()
+    end = data.rfind(b"\n") + 1
+
+    votes = []
+    for line in data[:end].splitlines():
+        # skip the chat lines without parsing them, the votes all end with "vote"
+        if b'vote"' not in line:
+            continue
+        row = json.loads(line)
+        if row["type"] in VOTES:
+            votes.append(row)
+    return votes, offset + end
+
+
+class IncrementalLeaderboard:
+    def __init__(
+        self,
+        exclude_model_names: Optional[List[str]] = None,
+        ban_ip_list: Optional[List[str]] = None,
+        exclude_models: Optional[List[str]] = None,
+        langs: Optional[List[str]] = None,
+        exclude_tie: bool = False,
+        exclude_unknown_lang: bool = False,
+        base: float = 10.0,
+        scale: float = 400.0,
+        init_rating: float = 1000.0,
+        tol: float = 1e-6,
+    ):
+        # cleaning, see clean_battle_data
+        self.exclude_model_names = exclude_model_names or []
+        self.ban_ip_list = ban_ip_list
+        # filters, see report_elo_analysis_results
+        self.exclude_models = exclude_models or []
+        self.langs = langs or []
+        self.exclude_tie = exclude_tie
+        self.exclude_unknown_lang = exclude_unknown_lang
+        self.base = base
+        self.scale = scale
+        self.init_rating = init_rating
+        self.tol = tol
+        self.reset()
+
+    def reset(self):
+        self.offsets: Dict[str, int] = {}
+        self.num_votes = 0
+        # (model_a, model_b, outcome id) -> number of battles
+        self.counts: Counter = Counter()
+        # the models in the order of their first battle as model_a and as model_b,
+        # preprocess_for_bt numbers them in this order
+        self.models_a: Dict[str, None] = {}
+        self.models_b: Dict[str, None] = {}
+        self.elo_rating_online: Dict[str, float] = {}
+        # the last BT ratings, on the natural scale
+        self.ratings: Dict[str, float] = {}
+        self.last_updated_tstamp = None
+
+    def set_ban_ip_list(self, ban_ip_list: Optional[List[str]]):
+        """Change the banned IPs. The counts are rebuilt, they hold the votes of the old list."""
+        if ban_ip_list != self.ban_ip_list:
+            print("The banned IPs changed, rebuild the leaderboard")
+            self.ban_ip_list = ban_ip_list
+            self.reset()
+
+    def update(self, log_files: List[str]) -> int:
+        """
+        Read the votes appended to the log files since the last update.
+        The counts are rebuilt from the log files when one of the files read before is
+        not in `log_files` anymore, e.g. it left a window of the last files.
+        """
+        if any(filename not in log_files for filename in self.offsets):
+            print("A log file left the log files, rebuild the leaderboard")
+            self.reset()
+        elif any(
+            os.path.getsize(filename) < offset
+            for filename, offset in self.offsets.items()
+            if os.path.exists(filename)
+        ):
+            # the logs are append-only, a shorter file was replaced
+            print("A log file was truncated, rebuild the leaderboard")
+            self.reset()
+
+        votes = []
+        for filename in log_files:
+            new_votes, self.offsets[filename] = read_new_votes(
+                filename, self.offsets.get(filename, 0)
+            )
+            votes.extend(new_votes)
+        self.num_votes += len(votes)
+        if not votes:
+            return 0
+
+        battles, _, _, _ = process_data(
+            votes, self.exclude_model_names, False, self.ban_ip_list
+        )
+        return self.add_battles(battles)
+
+    def add_battles(self, battles) -> int:
+        """Add cleaned battles, as returned by clean_battle_data."""
+        battles = pd.DataFrame(battles)
+        if len(battles) == 0:
+            return 0
+        battles = battles.sort_values(ascending=True, by=["tstamp"])
+
+        if len(self.langs) > 0:
+            battles = battles[battles["language"].isin(self.langs)]
+        if self.exclude_unknown_lang:
+            battles = battles[~battles["language"].str.contains("unknown")]
+        battles = battles[
+            ~(
+                battles["model_a"].isin(self.exclude_models)
+                | battles["model_b"].isin(self.exclude_models)
+            )
+        ]
+        # Only use anonymous votes
+        battles = battles[battles["anony"]]
+        if self.exclude_tie:
+            battles = battles[~battles["winner"].str.contains("tie")]
+        if len(battles) == 0:
+            return 0
+
+        outcome_ids = battles["winner"].map(OUTCOME_IDS).fillna(1).astype(int)
+        self.counts.update(zip(battles["model_a"], battles["model_b"], outcome_ids))
+        self.models_a.update(dict.fromkeys(battles["model_a"]))
+        self.models_b.update(dict.fromkeys(battles["model_b"]))
+        self.elo_rating_online.update(
+            compute_elo(battles, prev_ratings=self.elo_rating_online)
+        )
+        tstamp = battles["tstamp"].max()
+        if self.last_updated_tstamp is None or tstamp > self.last_updated_tstamp:
+            self.last_updated_tstamp = tstamp
+        return len(battles)
+
+    def get_battle_counts(self) -> pd.DataFrame:
+        """The battles so far as counts, see pivot_battle_counts."""
+        return pd.DataFrame(
+            [
+                (model_a, model_b, OUTCOME_WINNERS[outcome_id], count)
+                for (model_a, model_b, outcome_id), count in self.counts.items()
+            ],
+            columns=["model_a", "model_b", "winner", "count"],
+        )
+
+    def preprocess_for_bt(self):
+        """The output of preprocess_for_bt on all the battles, from the counts."""
+        models = list({**self.models_a, **self.models_b})
+        model_ids = {model: i for i, model in enumerate(models)}
+        keys = sorted(
+            self.counts, key=lambda key: (model_ids[key[0]], model_ids[key[1]], key[2])
+        )
+        matchups = np.array(
+            [(model_ids[a], model_ids[b]) for a, b, _ in keys], dtype=np.int32
+        )
+        outcomes = np.array([outcome_id for _, _, outcome_id in keys]) / 2.0
+        weights = np.array([self.counts[key] for key in keys], dtype=np.float64)
+        return matchups, outcomes, models, weights
+
+    def report(self, num_bootstrap: int = 100, scale: float = 1):
+        """The ratings and plots of report_elo_analysis_results with rating_system="bt"."""
+        matchups, outcomes, models, weights = self.preprocess_for_bt()
+        # warm start from the last ratings, new models start at 0 like in a cold start
+        init_ratings = np.array([self.ratings.get(model, 0.0) for model in models])
+        ratings = fit_bt(
+            matchups,
+            outcomes,
+            weights,
+            len(models),
+            math.log(self.base),
+            self.tol,
+            init_ratings=init_ratings,
+        )
+        self.ratings = dict(zip(models, ratings))
+
+        scaled_ratings = scale_and_offset(
+            ratings, models, self.scale, init_rating=self.init_rating
+        )
+        elo_rating_final = pd.Series(scaled_ratings, index=models).sort_values(
+            ascending=False
+        )
+        bootstrap_df = compute_bootstrap_bt_from_counts(
+            matchups,
+            outcomes,
+            models,
+            weights,
+            num_round=num_bootstrap,
+            base=self.base,
+            scale=self.scale,
+            init_rating=self.init_rating,
+            tol=self.tol,
+            init_ratings=ratings,
+        )
+
+        battle_counts = self.get_battle_counts()
+        battles_no_ties = battle_counts[~battle_counts["winner"].str.contains("tie")]
+        results = summarize_elo_analysis_results(
+            "bt",
+            dict(self.elo_rating_online),
+            elo_rating_final,
+            bootstrap_df,
+            battle_counts,
+            battles_no_ties,
+            self.last_updated_tstamp,
+            scale=scale,
+        )
+        results["style_coefficients"] = {}
+        return results
+
+    def save(self, filename: str):
+        with open(filename, "wb") as fout:
+            pickle.dump(self, fout)
+
+    @staticmethod
+    def load(filename: str) -> "IncrementalLeaderboard":
+        with open(filename, "rb") as fin:
+            return pickle.load(fin)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state-file", type=str, required=True)
+    parser.add_argument("--max-num-files", type=int)
+    parser.add_argument("--num-bootstrap", type=int, default=100)
+    parser.add_argument("--exclude-model-names", type=str, nargs="+")
+    parser.add_argument("--ban-ip-file", type=str)
+    parser.add_argument("--exclude-models", type=str, nargs="+", default=[])
+    parser.add_argument("--exclude-tie", action="store_true", default=False)
+    parser.add_argument("--exclude-unknown-lang", action="store_true", default=False)
+    parser.add_argument("--langs", type=str, nargs="+", default=[])
+    parser.add_argument("--scale", type=float, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.state_file):
+        leaderboard = IncrementalLeaderboard.load(args.state_file)
+    else:
+        ban_ip_list = json.load(open(args.ban_ip_file)) if args.ban_ip_file else None
+        leaderboard = IncrementalLeaderboard(
+            exclude_model_names=args.exclude_model_names,
+            ban_ip_list=ban_ip_list,
+            exclude_models=args.exclude_models,
+            langs=args.langs,
+            exclude_tie=args.exclude_tie,
+            exclude_unknown_lang=args.exclude_unknown_lang,
+        )
+
+    num_battles = leaderboard.update(get_log_files(args.max_num_files))
+    print(f"#new battles: {num_battles}, #votes: {leaderboard.num_votes}")
+    results = leaderboard.report(num_bootstrap=args.num_bootstrap, scale=args.scale)
+    leaderboard.save(args.state_file)
+
+    print("# Online Elo")
+    pretty_print_elo_rating(results["elo_rating_online"])
+    print("# Median")
+    pretty_print_elo_rating(results["elo_rating_final"])
+    print(f"last update : {results['last_updated_datetime']}")
+
+    cutoff_date = datetime.datetime.fromtimestamp(
+        results["last_updated_tstamp"], tz=timezone("US/Pacific")
+    ).strftime("%Y%m%d")
+    with open(f"elo_results_{cutoff_date}.pkl", "wb") as fout:
+        pickle.dump({"full": results}, fout)
@@ -20,8 +20,7 @@ import numpy as np
 
 from fastchat.constants import SURVEY_LINK
 from fastchat.serve.monitor.basic_stats import report_basic_stats, get_log_files
-from fastchat.serve.monitor.clean_battle_data import clean_battle_data
-from fastchat.serve.monitor.elo_analysis import report_elo_analysis_results
+from fastchat.serve.monitor.incremental_leaderboard import IncrementalLeaderboard
 from fastchat.utils import build_logger, get_window_url_params_js
 
 
@@ -52,6 +51,8 @@ notebook_url = (
 basic_component_values = [None] * 6
 leader_component_values = [None] * 5
 
+incremental_leaderboard = None
+
 
 def recompute_final_ranking(arena_df):
     q025 = arena_df["rating_q025"].values
@@ -85,11 +86,18 @@ def update_elo_components(
 
     # Leaderboard
     if elo_results_file is None:  # Do live update
+        global incremental_leaderboard
         ban_ip_list = json.load(open(ban_ip_file)) if ban_ip_file else None
-        battles = clean_battle_data(
-            log_files, exclude_model_names, ban_ip_list=ban_ip_list
-        )
-        elo_results = report_elo_analysis_results(battles, scale=2)
+        if incremental_leaderboard is None:
+            incremental_leaderboard = IncrementalLeaderboard(
+                exclude_model_names, ban_ip_list=ban_ip_list
+            )
+        # rebuilt when the banned IPs change, or when a file leaves the last
+        # max_num_files files, otherwise only the votes logged since the last update
+        # are read
+        incremental_leaderboard.set_ban_ip_list(ban_ip_list)
+        incremental_leaderboard.update(log_files)
+        elo_results = incremental_leaderboard.report(scale=2)
 
         leader_component_values[0] = make_leaderboard_md_live(elo_results)
         leader_component_values[1] = elo_results["win_fraction_heatmap"]
@@ -1,8 +1,10 @@
 import os
 import math
 import multiprocessing as mp
+from multiprocessing import shared_memory
 from functools import partial
 import numpy as np
+from scipy import sparse
 from scipy.special import expit
 from scipy.optimize import minimize
 import pandas as pd
@@ -136,10 +138,16 @@ def fit_vectorized_elo(
     return ratings + init_rating
 
 
-def compute_elo(df, k=4.0, base=10.0, init_rating=1000.0, scale=400.0):
+def compute_elo(
+    df, k=4.0, base=10.0, init_rating=1000.0, scale=400.0, prev_ratings=None
+):
+    """online Elo ratings of the battles, continuing from `prev_ratings` if given"""
     matchups, outcomes, models = preprocess_for_elo(df)
     alpha = math.log(base) / scale
-    ratings = np.full(shape=(len(models),), fill_value=init_rating)
+    prev_ratings = prev_ratings or {}
+    ratings = np.array(
+        [prev_ratings.get(model, init_rating) for model in models], dtype=np.float64
+    )
     for (model_a_idx, model_b_idx), outcome in zip(matchups, outcomes):
         prob = 1.0 / (
             1.0 + math.exp(alpha * (ratings[model_b_idx] - ratings[model_a_idx]))
@@ -181,8 +189,12 @@ def bt_loss_and_grad(ratings, matchups, outcomes, weights, alpha=1.0):
     return loss, model_grad
 
 
-def fit_bt(matchups, outcomes, weights, n_models, alpha, tol=1e-6):
-    initial_ratings = np.zeros(n_models, dtype=np.float64)
+def fit_bt(matchups, outcomes, weights, n_models, alpha, tol=1e-6, init_ratings=None):
+    """init_ratings optionally warm starts the fit, e.g. from the ratings of a previous fit"""
+    if init_ratings is None:
+        initial_ratings = np.zeros(n_models, dtype=np.float64)
+    else:
+        initial_ratings = np.asarray(init_ratings, dtype=np.float64)
     result = minimize(
         fun=bt_loss_and_grad,
         x0=initial_ratings,
@@ -226,28 +238,61 @@ def compute_bootstrap_bt(
     tol=1e-6,
     num_cpu=None,
 ):
+    # num_cpu is unused, all the rounds are fit at once by fit_vectorized_bt
     matchups, outcomes, models, weights = preprocess_for_bt(battles)
+    return compute_bootstrap_bt_from_counts(
+        matchups,
+        outcomes,
+        models,
+        weights,
+        num_round,
+        base=base,
+        scale=scale,
+        init_rating=init_rating,
+        tol=tol,
+    )
+
+
+def compute_bootstrap_bt_from_counts(
+    matchups,
+    outcomes,
+    models,
+    weights,
+    num_round,
+    base=10.0,
+    scale=400.0,
+    init_rating=1000.0,
+    tol=1e-6,
+    init_ratings=None,
+):
+    """bootstrap BT on the output of preprocess_for_bt, optionally warm starting every round"""
+    num_battles = int(weights.sum())
     # bootstrap sample the unique outcomes and their counts directly using the multinomial distribution
     rng = np.random.default_rng(seed=0)
     idxs = rng.multinomial(
-        n=len(battles), pvals=weights / weights.sum(), size=(num_round)
+        n=num_battles, pvals=weights / weights.sum(), size=(num_round)
     )
     # only the distribution over their occurance counts changes between samples (and it can be 0)
-    boot_weights = idxs.astype(np.float64) / len(battles)
+    boot_weights = idxs.astype(np.float64) / num_battles
 
     # the only thing different across samples is the distribution of weights
-    bt_fn = partial(
-        fit_bt, matchups, outcomes, n_models=len(models), alpha=np.log(base), tol=tol
+    ratings = fit_vectorized_bt(
+        matchups,
+        outcomes,
+        boot_weights,
+        len(models),
+        alpha=np.log(base),
+        tol=tol,
+        init_params=init_ratings,
     )
-    with mp.Pool(num_cpu if num_cpu else os.cpu_count()) as pool:
-        results = list(tqdm(pool.imap_unordered(bt_fn, boot_weights), total=num_round))
-
-    ratings = np.array(results)
     scaled_ratings = scale_and_offset(ratings, models, scale, init_rating)
     df = pd.DataFrame(scaled_ratings, columns=models)
     return df[df.median().sort_values(ascending=False).index]
 
 
+# the max size of the (N, samples) arrays of fit_vectorized_bt
+MAX_CHUNK_SIZE = 2**22
+
 DIFF_MASK = np.array(
     [1.0, -1.0], dtype=np.float64
 )  # create globally to not incur the instantiation cost in each call
@@ -323,6 +368,106 @@ def fit_contextual_bt(
     return result["x"]
 
 
+def fit_vectorized_bt(
+    matchups,
+    outcomes,
+    weights,
+    n_models,
+    alpha,
+    tol=1e-6,
+    init_params=None,
+    features=None,
+    reg=0.0,
+    max_iter=100,
+    max_step=1.0,
+    max_chunk_size=None,
+):
+    """
+    fit BT on multiple weightings of the same battles at the same time with Newton's method
+      weights: float64 (num_samples, N) the weight of every (matchup, outcome) row in each sample
+      features: optional float64 (N, n_features), fits the contextual BT of fit_contextual_bt
+    returns float64 (num_samples, n_models + n_features), the ratings then the feature params
+    this reaches the same minimum as fit_bt/fit_contextual_bt, without regularization the
+    ratings keep the sum of init_params (0 by default) like they do with L-BFGS
+    """
+    n_rows = len(outcomes)
+    n_features = 0 if features is None else features.shape[1]
+    n_params = n_models + n_features
+    num_samples = weights.shape[0]
+    rows = np.arange(n_rows)
+    # model_grad = diff.T @ matchups_grads and pair_hess = pairs.T @ matchups_hess aggregate
+    # the rows at the model and at the (model_a, model_b) level
+    diff = sparse.csr_matrix(
+        (np.tile(DIFF_MASK, n_rows), (np.repeat(rows, 2), matchups.ravel())),
+        shape=(n_rows, n_models),
+    )
+    pairs = sparse.csr_matrix(
+        (np.ones(n_rows), (rows, matchups[:, 0] * n_models + matchups[:, 1])),
+        shape=(n_rows, n_models * n_models),
+    )
+    diag = np.arange(n_params)
+
+    params = np.zeros((num_samples, n_params), dtype=np.float64)
+    if init_params is not None:
+        params[:] = init_params
+    # fit the samples in chunks to bound the size of the (N, samples) arrays
+    chunk_size = max(1, (max_chunk_size or MAX_CHUNK_SIZE) // max(n_rows, 1))
+    for start in range(0, num_samples, chunk_size):
+        # the samples of the chunk which have not converged yet, as columns
+        active = np.arange(start, min(start + chunk_size, num_samples))
+        sample_weights = np.ascontiguousarray(weights[active].T)
+        for _ in range(max_iter):
+            sample_params = params[active]
+            logits = alpha * (diff @ sample_params[:, :n_models].T)
+            if n_features:
+                logits += features @ sample_params[:, n_models:].T
+            probs = expit(logits)
+            error = (outcomes[:, None] - probs) * sample_weights
+
+            grad = reg * sample_params
+            grad[:, :n_models] -= alpha * (diff.T @ error).T
+            if n_features:
+                grad[:, n_models:] -= (features.T @ error).T
+            # same criterion as the gtol of L-BFGS-B
+            moving = np.abs(grad).max(axis=1) > tol
+            if not moving.any():
+                break
+            if not moving.all():
+                active, grad = active[moving], grad[moving]
+                sample_weights, probs = sample_weights[:, moving], probs[:, moving]
+
+            matchups_hess = probs * (1.0 - probs) * sample_weights
+            pair_hess = (pairs.T @ matchups_hess).T.reshape(-1, n_models, n_models)
+            pair_hess += pair_hess.transpose(0, 2, 1)
+            hess = np.zeros((len(active), n_params, n_params), dtype=np.float64)
+            hess[:, :n_models, :n_models] = -(alpha**2) * pair_hess
+            hess[:, diag[:n_models], diag[:n_models]] += alpha**2 * pair_hess.sum(
+                axis=2
+            )
+            # one feature at a time to keep the arrays at (N, samples)
+            for k in range(n_features):
+                weighted_feature = matchups_hess * features[:, [k]]
+                cross = alpha * (diff.T @ weighted_feature).T
+                hess[:, :n_models, n_models + k] = cross
+                hess[:, n_models + k, :n_models] = cross
+                hess[:, n_models:, n_models + k] = (features.T @ weighted_feature).T
+            hess[:, diag, diag] += reg
+            if reg == 0:
+                # the ratings are only defined up to a constant, the gradient never changes
+                # their sum and neither does the step with the constant direction added to the
+                # hessian, the ridge handles models without battles in a sample
+                scale = np.trace(hess, axis1=1, axis2=2)[:, None, None] / n_params
+                hess[:, :n_models, :n_models] += scale / n_models
+                hess[:, diag, diag] += 1e-6 * scale[:, :, 0]
+
+            step = np.linalg.solve(hess, -grad[:, :, None])[:, :, 0]
+            # limit the steps far from the minimum where newton can overshoot
+            max_abs_step = np.abs(step).max(axis=1, keepdims=True)
+            step *= max_step / np.maximum(max_abs_step, max_step)
+            params[active] += step
+    return params
+
+
 def compute_style_control(
     df, alpha=math.log(10.0), reg=0.5, init_rating=1000.0, scale=400.0, tol=1e-6
 ):
@@ -356,30 +501,125 @@ def compute_bootstrap_style_control(
     num_cpu=None,
 ):
     matchups, features, outcomes, models = preprocess_for_style(df)
-
-    contextual_bt_fn = partial(
-        fit_contextual_bt,
+    ratings_params = fit_bootstrap_style_control(
         matchups,
         features,
         outcomes,
-        models,
+        len(models),
+        num_round,
         alpha=alpha,
         reg=reg,
         tol=tol,
+        num_cpu=num_cpu,
     )
-
-    boot_idxs = np.random.randint(
-        low=0, high=matchups.shape[0], size=(num_round, matchups.shape[0])
-    )
-
-    with mp.Pool(num_cpu if num_cpu else os.cpu_count()) as pool:
-        results = list(
-            tqdm(pool.imap_unordered(contextual_bt_fn, boot_idxs), total=num_round)
-        )
-
-    ratings_params = np.array(results)
     ratings = ratings_params[:, : len(models)]
     params = ratings_params[:, len(models) :]
     scaled_ratings = scale_and_offset(ratings, models, scale, init_rating)
     df = pd.DataFrame(scaled_ratings, columns=models)
     return df[df.median().sort_values(ascending=False).index], params
+
+
+def to_shared_memory(arrays):
+    """copy the arrays to shared memory, returns the blocks to unlink and the specs for from_shared_memory"""
+    blocks, specs = [], []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs.append((block.name, array.shape, array.dtype.str))
+    return blocks, specs
+
+
+def from_shared_memory(specs):
+    """attach to the arrays of to_shared_memory without copying them, keep the blocks open while using them"""
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [
+        np.ndarray(shape, dtype, buffer=block.buf)
+        for block, (_, shape, dtype) in zip(blocks, specs)
+    ]
+    return blocks, arrays
+
+
+# the (blocks, arrays) of the battles in a style control worker, set by init_style_control_worker
+style_control_battles = None
+
+
+def init_style_control_worker(specs):
+    global style_control_battles
+    style_control_battles = from_shared_memory(specs)
+
+
+def fit_style_control_rounds(
+    matchups, features, outcomes, n_models, num_round, seed, alpha, reg, tol
+):
+    """fit rounds on poisson bootstrap weights, each battle is drawn Poisson(1) times"""
+    rng = np.random.default_rng(seed)
+    boot_weights = rng.poisson(1.0, size=(num_round, len(outcomes))).astype(np.float64)
+    return fit_vectorized_bt(
+        matchups,
+        outcomes,
+        boot_weights,
+        n_models,
+        alpha=alpha,
+        tol=tol,
+        features=features,
+        reg=reg,
+    )
+
+
+def fit_shared_style_control_rounds(args):
+    _, (matchups, features, outcomes) = style_control_battles
+    return fit_style_control_rounds(matchups, features, outcomes, *args)
+
+
+def fit_bootstrap_style_control(
+    matchups,
+    features,
+    outcomes,
+    n_models,
+    num_round,
+    alpha=math.log(10.0),
+    reg=0.5,
+    tol=1e-6,
+    num_cpu=None,
+):
+    """
+    bootstrap the contextual BT of fit_contextual_bt with poisson weights over the battles,
+    a chunk of rounds at a time so that only (chunk, N) weights exist at once,
+    the workers read the battles from shared memory instead of receiving copies
+    """
+    n = len(outcomes)
+    chunk_size = max(1, MAX_CHUNK_SIZE // max(n, 1))
+    chunks = [
+        min(chunk_size, num_round - start) for start in range(0, num_round, chunk_size)
+    ]
+    # derived from the global numpy seed like the previous resampling
+    seeds = np.random.SeedSequence(np.random.randint(2**31)).spawn(len(chunks))
+    tasks = [
+        (n_models, num_chunk_round, seed, alpha, reg, tol)
+        for num_chunk_round, seed in zip(chunks, seeds)
+    ]
+
+    num_cpu = min(num_cpu if num_cpu else os.cpu_count(), len(tasks))
+    if num_cpu <= 1:
+        results = [
+            fit_style_control_rounds(matchups, features, outcomes, *task)
+            for task in tqdm(tasks)
+        ]
+    else:
+        blocks, specs = to_shared_memory([matchups, features, outcomes])
+        try:
+            with mp.Pool(
+                num_cpu, initializer=init_style_control_worker, initargs=(specs,)
+            ) as pool:
+                results = list(
+                    tqdm(
+                        pool.imap(fit_shared_style_control_rounds, tasks),
+                        total=len(tasks),
+                    )
+                )
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    return np.concatenate(results)
@@ -23,7 +23,7 @@ import threading
 import uuid
 
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import JSONResponse
 import requests
 
 try:
@@ -56,8 +56,10 @@ from fastchat.model.model_codet5p import generate_stream_codet5p
 from fastchat.modules.gptq import GptqConfig
 from fastchat.modules.exllama import ExllamaConfig
 from fastchat.modules.xfastertransformer import XftConfig
+from fastchat.serve.base_model_worker import HeartBeatSender, track_latency
 from fastchat.serve.inference import generate_stream
 from fastchat.serve.model_worker import ModelWorker, worker_id, logger
+from fastchat.serve.stream_framing import create_stream_response
 from fastchat.utils import build_logger, pretty_print_semaphore, get_context_length
 
 
@@ -66,6 +68,7 @@ from fastchat.utils import build_logger, pretty_print_semaphore, get_context_len
 # each API call.
 workers = []
 worker_map = {}
+heart_beat_sender = None
 app = FastAPI()
 
 
@@ -99,9 +102,9 @@ async def api_generate_stream(request: Request):
     params = await request.json()
     await acquire_worker_semaphore()
     worker = worker_map[params["model"]]
-    generator = worker.generate_stream_gate(params)
+    generator = track_latency(worker.latency_stats, worker.generate_stream_gate(params))
     background_tasks = create_background_tasks()
-    return StreamingResponse(generator, background=background_tasks)
+    return create_stream_response(generator, request.headers, background_tasks)
 
 
 @app.post("/worker_generate")
@@ -124,13 +127,48 @@ async def api_get_embeddings(request: Request):
     return JSONResponse(content=embedding, background=background_tasks)
 
 
-@app.post("/worker_get_status")
-async def api_get_status(request: Request):
+def merge_latency_stats(latency_stats: List[dict]) -> dict:
+    """The workers share the GPU, so their latencies are averaged."""
+
+    def mean(key):
+        values = [stats[key] for stats in latency_stats if stats[key] > 0]
+        return sum(values) / len(values) if values else 0.0
+
     return {
+        "ttft": mean("ttft"),
+        "tokens_per_second": mean("tokens_per_second"),
+    }
+
+
+def get_status():
+    status = {
         "model_names": [m for w in workers for m in w.model_names],
         "speed": 1,
         "queue_length": sum([w.get_queue_length() for w in workers]),
+        "latency_stats": merge_latency_stats(
+            [w.latency_stats.to_dict() for w in workers]
+        ),
     }
+    if heart_beat_sender is not None:
+        status["heart_beat_stats"] = heart_beat_sender.get_stats()
+    return status
+
+
+def register_to_controller(controller_addr: str, check_heart_beat: bool):
+    logger.info("Register to controller")
+    url = controller_addr + "/register_worker"
+    data = {
+        "worker_name": workers[0].worker_addr,
+        "check_heart_beat": check_heart_beat,
+        "worker_status": get_status(),
+    }
+    r = requests.post(url, json=data)
+    assert r.status_code == 200
+
+
+@app.post("/worker_get_status")
+async def api_get_status(request: Request):
+    return get_status()
 
 
 @app.post("/count_token")
@@ -240,8 +278,9 @@ def create_multi_model_worker():
     elif len(args.conv_template) == 1:  # Repeat the same template
         args.conv_template = args.conv_template * len(args.model_path)
 
-    # Launch all workers
-    workers = []
+    global heart_beat_sender
+
+    # Launch all workers, their heart beats are sent together
     for conv_template, model_path, model_names in zip(
         args.conv_template, args.model_path, args.model_names
     ):
@@ -252,7 +291,7 @@ def create_multi_model_worker():
             model_path,
             model_names,
             args.limit_worker_concurrency,
-            args.no_register,
+            no_register=True,
             device=args.device,
             num_gpus=args.num_gpus,
             max_gpu_memory=args.max_gpu_memory,
@@ -269,18 +308,15 @@ def create_multi_model_worker():
             worker_map[model_name] = w
 
     # Register all models
-    url = args.controller_address + "/register_worker"
-    data = {
-        "worker_name": workers[0].worker_addr,
-        "check_heart_beat": not args.no_register,
-        "worker_status": {
-            "model_names": [m for w in workers for m in w.model_names],
-            "speed": 1,
-            "queue_length": sum([w.get_queue_length() for w in workers]),
-        },
-    }
-    r = requests.post(url, json=data)
-    assert r.status_code == 200
+    register_to_controller(args.controller_address, not args.no_register)
+    if not args.no_register:
+        heart_beat_sender = HeartBeatSender(
+            args.controller_address,
+            args.worker_address,
+            get_status,
+            lambda: register_to_controller(args.controller_address, True),
+        )
+        heart_beat_sender.start()
 
     return args, workers
 
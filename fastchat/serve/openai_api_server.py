@@ -11,7 +11,8 @@ import asyncio
 import argparse
 import json
 import os
-from typing import Generator, Optional, Union, Dict, List, Any
+import time
+from typing import Generator, Optional, Union, Dict, List, Any, Tuple
 
 import aiohttp
 import fastapi
@@ -28,6 +29,8 @@ import tiktoken
 import uvicorn
 
 from fastchat.constants import (
+    API_SERVER_CACHE_TTL,
+    API_SERVER_MAX_CONNECTIONS,
     WORKER_API_TIMEOUT,
     WORKER_API_EMBEDDING_BATCH_SIZE,
     ErrorCode,
@@ -61,6 +64,13 @@ from fastchat.protocol.api_protocol import (
     APITokenCheckResponse,
     APITokenCheckResponseItem,
 )
+from fastchat.serve.stream_framing import (
+    FRAMED_MEDIA_TYPE,
+    FrameDecoder,
+    get_delta,
+    is_framed,
+)
+from fastchat.serve.worker_registry import WorkerRegistryClient
 from fastchat.utils import build_logger
 
 logger = build_logger("openai_api_server", "openai_api_server.log")
@@ -69,21 +79,43 @@ conv_template_map = {}
 
 fetch_timeout = aiohttp.ClientTimeout(total=3 * 3600)
 
+# Connection-pooled HTTP clients, shared by all requests. Created at app startup.
+fetch_session: Optional[aiohttp.ClientSession] = None
+stream_client: Optional[httpx.AsyncClient] = None
+
+
+def get_fetch_session() -> aiohttp.ClientSession:
+    global fetch_session
+    if fetch_session is None or fetch_session.closed:
+        fetch_session = aiohttp.ClientSession(
+            timeout=fetch_timeout,
+            connector=aiohttp.TCPConnector(limit=API_SERVER_MAX_CONNECTIONS),
+        )
+    return fetch_session
+
+
+def get_stream_client() -> httpx.AsyncClient:
+    global stream_client
+    if stream_client is None or stream_client.is_closed:
+        stream_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=API_SERVER_MAX_CONNECTIONS)
+        )
+    return stream_client
+
 
 async def fetch_remote(url, pload=None, name=None):
-    async with aiohttp.ClientSession(timeout=fetch_timeout) as session:
-        async with session.post(url, json=pload) as response:
-            chunks = []
-            if response.status != 200:
-                ret = {
-                    "text": f"{response.reason}",
-                    "error_code": ErrorCode.INTERNAL_ERROR,
-                }
-                return json.dumps(ret)
-
-            async for chunk, _ in response.content.iter_chunks():
-                chunks.append(chunk)
-        output = b"".join(chunks)
+    async with get_fetch_session().post(url, json=pload) as response:
+        chunks = []
+        if response.status != 200:
+            ret = {
+                "text": f"{response.reason}",
+                "error_code": ErrorCode.INTERNAL_ERROR,
+            }
+            return json.dumps(ret)
+
+        async for chunk, _ in response.content.iter_chunks():
+            chunks.append(chunk)
+    output = b"".join(chunks)
 
     if name is not None:
         res = json.loads(output)
@@ -94,6 +126,87 @@ async def fetch_remote(url, pload=None, name=None):
     return output
 
 
+class TTLCache:
+    """
+    Cache of remote lookups. Entries expire after `ttl` seconds, and are refreshed
+    in the background by `refresh_all` so that requests rarely wait for a lookup.
+    """
+
+    def __init__(self, fetch, ttl: float):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._entries: Dict[Any, tuple] = {}
+        self._pending: Dict[Any, asyncio.Task] = {}
+        self._forced_refreshes: Dict[Any, float] = {}
+
+    async def get(self, key, refresh: bool = False):
+        entry = self._entries.get(key)
+        if entry is not None and not refresh and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        # concurrent misses of the same key share one lookup
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def get_fresh(self, key):
+        """
+        Refresh the entry, e.g. when a model is missing from the cached list.
+        Forced refreshes of a key happen at most once per `ttl` seconds, so requests
+        for an unknown model do not reach the remote on every call.
+        """
+        now = time.monotonic()
+        last_refresh = self._forced_refreshes.get(key)
+        if last_refresh is not None and now - last_refresh < self.ttl:
+            return await self.get(key)
+        self._forced_refreshes[key] = now
+        return await self.get(key, refresh=True)
+
+    async def refresh_all(self):
+        for key in list(self._entries):
+            try:
+                await self.get(key, refresh=True)
+            except Exception as e:
+                logger.warning(f"Failed to refresh {key}: {e}")
+                self._entries.pop(key, None)
+
+    async def _fetch(self, key):
+        value = await self.fetch(*key)
+        self._entries[key] = (value, time.monotonic())
+        return value
+
+
+async def fetch_model_list():
+    models = await fetch_remote(
+        app_settings.controller_address + "/list_models", None, "models"
+    )
+    if isinstance(models, str):  # error response, do not cache it
+        raise ValueError(f"Failed to list models: {models}")
+    return models
+
+
+async def fetch_context_length(worker_addr, model_name):
+    context_len = await fetch_remote(
+        worker_addr + "/model_details", {"model": model_name}, "context_length"
+    )
+    if isinstance(context_len, str):  # error response, do not cache it
+        raise ValueError(f"Failed to get model details: {context_len}")
+    return context_len
+
+
+model_list_cache = TTLCache(fetch_model_list, API_SERVER_CACHE_TTL)
+context_length_cache = TTLCache(fetch_context_length, API_SERVER_CACHE_TTL)
+
+
+async def refresh_caches():
+    while True:
+        await asyncio.sleep(API_SERVER_CACHE_TTL / 2)
+        await model_list_cache.refresh_all()
+        await context_length_cache.refresh_all()
+
+
 class AppSettings(BaseSettings):
     # The address of the model controller.
     controller_address: str = "http://localhost:21001"
@@ -101,11 +214,26 @@ class AppSettings(BaseSettings):
 
 
 app_settings = AppSettings()
+# Local mirror of the controller's workers, enabled by --watch-controller
+worker_registry_client: Optional[WorkerRegistryClient] = None
 app = fastapi.FastAPI()
 headers = {"User-Agent": "FastChat API Server"}
 get_bearer_token = HTTPBearer(auto_error=False)
 
 
+@app.on_event("startup")
+async def app_startup():
+    get_fetch_session()
+    get_stream_client()
+    asyncio.create_task(refresh_caches())
+
+
+@app.on_event("shutdown")
+async def app_shutdown():
+    await get_fetch_session().close()
+    await get_stream_client().aclose()
+
+
 async def check_api_key(
     auth: Optional[HTTPAuthorizationCredentials] = Depends(get_bearer_token),
 ) -> str:
@@ -139,17 +267,41 @@ async def validation_exception_handler(request, exc):
     return create_error_response(ErrorCode.VALIDATION_TYPE_ERROR, str(exc))
 
 
-async def check_model(request) -> Optional[JSONResponse]:
-    controller_address = app_settings.controller_address
-    ret = None
+async def check_model(request) -> Tuple[Optional[str], Optional[JSONResponse]]:
+    """
+    Check the model of a request and get the address of a worker serving it.
+    A served model takes one controller lookup, the model list is only read
+    to tell an unknown model from a model without workers.
+    """
+    try:
+        return await get_worker_address(request.model), None
+    except ValueError:
+        pass
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return None, create_error_response(
+            ErrorCode.CONTROLLER_NO_WORKER, f"The controller is unavailable: {e}"
+        )
+
+    try:
+        models = None
+        if worker_registry_client is not None:
+            models = worker_registry_client.list_models()
+        if models is None:
+            models = await model_list_cache.get(())
+        if request.model not in models:
+            # the model may have been registered since the last refresh
+            models = await model_list_cache.get_fresh(())
+    except (ValueError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return None, create_error_response(ErrorCode.CONTROLLER_NO_WORKER, str(e))
 
-    models = await fetch_remote(controller_address + "/list_models", None, "models")
     if request.model not in models:
-        ret = create_error_response(
+        return None, create_error_response(
             ErrorCode.INVALID_MODEL,
             f"Only {'&&'.join(models)} allowed now, your model {request.model}",
         )
-    return ret
+    return None, create_error_response(
+        ErrorCode.CONTROLLER_NO_WORKER, f"No available worker for {request.model}"
+    )
 
 
 async def check_length(request, prompt, max_tokens, worker_addr):
@@ -158,9 +310,7 @@ async def check_length(request, prompt, max_tokens, worker_addr):
     ):  # model worker not support max_tokens=None
         max_tokens = 1024 * 1024
 
-    context_len = await fetch_remote(
-        worker_addr + "/model_details", {"model": request.model}, "context_length"
-    )
+    context_len = await context_length_cache.get((worker_addr, request.model))
     token_num = await fetch_remote(
         worker_addr + "/count_token",
         {"model": request.model, "prompt": prompt},
@@ -372,10 +522,14 @@ async def get_worker_address(model_name: str) -> str:
     :return: Worker address from the controller
     :raises: :class:`ValueError`: No available worker for requested model
     """
-    controller_address = app_settings.controller_address
-    worker_addr = await fetch_remote(
-        controller_address + "/get_worker_address", {"model": model_name}, "address"
-    )
+    worker_addr = None
+    if worker_registry_client is not None:
+        worker_addr = worker_registry_client.get_worker_address(model_name)
+    if worker_addr is None:
+        controller_address = app_settings.controller_address
+        worker_addr = await fetch_remote(
+            controller_address + "/get_worker_address", {"model": model_name}, "address"
+        )
 
     # No available worker
     if worker_addr == "":
@@ -384,6 +538,20 @@ async def get_worker_address(model_name: str) -> str:
     return worker_addr
 
 
+async def report_worker_failure(worker_addr: str):
+    """
+    Report a failed request to the controller, which ejects a worker failing repeatedly
+    from dispatch as it does for the requests it proxies.
+    """
+    try:
+        await fetch_remote(
+            app_settings.controller_address + "/report_worker_failure",
+            {"worker_name": worker_addr},
+        )
+    except Exception as e:
+        logger.warning(f"Failed to report a failure of {worker_addr}: {e}")
+
+
 async def get_conv(model_name: str, worker_addr: str):
     conv_template = conv_template_map.get((worker_addr, model_name))
     if conv_template is None:
@@ -398,7 +566,7 @@ async def get_conv(model_name: str, worker_addr: str):
 async def show_available_models():
     controller_address = app_settings.controller_address
     ret = await fetch_remote(controller_address + "/refresh_all_workers")
-    models = await fetch_remote(controller_address + "/list_models", None, "models")
+    models = list(await model_list_cache.get((), refresh=True))
 
     models.sort()
     # TODO: return real model permission details
@@ -411,15 +579,13 @@ async def show_available_models():
 @app.post("/v1/chat/completions", dependencies=[Depends(check_api_key)])
 async def create_chat_completion(request: ChatCompletionRequest):
     """Creates a completion for the chat message"""
-    error_check_ret = await check_model(request)
+    worker_addr, error_check_ret = await check_model(request)
     if error_check_ret is not None:
         return error_check_ret
     error_check_ret = check_requests(request)
     if error_check_ret is not None:
         return error_check_ret
 
-    worker_addr = await get_worker_address(request.model)
-
     gen_params = await get_gen_params(
         request.model,
         worker_addr,
@@ -504,19 +670,12 @@ async def chat_completion_stream_generator(
         )
         yield f"data: {chunk.model_dump_json(exclude_unset=True)}\n\n"
 
-        previous_text = ""
         async for content in generate_completion_stream(gen_params, worker_addr):
             if content["error_code"] != 0:
                 yield f"data: {json.dumps(content, ensure_ascii=False)}\n\n"
                 yield "data: [DONE]\n\n"
                 return
-            decoded_unicode = content["text"].replace("\ufffd", "")
-            delta_text = decoded_unicode[len(previous_text) :]
-            previous_text = (
-                decoded_unicode
-                if len(decoded_unicode) > len(previous_text)
-                else previous_text
-            )
+            delta_text = content["text"]
 
             if len(delta_text) == 0:
                 delta_text = None
@@ -541,7 +700,7 @@ async def chat_completion_stream_generator(
 
 @app.post("/v1/completions", dependencies=[Depends(check_api_key)])
 async def create_completion(request: CompletionRequest):
-    error_check_ret = await check_model(request)
+    worker_addr, error_check_ret = await check_model(request)
     if error_check_ret is not None:
         return error_check_ret
     error_check_ret = check_requests(request)
@@ -550,7 +709,6 @@ async def create_completion(request: CompletionRequest):
 
     request.prompt = process_input(request.model, request.prompt)
 
-    worker_addr = await get_worker_address(request.model)
     for text in request.prompt:
         max_tokens, error_check_ret = await check_length(
             request, text, request.max_tokens, worker_addr
@@ -626,7 +784,6 @@ async def generate_completion_stream_generator(
     finish_stream_events = []
     for text in request.prompt:
         for i in range(n):
-            previous_text = ""
             gen_params = await get_gen_params(
                 request.model,
                 worker_addr,
@@ -646,13 +803,7 @@ async def generate_completion_stream_generator(
                     yield f"data: {json.dumps(content, ensure_ascii=False)}\n\n"
                     yield "data: [DONE]\n\n"
                     return
-                decoded_unicode = content["text"].replace("\ufffd", "")
-                delta_text = decoded_unicode[len(previous_text) :]
-                previous_text = (
-                    decoded_unicode
-                    if len(decoded_unicode) > len(previous_text)
-                    else previous_text
-                )
+                delta_text = content["text"]
                 # todo: index is not apparent
                 choice_data = CompletionResponseStreamChoice(
                     index=i,
@@ -678,29 +829,78 @@ async def generate_completion_stream_generator(
 
 
 async def generate_completion_stream(payload: Dict[str, Any], worker_addr: str):
-    controller_address = app_settings.controller_address
-    async with httpx.AsyncClient() as client:
-        delimiter = b"\0"
+    """
+    Yield the outputs of a worker stream with only what they add to the previous ones:
+    the new text, without "\ufffd", and the new logprobs entries. Errors are whole.
+    """
+    client = get_stream_client()
+    delimiter = b"\0"
+    text_length = 0
+    logprobs_lengths = {}
+
+    def to_delta(frame):
+        nonlocal text_length
+        if frame.get("error_code", 0) != 0:
+            return frame
+        text = frame["text"].replace("\ufffd", "")
+        logprobs = frame.get("logprobs") or {}
+        if frame.pop("reset", False):
+            # the whole output, keep what was not streamed yet
+            frame["text"] = text[text_length:]
+            text_length = max(text_length, len(text))
+            for key, value in logprobs.items():
+                if isinstance(value, list):
+                    n = logprobs_lengths.get(key, 0)
+                    logprobs[key] = value[n:]
+                    logprobs_lengths[key] = max(n, len(value))
+        else:
+            frame["text"] = text
+            text_length += len(text)
+            for key, value in logprobs.items():
+                if isinstance(value, list):
+                    logprobs_lengths[key] = logprobs_lengths.get(key, 0) + len(value)
+        return frame
+
+    try:
         async with client.stream(
             "POST",
             worker_addr + "/worker_generate_stream",
-            headers=headers,
+            headers={**headers, "Accept": FRAMED_MEDIA_TYPE},
             json=payload,
             timeout=WORKER_API_TIMEOUT,
         ) as response:
-            # content = await response.aread()
-            buffer = b""
+            if is_framed(response.headers):
+                decoder = FrameDecoder(cumulative=False)
+                async for raw_chunk in response.aiter_raw():
+                    for frame in decoder.feed(raw_chunk):
+                        yield to_delta(frame)
+                return
+
+            # an older worker or controller, the outputs end with the delimiter
+            previous = {}
+            buffer = bytearray()
             async for raw_chunk in response.aiter_raw():
                 buffer += raw_chunk
-                while (chunk_end := buffer.find(delimiter)) >= 0:
-                    chunk, buffer = buffer[:chunk_end], buffer[chunk_end + 1 :]
-                    if not chunk:
-                        continue
-                    yield json.loads(chunk.decode())
+                chunk_start = 0
+                while (chunk_end := buffer.find(delimiter, chunk_start)) >= 0:
+                    if chunk_end > chunk_start:
+                        output = json.loads(buffer[chunk_start:chunk_end])
+                        frame = get_delta(previous, output) or dict(output, reset=True)
+                        previous = output
+                        yield to_delta(frame)
+                    chunk_start = chunk_end + 1
+                del buffer[:chunk_start]
+    except httpx.HTTPError:
+        await report_worker_failure(worker_addr)
+        raise
 
 
 async def generate_completion(payload: Dict[str, Any], worker_addr: str):
-    return await fetch_remote(worker_addr + "/worker_generate", payload, "")
+    try:
+        return await fetch_remote(worker_addr + "/worker_generate", payload, "")
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        await report_worker_failure(worker_addr)
+        raise
 
 
 @app.post("/v1/embeddings", dependencies=[Depends(check_api_key)])
@@ -709,7 +909,7 @@ async def create_embeddings(request: EmbeddingsRequest, model_name: str = None):
     """Creates embeddings for the text"""
     if request.model is None:
         request.model = model_name
-    error_check_ret = await check_model(request)
+    worker_addr, error_check_ret = await check_model(request)
     if error_check_ret is not None:
         return error_check_ret
 
@@ -728,7 +928,7 @@ async def create_embeddings(request: EmbeddingsRequest, model_name: str = None):
             "input": batch,
             "encoding_format": request.encoding_format,
         }
-        embedding = await get_embedding(payload)
+        embedding = await get_embedding(payload, worker_addr)
         if "error_code" in embedding and embedding["error_code"] != 0:
             return create_error_response(embedding["error_code"], embedding["text"])
         data += [
@@ -751,10 +951,9 @@ async def create_embeddings(request: EmbeddingsRequest, model_name: str = None):
     ).model_dump(exclude_none=True)
 
 
-async def get_embedding(payload: Dict[str, Any]):
-    controller_address = app_settings.controller_address
-    model_name = payload["model"]
-    worker_addr = await get_worker_address(model_name)
+async def get_embedding(payload: Dict[str, Any], worker_addr: Optional[str] = None):
+    if worker_addr is None:
+        worker_addr = await get_worker_address(payload["model"])
 
     embedding = await fetch_remote(worker_addr + "/worker_get_embeddings", payload)
     return json.loads(embedding)
@@ -773,11 +972,7 @@ async def count_tokens(request: APITokenCheckRequest):
     for item in request.prompts:
         worker_addr = await get_worker_address(item.model)
 
-        context_len = await fetch_remote(
-            worker_addr + "/model_details",
-            {"prompt": item.prompt, "model": item.model},
-            "context_length",
-        )
+        context_len = await context_length_cache.get((worker_addr, item.model))
 
         token_num = await fetch_remote(
             worker_addr + "/count_token",
@@ -801,15 +996,13 @@ async def count_tokens(request: APITokenCheckRequest):
 @app.post("/api/v1/chat/completions")
 async def create_chat_completion(request: APIChatCompletionRequest):
     """Creates a completion for the chat message"""
-    error_check_ret = await check_model(request)
+    worker_addr, error_check_ret = await check_model(request)
     if error_check_ret is not None:
         return error_check_ret
     error_check_ret = check_requests(request)
     if error_check_ret is not None:
         return error_check_ret
 
-    worker_addr = await get_worker_address(request.model)
-
     gen_params = await get_gen_params(
         request.model,
         worker_addr,
@@ -908,6 +1101,11 @@ def create_openai_api_server():
         default=False,
         help="Enable SSL. Requires OS Environment variables 'SSL_KEYFILE' and 'SSL_CERTFILE'.",
     )
+    parser.add_argument(
+        "--watch-controller",
+        action="store_true",
+        help="Mirror the controller's workers through its /watch stream, and pick workers locally",
+    )
     args = parser.parse_args()
 
     app.add_middleware(
@@ -919,6 +1117,9 @@ def create_openai_api_server():
     )
     app_settings.controller_address = args.controller_address
     app_settings.api_keys = args.api_keys
+    if args.watch_controller:
+        global worker_registry_client
+        worker_registry_client = WorkerRegistryClient(args.controller_address).start()
 
     logger.info(f"args: {args}")
     return args
@@ -1,11 +1,18 @@
 # A JSON logger that sends data to remote endpoint.
 # Architecturally, it hosts a background thread that sends logs to a remote endpoint.
+# Records are sent in batches as a gzipped NDJSON body, and failed batches are retried
+# with exponential backoff.
+import gzip
+import itertools
 import os
 import json
+import random
 import requests
 import threading
 import queue
 import logging
+import time
+from typing import Literal, Optional
 
 _global_logger = None
 
@@ -15,7 +22,18 @@ def get_remote_logger():
     if _global_logger is None:
         if url := os.environ.get("REMOTE_LOGGER_URL"):
             logging.info(f"Remote logger enabled, sending data to {url}")
-            _global_logger = RemoteLogger(url=url)
+            _global_logger = RemoteLogger(
+                url=url,
+                batch_size=int(os.environ.get("REMOTE_LOGGER_BATCH_SIZE", 100)),
+                batch_interval=float(
+                    os.environ.get("REMOTE_LOGGER_BATCH_INTERVAL", 1.0)
+                ),
+                max_queue_size=int(
+                    os.environ.get("REMOTE_LOGGER_MAX_QUEUE_SIZE", 10000)
+                ),
+                overflow_policy=os.environ.get("REMOTE_LOGGER_OVERFLOW_POLICY", "drop"),
+                spill_path=os.environ.get("REMOTE_LOGGER_SPILL_PATH"),
+            )
         else:
             _global_logger = EmptyLogger()
     return _global_logger
@@ -31,29 +49,224 @@ class EmptyLogger:
         pass
 
 
+def flatten_record(data: dict) -> dict:
+    """Keep only the top level fields, and turn any nested value into a JSON string."""
+    return {
+        key: json.dumps(value, ensure_ascii=False, default=str)
+        if isinstance(value, (dict, list, tuple))
+        else value
+        for key, value in data.items()
+    }
+
+
 class RemoteLogger:
-    """A JSON logger that sends data to remote endpoint."""
+    """A JSON logger that sends data to remote endpoint.
+
+    Records are sent every `batch_size` records or `batch_interval` seconds. When the
+    queue is full, or a batch still fails after `max_retries` retries, records are
+    dropped, or appended to `spill_path` with the "spill" policy. The spilled records
+    are sent again every `resend_interval` seconds, and deleted from disk once the
+    endpoint accepted them. The "spilled" counter is the number of records on disk.
+    """
 
-    def __init__(self, url: str):
+    def __init__(
+        self,
+        url: str,
+        batch_size: int = 100,
+        batch_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        overflow_policy: Literal["drop", "spill"] = "drop",
+        spill_path: Optional[str] = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 10.0,
+        resend_interval: float = 10.0,
+    ):
+        if overflow_policy not in ("drop", "spill"):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if overflow_policy == "spill" and not spill_path:
+            raise ValueError("The spill policy requires a spill path")
         self.url = url
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.overflow_policy = overflow_policy
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.resend_interval = resend_interval
+
+        self.session = requests.Session()
+        self.logs = queue.Queue(maxsize=max_queue_size)
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._counters = {
+            "queued": 0,
+            "sent": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed_batches": 0,
+        }
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._next_resend_time = 0.0
 
-        self.logs = queue.Queue()
         self.thread = threading.Thread(target=self._send_logs, daemon=True)
         self.thread.start()
 
     def log(self, data: dict):
-        self.logs.put_nowait(data)
+        # serialize nested fields now, the caller may keep using `data`
+        record = flatten_record(data)
+        try:
+            self.logs.put_nowait(record)
+            self._count("queued")
+        except queue.Full:
+            self._overflow([record])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._counters)
+            stats["queue_depth"] = self.logs.qsize()
+            stats["latency_avg"] = (
+                self._latency_total / stats["batches"] if stats["batches"] else 0.0
+            )
+            stats["latency_max"] = self._latency_max
+            return stats
+
+    def close(self, timeout: Optional[float] = None):
+        """Send the queued records and stop the background thread."""
+        self._stopped.set()
+        self.thread.join(timeout)
 
     def _send_logs(self):
         while True:
-            data = self.logs.get()
+            batch = []
+            try:
+                batch = self._next_batch()
+                if batch and not self._send_batch(batch):
+                    self._overflow(batch)
+                    # the endpoint is down, wait before sending the spilled records
+                    self._next_resend_time = time.monotonic() + self.resend_interval
+                elif (
+                    self.overflow_policy == "spill"
+                    and not self._stopped.is_set()
+                    and time.monotonic() >= self._next_resend_time
+                ):
+                    self._resend_spilled()
+            except Exception:
+                logging.exception("Failed to send logs to remote endpoint")
+            if not batch and self._stopped.is_set():
+                return
 
-            # process the data by keep only the top level fields, and turn any nested dict into a string
-            for key, value in data.items():
-                if isinstance(value, (dict, list, tuple)):
-                    data[key] = json.dumps(value, ensure_ascii=False)
+    def _next_batch(self) -> list:
+        batch = []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.logs.get(timeout=min(timeout, 0.1)))
+            except queue.Empty:
+                if self._stopped.is_set():
+                    break
+        return batch
 
+    def _send_batch(self, batch: list) -> bool:
+        body = "".join(
+            json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            for record in batch
+        )
+        payload = gzip.compress(body.encode("utf-8"))
+        headers = {
+            "Content-Type": "application/x-ndjson",
+            "Content-Encoding": "gzip",
+        }
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._count("retries")
+                backoff = min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max)
+                time.sleep(backoff * random.uniform(0.5, 1.0))
+            start = time.monotonic()
             try:
-                requests.post(self.url, json=data)
+                response = self.session.post(
+                    self.url, data=payload, headers=headers, timeout=self.timeout
+                )
             except Exception:
                 logging.exception("Failed to send logs to remote endpoint")
+                continue
+            latency = time.monotonic() - start
+            if response.status_code < 300:
+                with self._stats_lock:
+                    self._counters["sent"] += len(batch)
+                    self._counters["batches"] += 1
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+                return True
+            logging.error(
+                f"Failed to send logs to remote endpoint: {response.status_code}"
+            )
+            if response.status_code < 500 and response.status_code != 429:
+                break
+        self._count("failed_batches")
+        return False
+
+    def _overflow(self, records: list):
+        if self.overflow_policy == "spill":
+            try:
+                with self._spill_lock, open(self.spill_path, "a") as fout:
+                    self._write_records(fout, records)
+                self._count("spilled", len(records))
+                return
+            except Exception:
+                logging.exception("Failed to spill logs to disk")
+        self._count("dropped", len(records))
+
+    def _resend_spilled(self):
+        self._next_resend_time = time.monotonic() + self.resend_interval
+        # the records being sent are moved to a .sending file, which is only removed
+        # once all of them are sent. One left by a failed resend is sent first.
+        sending_path = self.spill_path + ".sending"
+        with self._spill_lock:
+            if not os.path.exists(sending_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, sending_path)
+        logging.info(f"Resending the spilled logs of {sending_path}")
+        with open(sending_path) as fin:
+            records = self._read_records(fin)
+            while batch := list(itertools.islice(records, self.batch_size)):
+                if not self._send_batch(batch):
+                    # the endpoint is still down, keep the records not sent yet
+                    tmp_path = sending_path + ".tmp"
+                    with open(tmp_path, "w") as fout:
+                        self._write_records(fout, itertools.chain(batch, records))
+                    os.replace(tmp_path, sending_path)
+                    return
+                self._count("spilled", -len(batch))
+        os.remove(sending_path)
+
+    def _read_records(self, fin):
+        for line in fin:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.error(f"Dropping a malformed spilled log: {line[:200]!r}")
+                self._count("spilled", -1)
+                self._count("dropped")
+
+    def _write_records(self, fout, records):
+        for record in records:
+            fout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def _count(self, counter: str, value: int = 1):
+        with self._stats_lock:
+            # records spilled by an earlier process were never counted
+            self._counters[counter] = max(self._counters[counter] + value, 0)
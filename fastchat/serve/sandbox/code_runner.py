@@ -21,7 +21,7 @@ from fastchat.serve.sandbox.sandbox_telemetry import log_sandbox_telemetry_gradi
 
 
 from .constants import CODE_RUN_TIMEOUT_SECONDS, E2B_API_KEY, SANDBOX_TEMPLATE_ID, SANDBOX_NGINX_PORT
-from .sandbox_manager import get_sandbox_app_url, create_sandbox, install_npm_dependencies, install_pip_dependencies, reuse_or_create_sandbox, run_background_command_with_timeout, run_command_in_sandbox
+from .sandbox_manager import get_sandbox_app_url, create_sandbox, install_dependencies, install_npm_dependencies, install_pip_dependencies, release_sandbox, reuse_or_create_sandbox, run_background_command_with_timeout, run_command_in_sandbox
 
 SUPPORTED_SANDBOX_ENVIRONMENTS: list[str] = [
     env.value for env in SandboxEnvironment
@@ -127,6 +127,7 @@ def create_chatbot_sandbox_state(btn_list_length: int = 5) -> ChatbotSandboxStat
         'code_dependencies': ([], []),
         'btn_list_length': btn_list_length,
         'sandbox_id': None,
+        'owner_id': uuid.uuid4().hex,
         'chat_session_id': None,
         'conv_id': None,
         "sandbox_output": None,
@@ -166,7 +167,8 @@ def reset_sandbox_state(state: ChatbotSandboxState) -> ChatbotSandboxState:
     state['sandbox_error'] = None
     state['sandbox_output'] = None
 
-    # reset ids
+    # reset ids, the sandbox can be reused by later runs of this chatbot with the same dependencies
+    release_sandbox(state['sandbox_id'], state.get('owner_id'))
     state['sandbox_id'] = None
     state['conv_id'] = None
     state['chat_session_id'] = None
@@ -302,11 +304,8 @@ def run_code_interpreter(code: str, code_language: str | None, code_dependencies
     stderrs = []
 
     python_dependencies, npm_dependencies = code_dependencies
-    pip_install_errs = install_pip_dependencies(sandbox, python_dependencies)
-    npm_install_errs = install_npm_dependencies(sandbox, npm_dependencies)
-
-    stderrs.extend(pip_install_errs)
-    stderrs.extend(npm_install_errs)
+    install_errs = install_dependencies(sandbox, python_dependencies, npm_dependencies)
+    stderrs.extend(install_errs)
 
     execution = sandbox.run_code(
         code=code,
@@ -372,7 +371,7 @@ def run_html_sandbox(code: str, code_dependencies: tuple[list[str], list[str]],
     return (sandbox_url, sandbox.sandbox_id, '')
 
 
-def run_react_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None) -> CodeRunResult:
+def run_react_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None, owner_id: str | None = None) -> CodeRunResult:
     """
     Executes the provided code within a sandboxed environment and returns the output.
 
@@ -383,11 +382,15 @@ def run_react_sandbox(code: str, code_dependencies: tuple[list[str], list[str]],
         url for remote sandbox
     """
     project_root = "~/react_app"
-    sandbox = reuse_or_create_sandbox(sandbox_id=existing_sandbox_id)
+    _, npm_dependencies = code_dependencies
+    sandbox = reuse_or_create_sandbox(
+        sandbox_id=existing_sandbox_id,
+        dependency_layers=[(f"npm:{project_root}", npm_dependencies)],
+        owner_id=owner_id,
+    )
 
     stderrs: list[str] = [] # to collect errors
 
-    _, npm_dependencies = code_dependencies
     if npm_dependencies:
         print(f"Installing NPM dependencies...: {npm_dependencies}")
         install_errs = install_npm_dependencies(sandbox, npm_dependencies, project_root=project_root)
@@ -419,7 +422,7 @@ def run_react_sandbox(code: str, code_dependencies: tuple[list[str], list[str]],
     }
 
 
-def run_vue_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None) -> CodeRunResult:
+def run_vue_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None, owner_id: str | None = None) -> CodeRunResult:
     """
     Executes the provided Vue code within a sandboxed environment and returns the output.
 
@@ -429,8 +432,13 @@ def run_vue_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], e
     Returns:
         url for remote sandbox
     """
-    sandbox = reuse_or_create_sandbox(sandbox_id=existing_sandbox_id)
     project_root = "~/vue_app"
+    _, npm_dependencies = code_dependencies
+    sandbox = reuse_or_create_sandbox(
+        sandbox_id=existing_sandbox_id,
+        dependency_layers=[(f"npm:{project_root}", npm_dependencies)],
+        owner_id=owner_id,
+    )
 
     stderrs: list[str] = [] # to collect errors
 
@@ -441,7 +449,6 @@ def run_vue_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], e
     file_path = "~/vue_app/src/App.vue"
     sandbox.files.write(path=file_path, data=code, request_timeout=60)
 
-    _, npm_dependencies = code_dependencies
     if npm_dependencies:
         print(f"Installing NPM dependencies...: {npm_dependencies}")
         install_errs = install_npm_dependencies(sandbox, npm_dependencies, project_root=project_root)
@@ -464,7 +471,7 @@ def run_vue_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], e
     }
 
 
-def run_pygame_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None) -> CodeRunResult:
+def run_pygame_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None, owner_id: str | None = None) -> CodeRunResult:
     """
     Executes the provided code within a sandboxed environment and returns the output.
 
@@ -474,7 +481,12 @@ def run_pygame_sandbox(code: str, code_dependencies: tuple[list[str], list[str]]
     Returns:
         url for remote sandbox
     """
-    sandbox = reuse_or_create_sandbox(sandbox_id=existing_sandbox_id)
+    python_dependencies, _ = code_dependencies
+    sandbox = reuse_or_create_sandbox(
+        sandbox_id=existing_sandbox_id,
+        dependency_layers=[('pip', python_dependencies)],
+        owner_id=owner_id,
+    )
     project_root = "~/pygame_app"
     file_path = f"{project_root}/main.py"
 
@@ -482,7 +494,6 @@ def run_pygame_sandbox(code: str, code_dependencies: tuple[list[str], list[str]]
 
     sandbox.files.write(path=file_path, data=code, request_timeout=60)
 
-    python_dependencies, _ = code_dependencies
     install_errs = install_pip_dependencies(sandbox, python_dependencies)
     stderrs.extend(install_errs)
 
@@ -502,7 +513,7 @@ def run_pygame_sandbox(code: str, code_dependencies: tuple[list[str], list[str]]
     }
 
 
-def run_gradio_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None) -> tuple[str, str, str]:
+def run_gradio_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None, owner_id: str | None = None) -> tuple[str, str, str]:
     """
     Executes the provided code within a sandboxed environment and returns the output.
 
@@ -512,14 +523,18 @@ def run_gradio_sandbox(code: str, code_dependencies: tuple[list[str], list[str]]
     Returns:
         url for remote sandbox and sandbox id
     """
-    sandbox = reuse_or_create_sandbox(sandbox_id=existing_sandbox_id)
+    python_dependencies, _ = code_dependencies
+    sandbox = reuse_or_create_sandbox(
+        sandbox_id=existing_sandbox_id,
+        dependency_layers=[('pip', python_dependencies)],
+        owner_id=owner_id,
+    )
 
     file_path = "~/gradio_app/main.py"
     sandbox.files.write(path=file_path, data=code, request_timeout=60)
 
     stderrs = []
 
-    python_dependencies, _ = code_dependencies
     install_stderr = install_pip_dependencies(sandbox, python_dependencies)
     stderrs.extend(install_stderr)
     
@@ -535,8 +550,13 @@ def run_gradio_sandbox(code: str, code_dependencies: tuple[list[str], list[str]]
     return (sandbox_url, sandbox.sandbox_id, '\n'.join(stderrs))
 
 
-def run_streamlit_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None) -> tuple[str, str, str]:
-    sandbox = reuse_or_create_sandbox(sandbox_id=existing_sandbox_id)
+def run_streamlit_sandbox(code: str, code_dependencies: tuple[list[str], list[str]], existing_sandbox_id: str | None = None, owner_id: str | None = None) -> tuple[str, str, str]:
+    python_dependencies, _ = code_dependencies
+    sandbox = reuse_or_create_sandbox(
+        sandbox_id=existing_sandbox_id,
+        dependency_layers=[('pip', python_dependencies)],
+        owner_id=owner_id,
+    )
 
     stderrs = []
 
@@ -544,7 +564,6 @@ def run_streamlit_sandbox(code: str, code_dependencies: tuple[list[str], list[st
     file_path = "~/mystreamlit/app.py"
     sandbox.files.write(path=file_path, data=code, request_timeout=60)
 
-    python_dependencies, _ = code_dependencies
     install_stderr = install_pip_dependencies(sandbox, python_dependencies)
     stderrs.extend(install_stderr)
 
@@ -1179,6 +1198,7 @@ def on_run_code(
                 code=code,
                 code_dependencies=code_dependencies,
                 existing_sandbox_id=sandbox_state['sandbox_id'],
+                owner_id=sandbox_state.get('owner_id'),
             )
             sandbox_id, sandbox_error = code_run_result['sandbox_id'], code_run_result['stderr']
             if code_run_result['is_run_success'] is False and sandbox_error:
@@ -1203,6 +1223,7 @@ def on_run_code(
                 code=code,
                 code_dependencies=code_dependencies,
                 existing_sandbox_id=sandbox_state['sandbox_id'],
+                owner_id=sandbox_state.get('owner_id'),
             )
             sandbox_id, sandbox_error = code_run_result['sandbox_id'], code_run_result['stderr']
             if code_run_result['is_run_success'] is False and code_run_result['stderr']:
@@ -1227,6 +1248,7 @@ def on_run_code(
                 code=code,
                 code_dependencies=code_dependencies,
                 existing_sandbox_id=sandbox_state['sandbox_id'],
+                owner_id=sandbox_state.get('owner_id'),
             )
             sandbox_id, sandbox_error = code_run_result['sandbox_id'], code_run_result['stderr']
             if code_run_result['is_run_success'] is False and code_run_result['stderr']:
@@ -1251,6 +1273,7 @@ def on_run_code(
                 code=code,
                 code_dependencies=code_dependencies,
                 existing_sandbox_id=sandbox_state['sandbox_id'],
+                owner_id=sandbox_state.get('owner_id'),
             )
             if sandbox_error:
                 yield update_markdown_output("❌ Gradio sandbox failed to run!", clear_output=True)
@@ -1274,6 +1297,7 @@ def on_run_code(
                 code=code,
                 code_dependencies=code_dependencies,
                 existing_sandbox_id=sandbox_state['sandbox_id'],
+                owner_id=sandbox_state.get('owner_id'),
             )
             if sandbox_error:
                 yield update_markdown_output("❌ Streamlit sandbox failed to run!", clear_output=True)
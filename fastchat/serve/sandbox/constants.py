@@ -44,6 +44,27 @@ SANDBOX_RETRY_COUNT: int = 3
 Number of times to retry the sandbox creation.
 '''
 
+SANDBOX_POOL_MIN_SIZE: int = int(os.environ.get("SANDBOX_POOL_MIN_SIZE", 2))
+'''
+Number of pre-warmed sandboxes kept idle per template. 0 disables pre-warming.
+'''
+
+SANDBOX_POOL_MAX_SIZE: int = int(os.environ.get("SANDBOX_POOL_MAX_SIZE", 8))
+'''
+Maximum number of pre-warmed sandboxes kept idle per template under load.
+'''
+
+SANDBOX_POOL_TTL_SECONDS: int = SANDBOX_TIMEOUT_SECONDS - 60
+'''
+Idle pooled sandboxes are recycled after this many seconds, before they expire on e2b.
+'''
+
+DEPENDENCY_SNAPSHOT_TEMPLATES: list[tuple[str, list[str], str]] = []
+'''
+Pre-baked sandbox templates with a dependency set installed, as (ecosystem, dependencies, template id).
+Ecosystem is 'pip' or 'npm:<project root>', e.g. 'npm:~/react_app'.
+'''
+
 INSTALLED_PYPI_PACKAGES = [
     "boto3",
     "botocore",
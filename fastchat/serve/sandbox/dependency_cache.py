@@ -0,0 +1,221 @@
+'''
+Content-addressed cache of dependency layers installed in sandboxes.
+
+A dependency layer is a normalized (ecosystem, sorted dependencies) set, keyed by its hash.
+The cache records which sandboxes have installed each layer, and which pre-baked
+snapshot templates ship with it, so a later run with the same dependency set can
+skip the installation.
+
+A live sandbox is only handed out again once the session owning it has released it, and
+only to the same owner: a released sandbox still has the files, the running processes and
+the public app URL of its last run.
+'''
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Callable, Literal
+
+
+def normalize_dependencies(ecosystem: str, dependencies: list[str]) -> tuple[str, ...]:
+    '''
+    Normalize a dependency set: strip, de-duplicate and sort.
+    PyPI package names are case-insensitive and treat `-`, `_` and `.` alike.
+    '''
+    normalized = set()
+    for dependency in dependencies:
+        dependency = dependency.strip()
+        if not dependency:
+            continue
+        if ecosystem == "pip":
+            name = re.match(r"[A-Za-z0-9._-]*", dependency).group(0)
+            dependency = re.sub(r"[-_.]+", "-", name).lower() + dependency[len(name):]
+        normalized.add(dependency)
+    return tuple(sorted(normalized))
+
+
+def get_dependency_layer_key(ecosystem: str, dependencies: list[str]) -> str:
+    '''
+    Hash of a normalized dependency set.
+
+    Args:
+        ecosystem: The package ecosystem and scope, e.g. 'pip' or 'npm:~/react_app'.
+        dependencies: The dependencies of the layer.
+    '''
+    payload = json.dumps([ecosystem, normalize_dependencies(ecosystem, dependencies)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class DependencyLayer:
+    '''
+    A dependency set and the places it is installed.
+    '''
+    key: str
+    ecosystem: str
+    dependencies: tuple[str, ...]
+    sandbox_ids: list[str] = field(default_factory=list)
+    '''
+    Sandboxes with the layer installed, most recent last.
+    '''
+    snapshot_template: str | None = None
+    '''
+    Pre-baked sandbox template with the layer installed.
+    '''
+
+
+class DependencyCache:
+    '''
+    Record and look up where dependency layers are installed.
+    '''
+
+    def __init__(
+        self,
+        max_layers: int = 1024,
+        released_ttl_seconds: float = 5 * 60,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_layers = max_layers
+        self.released_ttl_seconds = released_ttl_seconds
+        self.clock = clock
+
+        self._layers: OrderedDict[str, DependencyLayer] = OrderedDict()
+        # sandbox id -> (owner, release time)
+        self._released: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+        self._lookups = 0
+        self._live_hits = 0
+        self._snapshot_hits = 0
+
+    def record_installed(self, ecosystem: str, dependencies: list[str], sandbox_id: str) -> None:
+        '''
+        Record that a dependency set has been installed in a sandbox.
+        '''
+        with self._lock:
+            layer = self._get_or_create_layer(ecosystem, dependencies)
+            if sandbox_id in layer.sandbox_ids:
+                layer.sandbox_ids.remove(sandbox_id)
+            layer.sandbox_ids.append(sandbox_id)
+
+    def register_snapshot(self, ecosystem: str, dependencies: list[str], template: str) -> None:
+        '''
+        Register a pre-baked sandbox template with the dependency set installed.
+        '''
+        with self._lock:
+            self._get_or_create_layer(ecosystem, dependencies).snapshot_template = template
+
+    def has_installed(self, ecosystem: str, dependencies: list[str], sandbox_id: str) -> bool:
+        '''
+        Whether a dependency set has been recorded as installed in a sandbox.
+        '''
+        key = get_dependency_layer_key(ecosystem, dependencies)
+        with self._lock:
+            layer = self._layers.get(key)
+            return layer is not None and sandbox_id in layer.sandbox_ids
+
+    def release_sandbox(self, sandbox_id: str | None, owner: str | None) -> None:
+        '''
+        Mark a sandbox as no longer used by its session, so it can be claimed by another run of the same owner.
+        '''
+        if sandbox_id is None or owner is None:
+            return
+        with self._lock:
+            now = self.clock()
+            for expired_id in [
+                released_id for released_id, (_, released_at) in self._released.items()
+                if now - released_at >= self.released_ttl_seconds
+            ]:
+                del self._released[expired_id]
+            if any(sandbox_id in layer.sandbox_ids for layer in self._layers.values()):
+                self._released[sandbox_id] = (owner, now)
+
+    def claim_sandbox(self, sandbox_id: str, owner: str | None) -> bool:
+        '''
+        Claim a released sandbox.
+        Return False if it has already been claimed, has expired or was released by another owner.
+        '''
+        with self._lock:
+            if not self._is_released_to(sandbox_id, owner):
+                return False
+            del self._released[sandbox_id]
+            return True
+
+    def forget_sandbox(self, sandbox_id: str) -> None:
+        '''
+        Drop a sandbox which is no longer running.
+        '''
+        with self._lock:
+            self._released.pop(sandbox_id, None)
+            for layer in self._layers.values():
+                if sandbox_id in layer.sandbox_ids:
+                    layer.sandbox_ids.remove(sandbox_id)
+
+    def lookup(self, ecosystem: str, dependencies: list[str], owner: str | None = None) -> tuple[list[str], str | None]:
+        '''
+        Look up a dependency set.
+
+        Return the sandboxes with the set installed released by `owner` (most recent first) and the snapshot template if any.
+        '''
+        key = get_dependency_layer_key(ecosystem, dependencies)
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is None:
+                return [], None
+            self._layers.move_to_end(key)
+            released_sandbox_ids = [
+                sandbox_id for sandbox_id in reversed(layer.sandbox_ids)
+                if self._is_released_to(sandbox_id, owner)
+            ]
+            return released_sandbox_ids, layer.snapshot_template
+
+    def record_lookup(self, result: Literal['live', 'snapshot', 'miss']) -> None:
+        '''
+        Record the outcome of a lookup for the hit rate.
+        '''
+        with self._lock:
+            self._lookups += 1
+            if result == 'live':
+                self._live_hits += 1
+            elif result == 'snapshot':
+                self._snapshot_hits += 1
+
+    def stats(self) -> dict[str, int | float]:
+        '''
+        Cache metrics: lookup count and hit rate.
+        '''
+        with self._lock:
+            hits = self._live_hits + self._snapshot_hits
+            return {
+                "layers": len(self._layers),
+                "released_sandboxes": len(self._released),
+                "lookups": self._lookups,
+                "live_hits": self._live_hits,
+                "snapshot_hits": self._snapshot_hits,
+                "hit_rate": hits / self._lookups if self._lookups else 0.0,
+            }
+
+    def _is_released_to(self, sandbox_id: str, owner: str | None) -> bool:
+        if owner is None or sandbox_id not in self._released:
+            return False
+        released_by, released_at = self._released[sandbox_id]
+        return released_by == owner and self.clock() - released_at < self.released_ttl_seconds
+
+    def _get_or_create_layer(self, ecosystem: str, dependencies: list[str]) -> DependencyLayer:
+        key = get_dependency_layer_key(ecosystem, dependencies)
+        layer = self._layers.get(key)
+        if layer is None:
+            layer = DependencyLayer(
+                key=key,
+                ecosystem=ecosystem,
+                dependencies=normalize_dependencies(ecosystem, dependencies),
+            )
+            self._layers[key] = layer
+            while len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+        self._layers.move_to_end(key)
+        return layer
@@ -0,0 +1,145 @@
+'''
+In-memory stand-in for `e2b.Sandbox`.
+
+Implements the subset of the e2b sandbox API used by the sandbox manager,
+so the sandbox pool and installers can be exercised without network access.
+'''
+
+from dataclasses import dataclass
+import itertools
+import threading
+from typing import Any, Callable
+
+
+@dataclass
+class FakeCommandResult:
+    '''
+    Result of a command run in a fake sandbox.
+    '''
+    exit_code: int
+    stdout: str
+    stderr: str
+
+
+class FakeCommandExitException(Exception):
+    '''
+    Raised when a fake command exits with a non-zero code, like e2b's `CommandExitException`.
+    '''
+
+    def __init__(self, result: FakeCommandResult) -> None:
+        super().__init__(f"Command exited with code {result.exit_code}: {result.stderr}")
+        self.exit_code = result.exit_code
+        self.stdout = result.stdout
+        self.stderr = result.stderr
+
+
+CommandHandler = Callable[[str, str | None], FakeCommandResult]
+'''
+Computes the result of a command given (command, cwd).
+'''
+
+
+def succeed_all_commands(command: str, cwd: str | None) -> FakeCommandResult:
+    return FakeCommandResult(exit_code=0, stdout="", stderr="")
+
+
+class FakeCommands:
+    '''
+    Fake of `Sandbox.commands`, recording every command run.
+    '''
+
+    def __init__(self, handler: CommandHandler) -> None:
+        self.handler = handler
+        self.history: list[tuple[str, str | None]] = []
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        cmd: str,
+        cwd: str | None = None,
+        timeout: float | None = None,
+        request_timeout: float | None = None,
+        on_stdout: Callable[[str], Any] | None = None,
+        on_stderr: Callable[[str], Any] | None = None,
+        background: bool = False,
+        **kwargs: Any,
+    ) -> FakeCommandResult:
+        with self._lock:
+            self.history.append((cmd, cwd))
+        result = self.handler(cmd, cwd)
+        if on_stdout and result.stdout:
+            on_stdout(result.stdout)
+        if on_stderr and result.stderr:
+            on_stderr(result.stderr)
+        if result.exit_code != 0:
+            raise FakeCommandExitException(result)
+        return result
+
+
+class FakeFiles:
+    '''
+    Fake of `Sandbox.files`, keeping written files in memory.
+    '''
+
+    def __init__(self) -> None:
+        self.files: dict[str, str | bytes] = {}
+        self.dirs: set[str] = set()
+
+    def write(self, path: str, data: str | bytes, **kwargs: Any) -> None:
+        self.files[path] = data
+
+    def read(self, path: str, **kwargs: Any) -> str | bytes:
+        return self.files[path]
+
+    def make_dir(self, path: str, **kwargs: Any) -> bool:
+        self.dirs.add(path)
+        return True
+
+
+class FakeSandbox:
+    '''
+    Fake of `e2b.Sandbox`.
+    '''
+
+    _ids = itertools.count()
+
+    def __init__(
+        self,
+        template: str = "fake",
+        timeout: int = 300,
+        command_handler: CommandHandler = succeed_all_commands,
+        **kwargs: Any,
+    ) -> None:
+        self.sandbox_id = f"{template}-{next(FakeSandbox._ids)}"
+        self.template = template
+        self.timeout = timeout
+        self.running = True
+        self.killed = False
+        self.commands = FakeCommands(command_handler)
+        self.files = FakeFiles()
+
+    def is_running(self, request_timeout: float | None = None) -> bool:
+        return self.running
+
+    def set_timeout(self, timeout: int, **kwargs: Any) -> None:
+        self.timeout = timeout
+
+    def kill(self, **kwargs: Any) -> bool:
+        self.running = False
+        self.killed = True
+        return True
+
+    def get_host(self, port: int) -> str:
+        return f"{port}-{self.sandbox_id}.fake.e2b.dev"
+
+
+class FakeClock:
+    '''
+    Manually advanced stand-in for `time.monotonic`, to pass as the `clock` of the sandbox pool and dependency cache.
+    '''
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
@@ -2,8 +2,10 @@
 Facades for interacting with the e2b sandbox.
 '''
 
+from concurrent.futures import ThreadPoolExecutor
 import json
-from typing import Literal
+import shlex
+from typing import Any, Callable, Literal
 from e2b import Sandbox
 from e2b.sandbox.commands.command_handle import CommandExitException
 from e2b.exceptions import TimeoutException
@@ -12,7 +14,9 @@ import threading
 from httpcore import ReadTimeout
 import queue
 
-from .constants import E2B_API_KEY, SANDBOX_TEMPLATE_ID, SANDBOX_NGINX_PORT, SANDBOX_RETRY_COUNT, SANDBOX_TIMEOUT_SECONDS, INSTALLED_PYPI_PACKAGES
+from .constants import E2B_API_KEY, SANDBOX_TEMPLATE_ID, SANDBOX_NGINX_PORT, SANDBOX_RETRY_COUNT, SANDBOX_TIMEOUT_SECONDS, INSTALLED_PYPI_PACKAGES, SANDBOX_POOL_MIN_SIZE, SANDBOX_POOL_MAX_SIZE, SANDBOX_POOL_TTL_SECONDS, DEPENDENCY_SNAPSHOT_TEMPLATES
+from .dependency_cache import DependencyCache
+from .sandbox_pool import SandboxPool
 
 
 def create_sandbox(template: str = SANDBOX_TEMPLATE_ID) -> Sandbox:
@@ -36,28 +40,165 @@ def create_sandbox(template: str = SANDBOX_TEMPLATE_ID) -> Sandbox:
     raise RuntimeError("Failed to create sandbox after maximum attempts")
 
 
-def reuse_or_create_sandbox(sandbox_id: str | None, template: str = SANDBOX_TEMPLATE_ID) -> Sandbox:
+_sandbox_pools: dict[str, SandboxPool] = {}
+_sandbox_pools_lock = threading.Lock()
+_sandbox_pools_started = False
+
+
+def start_sandbox_pools() -> None:
     '''
-    Reuse an existing sandbox if it is running, otherwise create a new sandbox.
+    Start pre-warming sandboxes in the background, called once by the server at startup.
+    Until then the pools create sandboxes on demand only.
     '''
-    sandbox = None
+    global _sandbox_pools_started
+    with _sandbox_pools_lock:
+        _sandbox_pools_started = True
+        pools = list(_sandbox_pools.values())
+    for pool in pools:
+        pool.start()
+    get_sandbox_pool()
 
-    if sandbox_id is not None:
-        try:
-            sandbox = Sandbox.connect(
-                sandbox_id=sandbox_id,
-                api_key=E2B_API_KEY,
+
+def get_sandbox_pool(template: str = SANDBOX_TEMPLATE_ID) -> SandboxPool:
+    '''
+    Get the sandbox pool for a template.
+    It is started on first use once the server has called `start_sandbox_pools`.
+    '''
+    with _sandbox_pools_lock:
+        pool = _sandbox_pools.get(template)
+        if pool is None:
+            pool = SandboxPool(
+                template=template,
+                sandbox_factory=lambda: create_sandbox(template=template),
+                # the snapshot templates only keep sandboxes warm while they are leased
+                min_size=SANDBOX_POOL_MIN_SIZE if template == SANDBOX_TEMPLATE_ID else 0,
+                max_size=SANDBOX_POOL_MAX_SIZE,
+                ttl_seconds=SANDBOX_POOL_TTL_SECONDS,
             )
-            if not sandbox.is_running(request_timeout=5):
-                sandbox = None
-        except Exception as e:
-            pass
+            _sandbox_pools[template] = pool
+        started = _sandbox_pools_started
+    if started:
+        pool.start()
+    return pool
 
-    if sandbox is not None:
+
+def get_sandbox_pool_stats() -> list[dict]:
+    '''
+    Get metrics of all sandbox pools.
+    '''
+    with _sandbox_pools_lock:
+        pools = list(_sandbox_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def lease_sandbox(template: str = SANDBOX_TEMPLATE_ID) -> Sandbox:
+    '''
+    Lease a new sandbox, from the pre-warmed pool if possible.
+    '''
+    if SANDBOX_POOL_MAX_SIZE <= 0:
+        return create_sandbox(template=template)
+    sandbox = get_sandbox_pool(template).lease()
+    # pooled sandboxes have been idle for a while, give the user the full timeout
+    try:
         sandbox.set_timeout(timeout=SANDBOX_TIMEOUT_SECONDS)
-    else:
+    except Exception:
+        # it stopped since the pool last checked it
         sandbox = create_sandbox(template=template)
+    return sandbox
+
 
+_dependency_cache = DependencyCache(released_ttl_seconds=SANDBOX_TIMEOUT_SECONDS)
+for _ecosystem, _dependencies, _template in DEPENDENCY_SNAPSHOT_TEMPLATES:
+    _dependency_cache.register_snapshot(_ecosystem, _dependencies, _template)
+
+
+def get_dependency_cache() -> DependencyCache:
+    '''
+    Get the cache of dependency layers installed in sandboxes.
+    '''
+    return _dependency_cache
+
+
+def release_sandbox(sandbox_id: str | None, owner_id: str | None) -> None:
+    '''
+    Release a sandbox no longer used by its session,
+    so later runs of the same owner with the same dependencies can reuse it.
+    '''
+    _dependency_cache.release_sandbox(sandbox_id, owner_id)
+
+
+def connect_sandbox(sandbox_id: str) -> Sandbox | None:
+    '''
+    Connect to an existing sandbox. Return None if it is not running.
+    '''
+    try:
+        sandbox = Sandbox.connect(
+            sandbox_id=sandbox_id,
+            api_key=E2B_API_KEY,
+        )
+        if sandbox.is_running(request_timeout=5):
+            return sandbox
+    except Exception as e:
+        pass
+    return None
+
+
+def find_sandbox_with_dependencies(
+        dependency_layers: list[tuple[str, list[str]]],
+        owner_id: str | None = None,
+    ) -> Sandbox | None:
+    '''
+    Find a sandbox with one of the dependency layers already installed:
+    a live sandbox released by the same owner first, then a pre-baked snapshot template.
+
+    Args:
+        dependency_layers: List of (ecosystem, dependencies), e.g. [('npm:~/react_app', ['recharts'])].
+        owner_id: The owner of the sandboxes which can be reused, see ChatbotSandboxState.owner_id.
+    '''
+    dependency_layers = [(ecosystem, dependencies) for ecosystem, dependencies in dependency_layers if dependencies]
+    if not dependency_layers:
+        return None
+
+    for ecosystem, dependencies in dependency_layers:
+        sandbox_ids, snapshot_template = _dependency_cache.lookup(ecosystem, dependencies, owner_id)
+        for sandbox_id in sandbox_ids:
+            if not _dependency_cache.claim_sandbox(sandbox_id, owner_id):
+                continue
+            sandbox = connect_sandbox(sandbox_id)
+            if sandbox is None:
+                _dependency_cache.forget_sandbox(sandbox_id)
+                continue
+            _dependency_cache.record_lookup('live')
+            sandbox.set_timeout(timeout=SANDBOX_TIMEOUT_SECONDS)
+            return sandbox
+        if snapshot_template is not None:
+            _dependency_cache.record_lookup('snapshot')
+            return lease_sandbox(template=snapshot_template)
+
+    _dependency_cache.record_lookup('miss')
+    return None
+
+
+def reuse_or_create_sandbox(
+        sandbox_id: str | None,
+        template: str = SANDBOX_TEMPLATE_ID,
+        dependency_layers: list[tuple[str, list[str]]] | None = None,
+        owner_id: str | None = None,
+    ) -> Sandbox:
+    '''
+    Reuse an existing sandbox if it is running.
+    Otherwise prefer a sandbox with the dependency layers installed released by the same owner,
+    or lease a new sandbox.
+    '''
+    sandbox = connect_sandbox(sandbox_id) if sandbox_id is not None else None
+
+    if sandbox is not None:
+        sandbox.set_timeout(timeout=SANDBOX_TIMEOUT_SECONDS)
+        return sandbox
+
+    sandbox = find_sandbox_with_dependencies(dependency_layers or [], owner_id)
+    if sandbox is None:
+        sandbox = lease_sandbox(template=template)
     return sandbox
 
 
@@ -101,29 +242,73 @@ def run_command_in_sandbox(
     return is_run_success, stdouts, stderrs
 
 
+def install_packages_with_bisect(
+        install: Callable[[list[str], float], Any],
+        packages: list[str],
+        timeout: float = 60 * 3,
+        retry_timeout: float = 60,
+        total_timeout: float = 60 * 5,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> list[tuple[str, Exception]]:
+    '''
+    Install all packages with a single call to `install(packages, timeout)`.
+    If it fails, bisect the list so the other packages still get installed
+    and the failing packages can be reported.
+
+    The first call gets `timeout` seconds and each retry `retry_timeout` seconds,
+    all within `total_timeout` seconds. The packages not tried by then are reported as failed.
+
+    Return the packages that failed to install with their errors.
+    '''
+    deadline = clock() + total_timeout
+
+    def bisect(packages: list[str], call_timeout: float) -> list[tuple[str, Exception]]:
+        if not packages:
+            return []
+        remaining = deadline - clock()
+        if remaining <= 0:
+            error = TimeoutError(f"Gave up installing after {total_timeout} seconds")
+            return [(package, error) for package in packages]
+        try:
+            install(packages, min(call_timeout, remaining))
+            return []
+        except Exception as e:
+            if len(packages) == 1:
+                return [(packages[0], e)]
+        middle = len(packages) // 2
+        return bisect(packages[:middle], retry_timeout) + bisect(packages[middle:], retry_timeout)
+
+    return bisect(packages, timeout)
+
+
 def install_pip_dependencies(sandbox: Sandbox, dependencies: list[str]) -> list[str]:
     '''
-    Install pip dependencies in the sandbox.
+    Install pip dependencies in the sandbox with a single command.
 
     Return errors if any.
     '''
-    install_errors = []
-    if not dependencies:
-        return install_errors
-  
-    for dependency in dependencies:
-        if dependency not in INSTALLED_PYPI_PACKAGES:
-            try:
-                sandbox.commands.run(
-                    f"uv pip install --system {dependency}",
-                    timeout=60 * 3,
-                    on_stdout=lambda message: print(message),
-                    on_stderr=lambda message: print(message),
-                )
-            except Exception as e:
-                install_errors.append(f"Error during installing pip package {dependency}: {str(e)}")
-                continue
+    if not dependencies or _dependency_cache.has_installed('pip', dependencies, sandbox.sandbox_id):
+        return []
+
+    dependencies_to_install = [
+        dependency for dependency in dict.fromkeys(dependencies)
+        if dependency not in INSTALLED_PYPI_PACKAGES
+    ]
+
+    def install(packages: list[str], timeout: float) -> None:
+        sandbox.commands.run(
+            "uv pip install --system " + " ".join(shlex.quote(package) for package in packages),
+            timeout=timeout,
+            on_stdout=lambda message: print(message),
+            on_stderr=lambda message: print(message),
+        )
 
+    install_errors = [
+        f"Error during installing pip package {dependency}: {str(e)}"
+        for dependency, e in install_packages_with_bisect(install, dependencies_to_install)
+    ]
+    if not install_errors:
+        _dependency_cache.record_installed('pip', dependencies, sandbox.sandbox_id)
     return install_errors
 
 
@@ -159,36 +344,60 @@ def get_installed_npm_packages(sandbox: Sandbox, project_root: str) -> dict[str,
 
 def install_npm_dependencies(sandbox: Sandbox, dependencies: list[str], project_root: str = '~') -> list[str]:
     '''
-    Install npm dependencies in the sandbox.
+    Install npm dependencies in the sandbox with a single command.
 
     Return errors if any.
     '''
     install_errors = []
-    if not dependencies:
+    ecosystem = f"npm:{project_root}"
+    if not dependencies or _dependency_cache.has_installed(ecosystem, dependencies, sandbox.sandbox_id):
         return install_errors
 
     installed_packages: dict[str, str | None] = get_installed_npm_packages(
         sandbox, project_root)
 
-    dependencies_to_install = [dependency for dependency in dependencies if not is_npm_package_installed(
+    dependencies_to_install = [dependency for dependency in dict.fromkeys(dependencies) if not is_npm_package_installed(
         dependency, installed_packages)]
 
-    for dependency in dependencies_to_install:
-        try:
-            sandbox.commands.run(
-                f"npm install {dependency} --prefer-offline --no-audit --no-fund --legacy-peer-deps",
-                cwd=project_root,
-                timeout=60 * 3,
-                on_stdout=lambda message: print(message),
-                on_stderr=lambda message: print(message),
-            )
-        except Exception as e:
-            install_errors.append(f"Error during installing npm package {dependency}:" + str(e))
-            continue
+    def install(packages: list[str], timeout: float) -> None:
+        sandbox.commands.run(
+            "npm install " + " ".join(shlex.quote(package) for package in packages)
+            + " --prefer-offline --no-audit --no-fund --legacy-peer-deps",
+            cwd=project_root,
+            timeout=timeout,
+            on_stdout=lambda message: print(message),
+            on_stderr=lambda message: print(message),
+        )
 
+    install_errors.extend(
+        f"Error during installing npm package {dependency}:" + str(e)
+        for dependency, e in install_packages_with_bisect(install, dependencies_to_install)
+    )
+    if not install_errors:
+        _dependency_cache.record_installed(ecosystem, dependencies, sandbox.sandbox_id)
     return install_errors
 
 
+def install_dependencies(
+        sandbox: Sandbox,
+        python_dependencies: list[str],
+        npm_dependencies: list[str],
+        project_root: str = '~',
+    ) -> list[str]:
+    '''
+    Install pip and npm dependencies in the sandbox concurrently.
+
+    Return errors if any.
+    '''
+    if not python_dependencies or not npm_dependencies:
+        return install_pip_dependencies(sandbox, python_dependencies) + install_npm_dependencies(sandbox, npm_dependencies, project_root=project_root)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pip_future = executor.submit(install_pip_dependencies, sandbox, python_dependencies)
+        npm_future = executor.submit(install_npm_dependencies, sandbox, npm_dependencies, project_root)
+        return pip_future.result() + npm_future.result()
+
+
 def run_background_command_with_timeout(
     sandbox: Sandbox,
     command: str,
@@ -0,0 +1,290 @@
+'''
+Pool of pre-warmed sandboxes.
+
+Creating an e2b sandbox takes several seconds, which dominates the time to first render
+when a user clicks "Run in Sandbox". The pool keeps a few idle sandboxes per template
+warm in the background and leases them out on demand.
+
+The pool only depends on the sandbox factory passed in, so it can be driven by
+`fastchat.serve.sandbox.fake_sandbox.FakeSandbox` in tests.
+'''
+
+from collections import deque
+from dataclasses import dataclass
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PooledSandbox:
+    '''
+    An idle sandbox held by the pool.
+    '''
+    sandbox: Any
+    '''
+    The sandbox instance.
+    '''
+    created_at: float
+    '''
+    Monotonic time when the sandbox was created.
+    '''
+    checked_at: float
+    '''
+    Monotonic time when the sandbox was last known to be running.
+    '''
+
+
+class SandboxPool:
+    '''
+    A pool of pre-warmed sandboxes for a single template.
+
+    - Keeps at least `min_size` idle sandboxes, growing up to `max_size` when leases miss.
+    - Refills in a background thread, which also checks `is_running` on the idle sandboxes.
+    - Checks a sandbox not checked for `health_check_interval_seconds` before handing it out,
+      and creates one on the spot if that check fails, so a lease waits for at most one check.
+    - Recycles idle sandboxes before they hit their e2b timeout.
+    '''
+
+    def __init__(
+        self,
+        template: str,
+        sandbox_factory: Callable[[], Any],
+        min_size: int,
+        max_size: int,
+        ttl_seconds: float,
+        refill_interval_seconds: float = 5,
+        health_check_timeout: float = 5,
+        health_check_interval_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if min_size < 0 or max_size < min_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.template = template
+        self.sandbox_factory = sandbox_factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.refill_interval_seconds = refill_interval_seconds
+        self.health_check_timeout = health_check_timeout
+        self.health_check_interval_seconds = health_check_interval_seconds
+        self.clock = clock
+
+        self._idle: deque[PooledSandbox] = deque()
+        self._creating = 0
+        self._target_size = min_size
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._refill_thread: threading.Thread | None = None
+
+        self._hits = 0
+        self._misses = 0
+        self._created = 0
+        self._create_failures = 0
+        self._expired = 0
+        self._unhealthy = 0
+        self._lease_count = 0
+        self._lease_latency_total = 0.0
+        self._lease_latency_max = 0.0
+
+    def start(self) -> None:
+        '''
+        Start the background refill thread.
+        '''
+        with self._lock:
+            if self._refill_thread is not None or self._closed:
+                return
+            self._refill_thread = threading.Thread(
+                target=self._refill_loop,
+                name=f"sandbox-pool-{self.template}",
+                daemon=True,
+            )
+            self._refill_thread.start()
+
+    def close(self) -> None:
+        '''
+        Stop refilling and kill all idle sandboxes.
+        '''
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        self._wakeup.set()
+        for entry in idle:
+            self._kill(entry.sandbox)
+        if self._refill_thread is not None:
+            self._refill_thread.join(timeout=self.refill_interval_seconds + 1)
+
+    def lease(self) -> Any:
+        '''
+        Take a healthy sandbox from the pool.
+        Falls back to creating one on the spot if the pool is empty
+        or the sandbox taken from it is not running anymore.
+        '''
+        start = self.clock()
+        sandbox = None
+        while sandbox is None:
+            with self._lock:
+                if not self._idle:
+                    break
+                entry = self._idle.popleft()
+            if self._is_expired(entry):
+                with self._lock:
+                    self._expired += 1
+                self._kill(entry.sandbox)
+            elif self._is_checked_recently(entry) or self._is_healthy(entry.sandbox):
+                sandbox = entry.sandbox
+            else:
+                with self._lock:
+                    self._unhealthy += 1
+                self._kill(entry.sandbox)
+                # the other idle sandboxes are checked in the background, do not wait on them
+                break
+
+        if sandbox is not None:
+            with self._lock:
+                self._hits += 1
+        else:
+            with self._lock:
+                self._misses += 1
+                self._target_size = min(self._target_size + 1, self.max_size)
+            sandbox = self.sandbox_factory()
+            with self._lock:
+                self._created += 1
+
+        latency = self.clock() - start
+        with self._lock:
+            self._lease_count += 1
+            self._lease_latency_total += latency
+            self._lease_latency_max = max(self._lease_latency_max, latency)
+        self._wakeup.set()
+        return sandbox
+
+    def refill(self) -> int:
+        '''
+        Recycle expired sandboxes, discard the ones not running anymore,
+        and create new ones up to the target size.
+        Return the number of sandboxes created.
+        '''
+        self._check_idle()
+
+        expired: list[PooledSandbox] = []
+        with self._lock:
+            if self._closed:
+                return 0
+            kept: deque[PooledSandbox] = deque()
+            for entry in self._idle:
+                (expired if self._is_expired(entry) else kept).append(entry)
+            self._idle = kept
+            self._expired += len(expired)
+            # sandboxes expiring unused means the pool is larger than the demand
+            self._target_size = max(self._target_size - len(expired), self.min_size)
+            to_create = max(self._target_size - len(self._idle) - self._creating, 0)
+            self._creating += to_create
+
+        for entry in expired:
+            self._kill(entry.sandbox)
+
+        created = 0
+        for _ in range(to_create):
+            try:
+                sandbox = self.sandbox_factory()
+            except Exception:
+                logger.exception(f"Error pre-warming sandbox for template {self.template}")
+                with self._lock:
+                    self._creating -= 1
+                    self._create_failures += 1
+                continue
+            with self._lock:
+                self._creating -= 1
+                self._created += 1
+                if self._closed:
+                    sandbox_to_kill = sandbox
+                else:
+                    sandbox_to_kill = None
+                    now = self.clock()
+                    self._idle.append(PooledSandbox(sandbox=sandbox, created_at=now, checked_at=now))
+                    created += 1
+            if sandbox_to_kill is not None:
+                self._kill(sandbox_to_kill)
+        return created
+
+    def stats(self) -> dict[str, Any]:
+        '''
+        Pool metrics: hit / miss counts, lease latency, and current sizes.
+        '''
+        with self._lock:
+            leases = self._hits + self._misses
+            return {
+                "template": self.template,
+                "idle": len(self._idle),
+                "creating": self._creating,
+                "target_size": self._target_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / leases if leases else 0.0,
+                "created": self._created,
+                "create_failures": self._create_failures,
+                "expired": self._expired,
+                "unhealthy": self._unhealthy,
+                "lease_latency_avg": self._lease_latency_total / self._lease_count if self._lease_count else 0.0,
+                "lease_latency_max": self._lease_latency_max,
+            }
+
+    def _refill_loop(self) -> None:
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+            try:
+                self.refill()
+            except Exception:
+                logger.exception(f"Error refilling sandbox pool for template {self.template}")
+            self._wakeup.wait(timeout=self.refill_interval_seconds)
+            self._wakeup.clear()
+
+    def _check_idle(self) -> None:
+        '''
+        Check the idle sandboxes not checked recently, off the lease path.
+        '''
+        with self._lock:
+            entries = [entry for entry in self._idle if not self._is_checked_recently(entry)]
+        unhealthy = []
+        for entry in entries:
+            if self._is_healthy(entry.sandbox):
+                entry.checked_at = self.clock()
+            else:
+                unhealthy.append(entry)
+        discarded = []
+        with self._lock:
+            for entry in unhealthy:
+                # it may have been leased meanwhile
+                if entry in self._idle:
+                    self._idle.remove(entry)
+                    self._unhealthy += 1
+                    discarded.append(entry)
+        for entry in discarded:
+            self._kill(entry.sandbox)
+
+    def _is_expired(self, entry: PooledSandbox) -> bool:
+        return self.clock() - entry.created_at >= self.ttl_seconds
+
+    def _is_checked_recently(self, entry: PooledSandbox) -> bool:
+        return self.clock() - entry.checked_at < self.health_check_interval_seconds
+
+    def _is_healthy(self, sandbox: Any) -> bool:
+        try:
+            return bool(sandbox.is_running(request_timeout=self.health_check_timeout))
+        except Exception:
+            return False
+
+    @staticmethod
+    def _kill(sandbox: Any) -> None:
+        try:
+            sandbox.kill()
+        except Exception:
+            pass
@@ -67,6 +67,11 @@ class ChatbotSandboxState(TypedDict):
     '''
     The remote e2b sandbox id. None if not run yet.
     '''
+    owner_id: str
+    '''
+    The owner id, unique per chatbot state and kept across resets.
+    Only the sandboxes released by the same owner are reused.
+    '''
     chat_session_id: str | None
     '''
     The chat session id, unique per chat.
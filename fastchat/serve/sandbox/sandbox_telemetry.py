@@ -13,6 +13,7 @@ from fastchat.serve.sandbox.sandbox_state import ChatbotSandboxState
 from azure.storage.blob import BlobServiceClient
 
 from fastchat.serve.sandbox.constants import AZURE_BLOB_STORAGE_CONNECTION_STRING, AZURE_BLOB_STORAGE_CONTAINER_NAME
+from fastchat.serve.sandbox.sandbox_manager import get_dependency_cache
 
 
 class SandboxLog(TypedDict):
@@ -21,6 +22,7 @@ class SandboxLog(TypedDict):
     '''
     sandbox_state: ChatbotSandboxState
     user_interaction_records: Optional[List[Any]]
+    dependency_cache_stats: dict[str, int | float]
 
 
 def upload_data_to_azure_storage(
@@ -184,6 +186,7 @@ def create_sandbox_log(sandbox_state: ChatbotSandboxState, user_interaction_reco
     return {
         "sandbox_state": sandbox_state,
         "user_interaction_records": user_interaction_records,
+        "dependency_cache_stats": get_dependency_cache().stats(),
     }
 
 
@@ -7,12 +7,11 @@ python3 -m fastchat.serve.sglang_worker --model-path liuhaotian/llava-v1.5-7b --
 
 import argparse
 import asyncio
-import json
 import multiprocessing
 from typing import List
 
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import JSONResponse
 import uvicorn
 import sglang as sgl
 from sglang.srt.hf_transformers_utils import get_tokenizer, get_config
@@ -20,11 +19,12 @@ from sglang.srt.utils import load_image, is_multimodal_model
 
 from fastchat.conversation import IMAGE_PLACEHOLDER_STR
 from fastchat.constants import ErrorCode, SERVER_ERROR_MSG
-from fastchat.serve.base_model_worker import BaseModelWorker
+from fastchat.serve.base_model_worker import BaseModelWorker, track_latency
 from fastchat.serve.model_worker import (
     logger,
     worker_id,
 )
+from fastchat.serve.stream_framing import create_stream_response
 from fastchat.utils import get_context_length, is_partial_stop
 
 app = FastAPI()
@@ -164,18 +164,18 @@ class SGLWorker(BaseModelWorker):
     async def generate_stream_gate(self, params):
         try:
             async for ret in self.generate_stream(params):
-                yield json.dumps(ret).encode() + b"\0"
+                yield ret
         except (ValueError, RuntimeError) as e:
             ret = {
                 "text": f"{SERVER_ERROR_MSG}\n\n({e})",
                 "error_code": ErrorCode.INTERNAL_ERROR,
             }
-            yield json.dumps(ret).encode() + b"\0"
+            yield ret
 
     async def generate_gate(self, params):
         async for x in self.generate_stream_gate(params):
             pass
-        return json.loads(x[:-1].decode())
+        return x
 
 
 def release_worker_semaphore():
@@ -198,9 +198,9 @@ def create_background_tasks():
 async def api_generate_stream(request: Request):
     params = await request.json()
     await acquire_worker_semaphore()
-    generator = worker.generate_stream_gate(params)
+    generator = track_latency(worker.latency_stats, worker.generate_stream_gate(params))
     background_tasks = create_background_tasks()
-    return StreamingResponse(generator, background=background_tasks)
+    return create_stream_response(generator, request.headers, background_tasks)
 
 
 @app.post("/worker_generate")
@@ -0,0 +1,259 @@
+"""
+A compact framing of the /worker_generate_stream responses.
+
+By default a stream is the JSON of each output followed by b"\\0", and every output
+repeats the text and logprobs generated so far. A client sending
+`Accept: application/x-fastchat-frames` gets length-prefixed frames instead: a 4-byte
+big-endian length and the JSON of only what changed since the previous output, i.e.
+the new text and logprobs, plus the counters. Servers that do not know the header
+answer with the default stream, so clients pick the decoder from the content type.
+
+Workers yield the outputs as dicts and create_stream_response encodes them for either
+format, so a frame costs the size of what changed, not of the whole output. A frame with
+`"reset": true` replaces the previous outputs instead of extending them, e.g. an error.
+
+Usage:
+decoder = FrameDecoder()
+for data in response.iter_content(chunk_size=None):
+    for output in decoder.feed(data):
+        print(output["text"])
+
+Clients which only need what changed, e.g. to stream it on, take the frames as they are:
+decoder = FrameDecoder(cumulative=False)
+"""
+import json
+import struct
+from typing import Dict, List, Optional
+
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FRAMED_MEDIA_TYPE = "application/x-fastchat-frames"
+
+_LENGTH = struct.Struct(">I")
+
+
+def accepts_frames(headers) -> bool:
+    """Whether the request headers ask for framed streams."""
+    return FRAMED_MEDIA_TYPE in headers.get("accept", "")
+
+
+def is_framed(headers) -> bool:
+    """Whether the response headers announce a framed stream."""
+    return headers.get("content-type", "").startswith(FRAMED_MEDIA_TYPE)
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def loads(data):
+    """Parse JSON from bytes, a bytearray or a memoryview, without copying with orjson."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+# The number of characters at the end of the previous text checked to still be there
+_CHECKED_TEXT_LENGTH = 8
+
+
+def get_delta(previous: Dict, output: Dict) -> Optional[Dict]:
+    """
+    The frame of `output` after `previous`: the text and the logprobs entries added
+    since, and the other fields. None if `output` does not extend `previous`.
+
+    The outputs of a stream extend each other by contract, so only the lengths and the
+    end of the previous text and lists are checked, which costs the size of the delta.
+    Errors are never deltas.
+    """
+    text = output.get("text")
+    if not isinstance(text, str) or output.get("error_code", 0) != 0:
+        return None
+    frame = dict(output)
+    if not previous:
+        return frame
+    previous_text = previous.get("text")
+    if not isinstance(previous_text, str) or len(text) < len(previous_text):
+        return None
+    n = len(previous_text)
+    start = max(n - _CHECKED_TEXT_LENGTH, 0)
+    if text[start:n] != previous_text[start:]:
+        return None
+    frame["text"] = text[n:]
+
+    logprobs = output.get("logprobs")
+    previous_logprobs = previous.get("logprobs")
+    if logprobs is None or previous_logprobs is None:
+        return frame if previous_logprobs is None else None
+    frame["logprobs"] = {}
+    for key, value in logprobs.items():
+        previous_value = previous_logprobs.get(key)
+        if isinstance(value, list) and isinstance(previous_value, list):
+            # the lists are appended to, check the last previous item
+            n = len(previous_value)
+            if len(value) < n or value[n - 1 : n] != previous_value[-1:]:
+                return None
+            value = value[n:]
+        frame["logprobs"][key] = value
+    return frame
+
+
+class FrameEncoder:
+    """Encode the outputs of one stream as frames."""
+
+    def __init__(self):
+        self.previous = {}
+
+    def encode(self, output: Dict, reset: bool = False) -> bytes:
+        """Encode an output, as a replacement of the previous ones if `reset`."""
+        frame = None if reset else get_delta(self.previous, output)
+        if frame is None:
+            # e.g. an error message, send the whole output
+            frame = dict(output, reset=True)
+        self.previous = output
+        payload = dumps(frame)
+        return _LENGTH.pack(len(payload)) + payload
+
+    def encode_chunk(self, chunk: bytes, reset: bool = False) -> bytes:
+        """Encode the outputs of a chunk of the default stream."""
+        return b"".join(
+            self.encode(loads(data), reset) for data in chunk.split(b"\0") if data
+        )
+
+
+class FrameDecoder:
+    """
+    Decode a framed stream fed in chunks of any size. The outputs are the full outputs
+    if `cumulative`, which copies the text and the logprobs so far for every frame.
+    Otherwise they are the frames, each with only what changed unless `reset` is set.
+    """
+
+    def __init__(self, cumulative: bool = True):
+        self.cumulative = cumulative
+        self.output = {}
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Dict]:
+        """Return the outputs of the frames completed by `data`."""
+        self._buffer += data
+        outputs = []
+        pos = 0
+        with memoryview(self._buffer) as view:
+            while len(view) - pos >= _LENGTH.size:
+                (length,) = _LENGTH.unpack_from(view, pos)
+                end = pos + _LENGTH.size + length
+                if end > len(view):
+                    break
+                outputs.append(self._apply(loads(view[pos + _LENGTH.size : end])))
+                pos = end
+        del self._buffer[:pos]
+        return outputs
+
+    def _apply(self, frame: Dict) -> Dict:
+        if not self.cumulative:
+            return frame
+        output = frame
+        if not frame.pop("reset", False) and self.output:
+            output["text"] = self.output["text"] + frame["text"]
+            previous_logprobs = self.output.get("logprobs")
+            if frame.get("logprobs") is not None and previous_logprobs is not None:
+                output["logprobs"] = {
+                    key: previous_logprobs[key] + value
+                    if isinstance(value, list)
+                    and isinstance(previous_logprobs.get(key), list)
+                    else value
+                    for key, value in frame["logprobs"].items()
+                }
+        self.output = output
+        return output
+
+
+def complete_length(buffer, framed: bool) -> int:
+    """The length of the complete outputs at the start of a buffer of a stream."""
+    if not framed:
+        return buffer.rfind(b"\0") + 1
+    pos = 0
+    while len(buffer) - pos >= _LENGTH.size:
+        end = pos + _LENGTH.size + _LENGTH.unpack_from(buffer, pos)[0]
+        if end > len(buffer):
+            break
+        pos = end
+    return pos
+
+
+def encode_default(output) -> bytes:
+    """A chunk of the default stream, from an output or from a chunk already encoded."""
+    if isinstance(output, dict):
+        return dumps(output) + b"\0"
+    if isinstance(output, str):
+        return output.encode()
+    return output
+
+
+def encode_frames(chunks):
+    """
+    Convert a sync or async generator of outputs into frames. Chunks of the default
+    stream, as yielded by the workers which do not yield dicts, are parsed first.
+    """
+    encoder = FrameEncoder()
+
+    def encode(chunk):
+        if isinstance(chunk, dict):
+            return encoder.encode(chunk)
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        return encoder.encode_chunk(chunk)
+
+    if hasattr(chunks, "__aiter__"):
+
+        async def wrapped():
+            async for chunk in chunks:
+                yield encode(chunk)
+
+    else:
+
+        def wrapped():
+            for chunk in chunks:
+                yield encode(chunk)
+
+    return wrapped()
+
+
+def encode_default_stream(chunks):
+    """Convert a sync or async generator of outputs into the default stream."""
+    if hasattr(chunks, "__aiter__"):
+
+        async def wrapped():
+            async for chunk in chunks:
+                yield encode_default(chunk)
+
+    else:
+
+        def wrapped():
+            for chunk in chunks:
+                yield encode_default(chunk)
+
+    return wrapped()
+
+
+def create_stream_response(generator, request_headers, background=None):
+    """
+    Stream the outputs of a generator, framed if the request asks for it. The generator
+    yields the outputs as dicts, or as chunks of the default stream.
+    """
+    if accepts_frames(request_headers):
+        return StreamingResponse(
+            encode_frames(generator),
+            media_type=FRAMED_MEDIA_TYPE,
+            background=background,
+        )
+    return StreamingResponse(encode_default_stream(generator), background=background)
@@ -1,8 +1,66 @@
 import base64
+from collections import OrderedDict
 from enum import auto, IntEnum
+import hashlib
 from io import BytesIO
+import threading
+from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+
+# Bytes of decoded pixels kept in memory
+DECODED_IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class DecodedImageCache:
+    """An LRU cache of decoded images, bounded by the size of their pixels and keys."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, image):
+        num_bytes = image.width * image.height * len(image.getbands()) + len(key)
+        if num_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                return
+            self._images[key] = (image, num_bytes)
+            self._num_bytes += num_bytes
+            while self._num_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._images.popitem(last=False)
+                self._num_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._num_bytes = 0
+
+
+decoded_image_cache = DecodedImageCache(DECODED_IMAGE_CACHE_BYTES)
+
+
+def decode_image(base64_str: str):
+    """Decode a base64 encoded image. The returned PIL image is shared, do not modify it."""
+    from fastchat.utils import load_image
+
+    image = decoded_image_cache.get(base64_str)
+    if image is None:
+        image = load_image(base64_str)
+        image.load()
+        decoded_image_cache.put(base64_str, image)
+    return image
 
 
 class ImageFormat(IntEnum):
@@ -25,6 +83,21 @@ class Image(BaseModel):
     image_format: ImageFormat = ImageFormat.BYTES
     base64_str: str = ""
 
+    _image_hash: Optional[str] = PrivateAttr(default=None)
+    _hashed_base64_str: Optional[str] = PrivateAttr(default=None)
+
+    def to_pil_image(self):
+        """Decode the image. The returned PIL image is shared, do not modify it."""
+        return decode_image(self.base64_str)
+
+    def get_image_hash(self) -> str:
+        """MD5 of the decoded pixels, computed once per image content."""
+        # the comparison is an identity check unless base64_str has been replaced
+        if self._image_hash is None or self._hashed_base64_str != self.base64_str:
+            self._image_hash = hashlib.md5(self.to_pil_image().tobytes()).hexdigest()
+            self._hashed_base64_str = self.base64_str
+        return self._image_hash
+
     def convert_image_to_base64(self):
         """Given an image, return the base64 encoded image string."""
         from PIL import Image
@@ -127,6 +200,7 @@ class Image(BaseModel):
         self.filetype = image_format
         self.image_format = ImageFormat.BYTES
         self.base64_str = image_bytes
+        self.get_image_hash()
 
         return self
 
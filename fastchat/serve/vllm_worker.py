@@ -6,22 +6,22 @@ See documentations at docs/vllm_integration.md
 
 import argparse
 import asyncio
-import json
 from typing import List
 
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import JSONResponse
 import uvicorn
 from vllm import AsyncLLMEngine
 from vllm.engine.arg_utils import AsyncEngineArgs
 from vllm.sampling_params import SamplingParams
 from vllm.utils import random_uuid
 
-from fastchat.serve.base_model_worker import BaseModelWorker
+from fastchat.serve.base_model_worker import BaseModelWorker, track_latency
 from fastchat.serve.model_worker import (
     logger,
     worker_id,
 )
+from fastchat.serve.stream_framing import create_stream_response
 from fastchat.utils import get_context_length, is_partial_stop
 
 
@@ -163,8 +163,8 @@ class VLLMWorker(BaseModelWorker):
             # Emit twice here to ensure a 'finish_reason' with empty content in the OpenAI API response.
             # This aligns with the behavior of model_worker.
             if request_output.finished:
-                yield (json.dumps({**ret, **{"finish_reason": None}}) + "\0").encode()
-            yield (json.dumps(ret) + "\0").encode()
+                yield {**ret, **{"finish_reason": None}}
+            yield ret
 
             if aborted:
                 break
@@ -172,7 +172,7 @@ class VLLMWorker(BaseModelWorker):
     async def generate(self, params):
         async for x in self.generate_stream(params):
             pass
-        return json.loads(x[:-1].decode())
+        return x
 
 
 def release_worker_semaphore():
@@ -202,9 +202,9 @@ async def api_generate_stream(request: Request):
     request_id = random_uuid()
     params["request_id"] = request_id
     params["request"] = request
-    generator = worker.generate_stream(params)
+    generator = track_latency(worker.latency_stats, worker.generate_stream(params))
     background_tasks = create_background_tasks(request_id)
-    return StreamingResponse(generator, background=background_tasks)
+    return create_stream_response(generator, request.headers, background_tasks)
 
 
 @app.post("/worker_generate")
@@ -0,0 +1,444 @@
+"""
+The registry of model workers, shared by the controller and its clients.
+
+The controller owns a `WorkerRegistry` and publishes every change to the
+subscribers of its `/watch` stream. Clients such as the OpenAI API server and the
+Gradio web server mirror it with a `WorkerRegistryClient`, so that picking a worker
+for a model is a local lookup instead of a request to the controller.
+"""
+import asyncio
+import dataclasses
+from enum import Enum, auto
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import requests
+
+from fastchat.utils import build_logger
+
+logger = build_logger("worker_registry", "worker_registry.log")
+
+
+class DispatchMethod(Enum):
+    LOTTERY = auto()
+    SHORTEST_QUEUE = auto()
+    POWER_OF_TWO = auto()
+
+    @classmethod
+    def from_str(cls, name):
+        if name == "lottery":
+            return cls.LOTTERY
+        elif name == "shortest_queue":
+            return cls.SHORTEST_QUEUE
+        elif name == "power_of_two":
+            return cls.POWER_OF_TWO
+        else:
+            raise ValueError(f"Invalid dispatch method")
+
+    def to_str(self):
+        return self.name.lower()
+
+
+@dataclasses.dataclass
+class WorkerInfo:
+    model_names: List[str]
+    speed: int
+    queue_length: int
+    check_heart_beat: bool
+    last_heart_beat: str
+    multimodal: bool
+    # rolling latency stats reported by the worker, 0 until it has served a request
+    ttft: float = 0.0
+    tokens_per_second: float = 0.0
+    # outlier ejection after repeated timeouts
+    recent_failures: int = 0
+    last_failure: float = 0.0
+    ejections: int = 0
+    ejected_until: float = 0.0
+
+
+# The response length used to turn decoding speed into an expected latency
+REFERENCE_RESPONSE_TOKENS = 256
+# The latency assumed for a worker which has not reported any stats yet
+DEFAULT_EXPECTED_LATENCY = 1.0
+# A worker ejected again is ejected for longer, up to this many times the ejection time
+MAX_EJECTION_MULTIPLIER = 10
+
+
+def get_expected_latency(worker_info: WorkerInfo) -> float:
+    """The expected latency of one request on an idle worker, from its EWMA stats."""
+    if worker_info.tokens_per_second <= 0:
+        if worker_info.ttft <= 0:
+            return DEFAULT_EXPECTED_LATENCY / worker_info.speed
+        return worker_info.ttft
+    return worker_info.ttft + REFERENCE_RESPONSE_TOKENS / worker_info.tokens_per_second
+
+
+def get_dispatch_score(worker_info: WorkerInfo) -> float:
+    """Expected latency times the load a new request would join. Lower is better."""
+    return get_expected_latency(worker_info) * (worker_info.queue_length + 1)
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending: int):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.max_pending = max_pending
+        self.overflowed = False
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def put(self, event):
+        # called from any thread
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.overflowed = True
+                event = None
+            self._pending += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self):
+        event = await self.queue.get()
+        with self._lock:
+            self._pending -= 1
+        return event
+
+
+class WorkerRegistry:
+    """
+    Workers and their model -> workers index, safe to use from several threads.
+
+    Every change increments `version` and is published to the subscribers as an event:
+        {"type": "upsert", "version": ..., "worker_name": ..., "worker_info": {...}}
+        {"type": "remove", "version": ..., "worker_name": ...}
+
+    A worker which times out `ejection_failures` times, each within `ejection_time`
+    seconds of the previous one, is ejected from power-of-two dispatch for
+    `ejection_time` seconds, times the number of its recent ejections.
+    """
+
+    def __init__(
+        self,
+        dispatch_method: DispatchMethod,
+        max_pending_events: int = 10000,
+        ejection_failures: int = 3,
+        ejection_time: float = 30,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.dispatch_method = dispatch_method
+        self.max_pending_events = max_pending_events
+        self.ejection_failures = ejection_failures
+        self.ejection_time = ejection_time
+        self.clock = clock
+        self.version = 0
+
+        self._workers: Dict[str, WorkerInfo] = {}
+        # model name -> worker names, in registration order
+        self._model_index: Dict[str, Dict[str, None]] = {}
+        self._subscribers: List[_Subscriber] = []
+        self._lock = threading.RLock()
+
+    def upsert(self, worker_name: str, worker_info: WorkerInfo):
+        with self._lock:
+            self._unindex(worker_name)
+            self._workers[worker_name] = worker_info
+            for model_name in worker_info.model_names:
+                self._model_index.setdefault(model_name, {})[worker_name] = None
+            self._publish_upsert(worker_name, worker_info)
+
+    def remove(self, worker_name: str) -> bool:
+        with self._lock:
+            if worker_name not in self._workers:
+                return False
+            self._unindex(worker_name)
+            del self._workers[worker_name]
+            self._publish({"type": "remove", "worker_name": worker_name})
+            return True
+
+    def replace_all(self, workers: Dict[str, WorkerInfo]):
+        with self._lock:
+            for worker_name in list(self._workers):
+                if worker_name not in workers:
+                    self.remove(worker_name)
+            for worker_name, worker_info in workers.items():
+                self.upsert(worker_name, worker_info)
+
+    def receive_heart_beat(
+        self,
+        worker_name: str,
+        queue_length: Optional[int] = None,
+        latency_stats: Optional[dict] = None,
+    ) -> bool:
+        """A heart beat without a queue length or latency stats keeps the previous ones."""
+        with self._lock:
+            worker_info = self._workers.get(worker_name)
+            if worker_info is None:
+                return False
+            if queue_length is not None:
+                worker_info.queue_length = queue_length
+            worker_info.last_heart_beat = self.clock()
+            if latency_stats:
+                update_latency_stats(worker_info, latency_stats)
+            self._publish_upsert(worker_name, worker_info)
+            return True
+
+    def report_failure(self, worker_name: str) -> bool:
+        """Record a timed out request. Return whether the worker got ejected."""
+        with self._lock:
+            worker_info = self._workers.get(worker_name)
+            if worker_info is None:
+                return False
+            now = self.clock()
+            since_last_failure = now - worker_info.last_failure
+            if since_last_failure > self.ejection_time:
+                worker_info.recent_failures = 0
+            if since_last_failure > self.ejection_time * MAX_EJECTION_MULTIPLIER:
+                worker_info.ejections = 0
+            worker_info.recent_failures += 1
+            worker_info.last_failure = now
+            ejected = worker_info.recent_failures >= self.ejection_failures
+            if ejected:
+                worker_info.recent_failures = 0
+                worker_info.ejections = min(
+                    worker_info.ejections + 1, MAX_EJECTION_MULTIPLIER
+                )
+                ejection_time = self.ejection_time * worker_info.ejections
+                worker_info.ejected_until = now + ejection_time
+                logger.info(f"Eject worker: {worker_name} for {ejection_time}s")
+            self._publish_upsert(worker_name, worker_info)
+            return ejected
+
+    def remove_stale_workers(self, expire: float) -> List[str]:
+        with self._lock:
+            to_delete = [
+                worker_name
+                for worker_name, w_info in self._workers.items()
+                if w_info.check_heart_beat and w_info.last_heart_beat < expire
+            ]
+            for worker_name in to_delete:
+                self.remove(worker_name)
+            return to_delete
+
+    def get(self, worker_name: str) -> Optional[WorkerInfo]:
+        with self._lock:
+            worker_info = self._workers.get(worker_name)
+            return dataclasses.replace(worker_info) if worker_info else None
+
+    def worker_names(self) -> List[str]:
+        with self._lock:
+            return list(self._workers)
+
+    def __contains__(self, worker_name: str) -> bool:
+        with self._lock:
+            return worker_name in self._workers
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._workers)
+
+    def list_models(self, multimodal: Optional[bool] = None) -> List[str]:
+        with self._lock:
+            if multimodal is None:
+                return list(self._model_index)
+            return [
+                model_name
+                for model_name, worker_names in self._model_index.items()
+                if any(
+                    self._workers[worker_name].multimodal == multimodal
+                    for worker_name in worker_names
+                )
+            ]
+
+    def get_worker_address(self, model_name: str) -> str:
+        with self._lock:
+            worker_names = list(self._model_index.get(model_name, ()))
+            if not worker_names:
+                return ""
+            workers = [self._workers[worker_name] for worker_name in worker_names]
+
+            if self.dispatch_method == DispatchMethod.LOTTERY:
+                worker_speeds = np.array([w.speed for w in workers], dtype=np.float32)
+                norm = np.sum(worker_speeds)
+                if norm < 1e-4:
+                    return ""
+                pt = np.random.choice(
+                    np.arange(len(worker_names)), p=worker_speeds / norm
+                )
+                return worker_names[pt]
+            elif self.dispatch_method == DispatchMethod.SHORTEST_QUEUE:
+                worker_qlen = [w.queue_length / w.speed for w in workers]
+                min_index = int(np.argmin(worker_qlen))
+                w_name = worker_names[min_index]
+                # local estimate until the next heart beat reports the real length
+                workers[min_index].queue_length += 1
+                logger.debug(
+                    f"names: {worker_names}, queue_lens: {worker_qlen}, ret: {w_name}"
+                )
+                return w_name
+            elif self.dispatch_method == DispatchMethod.POWER_OF_TWO:
+                now = self.clock()
+                candidates = [
+                    i for i, w in enumerate(workers) if w.ejected_until <= now
+                ]
+                if not candidates:
+                    # every worker is ejected, better to try one than to fail
+                    candidates = list(range(len(workers)))
+                if len(candidates) > 2:
+                    candidates = np.random.choice(candidates, 2, replace=False)
+                index = min(candidates, key=lambda i: get_dispatch_score(workers[i]))
+                # local estimate until the next heart beat reports the real length
+                workers[index].queue_length += 1
+                return worker_names[index]
+            else:
+                raise ValueError(f"Invalid dispatch method: {self.dispatch_method}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "type": "snapshot",
+                "version": self.version,
+                "dispatch_method": self.dispatch_method.to_str(),
+                "workers": {
+                    worker_name: dataclasses.asdict(worker_info)
+                    for worker_name, worker_info in self._workers.items()
+                },
+            }
+
+    def subscribe(self):
+        """
+        Subscribe to the changes. Must be called from the event loop which reads the events.
+        Return the current snapshot and a queue of the following events.
+        A `None` event means the subscriber fell too far behind and must resubscribe.
+        """
+        subscriber = _Subscriber(asyncio.get_running_loop(), self.max_pending_events)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            return self.snapshot(), subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def _unindex(self, worker_name: str):
+        worker_info = self._workers.get(worker_name)
+        if worker_info is None:
+            return
+        for model_name in worker_info.model_names:
+            worker_names = self._model_index.get(model_name)
+            if worker_names is None:
+                continue
+            worker_names.pop(worker_name, None)
+            if not worker_names:
+                del self._model_index[model_name]
+
+    def _publish_upsert(self, worker_name: str, worker_info: WorkerInfo):
+        self._publish(
+            {
+                "type": "upsert",
+                "worker_name": worker_name,
+                "worker_info": dataclasses.asdict(worker_info),
+            }
+        )
+
+    def _publish(self, event: dict):
+        self.version += 1
+        event["version"] = self.version
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.put(event)
+            except RuntimeError:
+                # the event loop of the subscriber is closed
+                self._subscribers.remove(subscriber)
+                continue
+            if subscriber.overflowed:
+                self._subscribers.remove(subscriber)
+
+
+def update_latency_stats(worker_info: WorkerInfo, latency_stats: dict):
+    worker_info.ttft = latency_stats.get("ttft", worker_info.ttft)
+    worker_info.tokens_per_second = latency_stats.get(
+        "tokens_per_second", worker_info.tokens_per_second
+    )
+
+
+class WorkerRegistryClient:
+    """
+    A local mirror of the controller's worker registry, kept up to date by its `/watch` stream.
+
+    Until the first snapshot is received, or while the stream is disconnected,
+    `ready` is False and callers should fall back to asking the controller.
+    """
+
+    def __init__(
+        self,
+        controller_url: str,
+        read_timeout: float = 60,
+        retry_interval: float = 5,
+    ):
+        self.controller_url = controller_url
+        self.read_timeout = read_timeout
+        self.retry_interval = retry_interval
+
+        self.registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE)
+        self.ready = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def list_models(self, multimodal: Optional[bool] = None) -> Optional[List[str]]:
+        if not self.ready:
+            return None
+        return self.registry.list_models(multimodal)
+
+    def get_worker_address(self, model_name: str) -> Optional[str]:
+        if not self.ready:
+            return None
+        return self.registry.get_worker_address(model_name)
+
+    def apply_event(self, event: dict):
+        if event["type"] == "snapshot":
+            self.registry.dispatch_method = DispatchMethod.from_str(
+                event["dispatch_method"]
+            )
+            self.registry.replace_all(
+                {
+                    worker_name: WorkerInfo(**worker_info)
+                    for worker_name, worker_info in event["workers"].items()
+                }
+            )
+            self.ready = True
+        elif event["type"] == "upsert":
+            self.registry.upsert(
+                event["worker_name"], WorkerInfo(**event["worker_info"])
+            )
+        elif event["type"] == "remove":
+            self.registry.remove(event["worker_name"])
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            try:
+                with requests.post(
+                    self.controller_url + "/watch",
+                    stream=True,
+                    timeout=(5, self.read_timeout),
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if self._stopped.is_set():
+                            return
+                        if line:
+                            self.apply_event(json.loads(line))
+            except Exception as e:
+                logger.warning(f"Watching the controller failed: {e}")
+            self.ready = False
+            self._stopped.wait(self.retry_interval)
@@ -8,7 +8,7 @@ import time
 
 import numpy as np
 
-from fastchat.serve.api_provider import get_api_provider_stream_iter
+from fastchat.serve.api_provider import StreamedText, get_api_provider_stream_iter
 from fastchat.serve.chat_state import ModelChatState
 from fastchat.serve.vision.image import Image
 
@@ -53,8 +53,10 @@ def call_model(
     )
     call_time = time.time()
     token_times = []
+    streamed_text = StreamedText()
     for i, data in enumerate(stream_iter):
-        output = data["text"].strip()
+        streamed_text.update(data)
+        output = streamed_text.text.strip()
         if i == 0:
             metrics.ttft = time.time() - call_time
             prev_message = output
@@ -0,0 +1,136 @@
+"""
+Benchmark the bootstrap of BT and of style controlled BT on synthetic battles.
+
+The previous implementation, one L-BFGS fit per round in a process pool, is compared
+with fit_vectorized_bt, which fits all the rounds at once with Newton's method. The max
+difference of the bootstrap quantiles on the Elo scale is reported next to the times.
+
+Usage:
+python3 -m playground.benchmark.benchmark_bootstrap_bt --num-battles 1000000
+"""
+import argparse
+import math
+import multiprocessing as mp
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from fastchat.serve.monitor.rating_systems import (
+    fit_bt,
+    fit_contextual_bt,
+    fit_vectorized_bt,
+)
+
+
+def create_battles(num_battles, num_models, num_features, seed=0):
+    rng = np.random.default_rng(seed)
+    strengths = rng.normal(size=num_models)
+    model_a = rng.integers(num_models, size=num_battles)
+    model_b = (model_a + rng.integers(1, num_models, size=num_battles)) % num_models
+    features = rng.normal(size=(num_battles, num_features))
+    logits = math.log(10.0) * (strengths[model_a] - strengths[model_b])
+    p = 1 / (1 + np.exp(-(logits + features @ rng.normal(size=num_features) * 0.3)))
+    r = rng.random(num_battles)
+    outcomes = np.where(r < 0.1, 0.5, np.where(r < 0.1 + 0.9 * p, 1.0, 0.0))
+    matchups = np.column_stack([model_a, model_b]).astype(np.int32)
+    return matchups, features, outcomes
+
+
+def unique_rows(matchups, outcomes):
+    schedule = np.column_stack([matchups, (outcomes * 2).astype(np.int32)])
+    rows, counts = np.unique(schedule, return_counts=True, axis=0)
+    return rows[:, :2], rows[:, 2] / 2.0, counts.astype(np.float64)
+
+
+def timeit(func):
+    tic = time.perf_counter()
+    result = func()
+    return time.perf_counter() - tic, result
+
+
+def max_quantile_diff(a, b, scale=400.0):
+    q = [2.5, 50, 97.5]
+    return (
+        np.abs(np.percentile(a, q, axis=0) - np.percentile(b, q, axis=0)).max() * scale
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-battles", type=int, default=1000000)
+    parser.add_argument("--num-models", type=int, default=100)
+    parser.add_argument("--num-round", type=int, default=100)
+    parser.add_argument("--num-style-round", type=int, default=10)
+    parser.add_argument("--num-cpu", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    alpha = math.log(10.0)
+    matchups, features, outcomes = create_battles(
+        args.num_battles, args.num_models, num_features=4
+    )
+
+    # BT on the unique (matchup, outcome) rows, as in compute_bootstrap_bt
+    bt_matchups, bt_outcomes, weights = unique_rows(matchups, outcomes)
+    rng = np.random.default_rng(seed=0)
+    boot_weights = rng.multinomial(
+        args.num_battles, weights / weights.sum(), size=args.num_round
+    ) / float(args.num_battles)
+    bt_fn = partial(
+        fit_bt, bt_matchups, bt_outcomes, n_models=args.num_models, alpha=alpha
+    )
+
+    def bootstrap_with_pool():
+        with mp.Pool(args.num_cpu) as pool:
+            return np.array(pool.map(bt_fn, boot_weights))
+
+    pool_time, pool_ratings = timeit(bootstrap_with_pool)
+    vectorized_time, vectorized_ratings = timeit(
+        lambda: fit_vectorized_bt(
+            bt_matchups, bt_outcomes, boot_weights, args.num_models, alpha
+        )
+    )
+    print(
+        f"BT, {args.num_battles} battles, {len(bt_outcomes)} unique rows, "
+        f"{args.num_round} rounds | pool of {args.num_cpu}: {pool_time:.2f} s | "
+        f"vectorized: {vectorized_time:.2f} s | max quantile diff "
+        f"{max_quantile_diff(pool_ratings, vectorized_ratings):.4f}"
+    )
+
+    # style control on the battles, as in compute_bootstrap_style_control
+    n = args.num_battles
+    boot_idxs = np.random.randint(low=0, high=n, size=(args.num_style_round, n))
+    contextual_bt_fn = partial(
+        fit_contextual_bt,
+        matchups,
+        features,
+        outcomes,
+        list(range(args.num_models)),
+        alpha=alpha,
+        reg=0.5,
+    )
+
+    def style_bootstrap_with_pool():
+        with mp.Pool(args.num_cpu) as pool:
+            return np.array(pool.map(contextual_bt_fn, boot_idxs))
+
+    pool_time, pool_params = timeit(style_bootstrap_with_pool)
+    style_weights = np.array([np.bincount(idxs, minlength=n) for idxs in boot_idxs])
+    vectorized_time, vectorized_params = timeit(
+        lambda: fit_vectorized_bt(
+            matchups,
+            outcomes,
+            style_weights.astype(np.float64),
+            args.num_models,
+            alpha,
+            features=features,
+            reg=0.5,
+        )
+    )
+    print(
+        f"style control, {n} battles, {args.num_style_round} rounds | "
+        f"pool of {args.num_cpu}: {pool_time:.2f} s | "
+        f"vectorized: {vectorized_time:.2f} s | max quantile diff "
+        f"{max_quantile_diff(pool_params[:, :args.num_models], vectorized_params[:, :args.num_models]):.4f}"
+    )
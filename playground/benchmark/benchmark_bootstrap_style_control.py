@@ -0,0 +1,111 @@
+"""
+Benchmark the peak memory and the wall time of the style control bootstrap.
+
+"resample" is the previous implementation: (num_round, N) bootstrap indices, and a pool
+whose tasks each receive a pickled copy of the battles and fit the resampled copy with
+L-BFGS. "weights" is fit_bootstrap_style_control: poisson weights drawn a chunk of rounds
+at a time, and workers reading the battles from shared memory. Each implementation runs
+in its own process so that the peak RSS of the main process and of the largest worker
+are its own.
+
+Usage:
+python3 -m playground.benchmark.benchmark_bootstrap_style_control --num-battles 1000000
+"""
+import argparse
+import math
+import multiprocessing as mp
+import os
+import resource
+import subprocess
+import sys
+import time
+from functools import partial
+
+import numpy as np
+
+from fastchat.serve.monitor.rating_systems import (
+    fit_bootstrap_style_control,
+    fit_contextual_bt,
+)
+
+
+def create_battles(num_battles, num_models, num_features=4, seed=0):
+    rng = np.random.default_rng(seed)
+    strengths = rng.normal(size=num_models)
+    model_a = rng.integers(num_models, size=num_battles)
+    model_b = (model_a + rng.integers(1, num_models, size=num_battles)) % num_models
+    features = rng.normal(size=(num_battles, num_features))
+    logits = math.log(10.0) * (strengths[model_a] - strengths[model_b])
+    p = 1 / (1 + np.exp(-(logits + features @ rng.normal(size=num_features) * 0.3)))
+    r = rng.random(num_battles)
+    outcomes = np.where(r < 0.1, 0.5, np.where(r < 0.1 + 0.9 * p, 1.0, 0.0))
+    matchups = np.column_stack([model_a, model_b]).astype(np.int32)
+    return matchups, features, outcomes
+
+
+def resample_bootstrap(matchups, features, outcomes, num_models, num_round, num_cpu):
+    contextual_bt_fn = partial(
+        fit_contextual_bt,
+        matchups,
+        features,
+        outcomes,
+        list(range(num_models)),
+        alpha=math.log(10.0),
+        reg=0.5,
+        tol=1e-6,
+    )
+    boot_idxs = np.random.randint(
+        low=0, high=matchups.shape[0], size=(num_round, matchups.shape[0])
+    )
+    with mp.Pool(num_cpu) as pool:
+        return np.array(list(pool.imap_unordered(contextual_bt_fn, boot_idxs)))
+
+
+def run(args):
+    matchups, features, outcomes = create_battles(args.num_battles, args.num_models)
+    tic = time.perf_counter()
+    if args.impl == "resample":
+        resample_bootstrap(
+            matchups, features, outcomes, args.num_models, args.num_round, args.num_cpu
+        )
+    else:
+        fit_bootstrap_style_control(
+            matchups,
+            features,
+            outcomes,
+            args.num_models,
+            args.num_round,
+            num_cpu=args.num_cpu,
+        )
+    wall_time = time.perf_counter() - tic
+    # ru_maxrss is in KiB on linux
+    main_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(
+        f"{args.impl:>8} | {wall_time:7.2f} s | peak RSS main {main_rss:7.0f} MiB, "
+        f"largest worker {worker_rss:7.0f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-battles", type=int, default=1000000)
+    parser.add_argument("--num-models", type=int, default=100)
+    parser.add_argument("--num-round", type=int, default=20)
+    parser.add_argument("--num-cpu", type=int, default=os.cpu_count())
+    parser.add_argument("--impl", choices=["resample", "weights"])
+    args = parser.parse_args()
+
+    if args.impl:
+        run(args)
+        sys.exit()
+
+    print(
+        f"{args.num_battles} battles, {args.num_models} models, "
+        f"{args.num_round} rounds, {args.num_cpu} processes"
+    )
+    for impl in ["resample", "weights"]:
+        subprocess.run(
+            [sys.executable, "-m", __spec__.name, *sys.argv[1:], "--impl", impl],
+            check=True,
+        )
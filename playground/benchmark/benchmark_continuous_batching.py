@@ -0,0 +1,127 @@
+"""
+Benchmark continuous batching against per-request decoding on CPU.
+
+A randomly initialized Llama model is built from a config and a character level
+tokenizer, so no download or GPU is needed. The "before" run decodes each request with
+`generate_stream` in its own thread, as the model worker does for concurrent requests.
+The "after" run sends the same requests to a `ContinuousBatchingEngine`.
+
+Usage:
+python3 -m playground.benchmark.benchmark_continuous_batching --num-requests 32 --concurrency 8
+"""
+import argparse
+import string
+import threading
+import time
+
+import numpy as np
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from fastchat.serve.continuous_batching import ContinuousBatchingEngine
+from fastchat.serve.inference import generate_stream
+
+CONTEXT_LEN = 1024
+
+
+def create_tokenizer():
+    vocab = ["<s>", "</s>"] + list(string.printable)
+    tokenizer = Tokenizer(
+        models.WordLevel({c: i for i, c in enumerate(vocab)}, unk_token="?")
+    )
+    tokenizer.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer.decoder = decoders.Fuse()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>"
+    )
+
+
+def create_model(tokenizer, hidden_size, num_layers):
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 3,
+        num_hidden_layers=num_layers,
+        num_attention_heads=hidden_size // 64,
+        max_position_embeddings=CONTEXT_LEN,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def run(generate, requests, concurrency):
+    latencies = [0.0] * len(requests)
+    completion_tokens = [0] * len(requests)
+    semaphore = threading.Semaphore(concurrency)
+
+    def one(i):
+        with semaphore:
+            start = time.perf_counter()
+            for output in generate(dict(requests[i])):
+                pass
+            latencies[i] = time.perf_counter() - start
+            completion_tokens[i] = output["usage"]["completion_tokens"] + 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return sum(completion_tokens) / elapsed, np.array(latencies)
+
+
+def main(args):
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    tokenizer = create_tokenizer()
+    model = create_model(tokenizer, args.hidden_size, args.num_layers)
+
+    requests = []
+    for _ in range(args.num_requests):
+        prompt_len = int(rng.integers(16, args.max_prompt_len))
+        requests.append(
+            {
+                "prompt": "".join(rng.choice(list(string.ascii_letters), prompt_len)),
+                "temperature": 0.7,
+                # random weights rarely emit eos, most requests run to this length
+                "max_new_tokens": int(rng.integers(16, args.max_new_tokens)),
+                "echo": False,
+            }
+        )
+
+    def sequential(params):
+        return generate_stream(model, tokenizer, params, "cpu", CONTEXT_LEN)
+
+    engine = ContinuousBatchingEngine(
+        model, tokenizer, "cpu", CONTEXT_LEN, max_batch_size=args.concurrency
+    )
+
+    print(
+        f"{args.num_requests} requests, concurrency {args.concurrency}, "
+        f"{args.num_layers} layers x {args.hidden_size} hidden"
+    )
+    for name, generate in [("before", sequential), ("after", engine.generate_stream)]:
+        tokens_per_second, latencies = run(generate, requests, args.concurrency)
+        print(
+            f"{name:>6} | {tokens_per_second:8.1f} tokens/s | "
+            f"latency p50 {np.percentile(latencies, 50):6.2f}s "
+            f"p99 {np.percentile(latencies, 99):6.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-prompt-len", type=int, default=256)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--num-layers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,183 @@
+"""
+Benchmark the streams proxied by the controller under many concurrent requests.
+
+A fake worker streams `--num-outputs` outputs, the first after `--prefill-time` and
+then one every `--interval` seconds, and a controller is started next to it. `--concurrency` streams are then opened at once,
+directly to the worker and through the controller, and the wall time, the time to the
+first output and the threads and memory of the controller are reported.
+
+Usage:
+python3 -m playground.benchmark.benchmark_controller_stream --concurrency 2000
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+from fastchat.serve.stream_framing import FRAMED_MEDIA_TYPE, FrameDecoder
+
+
+def run_worker(args):
+    from fastapi import FastAPI, Request
+    import uvicorn
+
+    from fastchat.serve.stream_framing import create_stream_response
+
+    app = FastAPI()
+
+    async def generate_stream():
+        await asyncio.sleep(args.prefill_time)
+        for i in range(1, args.num_outputs + 1):
+            await asyncio.sleep(args.interval)
+            output = {"text": " token" * i, "error_code": 0}
+            yield json.dumps(output).encode() + b"\0"
+
+    @app.post("/worker_generate_stream")
+    async def api_generate_stream(request: Request):
+        await request.json()
+        return create_stream_response(generate_stream(), request.headers)
+
+    @app.post("/worker_get_status")
+    async def api_get_status():
+        return {"model_names": ["fake"], "speed": 1, "queue_length": 0}
+
+    uvicorn.run(app, port=args.worker_port, log_level="warning", backlog=8192)
+
+
+def get_process_stats(pid):
+    stats = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            if key in ["Threads", "VmRSS"]:
+                stats[key] = value.strip()
+    return stats
+
+
+async def stream(client, url, framed):
+    headers = {"Accept": FRAMED_MEDIA_TYPE} if framed else {}
+    start = time.perf_counter()
+    first_output = None
+    async with client.stream(
+        "POST", url, json={"model": "fake"}, headers=headers
+    ) as response:
+        decoder = FrameDecoder()
+        async for data in response.aiter_raw():
+            if first_output is None:
+                first_output = time.perf_counter() - start
+            if framed:
+                decoder.feed(data)
+    return first_output
+
+
+async def run_streams(args, url, framed, controller_pid=None):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+        peak = {}
+
+        async def poll_stats():
+            while controller_pid is not None:
+                stats = get_process_stats(controller_pid)
+                for key, value in stats.items():
+                    peak[key] = max(
+                        peak.get(key, value), value, key=lambda x: int(x.split()[0])
+                    )
+                await asyncio.sleep(0.2)
+
+        poller = asyncio.create_task(poll_stats())
+        start = time.perf_counter()
+        first_outputs = await asyncio.gather(
+            *(stream(client, url, framed) for _ in range(args.concurrency))
+        )
+        wall_time = time.perf_counter() - start
+        poller.cancel()
+    return wall_time, first_outputs, peak
+
+
+async def wait_for(url):
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.post(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def main(args):
+    worker_addr = f"http://localhost:{args.worker_port}"
+    controller_addr = f"http://localhost:{args.controller_port}"
+    await wait_for(worker_addr + "/worker_get_status")
+    await wait_for(controller_addr + "/list_models")
+    async with httpx.AsyncClient() as client:
+        await client.post(
+            controller_addr + "/register_worker",
+            json={
+                "worker_name": worker_addr,
+                "check_heart_beat": False,
+                "worker_status": None,
+            },
+        )
+
+    print(
+        f"{args.concurrency} streams of {args.num_outputs} outputs, "
+        f"prefill {args.prefill_time}s, one every {args.interval}s"
+    )
+    for name, url, controller_pid in [
+        ("direct", worker_addr, None),
+        ("controller", controller_addr, args.controller_pid),
+    ]:
+        for framed in [False, True]:
+            wall_time, first_outputs, peak = await run_streams(
+                args, url + "/worker_generate_stream", framed, controller_pid
+            )
+            label = f"{name}{', framed' if framed else ''}"
+            print(
+                f"{label:>20} | {wall_time:6.2f} s | first output "
+                f"p50 {np.median(first_outputs) * 1000:7.1f} ms "
+                f"p99 {np.percentile(first_outputs, 99) * 1000:7.1f} ms"
+                + (
+                    f" | controller {peak['Threads']} threads, {peak['VmRSS']}"
+                    if peak
+                    else ""
+                )
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--num-outputs", type=int, default=64)
+    parser.add_argument("--prefill-time", type=float, default=0.5)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--worker-port", type=int, default=21102)
+    parser.add_argument("--controller-port", type=int, default=21101)
+    parser.add_argument("--role", choices=["main", "worker"], default="main")
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        run_worker(args)
+        sys.exit()
+
+    worker = subprocess.Popen([sys.executable, *sys.argv, "--role", "worker"])
+    controller = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "fastchat.serve.controller",
+            "--port",
+            str(args.controller_port),
+        ]
+    )
+    args.controller_pid = controller.pid
+    try:
+        asyncio.run(main(args))
+    finally:
+        worker.terminate()
+        controller.kill()
@@ -0,0 +1,131 @@
+"""
+Benchmark the detokenization of streamed outputs in `generate_stream`.
+
+The "before" run decodes all output ids again on every chunk, and every token again
+for logprobs, as `generate_stream` used to. The "after" run uses the
+`IncrementalDetokenizer` and decodes each token for logprobs once. Llama style
+(SentencePiece with byte fallback) and GPT2 style (byte-level BPE) tokenizers are
+trained on the docs of this repository, so no download is needed.
+
+Usage:
+python3 -m playground.benchmark.benchmark_detokenization --num-tokens 4096 --stream-interval 2
+"""
+import argparse
+import glob
+import time
+
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers
+from tokenizers.trainers import BpeTrainer
+from transformers import PreTrainedTokenizerFast
+
+from fastchat.serve.inference import IncrementalDetokenizer
+
+
+def train_llama_style_tokenizer(corpus, vocab_size):
+    tokenizer = Tokenizer(models.BPE(byte_fallback=True, unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Sequence(
+        [normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")]
+    )
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace(prepend_scheme="never")
+    special_tokens = ["<unk>", "<s>", "</s>"] + [f"<0x{i:02X}>" for i in range(256)]
+    tokenizer.train_from_iterator(
+        corpus, BpeTrainer(vocab_size=vocab_size, special_tokens=special_tokens)
+    )
+    tokenizer.pre_tokenizer = None
+    tokenizer.decoder = decoders.Sequence(
+        [
+            decoders.Replace("▁", " "),
+            decoders.ByteFallback(),
+            decoders.Fuse(),
+            decoders.Strip(" ", 1, 0),
+        ]
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+
+
+def train_gpt2_style_tokenizer(corpus, vocab_size):
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        corpus,
+        BpeTrainer(
+            vocab_size=vocab_size,
+            special_tokens=["<|endoftext|>"],
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        ),
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token="<|endoftext|>"
+    )
+
+
+def stream_before(tokenizer, token_ids, stream_interval, logprobs):
+    for i in range(len(token_ids)):
+        if i % stream_interval == 0 or i == len(token_ids) - 1:
+            output = tokenizer.decode(
+                token_ids[: i + 1], **IncrementalDetokenizer.decode_kwargs
+            )
+            if logprobs:
+                tokens = [tokenizer.decode(token) for token in token_ids[: i + 1]]
+    return output
+
+
+def stream_after(tokenizer, token_ids, stream_interval, logprobs):
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    token_texts = []
+    for i in range(len(token_ids)):
+        if i % stream_interval == 0 or i == len(token_ids) - 1:
+            output = detokenizer.decode(
+                token_ids[: i + 1], final=i == len(token_ids) - 1
+            )
+            if logprobs:
+                for token in token_ids[len(token_texts) : i + 1]:
+                    token_texts.append(tokenizer.decode(token))
+                tokens = list(token_texts)
+    return output
+
+
+def main(args):
+    corpus = []
+    for path in sorted(glob.glob("docs/*.md")) + ["README.md"]:
+        with open(path, encoding="utf-8") as f:
+            corpus.extend(line for line in f.read().splitlines() if line.strip())
+    text = "\n".join(corpus)
+
+    print(f"{args.num_tokens} tokens, stream interval {args.stream_interval}")
+    for name, train in [
+        ("llama", train_llama_style_tokenizer),
+        ("gpt2", train_gpt2_style_tokenizer),
+    ]:
+        tokenizer = train(corpus, args.vocab_size)
+        token_ids = tokenizer(text).input_ids
+        while len(token_ids) < args.num_tokens:
+            token_ids = token_ids + token_ids
+        token_ids = token_ids[: args.num_tokens]
+        expected = tokenizer.decode(token_ids, **IncrementalDetokenizer.decode_kwargs)
+
+        for logprobs in [False, True]:
+            results = []
+            for stream in [stream_before, stream_after]:
+                start = time.perf_counter()
+                output = stream(tokenizer, token_ids, args.stream_interval, logprobs)
+                results.append(time.perf_counter() - start)
+                assert output == expected
+            print(
+                f"{name:>5} | logprobs {str(logprobs):>5} | "
+                f"before {results[0]:7.3f}s | after {results[1]:7.3f}s | "
+                f"speedup {results[0] / results[1]:6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-tokens", type=int, default=4096)
+    parser.add_argument("--stream-interval", type=int, default=2)
+    parser.add_argument("--vocab-size", type=int, default=8000)
+    args = parser.parse_args()
+
+    main(args)
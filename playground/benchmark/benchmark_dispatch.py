@@ -0,0 +1,198 @@
+"""
+Simulate the dispatch methods of the controller on synthetic workers and compare tail latency.
+
+A discrete event simulation: requests arrive as a Poisson process and are dispatched by a
+`WorkerRegistry` on a simulated clock. Each worker runs up to `--concurrency` requests at
+once and queues the rest. Heterogeneous workers (fast, slow, and a flaky one whose requests
+sometimes hang until the timeout) report their queue length and latency stats in heart beats,
+so the registry sees the same stale view as the real controller between heart beats.
+
+Usage:
+python3 -m playground.benchmark.benchmark_dispatch --num-requests 20000 --load 0.7
+"""
+import argparse
+from collections import deque
+import heapq
+import itertools
+import logging
+
+import numpy as np
+
+from fastchat.serve.worker_registry import DispatchMethod, WorkerInfo, WorkerRegistry
+
+MODEL = "sim-model"
+# (ttft, tokens per second of a single request, probability of hanging until timeout)
+WORKER_PROFILES = {
+    "fast": (0.2, 40.0, 0.0),
+    "slow": (0.6, 15.0, 0.0),
+    "flaky": (0.2, 40.0, 0.3),
+}
+
+
+class SimWorker:
+    def __init__(
+        self, name, ttft, tokens_per_second, hang_prob, concurrency, alpha=0.2
+    ):
+        self.name = name
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.hang_prob = hang_prob
+        self.concurrency = concurrency
+        self.alpha = alpha
+        self.running = 0
+        self.waiting = deque()
+        self.ewma_ttft = 0.0
+        self.ewma_tokens_per_second = 0.0
+
+    def queue_length(self):
+        return self.running + len(self.waiting)
+
+    def latency_stats(self):
+        return {
+            "ttft": self.ewma_ttft,
+            "tokens_per_second": self.ewma_tokens_per_second,
+        }
+
+    def record(self, ttft, tokens_per_second):
+        if self.ewma_ttft == 0:
+            self.ewma_ttft, self.ewma_tokens_per_second = ttft, tokens_per_second
+            return
+        a = self.alpha
+        self.ewma_ttft = (1 - a) * self.ewma_ttft + a * ttft
+        self.ewma_tokens_per_second = (
+            1 - a
+        ) * self.ewma_tokens_per_second + a * tokens_per_second
+
+
+def simulate(dispatch_method, args, seed):
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    now = [0.0]
+    registry = WorkerRegistry(
+        dispatch_method,
+        ejection_failures=args.ejection_failures,
+        ejection_time=args.ejection_time,
+        clock=lambda: now[0],
+    )
+
+    workers = {}
+    for kind, count in [
+        ("fast", args.fast),
+        ("slow", args.slow),
+        ("flaky", args.flaky),
+    ]:
+        for i in range(count):
+            name = f"http://{kind}-{i}"
+            workers[name] = SimWorker(
+                name, *WORKER_PROFILES[kind], concurrency=args.concurrency
+            )
+            registry.upsert(name, WorkerInfo([MODEL], 1, 0, True, 0.0, False))
+
+    # arrival rate for the requested load of the healthy workers running full batches
+    full_batch_slowdown = 1 + args.batch_slowdown * (args.concurrency - 1)
+    capacity = sum(
+        args.concurrency
+        / (full_batch_slowdown * (w.ttft + args.mean_tokens / w.tokens_per_second))
+        for w in workers.values()
+        if w.hang_prob == 0
+    )
+    arrival_rate = args.load * capacity
+
+    events = []
+    seq = itertools.count()
+
+    def push(time, kind, *data):
+        heapq.heappush(events, (time, next(seq), kind, data))
+
+    def start(worker, arrival, num_tokens):
+        worker.running += 1
+        if rng.random() < worker.hang_prob:
+            push(arrival + args.timeout, "timeout", worker, arrival)
+            return
+        # decoding slows down as the batch grows
+        slowdown = 1 + args.batch_slowdown * (worker.running - 1)
+        ttft = worker.ttft * slowdown
+        tokens_per_second = worker.tokens_per_second / slowdown
+        end = now[0] + ttft + num_tokens / tokens_per_second
+        push(end, "finish", worker, arrival, ttft, tokens_per_second)
+
+    def release(worker):
+        worker.running -= 1
+        if worker.waiting:
+            start(worker, *worker.waiting.popleft())
+
+    arrival = 0.0
+    for _ in range(args.num_requests):
+        arrival += rng.exponential(1 / arrival_rate)
+        num_tokens = max(1, int(rng.exponential(args.mean_tokens)))
+        push(arrival, "arrive", num_tokens)
+    for t in np.arange(0, arrival, args.heart_beat_interval):
+        push(t, "heart_beat")
+
+    latencies = []
+    timeouts = 0
+    while events:
+        now[0], _, kind, data = heapq.heappop(events)
+        if kind == "arrive":
+            worker = workers[registry.get_worker_address(MODEL)]
+            if worker.running < worker.concurrency:
+                start(worker, now[0], data[0])
+            else:
+                worker.waiting.append((now[0], data[0]))
+        elif kind == "finish":
+            worker, arrival, ttft, tokens_per_second = data
+            latencies.append(now[0] - arrival)
+            worker.record(ttft, tokens_per_second)
+            release(worker)
+        elif kind == "timeout":
+            worker, arrival = data
+            latencies.append(now[0] - arrival)
+            timeouts += 1
+            registry.report_failure(worker.name)
+            release(worker)
+        elif kind == "heart_beat":
+            for worker in workers.values():
+                registry.receive_heart_beat(
+                    worker.name, worker.queue_length(), worker.latency_stats()
+                )
+
+    return np.array(latencies), timeouts
+
+
+def main(args):
+    # the registry logs every dispatch and ejection
+    logging.getLogger("worker_registry").setLevel(logging.WARNING)
+    print(
+        f"{args.fast} fast, {args.slow} slow, {args.flaky} flaky workers | "
+        f"{args.num_requests} requests at {args.load:.0%} load"
+    )
+    print(
+        f"{'method':>15} | {'mean':>7} | {'p50':>7} | {'p90':>7} | {'p99':>7} | timeouts"
+    )
+    for name in ["lottery", "shortest_queue", "power_of_two"]:
+        latencies, timeouts = simulate(DispatchMethod.from_str(name), args, args.seed)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(
+            f"{name:>15} | {latencies.mean():6.2f}s | {p50:6.2f}s | {p90:6.2f}s |"
+            f" {p99:6.2f}s | {timeouts}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-requests", type=int, default=20000)
+    parser.add_argument("--load", type=float, default=0.7)
+    parser.add_argument("--fast", type=int, default=5)
+    parser.add_argument("--slow", type=int, default=2)
+    parser.add_argument("--flaky", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mean-tokens", type=int, default=200)
+    parser.add_argument("--batch-slowdown", type=float, default=0.15)
+    parser.add_argument("--heart-beat-interval", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=100.0)
+    parser.add_argument("--ejection-failures", type=int, default=3)
+    parser.add_argument("--ejection-time", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
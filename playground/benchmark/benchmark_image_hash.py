@@ -0,0 +1,78 @@
+"""
+Benchmark building a log record of a vision conversation.
+
+Compares decoding every image of the history to hash it (the previous behavior)
+with the hash cached on `Image`, for a 10-image conversation at several image sizes.
+
+Usage:
+python3 -m playground.benchmark.benchmark_image_hash --image-sizes 256 512 1024 2048
+"""
+import argparse
+import base64
+import hashlib
+from io import BytesIO
+import time
+
+import numpy as np
+from PIL import Image as PILImage
+
+from fastchat.conversation import get_conv_template
+from fastchat.serve.vision.image import Image, ImageFormat
+from fastchat.utils import load_image
+
+
+def create_conv(image_size, num_images):
+    rng = np.random.default_rng(0)
+    conv = get_conv_template("chatgpt")
+    for i in range(num_images):
+        pixels = rng.integers(0, 256, (image_size, image_size, 4), dtype=np.uint8)
+        image_bytes = BytesIO()
+        PILImage.fromarray(pixels, "RGBA").save(image_bytes, format="PNG")
+        image = Image(
+            filetype="png",
+            image_format=ImageFormat.BYTES,
+            base64_str=base64.b64encode(image_bytes.getvalue()).decode(),
+        )
+        conv.append_message(conv.roles[0], (f"question {i}", [image]))
+        conv.append_message(conv.roles[1], f"answer {i}")
+    return conv
+
+
+def decode_and_hash(conv):
+    for _, message in conv.messages:
+        if type(message) is tuple:
+            for image in message[1]:
+                hashlib.md5(load_image(image.base64_str).tobytes()).hexdigest()
+    return conv.to_dict()
+
+
+def time_per_call(fn, num_calls):
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        fn()
+    return (time.perf_counter() - start) / num_calls * 1e3
+
+
+def main(image_sizes, num_images, num_calls):
+    for image_size in image_sizes:
+        conv = create_conv(image_size, num_images)
+        # hash once, as at upload time
+        conv.to_dict()
+        decode_ms = time_per_call(lambda: decode_and_hash(conv), num_calls)
+        cached_ms = time_per_call(conv.to_dict, num_calls)
+        print(
+            f"{image_size:>5}px x {num_images} images | decode + hash {decode_ms:9.3f} ms"
+            f" | cached hash {cached_ms:9.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--image-sizes", type=int, nargs="+", default=[256, 512, 1024, 2048]
+    )
+    parser.add_argument("--num-images", type=int, default=10)
+    parser.add_argument("--num-calls", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.image_sizes, args.num_images, args.num_calls)
@@ -0,0 +1,126 @@
+"""
+Benchmark a leaderboard refresh with the incremental state against a full recompute.
+
+`--num-battles` cleaned battles are already in the leaderboard and `--num-new` new ones
+arrive. The full recompute refits BT and the bootstrap on all the battles, like
+report_elo_analysis_results. The incremental refresh adds the new battles to the counts
+and refits from the last ratings. Reading the logs is timed separately on a synthetic
+log file, all of it against the lines appended since the last offset.
+
+Usage:
+python3 -m playground.benchmark.benchmark_incremental_leaderboard --num-battles 1000000
+"""
+import argparse
+import copy
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from fastchat.serve.monitor.elo_analysis import report_elo_analysis_results
+from fastchat.serve.monitor.incremental_leaderboard import (
+    IncrementalLeaderboard,
+    read_new_votes,
+)
+
+
+def create_battles(num_battles, num_models, start=0, seed=0):
+    rng = np.random.default_rng(seed)
+    strengths = rng.normal(size=num_models)
+    model_a = rng.integers(num_models, size=num_battles)
+    model_b = (model_a + rng.integers(1, num_models, size=num_battles)) % num_models
+    p = 1 / (1 + np.exp(strengths[model_b] - strengths[model_a]))
+    r = rng.random(num_battles)
+    winner = np.where(r < 0.2, "tie", np.where(r < 0.2 + 0.8 * p, "model_a", "model_b"))
+    models = np.array([f"model-{i}" for i in range(num_models)])
+    return pd.DataFrame(
+        {
+            "model_a": models[model_a],
+            "model_b": models[model_b],
+            "winner": winner,
+            "anony": True,
+            "language": "English",
+            "tstamp": start + np.arange(num_battles, dtype=np.float64),
+        }
+    )
+
+
+def write_log_lines(fout, battles):
+    for row in battles.itertuples():
+        chat = {"type": "chat", "tstamp": row.tstamp, "model": row.model_a}
+        fout.write(json.dumps(chat) + "\n")
+        vote = {
+            "type": "leftvote",
+            "tstamp": row.tstamp,
+            "models": ["", ""],
+            "states": [{"model_name": row.model_a}, {"model_name": row.model_b}],
+        }
+        fout.write(json.dumps(vote) + "\n")
+
+
+def timeit(func):
+    tic = time.perf_counter()
+    result = func()
+    return time.perf_counter() - tic, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-battles", type=int, default=1000000)
+    parser.add_argument("--num-new", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--num-models", type=int, default=100)
+    parser.add_argument("--num-bootstrap", type=int, default=100)
+    args = parser.parse_args()
+
+    battles = create_battles(args.num_battles, args.num_models)
+    leaderboard = IncrementalLeaderboard()
+    leaderboard.add_battles(battles)
+    leaderboard.report(num_bootstrap=args.num_bootstrap)
+
+    print(
+        f"{args.num_battles} battles, {args.num_models} models, "
+        f"{args.num_bootstrap} bootstrap rounds"
+    )
+    for num_new in args.num_new:
+        new_battles = create_battles(
+            num_new, args.num_models, start=args.num_battles, seed=num_new
+        )
+        all_battles = pd.concat([battles, new_battles], ignore_index=True)
+        full_time, _ = timeit(
+            lambda: report_elo_analysis_results(
+                all_battles,
+                num_bootstrap=args.num_bootstrap,
+            )
+        )
+        # refresh a copy so that every size starts from the same state
+        state = copy.deepcopy(leaderboard)
+        incremental_time, _ = timeit(
+            lambda: (
+                state.add_battles(new_battles),
+                state.report(num_bootstrap=args.num_bootstrap),
+            )
+        )
+        print(
+            f"{num_new:>8} new | full {full_time:7.2f} s | "
+            f"incremental {incremental_time:7.2f} s | "
+            f"speedup {full_time / incremental_time:5.1f}x"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "2024-01-01-conv.json")
+        with open(filename, "w") as fout:
+            write_log_lines(fout, battles)
+        offset = os.path.getsize(filename)
+        new_battles = create_battles(max(args.num_new), args.num_models)
+        with open(filename, "a") as fout:
+            write_log_lines(fout, new_battles)
+
+        full_time, (votes, _) = timeit(lambda: read_new_votes(filename))
+        new_time, (new_votes, _) = timeit(lambda: read_new_votes(filename, offset))
+        print(
+            f"read logs | all {len(votes)} votes {full_time:6.2f} s | "
+            f"{len(new_votes)} new votes {new_time:6.2f} s"
+        )
@@ -0,0 +1,139 @@
+"""
+Benchmark request admission of the OpenAI API server against a stub controller and worker.
+
+Admission is `check_model`, which also gets the worker address, and `check_length`.
+The "before" run opens a new aiohttp session per lookup and does not cache, as the
+server used to.
+The stubs answer after `--latency-ms` to emulate a network hop.
+
+Usage:
+python3 -m playground.benchmark.benchmark_openai_api_admission --num-requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+from fastchat.serve import openai_api_server
+from fastchat.serve.openai_api_server import (
+    app_settings,
+    check_length,
+    check_model,
+)
+
+MODEL = "stub-model"
+
+
+def create_stub_app(latency, port, calls):
+    async def respond(name, payload):
+        calls[name] = calls.get(name, 0) + 1
+        await asyncio.sleep(latency)
+        return web.json_response(payload)
+
+    async def list_models(request):
+        return await respond("list_models", {"models": [MODEL]})
+
+    async def get_worker_address(request):
+        return await respond(
+            "get_worker_address", {"address": f"http://127.0.0.1:{port}"}
+        )
+
+    async def model_details(request):
+        return await respond("model_details", {"context_length": 4096})
+
+    async def count_token(request):
+        return await respond("count_token", {"count": 128, "error_code": 0})
+
+    app = web.Application()
+    app.router.add_post("/list_models", list_models)
+    app.router.add_post("/get_worker_address", get_worker_address)
+    app.router.add_post("/model_details", model_details)
+    app.router.add_post("/count_token", count_token)
+    return app
+
+
+async def fetch_remote_per_call_session(url, pload=None, name=None):
+    # the previous implementation of `fetch_remote`
+    async with aiohttp.ClientSession(
+        timeout=openai_api_server.fetch_timeout
+    ) as session:
+        async with session.post(url, json=pload) as response:
+            output = await response.read()
+    res = json.loads(output)
+    return res[name] if name else res
+
+
+async def admit_uncached(request):
+    controller_address = app_settings.controller_address
+    models = await fetch_remote_per_call_session(
+        controller_address + "/list_models", None, "models"
+    )
+    assert request.model in models
+    worker_addr = await fetch_remote_per_call_session(
+        controller_address + "/get_worker_address", {"model": request.model}, "address"
+    )
+    context_len = await fetch_remote_per_call_session(
+        worker_addr + "/model_details", {"model": request.model}, "context_length"
+    )
+    token_num = await fetch_remote_per_call_session(
+        worker_addr + "/count_token", {"model": request.model, "prompt": "hi"}, "count"
+    )
+    assert context_len - token_num > 0
+
+
+async def admit(request):
+    worker_addr, error = await check_model(request)
+    assert error is None
+    _, error = await check_length(request, "hi", 256, worker_addr)
+    assert error is None
+
+
+async def run(admit_fn, num_requests, concurrency):
+    class Request:
+        model = MODEL
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await admit_fn(Request())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(num_requests)))
+    return num_requests / (time.perf_counter() - start)
+
+
+async def main(num_requests, concurrency, latency_ms, port):
+    calls = {}
+    runner = web.AppRunner(
+        create_stub_app(latency_ms / 1000, port, calls), access_log=None
+    )
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    app_settings.controller_address = f"http://127.0.0.1:{port}"
+
+    for name, admit_fn in [("before", admit_uncached), ("after", admit)]:
+        calls.clear()
+        requests_per_second = await run(admit_fn, num_requests, concurrency)
+        hops = sum(calls.values()) / num_requests
+        print(
+            f"{name:>6} | {requests_per_second:9.1f} req/s | {hops:.2f} lookups/request"
+            f" | {dict(sorted(calls.items()))}"
+        )
+
+    await openai_api_server.get_fetch_session().close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=21099)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.num_requests, args.concurrency, args.latency_ms, args.port))
@@ -0,0 +1,63 @@
+"""
+Benchmark stripping DeepSeek reasoning sections from a streamed response.
+
+Compares running the regex over the accumulated text on every chunk with
+the incremental ReasoningTagFilter.
+
+Usage:
+python3 -m playground.benchmark.benchmark_reasoning_filter --num-chunks 1000 8000 64000
+"""
+import argparse
+import re
+import time
+
+from fastchat.serve.api_provider import ReasoningTagFilter
+
+
+def create_chunks(num_chunks):
+    # the first half of the response is reasoning, as typical for DeepSeek-R1
+    chunks = ["<th", "ink>"]
+    chunks += ["thought "] * (num_chunks // 2)
+    chunks += ["</thi", "nk>\n\n"]
+    chunks += ["answer "] * (num_chunks // 2)
+    return chunks
+
+
+def strip_with_regex(chunks):
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    return text
+
+
+def strip_with_filter(chunks):
+    reasoning_filter = ReasoningTagFilter()
+    output = [reasoning_filter.feed(chunk) for chunk in chunks]
+    output.append(reasoning_filter.finish())
+    return "".join(output)
+
+
+def main(num_chunks_list):
+    for num_chunks in num_chunks_list:
+        chunks = create_chunks(num_chunks)
+        results = {}
+        for name, strip in [("regex", strip_with_regex), ("filter", strip_with_filter)]:
+            start = time.perf_counter()
+            results[name] = strip(chunks)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>6} | {num_chunks:>7} chunks | total {elapsed * 1e3:10.2f} ms"
+                f" | per chunk {elapsed / len(chunks) * 1e6:8.2f} us"
+            )
+        assert results["regex"] == results["filter"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num-chunks", type=int, nargs="+", default=[1000, 8000, 64000]
+    )
+    args = parser.parse_args()
+
+    main(args.num_chunks)
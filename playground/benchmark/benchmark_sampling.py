@@ -0,0 +1,95 @@
+"""
+Benchmark the per-step latency of the decoding loop of `generate_stream` on CPU.
+
+A small randomly initialized Llama model is used, so that the time spent in sampling,
+stop checking and logprobs is visible next to the forward pass. Each sampling setup
+decodes `--max-new-tokens` tokens after a prompt of `--prompt-len` tokens.
+
+Usage:
+python3 -m playground.benchmark.benchmark_sampling --prompt-len 2048 --max-new-tokens 256
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from fastchat.serve.inference import generate_stream
+
+
+class Tokenizer:
+    """Token ids written as numbers, so that any id can be generated and decoded."""
+
+    eos_token_id = 0
+
+    def __call__(self, prompt):
+        return argparse.Namespace(input_ids=[int(token) for token in prompt.split()])
+
+    def decode(self, token_ids, **kwargs):
+        if isinstance(token_ids, int):
+            token_ids = [token_ids]
+        return "".join(f" {token}" for token in token_ids)
+
+
+SETUPS = {
+    "greedy": {"temperature": 0},
+    "sampling": {"temperature": 0.7, "top_p": 0.9, "top_k": 50},
+    "repetition penalty": {"temperature": 0.7, "repetition_penalty": 1.1},
+    "logprobs": {"temperature": 0.7, "logprobs": 1, "echo": False},
+}
+
+
+def main(args):
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    context_len = args.prompt_len + args.max_new_tokens + 1
+    config = LlamaConfig(
+        vocab_size=args.vocab_size,
+        hidden_size=args.hidden_size,
+        intermediate_size=args.hidden_size * 3,
+        num_hidden_layers=args.num_layers,
+        num_attention_heads=args.hidden_size // 64,
+        max_position_embeddings=context_len,
+    )
+    model = LlamaForCausalLM(config).eval()
+    tokenizer = Tokenizer()
+    prompt = " ".join(map(str, rng.integers(1, args.vocab_size, args.prompt_len)))
+
+    print(
+        f"prompt {args.prompt_len} tokens, {args.max_new_tokens} new tokens, "
+        f"{args.num_layers} layers x {args.hidden_size} hidden"
+    )
+    for name, setup in SETUPS.items():
+        params = {
+            "prompt": prompt,
+            "max_new_tokens": args.max_new_tokens,
+            **setup,
+        }
+        step_times = []
+        for _ in range(args.num_trials):
+            outputs = generate_stream(
+                model, tokenizer, dict(params), "cpu", context_len, args.stream_interval
+            )
+            next(outputs)  # skip the prefill
+            start = time.perf_counter()
+            for output in outputs:
+                pass
+            num_steps = output["usage"]["completion_tokens"]
+            step_times.append((time.perf_counter() - start) / num_steps)
+        print(f"{name:>18} | {np.median(step_times) * 1000:7.3f} ms/step")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompt-len", type=int, default=2048)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--stream-interval", type=int, default=2)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--hidden-size", type=int, default=128)
+    parser.add_argument("--num-layers", type=int, default=2)
+    parser.add_argument("--num-trials", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
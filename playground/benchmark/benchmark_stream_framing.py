@@ -0,0 +1,163 @@
+"""
+Benchmark the client-side parse time and the size of a long /worker_generate_stream
+response, in the default format and with frames, and the worker-side encode time.
+
+The stream of one request generating `--num-tokens` tokens is built once, cut into
+network chunks of `--chunk-size` bytes, and parsed the way the clients do:
+- json5: the gradio web server before frames (iter_lines + json5.loads)
+- json: the OpenAI API server before frames (a growing bytes buffer + json.loads)
+- json, bytearray: the fallback of the clients for servers without frames
+- frames: FrameDecoder, rebuilding the full outputs like the gradio web server
+- frames, deltas: FrameDecoder(cumulative=False), like the OpenAI API server
+The worker encodes the frames from its outputs as dicts, or from the chunks of the
+default stream like the controller does for older workers.
+
+Usage:
+python3 -m playground.benchmark.benchmark_stream_framing --num-tokens 4096 --logprobs
+"""
+import argparse
+import json
+import time
+from functools import partial
+
+import numpy as np
+
+from fastchat.serve.stream_framing import FrameDecoder, FrameEncoder
+
+
+def create_outputs(num_tokens, stream_interval, logprobs):
+    outputs = []
+    tokens = [f" tok{i % 997}" for i in range(num_tokens)]
+    for i in range(stream_interval, num_tokens + 1, stream_interval):
+        output = {
+            "text": "".join(tokens[:i]),
+            "usage": {
+                "prompt_tokens": 16,
+                "completion_tokens": i,
+                "total_tokens": 16 + i,
+            },
+            "finish_reason": "length" if i == num_tokens else None,
+        }
+        if logprobs:
+            output["logprobs"] = {
+                "text_offset": list(range(i)),
+                "tokens": tokens[:i],
+                "token_logprobs": [-0.25] * i,
+                "top_logprobs": [{token: -0.25} for token in tokens[:i]],
+            }
+        outputs.append(output)
+    return outputs
+
+
+def split(stream, chunk_size):
+    return [stream[i : i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def parse_json5(chunks):
+    import json5
+
+    # requests' iter_lines
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\0")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                json5.loads(line.decode())
+
+
+def parse_json_bytes(chunks):
+    buffer = b""
+    for raw_chunk in chunks:
+        buffer += raw_chunk
+        while (chunk_end := buffer.find(b"\0")) >= 0:
+            chunk, buffer = buffer[:chunk_end], buffer[chunk_end + 1 :]
+            if chunk:
+                json.loads(chunk.decode())
+
+
+def parse_json_bytearray(chunks):
+    buffer = bytearray()
+    for raw_chunk in chunks:
+        buffer += raw_chunk
+        chunk_start = 0
+        while (chunk_end := buffer.find(b"\0", chunk_start)) >= 0:
+            if chunk_end > chunk_start:
+                json.loads(buffer[chunk_start:chunk_end])
+            chunk_start = chunk_end + 1
+        del buffer[:chunk_start]
+
+
+def parse_frames(chunks, cumulative=True):
+    decoder = FrameDecoder(cumulative=cumulative)
+    for chunk in chunks:
+        decoder.feed(chunk)
+
+
+def encode_outputs(outputs):
+    encoder = FrameEncoder()
+    for output in outputs:
+        encoder.encode(output)
+
+
+def encode_default_chunks(outputs):
+    encoder = FrameEncoder()
+    for output in outputs:
+        encoder.encode_chunk(json.dumps(output).encode() + b"\0")
+
+
+def timeit(func, arg, num_trials):
+    times = []
+    for _ in range(num_trials):
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main(args):
+    outputs = create_outputs(args.num_tokens, args.stream_interval, args.logprobs)
+    default_stream = b"".join(json.dumps(output).encode() + b"\0" for output in outputs)
+    encoder = FrameEncoder()
+    framed_stream = b"".join(encoder.encode(output) for output in outputs)
+
+    setups = [
+        ("json", parse_json_bytes, default_stream),
+        ("json, bytearray", parse_json_bytearray, default_stream),
+        ("frames", parse_frames, framed_stream),
+        ("frames, deltas", partial(parse_frames, cumulative=False), framed_stream),
+    ]
+    if not args.skip_json5:
+        setups.insert(0, ("json5", parse_json5, default_stream))
+
+    print(
+        f"{args.num_tokens} tokens, {len(outputs)} outputs, "
+        f"logprobs {args.logprobs}, chunks of {args.chunk_size} bytes"
+    )
+    for name, parse, stream in setups:
+        chunks = split(stream, args.chunk_size)
+        parse_time = timeit(parse, chunks, args.num_trials)
+        print(
+            f"{name:>16} | {len(stream) / 2**20:8.2f} MiB | "
+            f"{parse_time * 1000:9.1f} ms"
+        )
+
+    for name, encode in [
+        ("encode chunks", encode_default_chunks),
+        ("encode dicts", encode_outputs),
+    ]:
+        encode_time = timeit(encode, outputs, args.num_trials)
+        print(f"{name:>16} | {encode_time * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-tokens", type=int, default=4096)
+    parser.add_argument("--stream-interval", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, default=16384)
+    parser.add_argument("--logprobs", action="store_true")
+    parser.add_argument("--skip-json5", action="store_true")
+    parser.add_argument("--num-trials", type=int, default=3)
+    args = parser.parse_args()
+
+    main(args)
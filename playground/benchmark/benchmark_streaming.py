@@ -0,0 +1,97 @@
+"""
+Benchmark the CPU cost of consuming a provider stream in the web server.
+
+Compares the full-text protocol (every chunk carries the whole response, and the
+gradio chatbot is rebuilt per chunk) with the delta protocol (chunks carry the
+appended text, and the chatbot is rendered once per frame).
+
+Usage:
+python3 -m playground.benchmark.benchmark_streaming --num-tokens 1000 8000 64000
+"""
+import argparse
+import time
+
+from fastchat.conversation import get_conv_template
+from fastchat.serve.api_provider import StreamedText
+
+TOKEN = "tok "
+
+
+def create_conv():
+    conv = get_conv_template("chatgpt")
+    for i in range(4):
+        conv.append_message(conv.roles[0], f"question {i}")
+        conv.append_message(conv.roles[1], f"answer {i} " * 200)
+    conv.append_message(conv.roles[0], "final question")
+    conv.append_message(conv.roles[1], None)
+    return conv
+
+
+def consume_full_text(num_tokens):
+    conv = create_conv()
+    token_times = []
+    text = ""
+    for _ in range(num_tokens):
+        start = time.perf_counter()
+        # provider side: accumulate and send the full text
+        text += TOKEN
+        data = {"text": text, "error_code": 0}
+        # web server side: update the conversation and rebuild the chatbot
+        conv.update_last_message(data["text"].strip() + "▌")
+        conv.to_gradio_chatbot()
+        token_times.append(time.perf_counter() - start)
+    return token_times, []
+
+
+def consume_delta(num_tokens, tokens_per_frame):
+    conv = create_conv()
+    chatbot = conv.to_gradio_chatbot()
+    streamed_text = StreamedText()
+    token_times = []
+    frame_times = []
+    for i in range(num_tokens):
+        start = time.perf_counter()
+        data = {"delta": TOKEN, "error_code": 0}
+        streamed_text.update(data)
+        token_times.append(time.perf_counter() - start)
+        if i % tokens_per_frame == 0:
+            start = time.perf_counter()
+            output = streamed_text.text.strip()
+            conv.update_last_message(output + "▌")
+            chatbot = chatbot[:-1] + [[chatbot[-1][0], output + "▌"]]
+            frame_times.append(time.perf_counter() - start)
+    return token_times, frame_times
+
+
+def summarize(name, num_tokens, token_times, frame_times):
+    # per-token cost of the last 1000 tokens, where the response is longest
+    tail = token_times[-1000:]
+    tail_us = sum(tail) / len(tail) * 1e6
+    total_ms = (sum(token_times) + sum(frame_times)) * 1e3
+    frame_us = sum(frame_times) / len(frame_times) * 1e6 if frame_times else 0.0
+    print(
+        f"{name:>10} | {num_tokens:>7} tokens | per-token (tail) {tail_us:9.2f} us"
+        f" | per-frame {frame_us:9.2f} us | total {total_ms:10.2f} ms"
+    )
+
+
+def main(num_tokens_list, tokens_per_frame):
+    for num_tokens in num_tokens_list:
+        summarize("full-text", num_tokens, *consume_full_text(num_tokens))
+        summarize("delta", num_tokens, *consume_delta(num_tokens, tokens_per_frame))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num-tokens", type=int, nargs="+", default=[1000, 8000, 64000]
+    )
+    parser.add_argument(
+        "--tokens-per-frame",
+        type=int,
+        default=5,
+        help="Tokens received per rendered frame, e.g. 100 tokens/s with 50 ms frames",
+    )
+    args = parser.parse_args()
+
+    main(args.num_tokens, args.tokens_per_frame)
@@ -0,0 +1,124 @@
+import string
+
+import pytest
+
+
+@pytest.fixture
+def tiny_llama():
+    """
+    Build a character level tokenizer and a randomly initialized 2-layer Llama model,
+    so that the inference code can run on CPU without a download:
+    tokenizer, model = tiny_llama(context_len, dtype)
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    def create(context_len, dtype=torch.float32):
+        vocab = ["<s>", "</s>"] + list(string.ascii_letters + string.digits + " .,!?:")
+        tokenizer = Tokenizer(
+            models.WordLevel({c: i for i, c in enumerate(vocab)}, unk_token="?")
+        )
+        tokenizer.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+        tokenizer.decoder = decoders.Fuse()
+        tokenizer = PreTrainedTokenizerFast(
+            tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>"
+        )
+
+        torch.manual_seed(0)
+        config = LlamaConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=64,
+            intermediate_size=128,
+            num_hidden_layers=2,
+            num_attention_heads=4,
+            num_key_value_heads=2,
+            max_position_embeddings=context_len,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+        model = LlamaForCausalLM(config).to(dtype).eval()
+        return tokenizer, model
+
+    return create
+
+
+@pytest.fixture
+def make_battles():
+    """
+    Generate battles between models of random strengths, with the winners drawn
+    from the Elo win probabilities:
+    battles = make_battles(num_battles, num_models, num_judges=..., tstamp=...)
+    num_judges draws zipf distributed judges, of which the first num_bad_judges
+    always vote for the weaker model; tstamp sets the start of the timestamps;
+    conversations adds the conversations and their metadata.
+    """
+    import numpy as np
+    import pandas as pd
+
+    def create(
+        num_battles,
+        num_models=8,
+        tie_prob=0.1,
+        num_judges=None,
+        num_bad_judges=0,
+        tstamp=None,
+        tstamp_interval=1.0,
+        conversations=False,
+        seed=0,
+    ):
+        rng = np.random.default_rng(seed)
+        strengths = rng.normal(size=num_models)
+        model_a = rng.integers(num_models, size=num_battles)
+        model_b = (model_a + rng.integers(1, num_models, size=num_battles)) % num_models
+        p = 1 / (1 + 10 ** (strengths[model_b] - strengths[model_a]))
+        r = rng.random(num_battles)
+        winner = np.where(
+            r < tie_prob,
+            np.where(r < tie_prob / 3, "tie", "tie (bothbad)"),
+            np.where(r < tie_prob + (1 - tie_prob) * p, "model_a", "model_b"),
+        )
+        models = np.array([f"model-{i:02d}" for i in range(num_models)], dtype=object)
+        battles = pd.DataFrame(
+            {
+                "model_a": models[model_a],
+                "model_b": models[model_b],
+                "winner": winner.astype(object),
+                "anony": rng.random(num_battles) < 0.9,
+                "language": rng.choice(["English", "Chinese"], size=num_battles),
+            }
+        )
+
+        if num_judges is not None:
+            judge = rng.zipf(1.5, size=num_battles) % num_judges
+            weaker = np.where(
+                strengths[model_a] < strengths[model_b], "model_a", "model_b"
+            )
+            battles["winner"] = np.where(
+                judge < num_bad_judges, weaker, battles["winner"]
+            )
+            battles["judge"] = [f"user-{j}" for j in judge]
+        if tstamp is not None:
+            battles["tstamp"] = tstamp + np.arange(num_battles) * tstamp_interval
+        if conversations:
+            num_tokens = rng.integers(1, 100, size=num_battles)
+            battles["question_id"] = [f"q{i}" for i in range(num_battles)]
+            battles["conversation_a"] = [
+                [
+                    {"role": "user", "content": "hi", "num_tokens": 1},
+                    {"role": "assistant", "content": "a" * n, "num_tokens": n},
+                ]
+                for n in num_tokens.tolist()
+            ]
+            battles["conversation_b"] = [
+                [{"role": "user", "content": "hi", "num_tokens": 1}]
+                for _ in range(num_battles)
+            ]
+            battles["turn"] = 1
+            battles["conv_metadata"] = [
+                {"sum_assistant_a_tokens": n, "bold_count_a": {"**": 1}}
+                for n in num_tokens.tolist()
+            ]
+        return battles
+
+    return create
@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fastchat.serve.api_client_pool import APIClientPool
+
+
+class StandInProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.client_ports.add(self.client_address[1])
+        body = b'data: {"message": "hi"}\n\n'
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_base():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInProviderHandler)
+    server.client_ports = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_client_caches_per_endpoint_and_key():
+    pool = APIClientPool()
+    created = []
+
+    def create_client(http_client):
+        created.append(http_client)
+        return object()
+
+    client = pool.get_client("openai", "https://a", "key-1", create_client)
+    assert pool.get_client("openai", "https://a", "key-1", create_client) is client
+    assert pool.get_client("openai", "https://a", "key-2", create_client) is not client
+    assert pool.get_client("openai", "https://b", "key-1", create_client) is not client
+    assert len(created) == 3
+
+    stats = pool.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert all("key-1" not in str(pool_stats) for pool_stats in stats["pools"])
+    pool.close()
+
+
+def test_get_client_is_thread_safe():
+    pool = APIClientPool()
+    created = []
+
+    def create_client(http_client):
+        created.append(http_client)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        clients = list(
+            executor.map(
+                lambda _: pool.get_client("openai", "https://a", "key", create_client),
+                range(64),
+            )
+        )
+    assert len(created) == 1
+    assert all(client is clients[0] for client in clients)
+    pool.close()
+
+
+def test_session_reuses_connections(api_base):
+    server, url = api_base
+    pool = APIClientPool(max_connections=4)
+    session = pool.get_session(url)
+    for _ in range(10):
+        response = session.post(url, json={"stream": True}, stream=True, timeout=5)
+        assert list(response.iter_lines()) == [b'data: {"message": "hi"}', b""]
+
+    assert pool.get_session(url) is session
+    assert len(server.client_ports) == 1
+    (pool_stats,) = pool.stats()["pools"]
+    assert pool_stats["connections"] == 1
+    assert pool_stats["requests"] == 10
+    pool.close()
+
+
+def test_http_client_reuses_connections(api_base):
+    server, url = api_base
+    pool = APIClientPool(max_connections=4)
+    http_client = pool.get_client("stand-in", url, "key", lambda client: client)
+    for _ in range(10):
+        response = http_client.post(url, json={"stream": True})
+        assert response.status_code == 200
+
+    assert len(server.client_ports) == 1
+    (pool_stats,) = pool.stats()["pools"]
+    assert pool_stats["requests"] == 10
+    assert pool_stats["active_requests"] == 0
+
+    with http_client.stream("POST", url, json={"stream": True}) as response:
+        assert pool.stats()["pools"][0]["active_requests"] == 1
+        assert list(response.iter_lines()) == ['data: {"message": "hi"}', ""]
+    assert pool.stats()["pools"][0]["active_requests"] == 0
+    pool.close()
@@ -0,0 +1,145 @@
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from fastchat.serve import api_provider
+from fastchat.serve.api_provider import (
+    StreamedText,
+    column_api_stream_iter,
+    openai_api_stream_iter,
+)
+
+CHUNKS = ["Hello", ", ", "wor", "ld", "!", "", " How can I", " help?"]
+
+
+class FakeResponse:
+    def __init__(self, lines, error=None):
+        self.lines = lines
+        self.error = error
+
+    def iter_lines(self):
+        yield from self.lines
+        if self.error is not None:
+            raise self.error
+
+
+class FakeClientPool:
+    def __init__(self, client=None, response=None):
+        self.client = client
+        self.response = response
+
+    def get_client(self, api_type, api_base, api_key, create_client):
+        return self.client
+
+    def get_session(self, api_base):
+        return SimpleNamespace(post=lambda *args, **kwargs: self.response)
+
+
+def fake_openai_client(chunks, error=None):
+    def create(**kwargs):
+        for chunk in chunks:
+            delta = SimpleNamespace(content=chunk)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+        if error is not None:
+            raise error
+
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+
+
+def read_stream(stream_iter):
+    """the text bot_response shows after each item of the stream"""
+    streamed_text = StreamedText()
+    for data in stream_iter:
+        if data["error_code"] == 0:
+            streamed_text.update(data)
+            yield streamed_text.text
+        else:
+            yield data["text"] + f"\n\n(error_code: {data['error_code']})"
+
+
+def test_streamed_text():
+    streamed_text = StreamedText()
+    for chunk in CHUNKS[:3]:
+        streamed_text.update({"delta": chunk, "error_code": 0})
+    assert streamed_text.text == "Hello, wor"
+    # a full text replaces the deltas received before
+    streamed_text.update({"delta": "ld", "error_code": 0})
+    streamed_text.update({"text": "Bye", "error_code": 0})
+    assert streamed_text.text == "Bye"
+    streamed_text.update({"delta": "!", "error_code": 0})
+    assert streamed_text.text == "Bye!"
+
+
+def test_column_api_stream(monkeypatch):
+    lines = [b"data: " + json.dumps({"message": chunk}).encode() for chunk in CHUNKS]
+    pool = FakeClientPool(response=FakeResponse(lines[:3] + [b""] + lines[3:]))
+    monkeypatch.setattr(api_provider, "get_api_client_pool", lambda: pool)
+
+    texts = list(read_stream(column_api_stream_iter("m", [], 0.7, 1.0, 64, "b")))
+    # the same text after each item as the full texts streamed before
+    assert texts == ["".join(CHUNKS[: i + 1]) for i in range(len(CHUNKS))]
+
+
+def test_column_api_stream_error(monkeypatch):
+    lines = [b"data: " + json.dumps({"message": chunk}).encode() for chunk in CHUNKS]
+    response = FakeResponse(lines[:3], error=ConnectionError("connection reset"))
+    pool = FakeClientPool(response=response)
+    monkeypatch.setattr(api_provider, "get_api_client_pool", lambda: pool)
+
+    texts = list(read_stream(column_api_stream_iter("m", [], 0.7, 1.0, 64, "b")))
+    assert texts[:3] == ["Hello", "Hello, ", "Hello, wor"]
+    # the error replaces the partial response
+    assert texts[3:] == ["**API REQUEST ERROR** Reason: Unknown.\n\n(error_code: 1)"]
+
+
+@pytest.mark.parametrize("model_name", ["gpt-4o", "deepseek-r1"])
+def test_openai_api_stream(monkeypatch, model_name):
+    pytest.importorskip("openai")
+    chunks = ["<thi", "nk>Let me", " think.</th", "ink>\n\n"] + CHUNKS
+    pool = FakeClientPool(client=fake_openai_client(chunks))
+    monkeypatch.setattr(api_provider, "get_api_client_pool", lambda: pool)
+
+    stream_iter = openai_api_stream_iter(model_name, [], 0.7, 1.0, 64, "b", "key")
+    texts = list(read_stream(stream_iter))
+    text = "".join(chunks)
+    if "deepseek" in model_name:
+        text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    else:
+        assert texts == ["".join(chunks[: i + 1]) for i in range(len(chunks))]
+    assert texts[-1] == text
+
+
+def test_openai_api_stream_error(monkeypatch):
+    pytest.importorskip("openai")
+    client = fake_openai_client(CHUNKS[:3], error=ConnectionError("connection reset"))
+    monkeypatch.setattr(
+        api_provider, "get_api_client_pool", lambda: FakeClientPool(client=client)
+    )
+
+    texts = []
+    stream_iter = openai_api_stream_iter("gpt-4o", [], 0.7, 1.0, 64, "b", "key")
+    # raised to bot_response, which reports the error
+    with pytest.raises(ConnectionError):
+        for text in read_stream(stream_iter):
+            texts.append(text)
+    assert texts == ["Hello", "Hello, ", "Hello, wor"]
+
+
+def test_update_gradio_chatbot_last_message():
+    gradio_web_server = pytest.importorskip("fastchat.serve.gradio_web_server")
+    chatbot = [["Hi", "Hello!"], ["Tell me a joke", "▌"]]
+    streamed_text = StreamedText()
+    for chunk in CHUNKS:
+        streamed_text.update({"delta": chunk, "error_code": 0})
+        updated = gradio_web_server.update_gradio_chatbot_last_message(
+            chatbot, streamed_text.text + "▌"
+        )
+        assert updated[:-1] == chatbot[:-1]
+        assert updated[-1] == ["Tell me a joke", streamed_text.text + "▌"]
+    # the rendered history is not modified in place
+    assert chatbot == [["Hi", "Hello!"], ["Tell me a joke", "▌"]]
+    assert updated[-1][1] == "".join(CHUNKS) + "▌"
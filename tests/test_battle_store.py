@@ -0,0 +1,51 @@
+import json
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from fastchat.serve.monitor.battle_store import load_battles, write_battles
+
+
+def test_battle_store(tmp_path, make_battles):
+    battles = make_battles(
+        500,
+        num_models=5,
+        num_judges=30,
+        # 30 minutes apart, from 2024-06-01 00:00 in US/Pacific
+        tstamp=1717225200.0,
+        tstamp_interval=1800,
+        conversations=True,
+    ).to_dict("records")
+    json_file = tmp_path / "clean_battle.json"
+    with open(json_file, "w") as fout:
+        json.dump(battles, fout)
+    store = tmp_path / "clean_battle"
+    write_battles(battles[::-1], store)
+
+    # the same as the json, in the order of the tstamps
+    expected = load_battles(json_file)
+    pd.testing.assert_frame_equal(
+        load_battles(store, columns=list(expected.columns)), expected
+    )
+    assert "date=2024-06-01" in {p.name for p in (store / "battles").iterdir()}
+    assert "conversation_a" not in load_battles(store).columns
+
+    df = load_battles(
+        store,
+        columns=["model_a", "winner", "conversation_a", "tstamp"],
+        filters=[("date", ">=", "2024-06-05"), ("language", "==", "Chinese")],
+    )
+    rows = expected[(expected["tstamp"] >= 1717225200.0 + 4 * 86400)]
+    rows = rows[rows["language"] == "Chinese"]
+    pd.testing.assert_frame_equal(
+        df, rows[df.columns].reset_index(drop=True), check_dtype=False
+    )
+
+    # rewriting a date replaces it and keeps the others
+    write_battles(battles[:10], store)
+    assert len(load_battles(store)) == len(battles) - 48 + 10
+
+    with pytest.raises(ValueError):
+        load_battles(json_file, filters=[("language", "==", "Chinese")])
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import torch
+
+from fastchat.serve.continuous_batching import ContinuousBatchingEngine
+from fastchat.serve.inference import generate_stream
+
+CONTEXT_LEN = 256
+
+
+def run_concurrently(generate, params_list):
+    results = [None] * len(params_list)
+
+    def run(i):
+        results[i] = list(generate(dict(params_list[i])))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(params_list))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_matches_generate_stream(tiny_llama):
+    # double precision so that padding cannot flip a greedy choice
+    tokenizer, model = tiny_llama(CONTEXT_LEN, torch.float64)
+    engine = ContinuousBatchingEngine(
+        model, tokenizer, "cpu", CONTEXT_LEN, max_batch_size=3
+    )
+
+    prompts = ["Hello", "A much longer prompt, with more tokens", "Hi", "Yes!", "x"]
+    params_list = [
+        {"prompt": prompt, "temperature": 0, "max_new_tokens": 8 + 5 * i, "echo": i % 2}
+        for i, prompt in enumerate(prompts)
+    ]
+    expected = [
+        list(generate_stream(model, tokenizer, dict(params), "cpu", CONTEXT_LEN))
+        for params in params_list
+    ]
+    # more requests than batch slots: some join while others are decoding
+    assert run_concurrently(engine.generate_stream, params_list) == expected
+
+
+def test_stop_str_and_cancellation(tiny_llama):
+    # double precision so that padding cannot flip a greedy choice
+    tokenizer, model = tiny_llama(CONTEXT_LEN, torch.float64)
+    engine = ContinuousBatchingEngine(
+        model, tokenizer, "cpu", CONTEXT_LEN, max_batch_size=4
+    )
+
+    params = {"prompt": "Hello", "temperature": 0, "max_new_tokens": 32, "echo": False}
+    full_text = list(engine.generate_stream(dict(params)))[-1]["text"]
+    stop = full_text[5:7]
+    outputs = list(engine.generate_stream(dict(params, stop=stop)))
+    assert outputs[-1]["finish_reason"] == "stop"
+    assert outputs[-1]["text"] == full_text[: full_text.find(stop)]
+
+    # a client going away does not hold up the others
+    stream = engine.generate_stream(dict(params, max_new_tokens=200))
+    next(stream)
+    stream.close()
+    outputs = run_concurrently(engine.generate_stream, [params] * 3)
+    assert [output[-1]["text"] for output in outputs] == [full_text] * 3
+
+
+def test_waiting_requests_are_prefilled_together(tiny_llama):
+    # double precision so that padding cannot flip a greedy choice
+    tokenizer, model = tiny_llama(CONTEXT_LEN, torch.float64)
+    engine = ContinuousBatchingEngine(
+        model, tokenizer, "cpu", CONTEXT_LEN, max_batch_size=4
+    )
+
+    # hold the engine in the first prefill until the other requests are waiting
+    release = threading.Event()
+    prefill_sizes = []
+
+    def hook(module, args, kwargs):
+        input_ids = kwargs["input_ids"]
+        if input_ids.shape[1] > 1:
+            prefill_sizes.append(input_ids.shape[0])
+            release.wait()
+
+    handle = model.register_forward_pre_hook(hook, with_kwargs=True)
+    prompts = ["Hello", "A much longer prompt", "Hi", "Yes!"]
+    params_list = [
+        {"prompt": prompt, "temperature": 0, "max_new_tokens": 8, "echo": False}
+        for prompt in prompts
+    ]
+    results = [None] * len(params_list)
+
+    def run(i):
+        results[i] = list(engine.generate_stream(dict(params_list[i])))
+
+    threads = [threading.Thread(target=run, args=(0,))]
+    threads[0].start()
+    while not prefill_sizes:
+        time.sleep(0.01)
+    threads += [threading.Thread(target=run, args=(i,)) for i in range(1, 4)]
+    for thread in threads[1:]:
+        thread.start()
+    while engine._waiting.qsize() < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    handle.remove()
+
+    assert prefill_sizes == [1, 3]
+    expected = [
+        list(generate_stream(model, tokenizer, dict(params), "cpu", CONTEXT_LEN))
+        for params in params_list
+    ]
+    assert results == expected
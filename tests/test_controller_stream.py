@@ -0,0 +1,117 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from fastchat.constants import ErrorCode
+from fastchat.serve import controller as controller_module
+from fastchat.serve.controller import Controller, stream_until_disconnect
+from fastchat.serve.stream_framing import (
+    FRAMED_MEDIA_TYPE,
+    FrameDecoder,
+    FrameEncoder,
+    accepts_frames,
+)
+from fastchat.serve.worker_registry import WorkerInfo
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """Sends the chunks, then fails like a worker dying in the middle of an output."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        raise httpx.ReadError("connection reset")
+
+
+def create_outputs(num_outputs=20):
+    return [{"text": "Hello" * i, "error_code": 0} for i in range(1, num_outputs + 1)]
+
+
+def create_controller(monkeypatch, outputs):
+    monkeypatch.setattr(controller_module, "heart_beat_controller", lambda c: None)
+    controller = Controller("shortest_queue")
+    controller.registry.upsert(
+        "http://worker", WorkerInfo(["vicuna"], 1, 0, False, time.time(), False)
+    )
+
+    def handler(request):
+        if accepts_frames(request.headers):
+            encoder = FrameEncoder()
+            stream = b"".join(encoder.encode(output) for output in outputs)
+            headers = {"content-type": FRAMED_MEDIA_TYPE}
+        else:
+            stream = b"".join(json.dumps(output).encode() + b"\0" for output in outputs)
+            headers = {}
+        # cut in the middle of the last output
+        stream = stream[:-3]
+        chunks = [stream[i : i + 7] for i in range(0, len(stream), 7)]
+        return httpx.Response(200, headers=headers, stream=BrokenStream(chunks))
+
+    controller._stream_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler)
+    )
+    return controller
+
+
+async def collect(generator):
+    return [chunk async for chunk in generator]
+
+
+def test_proxy_forwards_complete_outputs(monkeypatch):
+    outputs = create_outputs()
+    controller = create_controller(monkeypatch, outputs)
+    params = {"model": "vicuna"}
+
+    for framed in [False, True]:
+        stream = b"".join(
+            asyncio.run(collect(controller.worker_api_generate_stream(params, framed)))
+        )
+        if framed:
+            received = FrameDecoder().feed(stream)
+        else:
+            received = [json.loads(chunk) for chunk in stream.split(b"\0")[:-1]]
+        # the last output was cut, the error replaces it
+        assert received[:-1] == outputs[:-1]
+        assert received[-1]["error_code"] == ErrorCode.CONTROLLER_WORKER_TIMEOUT
+
+    stream = asyncio.run(
+        collect(controller.worker_api_generate_stream({"model": "llama"}, True))
+    )
+    assert FrameDecoder().feed(b"".join(stream))[0]["error_code"] == (
+        ErrorCode.CONTROLLER_NO_WORKER
+    )
+
+
+def test_stream_until_disconnect():
+    class Request:
+        def __init__(self):
+            self.disconnected = asyncio.Event()
+
+        async def receive(self):
+            await self.disconnected.wait()
+            return {"type": "http.disconnect"}
+
+    closed = []
+
+    async def generator():
+        try:
+            yield b"first"
+            # waiting for the worker
+            await asyncio.sleep(3600)
+        finally:
+            closed.append(True)
+
+    async def main():
+        request = Request()
+        stream = stream_until_disconnect(generator(), request)
+        assert await stream.__anext__() == b"first"
+        request.disconnected.set()
+        assert await asyncio.wait_for(collect(stream), 5) == []
+
+    asyncio.run(main())
+    assert closed == [True]
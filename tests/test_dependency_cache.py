@@ -0,0 +1,87 @@
+from fastchat.serve.sandbox.dependency_cache import DependencyCache, get_dependency_layer_key
+from fastchat.serve.sandbox.fake_sandbox import FakeClock
+
+
+def test_layer_key_is_order_and_case_insensitive():
+    assert get_dependency_layer_key("pip", ["pygame", "NumPy"]) == get_dependency_layer_key("pip", ["numpy", "pygame", "numpy"])
+    assert get_dependency_layer_key("pip", ["typing_extensions"]) == get_dependency_layer_key("pip", ["typing-extensions"])
+    assert get_dependency_layer_key("pip", ["numpy==1.26.0"]) != get_dependency_layer_key("pip", ["numpy==1-26-0"])
+    assert get_dependency_layer_key("npm:~/react_app", ["recharts"]) != get_dependency_layer_key("npm:~/vue_app", ["recharts"])
+
+
+def test_only_released_sandboxes_are_returned():
+    cache = DependencyCache()
+    cache.record_installed("pip", ["pygame", "numpy"], "sandbox-1")
+
+    assert cache.lookup("pip", ["numpy", "pygame"], "owner-1") == ([], None)
+
+    cache.release_sandbox("sandbox-1", "owner-1")
+    assert cache.lookup("pip", ["numpy", "pygame"], "owner-1") == (["sandbox-1"], None)
+
+
+def test_released_sandbox_is_claimed_once():
+    cache = DependencyCache()
+    cache.record_installed("pip", ["pygame"], "sandbox-1")
+    cache.release_sandbox("sandbox-1", "owner-1")
+
+    assert cache.claim_sandbox("sandbox-1", "owner-1")
+    assert not cache.claim_sandbox("sandbox-1", "owner-1")
+    assert cache.lookup("pip", ["pygame"], "owner-1") == ([], None)
+
+
+def test_released_sandbox_is_not_shared_with_other_owners():
+    cache = DependencyCache()
+    cache.record_installed("pip", ["pygame"], "sandbox-1")
+    cache.release_sandbox("sandbox-1", "owner-1")
+
+    assert cache.lookup("pip", ["pygame"], "owner-2") == ([], None)
+    assert cache.lookup("pip", ["pygame"]) == ([], None)
+    assert not cache.claim_sandbox("sandbox-1", "owner-2")
+    assert not cache.claim_sandbox("sandbox-1", None)
+    assert cache.claim_sandbox("sandbox-1", "owner-1")
+
+
+def test_released_sandbox_expires():
+    clock = FakeClock()
+    cache = DependencyCache(released_ttl_seconds=60, clock=clock)
+    cache.record_installed("pip", ["pygame"], "sandbox-1")
+    cache.release_sandbox("sandbox-1", "owner-1")
+
+    clock.now = 61
+    assert cache.lookup("pip", ["pygame"], "owner-1") == ([], None)
+    assert not cache.claim_sandbox("sandbox-1", "owner-1")
+
+    # expired sandboxes are dropped on the next release
+    cache.release_sandbox("sandbox-1", "owner-1")
+    cache.record_installed("pip", ["numpy"], "sandbox-2")
+    clock.now = 200
+    cache.release_sandbox("sandbox-2", "owner-1")
+    assert cache.stats()["released_sandboxes"] == 1
+
+
+def test_unknown_sandbox_is_not_released():
+    cache = DependencyCache()
+    cache.release_sandbox("sandbox-without-dependencies", "owner-1")
+    assert cache.stats()["released_sandboxes"] == 0
+
+
+def test_snapshot_and_hit_rate():
+    cache = DependencyCache()
+    cache.register_snapshot("npm:~/react_app", ["recharts", "lucide-react"], "template-recharts")
+    assert cache.lookup("npm:~/react_app", ["lucide-react", "recharts"]) == ([], "template-recharts")
+
+    cache.record_lookup("snapshot")
+    cache.record_lookup("live")
+    cache.record_lookup("miss")
+    cache.record_lookup("miss")
+    stats = cache.stats()
+    assert stats["lookups"] == 4
+    assert stats["hit_rate"] == 0.5
+
+
+def test_layers_are_bounded():
+    cache = DependencyCache(max_layers=2)
+    for index in range(3):
+        cache.record_installed("pip", [f"package-{index}"], "sandbox-1")
+    assert not cache.has_installed("pip", ["package-0"], "sandbox-1")
+    assert cache.has_installed("pip", ["package-2"], "sandbox-1")
@@ -0,0 +1,92 @@
+import base64
+import hashlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image as PILImage
+
+from fastchat.conversation import get_conv_template
+from fastchat.serve.vision import image as image_module
+from fastchat.serve.vision.image import Image, ImageFormat
+
+
+def create_image(size, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    image_bytes = BytesIO()
+    PILImage.fromarray(pixels, "RGBA").save(image_bytes, format="PNG")
+    return Image(
+        filetype="png",
+        image_format=ImageFormat.BYTES,
+        base64_str=base64.b64encode(image_bytes.getvalue()).decode(),
+    )
+
+
+def md5_of_decoded_pixels(image):
+    decoded = PILImage.open(BytesIO(base64.b64decode(image.base64_str)))
+    return hashlib.md5(decoded.tobytes()).hexdigest()
+
+
+def test_image_hash_matches_decoded_pixels():
+    image = create_image(32)
+    assert image.get_image_hash() == md5_of_decoded_pixels(image)
+
+
+def test_image_hash_is_computed_once(monkeypatch):
+    image = create_image(32)
+    image.get_image_hash()
+
+    def fail(base64_str):
+        raise AssertionError("image decoded again")
+
+    monkeypatch.setattr(image_module, "decode_image", fail)
+    assert image.get_image_hash() == md5_of_decoded_pixels(image)
+    assert image.model_copy(deep=True).get_image_hash() == image.get_image_hash()
+
+
+def test_image_hash_follows_content():
+    image = create_image(32, seed=0)
+    first_hash = image.get_image_hash()
+    image.base64_str = create_image(32, seed=1).base64_str
+    assert image.get_image_hash() != first_hash
+    assert image.get_image_hash() == md5_of_decoded_pixels(image)
+
+
+def test_image_hash_is_kept_for_equal_content(monkeypatch):
+    image = create_image(32)
+    first_hash = image.get_image_hash()
+    monkeypatch.setattr(image_module, "decode_image", None)
+    # an equal string, e.g. after a round trip through json
+    image.base64_str = "".join(list(image.base64_str))
+    assert image.get_image_hash() == first_hash
+
+
+def test_decoded_images_are_bounded_by_size(monkeypatch):
+    images = [create_image(32, seed=i) for i in range(3)]
+    # two 32x32 RGBA images and their keys
+    max_bytes = 2 * 32 * 32 * 4 + sum(len(image.base64_str) for image in images[:2])
+    cache = image_module.DecodedImageCache(max_bytes)
+    monkeypatch.setattr(image_module, "decoded_image_cache", cache)
+
+    decoded = [image.to_pil_image() for image in images[:2]]
+    assert all(image.to_pil_image() is d for image, d in zip(images, decoded))
+    images[2].to_pil_image()
+    assert cache.get(images[0].base64_str) is None
+    assert cache.get(images[1].base64_str) is decoded[1]
+
+    # an image larger than the cache is not kept
+    large = create_image(64)
+    large.to_pil_image()
+    assert cache.get(large.base64_str) is None
+    assert cache.get(images[2].base64_str) is not None
+
+
+def test_conversation_logs_image_hashes():
+    conv = get_conv_template("chatgpt")
+    images = [create_image(16, seed=i) for i in range(3)]
+    conv.append_message(conv.roles[0], ("describe", images))
+    conv.append_message(conv.roles[1], "three images")
+
+    (_, (text, image_hashes)), _ = conv.to_dict()["messages"]
+    assert text == "describe"
+    assert image_hashes == [md5_of_decoded_pixels(image) for image in images]
@@ -0,0 +1,91 @@
+import random
+
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers
+from tokenizers.trainers import BpeTrainer
+from transformers import PreTrainedTokenizerFast
+
+from fastchat.serve.inference import IncrementalDetokenizer
+
+CORPUS = [
+    "FastChat is an open platform for training, serving, and evaluating chatbots.",
+    "def generate_stream(model, tokenizer, params): return model(**params)",
+    "The quick brown fox jumps over the lazy dog. Isn't it? Yes, it's 42!",
+    "你好，世界！这是一个测试。こんにちは世界。Привет мир.",
+    "Ünïcödé façade naïve café, emoji 😀🎉👍🏽 and more 🚀 tests.",
+] * 20
+
+
+def train_llama_style_tokenizer():
+    # SentencePiece BPE with byte fallback, converted like the Llama tokenizer
+    tokenizer = Tokenizer(models.BPE(byte_fallback=True, unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Sequence(
+        [normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")]
+    )
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace(prepend_scheme="never")
+    special_tokens = ["<unk>", "<s>", "</s>"] + [f"<0x{i:02X}>" for i in range(256)]
+    tokenizer.train_from_iterator(
+        CORPUS, BpeTrainer(vocab_size=500, special_tokens=special_tokens)
+    )
+    tokenizer.pre_tokenizer = None
+    tokenizer.decoder = decoders.Sequence(
+        [
+            decoders.Replace("▁", " "),
+            decoders.ByteFallback(),
+            decoders.Fuse(),
+            decoders.Strip(" ", 1, 0),
+        ]
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+
+
+def train_gpt2_style_tokenizer():
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        CORPUS,
+        BpeTrainer(
+            vocab_size=500,
+            special_tokens=["<|endoftext|>"],
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        ),
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token="<|endoftext|>"
+    )
+
+
+def decode(tokenizer, token_ids):
+    return tokenizer.decode(token_ids, **IncrementalDetokenizer.decode_kwargs)
+
+
+def check_streaming(tokenizer, token_ids, start, stream_interval):
+    detokenizer = IncrementalDetokenizer(tokenizer, start)
+    previous = ""
+    for end in range(start + 1, len(token_ids) + 1):
+        final = end == len(token_ids)
+        if (end - start) % stream_interval and not final:
+            continue
+        text = detokenizer.decode(token_ids[:end], final)
+        full_text = decode(tokenizer, token_ids[start:end])
+        # an incomplete character is held back, the text only grows
+        assert text == (full_text if final else full_text.rstrip("�"))
+        assert text.startswith(previous)
+        previous = text
+
+
+def test_matches_full_decode():
+    rng = random.Random(0)
+    for tokenizer in [train_llama_style_tokenizer(), train_gpt2_style_tokenizer()]:
+        token_ids = tokenizer(" ".join(CORPUS[:10])).input_ids
+        # multibyte characters are split into several tokens
+        assert len(token_ids) > len(" ".join(CORPUS[:10])) / 4
+        for stream_interval in [1, 2, 5]:
+            check_streaming(tokenizer, token_ids, 0, stream_interval)
+            # echo=False in generate_stream starts after the prompt
+            check_streaming(tokenizer, token_ids, 7, stream_interval)
+        # random ids make invalid byte sequences
+        random_ids = [rng.randrange(len(tokenizer)) for _ in range(300)]
+        check_streaming(tokenizer, random_ids, 0, 3)
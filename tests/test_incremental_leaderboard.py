@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from fastchat.serve.monitor.elo_analysis import report_elo_analysis_results
+from fastchat.serve.monitor.incremental_leaderboard import (
+    IncrementalLeaderboard,
+    read_new_votes,
+)
+from fastchat.serve.monitor.rating_systems import compute_elo, preprocess_for_bt
+
+
+def test_read_new_votes(tmp_path):
+    filename = tmp_path / "2024-01-01-conv.json"
+    vote = {"type": "leftvote", "tstamp": 1.0}
+    chat = {"type": "chat", "tstamp": 2.0, "text": "no vote here"}
+    line = json.dumps(vote) + "\n"
+    with open(filename, "w") as fout:
+        fout.write(json.dumps(chat) + "\n" + line + line[:10])
+
+    votes, offset = read_new_votes(filename)
+    assert votes == [vote]
+    # the partial line is read again next time
+    assert offset == len(json.dumps(chat)) + 1 + len(line)
+    with open(filename, "a") as fout:
+        fout.write(line[10:])
+    votes, offset = read_new_votes(filename, offset)
+    assert votes == [vote]
+    assert offset == filename.stat().st_size
+    assert read_new_votes(filename, offset) == ([], offset)
+
+
+def test_rebuild(tmp_path, make_battles):
+    filenames = [str(tmp_path / f"2024-01-0{i}-conv.json") for i in range(1, 4)]
+    for filename in filenames:
+        with open(filename, "w") as fout:
+            fout.write(json.dumps({"type": "chat", "tstamp": 1.0}) + "\n")
+
+    leaderboard = IncrementalLeaderboard(ban_ip_list=["1.2.3.4"])
+    leaderboard.update(filenames[:2])
+    num_battles = leaderboard.add_battles(
+        make_battles(10, num_models=6, tstamp=1700000000.0)
+    )
+    assert sum(leaderboard.counts.values()) == num_battles > 0
+    leaderboard.update(filenames[:2])
+    assert sum(leaderboard.counts.values()) == num_battles
+
+    # the window of the last files moved
+    leaderboard.update(filenames[1:])
+    assert list(leaderboard.offsets) == filenames[1:]
+    assert not leaderboard.counts
+
+    leaderboard.add_battles(make_battles(10, num_models=6, tstamp=1700000000.0))
+    leaderboard.set_ban_ip_list(["1.2.3.4"])
+    assert sum(leaderboard.counts.values()) == num_battles
+    leaderboard.set_ban_ip_list(["1.2.3.4", "5.6.7.8"])
+    assert not leaderboard.counts
+    assert not leaderboard.offsets
+
+
+def test_incremental_matches_full_recompute(make_battles):
+    battles = make_battles(3000, num_models=6, tstamp=1700000000.0)
+    leaderboard = IncrementalLeaderboard()
+    for start in range(0, len(battles), 1000):
+        leaderboard.add_battles(battles.iloc[start : start + 1000])
+        leaderboard.report(num_bootstrap=4)
+
+    anony = battles[battles["anony"]]
+    matchups, outcomes, models, weights = preprocess_for_bt(anony)
+    counts = leaderboard.preprocess_for_bt()
+    np.testing.assert_array_equal(counts[0], matchups)
+    np.testing.assert_array_equal(counts[1], outcomes)
+    assert counts[2] == models
+    np.testing.assert_array_equal(counts[3], weights)
+    assert leaderboard.elo_rating_online == compute_elo(anony)
+
+    results = leaderboard.report(num_bootstrap=20)
+    expected = report_elo_analysis_results(
+        battles, rating_system="bt", num_bootstrap=20
+    )
+    for key in ["elo_rating_final", "elo_rating_online"]:
+        pd.testing.assert_series_equal(
+            pd.Series(results[key]), pd.Series(expected[key]), atol=0.1
+        )
+    pd.testing.assert_frame_equal(
+        results["leaderboard_table_df"], expected["leaderboard_table_df"], atol=0.1
+    )
+    assert results["last_updated_tstamp"] == expected["last_updated_tstamp"]
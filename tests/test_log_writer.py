@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+
+from fastchat.serve.log_writer import LogWriter
+
+
+def read_records(path):
+    with open(path) as fin:
+        return [json.loads(line) for line in fin]
+
+
+def test_appends_records_in_order(tmp_path):
+    writer = LogWriter(flush_records=8, flush_interval=10)
+    path = os.path.join(
+        tmp_path, "2025_01_01", "conv_logs", "direct", "conv-log-a.json"
+    )
+    for i in range(20):
+        writer.write(path, {"i": i})
+    assert writer.flush(timeout=5)
+
+    assert [record["i"] for record in read_records(path)] == list(range(20))
+    stats = writer.stats()
+    assert stats["written"] == 20
+    assert stats["open_files"] == 1
+    writer.close()
+
+
+def test_overwrite_replaces_file(tmp_path):
+    writer = LogWriter()
+    path = os.path.join(tmp_path, "log.json")
+    writer.write(path, {"i": 0})
+    writer.write(path, {"i": 1}, write_mode="overwrite")
+    writer.write(path, {"i": 2})
+    writer.close()
+
+    assert [record["i"] for record in read_records(path)] == [1, 2]
+
+
+def test_close_drains_queue(tmp_path):
+    writer = LogWriter(max_queue_size=4, flush_records=1000, flush_interval=60)
+    paths = [os.path.join(tmp_path, f"log-{i % 3}.json") for i in range(3)]
+
+    def produce(thread_index):
+        for i in range(100):
+            writer.write(paths[i % 3], {"thread": thread_index, "i": i})
+
+    threads = [threading.Thread(target=produce, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+
+    assert sum(len(read_records(path)) for path in paths) == 400
+    stats = writer.stats()
+    assert stats["enqueued"] == stats["written"] == 400
+    assert stats["open_files"] == 0
+    assert stats["max_queue_depth"] <= 4
+
+
+def test_evicts_file_handles(tmp_path):
+    writer = LogWriter(max_open_files=2, fsync="always")
+    for i in range(5):
+        writer.write(os.path.join(tmp_path, f"log-{i}.json"), {"i": i})
+    writer.write(os.path.join(tmp_path, "log-0.json"), {"i": 5})
+    assert writer.flush(timeout=5)
+
+    assert writer.stats()["open_files"] == 2
+    assert writer.stats()["fsyncs"] == 6
+    assert [
+        record["i"] for record in read_records(os.path.join(tmp_path, "log-0.json"))
+    ] == [0, 5]
+    writer.close()
+
+
+def test_records_can_be_mutated_after_write(tmp_path):
+    writer = LogWriter(flush_records=100, flush_interval=10)
+    path = os.path.join(tmp_path, "log.json")
+    state = {"messages": ["hi"]}
+    writer.write(path, state)
+    state["messages"].append("hello")
+    writer.write(path, state)
+    assert writer.flush(timeout=5)
+
+    assert [record["messages"] for record in read_records(path)] == [
+        ["hi"],
+        ["hi", "hello"],
+    ]
+    writer.close()
+
+
+def test_writes_racing_close_are_not_lost(tmp_path):
+    writer = LogWriter(max_queue_size=2, flush_records=1000, flush_interval=60)
+    path = os.path.join(tmp_path, "log.json")
+    started = threading.Barrier(5)
+
+    def produce(thread_index):
+        started.wait()
+        for i in range(50):
+            writer.write(path, {"thread": thread_index, "i": i})
+
+    threads = [threading.Thread(target=produce, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    writer.close()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+
+    records = read_records(path)
+    assert len(records) == 200
+    for thread_index in range(4):
+        assert [r["i"] for r in records if r["thread"] == thread_index] == list(
+            range(50)
+        )
+
+
+def test_write_after_close_is_synchronous(tmp_path):
+    writer = LogWriter()
+    path = os.path.join(tmp_path, "log.json")
+    writer.write(path, {"i": 0})
+    writer.close()
+    writer.write(path, {"i": 1})
+
+    assert [record["i"] for record in read_records(path)] == [0, 1]
+    assert writer.flush() is True
+    assert writer.stats()["written"] == 2
+    assert writer.stats()["open_files"] == 0
@@ -0,0 +1,86 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from fastchat.serve.gradio_web_server import merge_bot_response_streams
+
+
+def fake_bot_response(outputs, stall=None, error=None, closed=None):
+    """yield the outputs, waiting for the stall event before the last one"""
+    try:
+        for i, output in enumerate(outputs):
+            if stall is not None and i == len(outputs) - 1:
+                stall.wait(timeout=10)
+            yield output
+        if error is not None:
+            raise error
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+def endless_bot_response(closed):
+    try:
+        for i in itertools.count():
+            time.sleep(0.001)
+            yield i
+    finally:
+        closed.set()
+
+
+def test_stalled_stream_does_not_hold_back_the_other():
+    stall = threading.Event()
+    gens = [
+        fake_bot_response(["a0", "a1"], stall=stall),
+        fake_bot_response(["b0", "b1", "b2"]),
+    ]
+    merged = merge_bot_response_streams(gens, frame_interval=0)
+    for frame in merged:
+        if frame[1] == "b2":
+            break
+    # the last output of the other side arrived while this one is stalled
+    assert frame[0] in [None, "a0"]
+
+    stall.set()
+    frames = list(merged)
+    assert frames[-1] == ["a1", "b2"]
+
+
+def test_last_frame_holds_final_outputs():
+    gens = [
+        fake_bot_response([f"a{i}" for i in range(3)]),
+        fake_bot_response([f"b{i}" for i in range(200)]),
+    ]
+    frames = list(merge_bot_response_streams(gens, frame_interval=0.01))
+    # the frames are coalesced, but the final outputs are not dropped
+    assert len(frames) < 200
+    assert frames[-1] == ["a2", "b199"]
+
+
+def test_error_is_raised_to_the_consumer():
+    stall = threading.Event()
+    closed = threading.Event()
+    gens = [
+        fake_bot_response(["a0"], error=ValueError("model error")),
+        fake_bot_response(["b0", "b1"], stall=stall, closed=closed),
+    ]
+    with pytest.raises(ValueError, match="model error"):
+        list(merge_bot_response_streams(gens, frame_interval=0))
+
+    # the other side is stopped after its next output
+    stall.set()
+    assert closed.wait(timeout=5)
+
+
+def test_close_stops_both_streams():
+    closed = [threading.Event(), threading.Event()]
+    gens = [endless_bot_response(closed[0]), endless_bot_response(closed[1])]
+    merged = merge_bot_response_streams(gens, frame_interval=0)
+    for _ in range(3):
+        next(merged)
+    merged.close()
+
+    assert closed[0].wait(timeout=5)
+    assert closed[1].wait(timeout=5)
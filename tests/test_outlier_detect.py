@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from fastchat.serve.monitor.elo_analysis import get_model_pair_stats, outlier_detect
+
+
+def reference_bad_users(model_pair_stats, battles, max_vote=100, alpha=0.05):
+    """the votes of each battle one at a time, as outlier_detect used to"""
+    user_vote_cnt = battles["judge"].value_counts()
+    bad_users = []
+    for user in user_vote_cnt[user_vote_cnt >= 5].index:
+        p_upper, p_lower = [], []
+        for _, row in battles[battles["judge"] == user].iterrows():
+            if len(p_upper) >= max_vote:
+                break
+            pair = tuple(sorted([row["model_a"], row["model_b"]]))
+            if row["winner"] in ["tie", "tie (bothbad)"]:
+                vote = 0.5
+            elif row[row["winner"]] == pair[0]:
+                vote = 1
+            else:
+                vote = 0
+            stats = model_pair_stats[pair]
+            ratings = np.array([1] * stats["win"] + [0] * stats["loss"])
+            p_upper.append((ratings <= vote).mean())
+            p_lower.append((ratings >= vote).mean())
+            if (np.prod(1 / (2 * np.array(p_upper))) > 1 / alpha) or (
+                np.prod(1 / (2 * np.array(p_lower))) > 1 / alpha
+            ):
+                bad_users.append({"user_id": user, "votes": len(p_upper)})
+                break
+    return bad_users
+
+
+def test_get_model_pair_stats():
+    battles = pd.DataFrame(
+        {
+            "model_a": ["b", "a", "a", "b", "c"],
+            "model_b": ["a", "b", "b", "a", "a"],
+            "winner": ["model_a", "model_a", "tie", "model_b", "tie (bothbad)"],
+        }
+    )
+    assert get_model_pair_stats(battles) == {
+        ("a", "b"): {"win": 2, "loss": 1, "tie": 1},
+        ("a", "c"): {"win": 0, "loss": 0, "tie": 1},
+    }
+
+
+def test_outlier_detect(capsys, make_battles):
+    battles = make_battles(
+        20000, num_models=12, tie_prob=0.15, num_judges=2000, num_bad_judges=20
+    )
+    model_pair_stats = get_model_pair_stats(battles)
+    expected = reference_bad_users(model_pair_stats, battles)
+    assert len(expected) > 0
+
+    capsys.readouterr()
+    remaining = outlier_detect(model_pair_stats, battles)
+    assert str(expected) in capsys.readouterr().out
+    bad_users = [x["user_id"] for x in expected]
+    pd.testing.assert_frame_equal(remaining, battles[~battles["judge"].isin(bad_users)])
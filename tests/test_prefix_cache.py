@@ -0,0 +1,76 @@
+import torch
+
+from fastchat.serve.inference import generate_stream
+from fastchat.serve.kv_cache import PrefixCache
+
+CONTEXT_LEN = 512
+
+
+def kv_tensors(num_tokens, num_layers=2):
+    # 2 layers x (key, value) x 4 bytes per token
+    return [
+        (torch.zeros(1, 1, num_tokens, 1), torch.zeros(1, 1, num_tokens, 1))
+        for _ in range(num_layers)
+    ]
+
+
+def test_multi_turn_chat(tiny_llama):
+    # double precision so that the prefill split cannot flip a greedy choice
+    tokenizer, model = tiny_llama(CONTEXT_LEN, torch.float64)
+    prefix_cache = PrefixCache(2**20)
+
+    def chat(prompt, prefix_cache):
+        params = {
+            "prompt": prompt,
+            "temperature": 0,
+            "max_new_tokens": 24,
+            "echo": False,
+        }
+        outputs = generate_stream(
+            model, tokenizer, params, "cpu", CONTEXT_LEN, prefix_cache=prefix_cache
+        )
+        return list(outputs)[-1]["text"]
+
+    prompt = "USER: Hi! ASSISTANT:"
+    for turn in range(3):
+        answer = chat(prompt, prefix_cache)
+        assert answer and answer == chat(prompt, None)
+        prompt = f"{prompt}{answer} USER: Question {turn}? ASSISTANT:"
+
+    stats = prefix_cache.get_stats()
+    assert stats["lookups"] == 3 and stats["hits"] == 2
+    # only the first prompt and the new messages are prefilled, with the last token
+    # of each answer, which had not been fed to the model
+    first_prompt_len = len("USER: Hi! ASSISTANT:") + 1  # with <s>
+    new_message_len = len(" USER: Question 0? ASSISTANT:") + 1
+    assert (
+        stats["prefill_tokens"] - stats["saved_prefill_tokens"]
+        <= first_prompt_len + 2 * new_message_len
+    )
+    # each turn's cache extends and replaces the previous one
+    assert stats["entries"] == 1
+
+
+def test_lru_eviction():
+    prefix_cache = PrefixCache(max_bytes=2 * 16 * 32, block_size=4)
+    a, b, c = [list(range(start, start + 32)) for start in [0, 100, 200]]
+    prefix_cache.put(a, kv_tensors(32))
+    prefix_cache.put(b, kv_tensors(32))
+    assert prefix_cache.get(a + [1000])[0] == 32
+    # b is the least recently used
+    prefix_cache.put(c, kv_tensors(32))
+    assert prefix_cache.get(b + [1000]) == (0, None)
+    assert prefix_cache.get(c + [1000])[0] == 32
+
+    # a shared prefix is reused up to the first differing token
+    length, cached = prefix_cache.get(a[:10] + [1000] + a[11:])
+    assert length == 10 and cached[0][0].shape[2] == 10
+    # not across a differing first block
+    assert prefix_cache.get([1000] + a[1:])[0] == 0
+    # the last token is always prefilled
+    assert prefix_cache.get(a)[0] == 31
+
+    # too large to cache at all
+    prefix_cache.put(list(range(1000, 1100)), kv_tensors(100))
+    assert prefix_cache.get_stats()["entries"] == 2
+    assert prefix_cache.get_stats()["bytes"] == 2 * 16 * 32
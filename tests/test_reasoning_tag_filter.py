@@ -0,0 +1,49 @@
+import random
+import re
+
+from fastchat.serve.api_provider import ReasoningTagFilter
+
+
+def filter_in_chunks(text, chunk_sizes):
+    reasoning_filter = ReasoningTagFilter()
+    output = []
+    pos = 0
+    for size in chunk_sizes:
+        output.append(reasoning_filter.feed(text[pos : pos + size]))
+        pos += size
+    output.append(reasoning_filter.feed(text[pos:]))
+    output.append(reasoning_filter.finish())
+    return "".join(output)
+
+
+def strip_with_regex(text):
+    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+
+
+def test_reasoning_section_is_removed():
+    text = "<think>\nLet me think.\n</think>\n\nThe answer is 42."
+    assert filter_in_chunks(text, [len(text)]) == "\n\nThe answer is 42."
+
+
+def test_tags_split_across_chunks():
+    text = "<think>hidden</think>visible"
+    assert filter_in_chunks(text, [1] * len(text)) == "visible"
+
+
+def test_unclosed_section_is_kept():
+    text = "before <think>still thinking"
+    assert filter_in_chunks(text, [3, 5, 7]) == text
+
+
+def test_partial_tag_at_end_is_kept():
+    text = "answer <thi"
+    assert filter_in_chunks(text, [9]) == text
+
+
+def test_matches_regex_on_random_splits():
+    rng = random.Random(0)
+    pieces = ["<think>", "</think>", "<", "</", "think", ">", "a", "b c", "\n"]
+    for _ in range(500):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 30)))
+        chunk_sizes = [rng.randint(0, 5) for _ in range(rng.randint(0, 10))]
+        assert filter_in_chunks(text, chunk_sizes) == strip_with_regex(text), text
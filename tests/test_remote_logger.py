@@ -0,0 +1,156 @@
+import gzip
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fastchat.serve.remote_logger import RemoteLogger
+
+
+class StandInLogHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+            else:
+                assert self.headers["Content-Encoding"] == "gzip"
+                lines = gzip.decompress(body).decode().splitlines()
+                server.batches.append([json.loads(line) for line in lines])
+        self.send_response(503 if fail else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInLogHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.failures = 0
+    server.batches = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/logs"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sends_batches(server):
+    logger = RemoteLogger(server.url, batch_size=10, batch_interval=5)
+    data = {"type": "upvote", "state": {"messages": [["user", "hi"]]}}
+    for i in range(25):
+        logger.log(dict(data, i=i))
+    logger.close()
+
+    assert [len(batch) for batch in server.batches] == [10, 10, 5]
+    records = [record for batch in server.batches for record in batch]
+    assert [record["i"] for record in records] == list(range(25))
+    assert records[0]["state"] == json.dumps(data["state"])
+    # the caller's record is left untouched
+    assert isinstance(data["state"], dict)
+
+    stats = logger.stats()
+    assert stats["queued"] == stats["sent"] == 25
+    assert stats["batches"] == 3
+
+
+def test_retries_failed_batches(server):
+    server.failures = 2
+    logger = RemoteLogger(server.url, batch_size=5, batch_interval=5, backoff_base=0.01)
+    for i in range(5):
+        logger.log({"i": i})
+    logger.close()
+
+    assert server.requests == 3
+    assert len(server.batches) == 1
+    stats = logger.stats()
+    assert stats["retries"] == 2
+    assert stats["sent"] == 5
+
+
+def test_drops_when_queue_is_full(server):
+    logger = RemoteLogger(
+        server.url, max_queue_size=2, batch_size=100, batch_interval=5
+    )
+    # keep the sender thread from draining the queue
+    logger._stopped.set()
+    logger.thread.join()
+    for i in range(5):
+        logger.log({"i": i})
+
+    stats = logger.stats()
+    assert stats["queued"] == 2
+    assert stats["dropped"] == 3
+
+
+def test_spills_and_resends(server, tmp_path):
+    spill_path = os.path.join(tmp_path, "spill.ndjson")
+    server.failures = 100
+    logger = RemoteLogger(
+        server.url,
+        batch_size=5,
+        batch_interval=0.05,
+        overflow_policy="spill",
+        spill_path=spill_path,
+        max_retries=1,
+        backoff_base=0.01,
+        resend_interval=0.05,
+    )
+    for i in range(5):
+        logger.log({"i": i})
+    while logger.stats()["spilled"] < 5:
+        time.sleep(0.01)
+    with server.lock:
+        server.failures = 0
+    while logger.stats()["sent"] < 5:
+        time.sleep(0.01)
+    logger.close()
+
+    assert [record["i"] for record in server.batches[0]] == list(range(5))
+    assert logger.stats()["spilled"] == 0
+    assert not os.path.exists(spill_path)
+
+
+def test_keeps_spilled_logs_until_sent(server, tmp_path):
+    # left by an earlier process, with a line cut short by a crash
+    spill_path = os.path.join(tmp_path, "spill.ndjson")
+    with open(spill_path, "w") as fout:
+        fout.write('{"i": 0}\n{"i": 1}\n{"i": 2, "sta\n{"i": 3}\n')
+    server.failures = 100
+    logger = RemoteLogger(
+        server.url,
+        batch_size=2,
+        batch_interval=0.05,
+        overflow_policy="spill",
+        spill_path=spill_path,
+        max_retries=0,
+        resend_interval=0.05,
+    )
+    while server.requests < 2:
+        time.sleep(0.01)
+    # the records are kept on disk while the endpoint fails
+    with server.lock:
+        server.failures = 0
+        assert server.batches == []
+    while os.path.exists(spill_path + ".sending"):
+        time.sleep(0.01)
+    logger.close()
+
+    records = [record for batch in server.batches for record in batch]
+    assert [record["i"] for record in records] == [0, 1, 3]
+    stats = logger.stats()
+    assert stats["spilled"] == 0
+    assert stats["dropped"] == 1
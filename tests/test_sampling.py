@@ -0,0 +1,52 @@
+import torch
+
+from fastchat.serve.inference import (
+    generate_stream,
+    prepare_logits_processor,
+    sample_top_p_top_k,
+)
+
+CONTEXT_LEN = 256
+
+
+def test_sample_top_p_top_k_matches_warpers():
+    torch.manual_seed(0)
+    for _ in range(20):
+        logits = torch.randn(500) * 3
+        for top_p, top_k in [(0.5, -1), (0.9, 20), (1.0, 5), (0.99, 1)]:
+            processor = prepare_logits_processor(1.0, 1.0, top_p, top_k)
+            allowed = processor(None, logits[None])[0] > -float("inf")
+            for _ in range(20):
+                assert allowed[sample_top_p_top_k(logits, top_p, top_k)].all()
+            if allowed.sum() >= 2:
+                # without replacement, like torch.multinomial
+                assert (
+                    len(set(sample_top_p_top_k(logits, top_p, top_k, 2).tolist())) == 2
+                )
+        assert int(sample_top_p_top_k(logits, 0.9, 1)) == int(logits.argmax())
+
+
+def test_stop_token_between_stream_chunks(tiny_llama):
+    tokenizer, model = tiny_llama(CONTEXT_LEN)
+    params = {"prompt": "Hello", "temperature": 0, "max_new_tokens": 32}
+
+    def generate(stream_interval, **kwargs):
+        return list(
+            generate_stream(
+                model,
+                tokenizer,
+                dict(params, **kwargs),
+                "cpu",
+                CONTEXT_LEN,
+                stream_interval,
+            )
+        )
+
+    output_ids = tokenizer(generate(1)[-1]["text"]).input_ids
+    stop_token_id = output_ids[-6]
+    expected = generate(1, stop_token_ids=[stop_token_id])[-1]
+    assert expected["finish_reason"] == "stop"
+    for stream_interval in [2, 3, 5]:
+        # stop tokens are checked only when the output is streamed
+        outputs = generate(stream_interval, stop_token_ids=[stop_token_id])
+        assert outputs[-1] == expected
@@ -0,0 +1,62 @@
+from fastchat.serve.sandbox.fake_sandbox import FakeCommandResult, FakeSandbox
+from fastchat.serve.sandbox.sandbox_manager import install_packages_with_bisect, install_pip_dependencies
+
+
+def fail_on_bad_packages(command: str, cwd: str | None) -> FakeCommandResult:
+    if "bad-" in command:
+        return FakeCommandResult(exit_code=1, stdout="", stderr="resolution failed")
+    return FakeCommandResult(exit_code=0, stdout="", stderr="")
+
+
+def test_pip_dependencies_installed_with_single_command():
+    sandbox = FakeSandbox(command_handler=fail_on_bad_packages)
+    errors = install_pip_dependencies(sandbox, ["pygame", "numpy", "arcade", "pygame"])
+    assert errors == []
+    # numpy is pre-installed in the template, pygame is de-duplicated
+    assert [command for command, _ in sandbox.commands.history] == [
+        "uv pip install --system pygame arcade",
+    ]
+
+
+def test_pip_install_failure_is_bisected():
+    sandbox = FakeSandbox(command_handler=fail_on_bad_packages)
+    errors = install_pip_dependencies(sandbox, ["pygame", "bad-one", "arcade", "bad-two"])
+    assert len(errors) == 2
+    assert "bad-one" in errors[0]
+    assert "bad-two" in errors[1]
+
+
+def test_bisect_installs_all_good_packages():
+    installed = []
+
+    def install(packages, timeout):
+        if any(package.startswith("bad-") for package in packages):
+            raise RuntimeError("install failed")
+        installed.extend(packages)
+
+    failures = install_packages_with_bisect(install, ["a", "b", "bad-c", "d", "e"])
+    assert [package for package, _ in failures] == ["bad-c"]
+    assert sorted(installed) == ["a", "b", "d", "e"]
+
+
+def test_bisect_retries_are_bounded():
+    now = [0.0]
+    timeouts = []
+
+    def install(packages, timeout):
+        timeouts.append(timeout)
+        now[0] += timeout
+        raise TimeoutError("install timed out")
+
+    failures = install_packages_with_bisect(
+        install,
+        ["a", "b", "c", "d"],
+        timeout=180,
+        retry_timeout=60,
+        total_timeout=300,
+        clock=lambda: now[0],
+    )
+    # 180s for all packages, 60s for [a, b], then the 60s left for [a]
+    assert timeouts == [180, 60, 60]
+    assert [package for package, _ in failures] == ["a", "b", "c", "d"]
+    assert all(isinstance(e, TimeoutError) for _, e in failures)
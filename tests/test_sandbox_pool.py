@@ -0,0 +1,121 @@
+from fastchat.serve.sandbox.fake_sandbox import FakeClock, FakeSandbox
+from fastchat.serve.sandbox.sandbox_pool import SandboxPool
+
+
+def create_pool(min_size=2, max_size=4, ttl_seconds=100, clock=None, factory=None):
+    created = []
+
+    def sandbox_factory():
+        sandbox = factory() if factory else FakeSandbox()
+        created.append(sandbox)
+        return sandbox
+
+    pool = SandboxPool(
+        template="fake",
+        sandbox_factory=sandbox_factory,
+        min_size=min_size,
+        max_size=max_size,
+        ttl_seconds=ttl_seconds,
+        clock=clock or FakeClock(),
+    )
+    return pool, created
+
+
+def test_refill_warms_pool_to_min_size():
+    pool, created = create_pool(min_size=2)
+    assert pool.refill() == 2
+    assert pool.refill() == 0
+    assert len(created) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_lease_hit_and_miss():
+    pool, created = create_pool(min_size=1)
+    pool.refill()
+
+    first = pool.lease()
+    assert first is created[0]
+    second = pool.lease()
+    assert second is created[1]
+
+    stats = pool.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_miss_grows_target_up_to_max_size():
+    pool, _ = create_pool(min_size=1, max_size=2)
+    for _ in range(3):
+        pool.lease()
+    assert pool.stats()["target_size"] == 2
+    assert pool.refill() == 2
+
+
+def test_unhealthy_sandbox_is_discarded():
+    clock = FakeClock()
+    pool, created = create_pool(min_size=2, clock=clock)
+    pool.refill()
+    created[0].running = False
+
+    # checked recently, handed out as it is
+    assert pool.lease() is created[0]
+
+    pool.refill()
+    created[1].running = False
+    created[2].running = False
+    clock.now = 40
+    # a lease waits for one failed check at most, then creates a sandbox
+    sandbox = pool.lease()
+    assert sandbox is created[3]
+    assert created[1].killed
+    assert not created[2].killed
+    assert pool.stats()["unhealthy"] == 1
+
+
+def test_idle_sandboxes_are_checked_in_background():
+    clock = FakeClock()
+    pool, created = create_pool(min_size=2, clock=clock)
+    pool.refill()
+    created[0].running = False
+
+    clock.now = 40
+    assert pool.refill() == 1
+    assert created[0].killed
+    assert pool.stats()["unhealthy"] == 1
+
+    # the others were just checked
+    created[1].is_running = None
+    assert pool.lease() is created[1]
+
+
+def test_expired_sandbox_is_recycled():
+    clock = FakeClock()
+    pool, created = create_pool(min_size=1, ttl_seconds=100, clock=clock)
+    pool.refill()
+
+    clock.now = 150
+    assert pool.refill() == 1
+    assert created[0].killed
+    assert pool.lease() is created[1]
+    assert pool.stats()["expired"] == 1
+
+
+def test_create_failure_is_counted():
+    def failing_factory():
+        raise RuntimeError("e2b is down")
+
+    pool, _ = create_pool(min_size=2, factory=failing_factory)
+    assert pool.refill() == 0
+    stats = pool.stats()
+    assert stats["create_failures"] == 2
+    assert stats["creating"] == 0
+
+
+def test_close_kills_idle_sandboxes():
+    pool, created = create_pool(min_size=2)
+    pool.start()
+    pool.refill()
+    pool.close()
+    assert all(sandbox.killed for sandbox in created)
+    assert pool.refill() == 0
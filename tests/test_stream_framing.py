@@ -0,0 +1,111 @@
+import json
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from fastchat.serve.stream_framing import (
+    FRAMED_MEDIA_TYPE,
+    FrameDecoder,
+    FrameEncoder,
+    create_stream_response,
+    get_delta,
+    is_framed,
+)
+
+
+def create_outputs(num_tokens=50, logprobs=False):
+    outputs = []
+    for i in range(1, num_tokens + 1):
+        output = {
+            "text": "".join(f"tok{j} é " for j in range(i)),
+            "usage": {
+                "prompt_tokens": 3,
+                "completion_tokens": i,
+                "total_tokens": 3 + i,
+            },
+            "finish_reason": "length" if i == num_tokens else None,
+        }
+        if logprobs:
+            output["logprobs"] = {
+                "text_offset": list(range(i)),
+                "tokens": [f"tok{j}" for j in range(i)],
+                "token_logprobs": [-0.5 * j for j in range(i)],
+                "top_logprobs": [{f"tok{j}": -0.5 * j} for j in range(i)],
+            }
+        outputs.append(output)
+    return outputs
+
+
+def default_stream(outputs):
+    for output in outputs:
+        yield json.dumps(output).encode() + b"\0"
+
+
+def test_round_trip_byte_by_byte():
+    for logprobs in [False, True]:
+        outputs = create_outputs(logprobs=logprobs)
+        # the outputs get less text than the previous one, e.g. after an error
+        outputs.append({"text": "**NETWORK ERROR**", "error_code": 1})
+        encoder = FrameEncoder()
+        stream = b"".join(encoder.encode(output) for output in outputs)
+        assert len(stream) < len(b"".join(default_stream(outputs))) / 3
+
+        decoder = FrameDecoder()
+        decoded = []
+        for i in range(len(stream)):
+            decoded.extend(decoder.feed(stream[i : i + 1]))
+        assert decoded == outputs
+
+
+def test_encode_default_chunks():
+    outputs = create_outputs(logprobs=True)
+    chunks = list(default_stream(outputs))
+    # several outputs in a chunk, as sent through a proxy
+    chunks = [chunks[0], b"".join(chunks[1:10]), *chunks[10:]]
+    encoder = FrameEncoder()
+    stream = b"".join(encoder.encode_chunk(chunk) for chunk in chunks)
+    assert FrameDecoder().feed(stream) == outputs
+
+
+def test_deltas():
+    outputs = create_outputs(num_tokens=3, logprobs=True)
+    outputs.append({"text": "**NETWORK ERROR**", "error_code": 1})
+    encoder = FrameEncoder()
+    stream = b"".join(encoder.encode(output) for output in outputs)
+    frames = FrameDecoder(cumulative=False).feed(stream)
+
+    assert frames[0] == outputs[0]
+    assert frames[2]["text"] == "tok2 é "
+    assert frames[2]["logprobs"]["tokens"] == ["tok2"]
+    assert frames[2]["usage"] == outputs[2]["usage"]
+    assert frames[3] == dict(outputs[3], reset=True)
+
+    assert get_delta(outputs[1], outputs[2]) == frames[2]
+    # a rewritten text is not a delta
+    assert get_delta({"text": "tok0 a"}, {"text": "tok0 b and more"}) is None
+
+
+def test_negotiation():
+    outputs = create_outputs()
+    app = FastAPI()
+
+    @app.post("/worker_generate_stream")
+    async def api_generate_stream(request: Request):
+        return create_stream_response(default_stream(outputs), request.headers)
+
+    # the workers yield the outputs as dicts
+    @app.post("/worker_generate_stream_outputs")
+    async def api_generate_stream_outputs(request: Request):
+        return create_stream_response(iter(outputs), request.headers)
+
+    client = TestClient(app)
+    for url in ["/worker_generate_stream", "/worker_generate_stream_outputs"]:
+        response = client.post(url, headers={"Accept": FRAMED_MEDIA_TYPE})
+        assert is_framed(response.headers)
+        assert FrameDecoder().feed(response.content) == outputs
+
+        # older clients get the default stream
+        response = client.post(url)
+        assert not is_framed(response.headers)
+        chunks = response.content.split(b"\0")[:-1]
+        assert [json.loads(chunk) for chunk in chunks] == outputs
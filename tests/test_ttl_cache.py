@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+from fastchat.constants import ErrorCode
+from fastchat.serve import openai_api_server
+from fastchat.serve.openai_api_server import TTLCache, check_model
+
+
+def test_ttl_cache_shares_concurrent_lookups():
+    calls = []
+
+    async def fetch(worker_addr, model_name):
+        calls.append((worker_addr, model_name))
+        await asyncio.sleep(0.01)
+        return 4096
+
+    async def main():
+        cache = TTLCache(fetch, ttl=60)
+        values = await asyncio.gather(
+            *(cache.get(("http://worker", "model")) for _ in range(10))
+        )
+        assert values == [4096] * 10
+        assert await cache.get(("http://worker", "model")) == 4096
+
+    asyncio.run(main())
+    assert calls == [("http://worker", "model")]
+
+
+def test_ttl_cache_expires_and_refreshes(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(openai_api_server.time, "monotonic", lambda: now[0])
+    values = iter([["a"], ["a", "b"], ["a", "b", "c"]])
+
+    async def fetch():
+        return next(values)
+
+    async def main():
+        cache = TTLCache(fetch, ttl=10)
+        assert await cache.get(()) == ["a"]
+        now[0] = 5
+        assert await cache.get(()) == ["a"]
+        now[0] = 11
+        assert await cache.get(()) == ["a", "b"]
+        await cache.refresh_all()
+        assert await cache.get(()) == ["a", "b", "c"]
+
+    asyncio.run(main())
+
+
+def test_ttl_cache_drops_failed_entries():
+    fail = [False]
+
+    async def fetch():
+        if fail[0]:
+            raise ValueError("controller is down")
+        return ["a"]
+
+    async def main():
+        cache = TTLCache(fetch, ttl=10)
+        await cache.get(())
+        fail[0] = True
+        await cache.refresh_all()
+        assert cache._entries == {}
+
+    asyncio.run(main())
+
+
+def test_ttl_cache_forced_refresh_is_rate_limited(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(openai_api_server.time, "monotonic", lambda: now[0])
+    calls = []
+
+    async def fetch():
+        calls.append(now[0])
+        return ["a"]
+
+    async def main():
+        cache = TTLCache(fetch, ttl=10)
+        await cache.get(())
+        for t in [1, 2, 3, 12]:
+            now[0] = t
+            assert await cache.get_fresh(()) == ["a"]
+
+    asyncio.run(main())
+    assert calls == [0, 1, 12]
+
+
+def test_check_model(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(openai_api_server.time, "monotonic", lambda: now[0])
+
+    class Request:
+        model = "model-b"
+
+    workers = {"model-a": "http://worker-a"}
+    models = [["model-a"]]
+    lookups = []
+
+    async def get_worker_address(model_name):
+        lookups.append(model_name)
+        if workers is None:
+            raise aiohttp.ClientConnectionError("connection refused")
+        if model_name not in workers:
+            raise ValueError(f"No available worker for {model_name}")
+        return workers[model_name]
+
+    async def fetch_model_list():
+        if models[0] is None:
+            raise ValueError("Failed to list models")
+        return models[0]
+
+    monkeypatch.setattr(openai_api_server, "get_worker_address", get_worker_address)
+    monkeypatch.setattr(
+        openai_api_server, "model_list_cache", TTLCache(fetch_model_list, ttl=60)
+    )
+
+    async def check(model):
+        Request.model = model
+        worker_addr, error = await check_model(Request)
+        return worker_addr, error and json.loads(error.body)["code"]
+
+    async def main():
+        assert await check("model-a") == ("http://worker-a", None)
+        assert lookups == ["model-a"]
+        assert await check("model-b") == (None, ErrorCode.INVALID_MODEL)
+        # the model list is refreshed at most once per ttl for unknown models
+        models[0] = ["model-a", "model-b"]
+        assert await check("model-b") == (None, ErrorCode.INVALID_MODEL)
+        now[0] = 61
+        assert await check("model-b") == (None, ErrorCode.CONTROLLER_NO_WORKER)
+        models[0] = None
+        openai_api_server.model_list_cache._entries.clear()
+        assert await check("model-b") == (None, ErrorCode.CONTROLLER_NO_WORKER)
+
+    asyncio.run(main())
+
+    workers = None
+    assert asyncio.run(check("model-a")) == (None, ErrorCode.CONTROLLER_NO_WORKER)
+
+
+def test_worker_failures_are_reported(monkeypatch):
+    reported = []
+
+    async def fetch_remote(url, pload=None, name=None):
+        if url.endswith("/report_worker_failure"):
+            reported.append(pload["worker_name"])
+            return b'{"ejected": false}'
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(openai_api_server, "fetch_remote", fetch_remote)
+
+    async def main():
+        await openai_api_server.generate_completion({}, "http://worker-a")
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    assert reported == ["http://worker-a"]
@@ -0,0 +1,113 @@
+import math
+
+import numpy as np
+from scipy.optimize import minimize
+
+from fastchat.serve.monitor import rating_systems
+from fastchat.serve.monitor.rating_systems import (
+    bt_loss_and_grad,
+    contextual_bt_loss_and_grad,
+    fit_bootstrap_style_control,
+    fit_vectorized_bt,
+)
+
+
+def create_matchups(make_battles, num_models=8, num_battles=5000):
+    battles = make_battles(num_battles, num_models)
+    models = sorted(set(battles["model_a"]) | set(battles["model_b"]))
+    index = {model: i for i, model in enumerate(models)}
+    matchups = np.column_stack(
+        [battles["model_a"].map(index), battles["model_b"].map(index)]
+    ).astype(np.int32)
+    outcomes = battles["winner"].map(
+        {"model_a": 1.0, "model_b": 0.0, "tie": 0.5, "tie (bothbad)": 0.5}
+    )
+    return matchups, outcomes.to_numpy()
+
+
+def fit_exact(loss_and_grad, x0, args):
+    options = {"maxiter": 1000, "gtol": 1e-12, "ftol": 1e-15}
+    return minimize(loss_and_grad, x0, args, jac=True, options=options)["x"]
+
+
+def test_fit_vectorized_bt(make_battles):
+    num_models = 8
+    matchups, outcomes = create_matchups(make_battles, num_models)
+    rng = np.random.default_rng(1)
+    alpha = math.log(10.0)
+    weights = rng.multinomial(
+        len(outcomes), np.full(len(outcomes), 1 / len(outcomes)), 3
+    )
+    weights = weights / len(outcomes)
+    # a model without battles in a sample stays at 0
+    weights[0, (matchups == 0).any(axis=1)] = 0
+
+    ratings = fit_vectorized_bt(matchups, outcomes, weights, num_models, alpha)
+    for sample_weights, sample_ratings in zip(weights, ratings):
+        expected = fit_exact(
+            bt_loss_and_grad,
+            np.zeros(num_models),
+            (matchups, outcomes, sample_weights, alpha),
+        )
+        np.testing.assert_allclose(sample_ratings, expected, atol=1e-5)
+    assert abs(ratings[0, 0]) < 1e-6
+    np.testing.assert_allclose(ratings.sum(axis=1), 0, atol=1e-9)
+
+
+def test_fit_vectorized_contextual_bt(make_battles):
+    num_models, num_features, reg = 8, 3, 0.5
+    matchups, outcomes = create_matchups(make_battles, num_models)
+    rng = np.random.default_rng(1)
+    features = rng.normal(size=(len(outcomes), num_features))
+    alpha = math.log(10.0)
+    idxs = rng.integers(len(outcomes), size=(2, len(outcomes)))
+    weights = np.array([np.bincount(i, minlength=len(outcomes)) for i in idxs])
+
+    params = fit_vectorized_bt(
+        matchups,
+        outcomes,
+        weights.astype(np.float64),
+        num_models,
+        alpha,
+        features=features,
+        reg=reg,
+    )
+    for sample_idxs, sample_params in zip(idxs, params):
+        # the resampled battles with duplicates, like fit_contextual_bt
+        expected = fit_exact(
+            contextual_bt_loss_and_grad,
+            np.zeros(num_models + num_features),
+            (
+                num_models,
+                matchups[sample_idxs],
+                features[sample_idxs],
+                outcomes[sample_idxs],
+                alpha,
+                reg,
+                reg / 2,
+            ),
+        )
+        np.testing.assert_allclose(sample_params, expected, atol=1e-5)
+
+
+def test_fit_bootstrap_style_control(monkeypatch, make_battles):
+    num_models, num_features = 8, 3
+    matchups, outcomes = create_matchups(make_battles, num_models, num_battles=2000)
+    rng = np.random.default_rng(1)
+    features = rng.normal(size=(len(outcomes), num_features))
+    # two rounds per chunk
+    monkeypatch.setattr(rating_systems, "MAX_CHUNK_SIZE", 2 * len(outcomes))
+
+    results = []
+    for num_cpu in [1, 2]:
+        np.random.seed(0)
+        results.append(
+            fit_bootstrap_style_control(
+                matchups, features, outcomes, num_models, 5, num_cpu=num_cpu
+            )
+        )
+    # the workers read the same battles from shared memory
+    np.testing.assert_array_equal(results[0], results[1])
+    assert results[0].shape == (5, num_models + num_features)
+    # the rounds are different samples
+    assert len(np.unique(results[0][:, 0])) == 5
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import time
+
+from fastchat.serve import base_model_worker
+from fastchat.serve.base_model_worker import (
+    HeartBeatSender,
+    LatencyStats,
+    track_latency,
+)
+from fastchat.serve.worker_registry import (
+    DispatchMethod,
+    WorkerInfo,
+    WorkerRegistry,
+    WorkerRegistryClient,
+)
+
+
+def create_worker_info(model_names, speed=1, queue_length=0, multimodal=False):
+    return WorkerInfo(model_names, speed, queue_length, True, time.time(), multimodal)
+
+
+def test_model_index_follows_changes():
+    registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE)
+    registry.upsert(
+        "http://a", create_worker_info(["vicuna", "llava"], multimodal=True)
+    )
+    registry.upsert("http://b", create_worker_info(["vicuna"]))
+    assert sorted(registry.list_models()) == ["llava", "vicuna"]
+    assert sorted(registry.list_models(multimodal=True)) == ["llava", "vicuna"]
+    assert registry.list_models(multimodal=False) == ["vicuna"]
+
+    registry.upsert("http://a", create_worker_info(["llava"], multimodal=True))
+    assert registry.get_worker_address("vicuna") == "http://b"
+
+    registry.remove("http://b")
+    assert registry.get_worker_address("vicuna") == ""
+    assert registry.list_models() == ["llava"]
+
+
+def test_shortest_queue_dispatch():
+    registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE)
+    registry.upsert("http://a", create_worker_info(["vicuna"], queue_length=2))
+    registry.upsert("http://b", create_worker_info(["vicuna"], queue_length=0))
+    assert [registry.get_worker_address("vicuna") for _ in range(4)] == [
+        "http://b",
+        "http://b",
+        "http://a",
+        "http://b",
+    ]
+    registry.receive_heart_beat("http://a", 0)
+    assert registry.get("http://a").queue_length == 0
+
+
+def test_remove_stale_workers():
+    registry = WorkerRegistry(DispatchMethod.LOTTERY)
+    registry.upsert("http://a", create_worker_info(["vicuna"]))
+    registry.upsert("http://b", create_worker_info(["vicuna"]))
+    registry._workers["http://a"].last_heart_beat = 0
+
+    assert registry.remove_stale_workers(time.time() - 60) == ["http://a"]
+    assert registry.get_worker_address("vicuna") == "http://b"
+
+
+def test_client_mirrors_subscription():
+    registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE)
+    registry.upsert("http://a", create_worker_info(["vicuna"]))
+    client = WorkerRegistryClient("http://controller")
+    assert client.get_worker_address("vicuna") is None
+
+    async def main():
+        snapshot, subscriber = registry.subscribe()
+        client.apply_event(snapshot)
+        assert client.get_worker_address("vicuna") == "http://a"
+
+        registry.upsert("http://b", create_worker_info(["llama"]))
+        registry.remove("http://a")
+        registry.receive_heart_beat("http://b", 3)
+        for _ in range(3):
+            client.apply_event(await subscriber.get())
+        registry.unsubscribe(subscriber)
+
+    asyncio.run(main())
+    assert client.list_models() == ["llama"]
+    assert client.get_worker_address("vicuna") == ""
+    assert client.registry.get("http://b").queue_length == 3
+    assert client.registry.dispatch_method == DispatchMethod.SHORTEST_QUEUE
+
+
+def test_slow_subscriber_is_dropped():
+    registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE, max_pending_events=2)
+
+    async def main():
+        _, subscriber = registry.subscribe()
+        for i in range(5):
+            registry.upsert(f"http://{i}", create_worker_info(["vicuna"]))
+        await asyncio.sleep(0)
+        events = []
+        while not subscriber.queue.empty():
+            events.append(await subscriber.get())
+        return events
+
+    events = asyncio.run(main())
+    assert [event and event["worker_name"] for event in events] == [
+        "http://0",
+        "http://1",
+        None,
+    ]
+    assert registry._subscribers == []
+
+
+def test_power_of_two_prefers_fast_idle_workers():
+    registry = WorkerRegistry(DispatchMethod.POWER_OF_TWO)
+    registry.upsert("http://slow", create_worker_info(["vicuna"]))
+    registry.upsert("http://fast", create_worker_info(["vicuna"]))
+    registry.receive_heart_beat(
+        "http://slow", 0, {"ttft": 2.0, "tokens_per_second": 10}
+    )
+    registry.receive_heart_beat(
+        "http://fast", 0, {"ttft": 0.1, "tokens_per_second": 100}
+    )
+    assert registry.get("http://fast").tokens_per_second == 100
+
+    # 2.66s vs 27.6s per request: the fast worker wins until 10 requests queue on it
+    picks = [registry.get_worker_address("vicuna") for _ in range(11)]
+    assert picks == ["http://fast"] * 10 + ["http://slow"]
+
+
+def test_power_of_two_ejects_timed_out_workers():
+    now = [1000.0]
+    registry = WorkerRegistry(
+        DispatchMethod.POWER_OF_TWO,
+        ejection_failures=2,
+        ejection_time=30,
+        clock=lambda: now[0],
+    )
+    registry.upsert("http://a", create_worker_info(["vicuna"]))
+    registry.upsert("http://b", create_worker_info(["vicuna"], queue_length=5))
+
+    assert registry.report_failure("http://a") is False
+    # failures too far apart do not add up
+    now[0] += 31
+    assert registry.report_failure("http://a") is False
+    now[0] += 10
+    assert registry.report_failure("http://a") is True
+    assert {registry.get_worker_address("vicuna") for _ in range(5)} == {"http://b"}
+
+    now[0] += 31
+    assert registry.get_worker_address("vicuna") == "http://a"
+
+    # ejected again, for twice as long
+    registry.report_failure("http://a")
+    assert registry.report_failure("http://a") is True
+    assert registry.get("http://a").ejected_until == now[0] + 60
+
+    # when every worker is ejected, still dispatch
+    registry.report_failure("http://b")
+    registry.report_failure("http://b")
+    assert registry.get_worker_address("vicuna") in ("http://a", "http://b")
+
+
+def test_latency_stats_track_streams():
+    latency_stats = LatencyStats(alpha=0.5)
+
+    def generate():
+        time.sleep(0.05)
+        yield json.dumps({"text": "a"}).encode() + b"\0"
+        time.sleep(0.05)
+        ret = {"text": "ab", "usage": {"completion_tokens": 10}}
+        yield json.dumps(ret).encode() + b"\0"
+
+    chunks = list(track_latency(latency_stats, generate()))
+    assert len(chunks) == 2
+    stats = latency_stats.to_dict()
+    assert 0.04 < stats["ttft"] < 0.5
+    assert 20 < stats["tokens_per_second"] < 250
+
+    async def agenerate():
+        yield b"not json\0"
+
+    async def main():
+        return [chunk async for chunk in track_latency(latency_stats, agenerate())]
+
+    assert asyncio.run(main()) == [b"not json\0"]
+    assert latency_stats.to_dict()["tokens_per_second"] == stats["tokens_per_second"]
+
+
+def test_heart_beat_sends_changes(monkeypatch):
+    monkeypatch.setattr(base_model_worker, "logger", logging.getLogger("test"))
+    registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE)
+    status = {
+        "queue_length": 3,
+        "latency_stats": {"ttft": 0.5, "tokens_per_second": 20},
+    }
+    payloads, registrations = [], []
+
+    class Session:
+        def post(self, url, json, timeout):
+            payloads.append(json)
+            exist = registry.receive_heart_beat(
+                json["worker_name"], json.get("queue_length"), json.get("latency_stats")
+            )
+            return type("Response", (), {"json": lambda self: {"exist": exist}})()
+
+    def register():
+        registrations.append(True)
+        registry.upsert("http://a", create_worker_info(["vicuna"]))
+
+    sender = HeartBeatSender("http://controller", "http://a", lambda: status, register)
+    sender.session = Session()
+    # unknown to the controller
+    assert sender.send()
+    assert registrations == [True]
+    # everything is sent again after registering
+    assert sender.send()
+    assert payloads[-1] == dict(status, worker_name="http://a")
+    assert registry.get("http://a").queue_length == 3
+
+    # a keep-alive
+    assert sender.send()
+    assert payloads[-1] == {"worker_name": "http://a", "queue_length": 3}
+    assert registry.get("http://a").queue_length == 3
+
+    status = dict(status, queue_length=1)
+    assert sender.send()
+    assert payloads[-1] == {"worker_name": "http://a", "queue_length": 1}
+    assert registry.get("http://a").queue_length == 1
+    assert sender.get_stats()["sent"] == 4
+
+
+def test_keep_alive_corrects_dispatched_queue_length(monkeypatch):
+    monkeypatch.setattr(base_model_worker, "logger", logging.getLogger("test"))
+    registry = WorkerRegistry(DispatchMethod.SHORTEST_QUEUE)
+    registry.upsert("http://a", create_worker_info(["vicuna"]))
+    status = {"queue_length": 0}
+
+    class Session:
+        def post(self, url, json, timeout):
+            exist = registry.receive_heart_beat(
+                json["worker_name"], json.get("queue_length"), json.get("latency_stats")
+            )
+            return type("Response", (), {"json": lambda self: {"exist": exist}})()
+
+    sender = HeartBeatSender("http://controller", "http://a", lambda: status, None)
+    sender.session = Session()
+    assert sender.send()
+
+    # dispatched requests which finished before the worker checked its queue again
+    for _ in range(3):
+        assert registry.get_worker_address("vicuna") == "http://a"
+    assert registry.get("http://a").queue_length == 3
+    # the keep-alive reports the unchanged queue length of the worker
+    assert sender.send()
+    assert registry.get("http://a").queue_length == 0